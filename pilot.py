@@ -29,6 +29,7 @@ from pilot.util.filehandling import get_pilot_work_dir, mkdirs, establish_loggin
 from pilot.util.harvester import is_harvester_mode
 from pilot.util.https import https_setup
 from pilot.util.timing import add_to_pilot_timing
+from pilot.util.tracereport import flush_traces
 
 
 def main():
@@ -329,12 +330,23 @@ def get_args():
                             dest='harvester_submitmode',
                             default='PULL',
                             help='Harvester submit mode (PUSH or PULL [default])')
+    arg_parser.add_argument('--harvester-max-jobs',
+                            dest='harvester_maxjobs',
+                            default=1,
+                            type=int,
+                            help='Max number of jobs from the Harvester job definition file to run at the same time')
     arg_parser.add_argument('--resource-type',
                             dest='resource_type',
                             default='',
                             type=str,
                             choices=['SCORE', 'MCORE', 'SCORE_HIMEM', 'MCORE_HIMEM'],
                             help='Resource type; MCORE, SCORE, SCORE_HIMEM or MCORE_HIMEM')
+    arg_parser.add_argument('--job-pipelining',
+                            dest='job_pipelining',
+                            default='off',
+                            choices=['off', 'getjob', 'stagein'],
+                            help='Download the next job during stage-out of the current job (getjob), '
+                                 'and also stage-in its input (stagein)')
     arg_parser.add_argument('--use-https',
                             dest='use_https',
                             type=str2bool,
@@ -452,6 +464,9 @@ def wrap_up(initdir, mainworkdir, args):
 
     exit_code = 0
 
+    # send any pending trace reports (before the spool file in the pilot workdir is removed)
+    flush_traces()
+
     # cleanup pilot workdir if created
     if initdir != mainworkdir and args.cleanup:
         chdir(initdir)
@@ -5,12 +5,15 @@
 # http://www.apache.org/licenses/LICENSE-2.0
 #
 # Authors:
-# - Paul Nilsson, paul.nilsson@cern.ch, 2018
+# - Paul Nilsson, paul.nilsson@cern.ch, 2018-2020
 
 from .services import Services
 from pilot.common.exception import NotImplemented, NotDefined, NotSameLength, UnknownException
-from pilot.util.filehandling import get_table_from_file
-from pilot.util.math import mean, sum_square_dev, sum_dev, chi2, float_to_rounded_string
+from pilot.util.filehandling import get_table_from_file, TableReader
+from pilot.util.math import chi2, float_to_rounded_string
+
+from array import array
+import os
 
 import logging
 logger = logging.getLogger(__name__)
@@ -22,6 +25,8 @@ class Analytics(Services):
     """
 
     _fit = None
+    _readers = {}  # file name -> TableReader, shared by all instances since the files are read incrementally
+    _fits = {}  # (file name, x_name, y_name, tails) -> (Fit, first row, end row) of the latest fit
 
     def __init__(self, **kwargs):
         """
@@ -114,10 +119,36 @@ class Analytics(Services):
 
         return get_table_from_file(filename, header=header, separator=separator, convert_to_float=convert_to_float)
 
+    def get_table_reader(self, filename):
+        """
+        Return the incremental table reader for the given file, updated with any new rows.
+        Readers for files that no longer exist (e.g. from previous jobs) are dropped.
+
+        :param filename: full path to input file (string).
+        :return: TableReader object (None if the file could not be read).
+        """
+
+        reader = self._readers.get(filename)
+        if not reader:
+            for _filename in list(self._readers.keys()):
+                if not os.path.exists(_filename):
+                    del self._readers[_filename]
+            for key in list(self._fits.keys()):
+                if key[0] not in self._readers:
+                    del self._fits[key]
+            reader = TableReader(filename)
+            self._readers[filename] = reader
+
+        if reader.update() is None:
+            return None
+
+        return reader
+
     def get_fitted_data(self, filename, x_name='Time', y_name='pss+swap', precision=2, tails=True):
         """
         Return a properly formatted job metrics string with analytics data.
         Currently the function returns a fit for PSS+Swap vs time, whose slope measures memory leaks.
+        The file is read incrementally, and the fit from the previous call is updated with the new rows only.
 
         :param filename: full path to memory monitor output (string).
         :param x_name: optional string, name selector for table column.
@@ -129,59 +160,88 @@ class Analytics(Services):
 
         slope = ""
         chi2 = ""
-        table = self.get_table(filename)
-
-        if table:
-            # extract data to be fitted
-            x, y = self.extract_from_table(table, x_name, y_name)
+        reader = self.get_table_reader(filename)
 
+        if reader and reader.keylist:
+            # select the rows to be fitted
             # remove tails if desired
             # this is useful e.g. for memory monitor data where the first and last values
             # represent allocation and de-allocation, ie not interesting
-            if not tails and len(x) > 7 and len(y) > 7:
+            start, end = 0, reader.nrows
+            if not tails and reader.nrows > 7:
                 logger.debug('removing tails from data to be fitted')
-                x = x[5:]
-                x = x[:-2]
-                y = y[5:]
-                y = y[:-2]
+                start, end = 5, reader.nrows - 2
 
-            if len(x) > 7 and len(y) > 7:
+            if end - start > 7:
                 logger.info('fitting %s vs %s' % (y_name, x_name))
                 try:
-                    fit = self.fit(x, y)
+                    fit = self.update_fit(reader, x_name, y_name, start, end, tails)
                     _slope = self.slope()
                 except Exception as e:
-                    logger.warning('failed to fit data, x=%s, y=%s: %s' % (str(x), str(y), e))
+                    x, y = self.extract_from_table(reader.get_table(), x_name, y_name, start=start, end=end)
+                    logger.warning('failed to fit data, x=%s, y=%s: %s' % (str(list(x)), str(list(y)), e))
                 else:
                     if _slope:
                         slope = float_to_rounded_string(fit.slope(), precision=precision)
                         chi2 = float_to_rounded_string(fit.chi2(), precision=0)  # decimals are not needed for chi2
                         if slope != "":
                             logger.info('current memory leak: %s B/s (using %d data points, chi2=%s)' %
-                                        (slope, len(x), chi2))
+                                        (slope, end - start, chi2))
             else:
-                logger.warning('wrong length of table data, x=%s, y=%s (must be same and length>=4)' % (str(x), str(y)))
+                logger.warning('wrong length of table data (%d rows, must be >7)' % (end - start))
 
         return {"slope": slope, "chi2": chi2}
 
-    def extract_from_table(self, table, x_name, y_name):
+    def update_fit(self, reader, x_name, y_name, start, end, tails):
+        """
+        Fit the given rows of the table, by adding the new rows to the previous fit if possible.
+
+        :param reader: TableReader object.
+        :param x_name: string, name selector for table column.
+        :param y_name: string, name selector for table column.
+        :param start: first row to be fitted (int).
+        :param end: end row (int).
+        :param tails: are tails used? (boolean).
+        :raises UnknownException: in case Fit() fails.
+        :return: fitting object.
+        """
+
+        key = (reader.filename, x_name, y_name, tails)
+        fit, _start, _end = self._fits.get(key, (None, None, None))
+        if fit and _start == start and _end <= end:
+            x, y = self.extract_from_table(reader.get_table(), x_name, y_name, start=_end, end=end)
+            try:
+                fit.add(x, y)
+            except Exception as e:
+                raise UnknownException(e)
+            self._fit = fit
+        else:
+            x, y = self.extract_from_table(reader.get_table(), x_name, y_name, start=start, end=end)
+            fit = self.fit(x, y)
+        self._fits[key] = (fit, start, end)
+
+        return fit
+
+    def extract_from_table(self, table, x_name, y_name, start=0, end=None):
         """
 
         :param table: dictionary with columns.
         :param x_name: column name to be extracted (string).
         :param y_name: column name to be extracted (may contain '+'-sign) (string).
+        :param start: optional first row to be extracted (int).
+        :param end: optional end row (int).
         :return: x (list), y (list).
         """
 
-        x = table.get(x_name, [])
+        x = table.get(x_name, [])[start:end]
         if '+' not in y_name:
-            y = table.get(y_name, [])
+            y = table.get(y_name, [])[start:end]
         else:
             try:
                 y1_name = y_name.split('+')[0]
                 y2_name = y_name.split('+')[1]
-                y1_value = table.get(y1_name, [])
-                y2_value = table.get(y2_name, [])
+                y1_value = table.get(y1_name, [])[start:end]
+                y2_value = table.get(y2_name, [])[start:end]
             except Exception as e:
                 logger.warning('exception caught: %s' % e)
                 x = []
@@ -196,6 +256,8 @@ class Analytics(Services):
 class Fit(object):
     """
     Low-level fitting class.
+    The linear fit is calculated from running sums, so that new data points can be added with `add()` without
+    recalculating the sums for the already fitted data.
     """
 
     _model = 'linear'  # fitting model
@@ -208,6 +270,7 @@ class Fit(object):
     _slope = None  # slope
     _intersect = None  # intersect
     _chi2 = None  # chi2
+    _sums = None  # running sums (n, x, y, x*x, x*y) of the values relative to the first data point
 
     def __init__(self, **kwargs):
         """
@@ -219,27 +282,60 @@ class Fit(object):
 
         # extract parameters
         self._model = kwargs.get('model', 'linear')
-        self._x = kwargs.get('x', None)
-        self._y = kwargs.get('y', None)
+        x = kwargs.get('x', None)
+        y = kwargs.get('y', None)
 
-        if not self._x or not self._y:
+        if not x or not y:
             raise NotDefined('input data not defined')
 
-        if len(self._x) != len(self._y):
+        if len(x) != len(y):
             raise NotSameLength('input data (lists) have different lengths')
 
         # base calculations
         if self._model == 'linear':
-            self._ss = sum_square_dev(self._x)
-            self._ss2 = sum_dev(self._x, self._y)
-            self.set_slope()
-            self._xm = mean(self._x)
-            self._ym = mean(self._y)
-            self.set_intersect()
-            self.set_chi2()
+            self._x = array('d')
+            self._y = array('d')
+            self._origin = (x[0], y[0])  # the sums are calculated relative to the first point for better precision
+            self._sums = [0, 0.0, 0.0, 0.0, 0.0]
+            self.add(x, y)
         else:
             raise NotImplemented("\'%s\' model is not implemented" % self._model)
 
+    def add(self, x, y):
+        """
+        Add data points to the fit and update the fit parameters.
+
+        :param x: list of input data (list of floats or ints).
+        :param y: list of input data (list of floats or ints).
+        :raises PilotException: NotSameLength if the input lists have different lengths.
+        :return:
+        """
+
+        if len(x) != len(y):
+            raise NotSameLength('input data (lists) have different lengths')
+
+        x0, y0 = self._origin
+        n, sx, sy, sxx, sxy = self._sums
+        for _x, _y in zip(x, y):
+            dx = _x - x0
+            dy = _y - y0
+            n += 1
+            sx += dx
+            sy += dy
+            sxx += dx * dx
+            sxy += dx * dy
+        self._sums = [n, sx, sy, sxx, sxy]
+        self._x.extend(x)
+        self._y.extend(y)
+
+        self._ss = sxx - sx * sx / n
+        self._ss2 = sxy - sx * sy / n
+        self.set_slope()
+        self._xm = x0 + sx / n
+        self._ym = y0 + sy / n
+        self.set_intersect()
+        self.set_chi2()
+
     def fit(self):
         """
         Return fitting object.
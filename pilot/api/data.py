@@ -6,7 +6,7 @@
 #
 # Authors:
 # - Mario Lassnig, mario.lassnig@cern.ch, 2017
-# - Paul Nilsson, paul.nilsson@cern.ch, 2017-2019
+# - Paul Nilsson, paul.nilsson@cern.ch, 2017-2020
 # - Tobias Wegner, tobias.wegner@cern.ch, 2017-2018
 # - Alexey Anisenkov, anisyonk@cern.ch, 2018-2019
 
@@ -15,8 +15,14 @@
 import os
 import hashlib
 import logging
+import threading
 import time
 
+try:
+    import Queue as queue  # noqa: N813
+except Exception:
+    import queue  # Python 3
+
 try:
     from functools import reduce  # Python 3
 except Exception:
@@ -53,6 +59,9 @@ class StagingClient(object):
     # list of allowed schemas to be used for transfers from REMOTE sites
     remoteinput_allowed_schemas = ['root', 'gsiftp', 'dcap', 'davs', 'srm', 'storm', 'https']
 
+    # number of times a failed file transfer is retried with the same copytool in concurrent transfer mode
+    transfer_retries = 1
+
     def __init__(self, infosys_instance=None, acopytools=None, logger=None, default_copytools='rucio', trace_report=None):  # noqa: C901
         """
             If `acopytools` is not specified then it will be automatically resolved via infosys. In this case `infosys` requires initialization.
@@ -364,6 +373,112 @@ class StagingClient(object):
 
         raise NotImplemented()
 
+    def get_transfer_concurrency(self):
+        """
+            Resolve the maximum number of concurrent file transfers from queuedata
+            :return: maxtransfers (int), maxtransfers_ddm (int, 0 means no limit per DDMEndpoint)
+        """
+
+        queuedata = self.infosys.queuedata if self.infosys else None
+        if not queuedata:
+            return 1, 0
+
+        return max(queuedata.maxtransfers or 1, 1), max(queuedata.maxtransfers_ddm or 0, 0)
+
+    def copy_files(self, method, files, maxtransfers=None, maxtransfers_ddm=None, **kwargs):
+        """
+            Call the copytool transfer handler (copy_in/copy_out) for the given files.
+            If more than one concurrent transfer is allowed (see `get_transfer_concurrency()`), the files are
+            transferred in parallel by a pool of worker threads, one file per handler call, otherwise all files are
+            passed to the handler at once.
+            :param method: copytool transfer handler (`copytool.copy_in` or `copytool.copy_out`)
+            :param files: list of `FileSpec` objects
+            :param maxtransfers: maximum number of concurrent transfers (default from queuedata)
+            :param maxtransfers_ddm: maximum number of concurrent transfers per DDMEndpoint (default from queuedata)
+            :param kwargs: extra kwargs to be passed to copytool transfer handler
+            :raise: exception of the first failed file transfer
+            :return: list of processed `FileSpec` objects
+        """
+
+        _maxtransfers, _maxtransfers_ddm = self.get_transfer_concurrency()
+        maxtransfers = maxtransfers or _maxtransfers
+        maxtransfers_ddm = _maxtransfers_ddm if maxtransfers_ddm is None else maxtransfers_ddm
+
+        if maxtransfers <= 1 or len(files) <= 1:
+            return method(files, **kwargs)
+
+        nthreads = min(maxtransfers, len(files))
+        self.logger.info('will transfer %d files using %d concurrent transfers (maximum per ddmendpoint: %s)' %
+                         (len(files), nthreads, maxtransfers_ddm or 'unlimited'))
+
+        workqueue = queue.Queue()
+        for fspec in files:
+            workqueue.put(fspec)
+
+        # limit the number of concurrent transfers per ddmendpoint
+        semaphores = {}
+        if maxtransfers_ddm:
+            for fspec in files:
+                semaphores.setdefault(fspec.ddmendpoint, threading.BoundedSemaphore(maxtransfers_ddm))
+
+        errors = {}
+        threads = [threading.Thread(target=self.copy_files_worker, args=(method, workqueue, semaphores, errors),
+                                    kwargs=kwargs, name='transfer_%d' % i) for i in range(nthreads)]
+        t0 = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.logger.info('concurrent transfer of %d files completed in %.1f s (%d failed)' %
+                         (len(files), time.time() - t0, len(errors)))
+
+        # report the error of the first failed file; remaining files will be retried by the next copytool
+        for fspec in files:
+            if id(fspec) in errors:
+                raise errors[id(fspec)]
+
+        return files
+
+    def copy_files_worker(self, method, workqueue, semaphores, errors, **kwargs):
+        """
+            Transfer files from the work queue one by one (used by the worker threads of `copy_files()`).
+            Each file transfer is retried `transfer_retries` times. Each call gets its own trace report copy, since
+            the copytools update the trace report for every file.
+            :param method: copytool transfer handler
+            :param workqueue: queue of `FileSpec` objects
+            :param semaphores: dict of semaphores per ddmendpoint
+            :param errors: dict of exceptions per failed `FileSpec` (by id)
+            :param kwargs: extra kwargs to be passed to copytool transfer handler
+        """
+
+        trace_report = kwargs.get('trace_report')
+        while True:
+            try:
+                fspec = workqueue.get_nowait()
+            except queue.Empty:
+                return
+
+            semaphore = semaphores.get(fspec.ddmendpoint)
+            if semaphore:
+                semaphore.acquire()
+            try:
+                for attempt in range(1 + self.transfer_retries):
+                    _kwargs = dict(kwargs)  # copytools may modify kwargs
+                    if trace_report is not None:
+                        _kwargs['trace_report'] = TraceReport(trace_report)
+                    try:
+                        method([fspec], **_kwargs)
+                    except Exception as e:
+                        self.logger.warning('transfer attempt %d/%d failed for lfn=%s: %s' %
+                                            (attempt + 1, 1 + self.transfer_retries, fspec.lfn, e))
+                        errors[id(fspec)] = e
+                    else:
+                        errors.pop(id(fspec), None)
+                        break
+            finally:
+                if semaphore:
+                    semaphore.release()
+
     def transfer(self, files, activity='default', **kwargs):  # noqa: C901
         """
             Automatically stage passed files using copy tools related to given `activity`
@@ -794,7 +909,7 @@ class StageInClient(StagingClient):
         # use bulk downloads if necessary
         # if kwargs['use_bulk_transfer']
         # return copytool.copy_in_bulk(remain_files, **kwargs)
-        return copytool.copy_in(remain_files, **kwargs)
+        return self.copy_files(copytool.copy_in, remain_files, **kwargs)
 
     def set_status_for_direct_access(self, files):
         """
@@ -1033,7 +1148,7 @@ class StageOutClient(StagingClient):
         # add the trace report
         kwargs['trace_report'] = self.trace_report
 
-        return copytool.copy_out(files, **kwargs)
+        return self.copy_files(copytool.copy_out, files, **kwargs)
 
 #class StageInClientAsync(object):
 #
@@ -5,25 +5,52 @@
 # http://www.apache.org/licenses/LICENSE-2.0
 #
 # Authors:
-# - Paul Nilsson, paul.nilsson@cern.ch, 2018-2019
+# - Paul Nilsson, paul.nilsson@cern.ch, 2018-2020
 
+import os
+import threading
+import time
 from os import getcwd
 from .services import Services
 
+from pilot.util.filehandling import write_json
+from pilot.util.processes import ProcessTable
+
 import logging
 logger = logging.getLogger(__name__)
 
+_monitors = {}  # work directory -> MemoryMonitoring object
+_monitors_lock = threading.Lock()
+
 
 class MemoryMonitoring(Services):
     """
     Memory monitoring service class.
+
+    The memory monitor samples the payload process tree from /proc in a pilot thread, at the given interval. The
+    output is the same as for prmon: a text file with one row per sample (memory in kB, I/O in B, times in s) and a
+    JSON summary with the maximum and average values. The maximum and average values are also kept up to date in
+    memory, so that they can be read at any time with get_results() without parsing the output files.
+    Usage: monitor = MemoryMonitoring(pid=job.pid, workdir=job.workdir)
+           monitor.execute()
+           ..
+           monitor.stop()
     """
 
     user = ""     # Pilot user, e.g. 'ATLAS'
     pid = 0       # Job process id
     workdir = ""  # Job work directory
+    interval = 60  # Sampling interval (s)
+    filename = "memory_monitor_output.txt"  # Text output file name
+    summary = "memory_monitor_summary.json"  # JSON summary file name
     _cmd = ""     # Memory monitoring command (full path, all options)
 
+    # columns of the text output (same as prmon)
+    columns = ['Time', 'nprocs', 'nthreads', 'pss', 'rchar', 'read_bytes', 'rss', 'stime', 'swap', 'utime', 'vmem',
+               'wchar', 'write_bytes', 'wtime']
+    memory_keys = ['nprocs', 'nthreads', 'pss', 'rss', 'swap', 'vmem']  # averaged over the samples
+    counter_keys = ['rchar', 'read_bytes', 'stime', 'utime', 'wchar', 'write_bytes']  # cumulative values
+
     def __init__(self, **kwargs):
         """
         Init function.
@@ -41,6 +68,19 @@ class MemoryMonitoring(Services):
             user_utility = __import__('pilot.user.%s.utilities' % self.user, globals(), locals(), [self.user], 0)  # Python 2/3
             self._cmd = user_utility.get_memory_monitor_setup(self.pid, self.workdir)
 
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.table = None
+        self.start_time = None
+        self.nsamples = 0
+        self.last = {}  # last sample
+        self.maxima = {}
+        self.sums = {}
+        self.counters = {}  # pid -> last cumulative values of a process
+        self.exited = dict((key, 0) for key in self.counter_keys)  # cumulative values of processes that have ended
+        self.smaps = 'smaps_rollup' if os.path.exists('/proc/self/smaps_rollup') else 'smaps'
+
     def get_command(self):
         """
         Return the full command for the memory monitor.
@@ -52,28 +92,249 @@ class MemoryMonitoring(Services):
 
     def execute(self):
         """
-        Execute the memory monitor command.
-        Return the process.
+        Start sampling the process tree in a separate thread.
+        Return the memory monitor itself, which can be used like a process (see poll()).
 
-        :return: process.
+        :return: MemoryMonitoring object.
         """
 
-        return None
+        if self.thread and self.thread.is_alive():
+            return self
 
-    def get_filename(self):
+        if self.start_time is None:
+            self.start_time = time.time()
+            try:
+                with open(self.get_filename(), 'w') as f:
+                    f.write('\t'.join(self.columns) + '\n')
+            except IOError as e:
+                logger.warning('failed to create memory monitor output file: %s' % e)
+
+        register_memory_monitor(self.workdir, self)
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='memorymonitor')
+        self.thread.daemon = True
+        self.thread.start()
+
+        return self
+
+    def run(self):
         """
-        ..
+        Sample the process tree until the monitor is stopped.
 
         :return:
         """
 
-        return ""
+        logger.info('memory monitor started for pid=%d (interval=%d s)' % (self.pid, self.interval))
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                logger.warning('memory monitor failed to sample process tree: %s' % e)
+            if self.stop_event.wait(self.interval) or self.stop_event.is_set():  # wait() returns None in Python 2.6
+                break
 
-    def get_results(self):
+    def sample(self):
         """
-        ..
+        Measure the resource usage of the process tree and update the output files and the summary.
+
+        :return: sample (dictionary).
+        """
+
+        if self.table is None:
+            self.table = ProcessTable()
+        else:
+            self.table.update()
+
+        pids = self.table.get_descendants(self.pid)
+        if not pids:
+            return {}
+
+        values = dict((key, 0) for key in self.memory_keys)
+        counters = {}
+        for pid in pids:
+            info = self.table.processes[pid]
+            values['nprocs'] += 1
+            values['nthreads'] += info['threads']
+            values['vmem'] += info['vsize'] // 1024
+            memory = self.read_smaps(pid)
+            values['pss'] += memory.get('Pss', 0)
+            values['rss'] += memory.get('Rss', info['rss'] // 1024)
+            values['swap'] += memory.get('Swap', 0)
+            counters[pid] = self.read_io(pid)
+            counters[pid]['utime'] = info['utime']
+            counters[pid]['stime'] = info['stime']
+
+        # add the last known values of the processes that have ended, to keep the counters from going down
+        for pid in set(self.counters) - set(counters):
+            for key, value in list(self.counters[pid].items()):  # Python 2/3
+                self.exited[key] += value
+        self.counters = counters
+
+        for key in self.counter_keys:
+            values[key] = self.exited[key] + sum(_counters.get(key, 0) for _counters in counters.values())
+        for key in ['utime', 'stime']:
+            values[key] = int(values[key])
+
+        now = time.time()
+        values['Time'] = int(now)
+        values['wtime'] = int(now - self.start_time)
+
+        with self.lock:
+            self.nsamples += 1
+            self.last = values
+            for key in self.columns:
+                if key != 'Time':
+                    self.maxima[key] = max(self.maxima.get(key, 0), values[key])
+            for key in self.memory_keys:
+                self.sums[key] = self.sums.get(key, 0) + values[key]
+
+        try:
+            with open(self.get_filename(), 'a') as f:
+                f.write('\t'.join(str(values[key]) for key in self.columns) + '\n')
+        except IOError as e:
+            logger.warning('failed to write memory monitor output: %s' % e)
+        self.write_summary(snapshot=True)
 
+        return values
+
+    def read_smaps(self, pid):
+        """
+        Read the memory usage of a process from /proc/<pid>/smaps_rollup (or smaps on older kernels).
+
+        :param pid: process id (int).
+        :return: dictionary with e.g. Pss, Rss and Swap in kB.
+        """
+
+        memory = {}
+        try:
+            with open('/proc/%d/%s' % (pid, self.smaps)) as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    if key in ('Pss', 'Rss', 'Swap'):
+                        memory[key] = memory.get(key, 0) + int(value.split()[0])
+        except (IOError, OSError, ValueError, IndexError):
+            pass  # process has gone away or is not readable
+
+        return memory
+
+    def read_io(self, pid):
+        """
+        Read the I/O counters of a process from /proc/<pid>/io.
+
+        :param pid: process id (int).
+        :return: dictionary with rchar, wchar, read_bytes and write_bytes in B.
+        """
+
+        counters = {}
+        try:
+            with open('/proc/%d/io' % pid) as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    if key in ('rchar', 'wchar', 'read_bytes', 'write_bytes'):
+                        counters[key] = int(value)
+        except (IOError, OSError, ValueError):
+            pass
+
+        return counters
+
+    def poll(self):
+        """
+        Return None if the memory monitor is running, like Popen.poll().
+
+        :return: None or 0.
+        """
+
+        return None if self.thread and self.thread.is_alive() else 0
+
+    def stop(self, timeout=10):
+        """
+        Stop sampling and write the final JSON summary.
+
+        :param timeout: max time to wait for the sampling thread (s).
+        :return:
+        """
+
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout)
+        self.write_summary()
+        logger.info('memory monitor stopped after %d samples' % self.nsamples)
+
+    def write_summary(self, snapshot=False):
+        """
+        Write the JSON summary file.
+
+        :param snapshot: write the intermediate summary file (boolean).
         :return:
         """
 
-        return None
+        path = os.path.join(self.workdir, self.summary + ('_snapshot' if snapshot else ''))
+        try:
+            write_json(path, self.get_results())
+        except Exception as e:
+            logger.warning('failed to write memory monitor summary: %s' % e)
+
+    def get_filename(self):
+        """
+        Return the path to the text output file.
+
+        :return: path (string).
+        """
+
+        return os.path.join(self.workdir, self.filename)
+
+    def get_results(self):
+        """
+        Return the summary of all samples in the same format as the prmon JSON summary, i.e. the maximum values in
+        'Max', and the average values of the memory measurements and the average rates (per second) of the cumulative
+        values in 'Avg'.
+
+        :return: summary dictionary ({} if there are no samples yet).
+        """
+
+        with self.lock:
+            if not self.nsamples:
+                return {}
+            averages = dict((key, self.sums[key] // self.nsamples) for key in self.memory_keys)
+            wtime = self.last.get('wtime', 0)
+            for key in ['rchar', 'read_bytes', 'wchar', 'write_bytes']:
+                averages[key] = self.last.get(key, 0) // wtime if wtime > 0 else 0
+
+            return {'Max': dict(self.maxima), 'Avg': averages}
+
+
+def register_memory_monitor(workdir, monitor):
+    """
+    Register a running memory monitor for the given work directory.
+
+    :param workdir: job work directory (string).
+    :param monitor: MemoryMonitoring object.
+    :return:
+    """
+
+    with _monitors_lock:
+        _monitors[workdir] = monitor
+
+
+def get_memory_monitor(workdir):
+    """
+    Return the memory monitor for the given work directory.
+
+    :param workdir: job work directory (string).
+    :return: MemoryMonitoring object (None if not registered).
+    """
+
+    with _monitors_lock:
+        return _monitors.get(workdir)
+
+
+def unregister_memory_monitor(workdir):
+    """
+    Remove the memory monitor of the given work directory.
+
+    :param workdir: job work directory (string).
+    :return:
+    """
+
+    with _monitors_lock:
+        _monitors.pop(workdir, None)
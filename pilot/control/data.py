@@ -26,12 +26,17 @@ from pilot.api.es_data import StageInESClient
 from pilot.control.job import send_state
 from pilot.common.errorcodes import ErrorCodes
 from pilot.common.exception import ExcThread, PilotException, LogFileCreationFailure
-from pilot.util.auxiliary import get_logger, set_pilot_state, check_for_final_server_update  #, abort_jobs_in_queues
+from pilot.util.auxiliary import get_logger, set_pilot_state, set_server_update, check_for_final_server_update  #, abort_jobs_in_queues
 from pilot.util.common import should_abort
+from pilot.util.config import config
 from pilot.util.constants import PILOT_PRE_STAGEIN, PILOT_POST_STAGEIN, PILOT_PRE_STAGEOUT, PILOT_POST_STAGEOUT, LOG_TRANSFER_IN_PROGRESS,\
     LOG_TRANSFER_DONE, LOG_TRANSFER_NOT_DONE, LOG_TRANSFER_FAILED, SERVER_UPDATE_RUNNING, MAX_KILL_WAIT_TIME
 from pilot.util.container import execute
 from pilot.util.filehandling import remove, get_local_file_size
+from pilot.util.harvester import get_max_concurrent_jobs
+from pilot.util.logarchive import create_log_archive
+from pilot.util.math import human2bytes
+from pilot.util.parameters import convert_to_int
 from pilot.util.processes import threads_aborted
 from pilot.util.queuehandling import declare_failed_by_kill, put_in_queue
 from pilot.util.timing import add_to_pilot_timing
@@ -47,6 +52,10 @@ errors = ErrorCodes()
 def control(queues, traces, args):
 
     targets = {'copytool_in': copytool_in, 'copytool_out': copytool_out, 'queue_monitoring': queue_monitoring}
+    # in Harvester multi-job mode, the jobs are staged in and out at the same time
+    for i in range(1, get_max_concurrent_jobs(args)):
+        targets['copytool_in_%d' % i] = copytool_in
+        targets['copytool_out_%d' % i] = copytool_out
     threads = [ExcThread(bucket=queue.Queue(), target=target, kwargs={'queues': queues, 'traces': traces, 'args': args},
                          name=name) for name, target in list(targets.items())]  # Python 2/3
 
@@ -432,7 +441,7 @@ def copytool_in(queues, traces, args):
 
             # ready to set the job in running state
             send_state(job, args, 'running')
-            os.environ['SERVER_UPDATE'] = SERVER_UPDATE_RUNNING
+            set_server_update(job=job, state=SERVER_UPDATE_RUNNING)
             log = get_logger(job.jobid)
 
             if args.abort_job.is_set():
@@ -474,6 +483,9 @@ def copytool_in(queues, traces, args):
                 traces.pilot['error_code'] = job.piloterrorcodes[0]
                 #queues.failed_data_in.put(job)
                 put_in_queue(job, queues.failed_data_in)
+                # in multi-job mode, the other jobs are allowed to continue
+                if get_max_concurrent_jobs(args) > 1:
+                    continue
                 # do not set graceful stop if pilot has not finished sending the final job update
                 # i.e. wait until SERVER_UPDATE is DONE_FINAL
                 check_for_final_server_update(args.update_server)
@@ -531,8 +543,8 @@ def copytool_out(queues, traces, args):
                 # in multi-output jobs)
                 # should not be necessary unless job object is added to queues.data_out more than once - check this
                 # for multiple output files
-                if processed_jobs:
-                    if is_already_processed(queues, processed_jobs):
+                if job.jobid in processed_jobs:
+                    if is_already_processed(queues, [job.jobid]):
                         continue
 
                 log.info('will perform stage-out for job id=%s' % job.jobid)
@@ -662,17 +674,19 @@ def create_log(job, logfile, tarball_name, args):
 
     log = get_logger(job.jobid)
     log.debug('preparing to create log file')
-    pilot_home = os.environ.get('PILOT_HOME', os.getcwd())
-    current_dir = os.getcwd()
-    if pilot_home != current_dir:
-        log.debug('cd from %s to %s for log creation' % (current_dir, pilot_home))
-        os.chdir(pilot_home)
 
     # perform special cleanup (user specific) prior to log file creation
+    exclude = None
+    archiver = getattr(config.Pilot, 'log_archiver', 'native')
     if args.cleanup:
         pilot_user = os.environ.get('PILOT_USER', 'generic').lower()
         user = __import__('pilot.user.%s.common' % pilot_user, globals(), locals(), [pilot_user], 0)  # Python 2/3
-        user.remove_redundant_files(job.workdir, islooping=errors.LOOPINGJOB in job.piloterrorcodes)
+        islooping = errors.LOOPINGJOB in job.piloterrorcodes
+        if archiver == 'native':
+            # the redundant files are left out while the native archiver walks the workdir
+            exclude = user.get_redundant_file_filter(job.workdir, islooping=islooping)
+        else:
+            user.remove_redundant_files(job.workdir, islooping=islooping)
     else:
         log.debug('user specific cleanup not performed')
 
@@ -686,46 +700,68 @@ def create_log(job, logfile, tarball_name, args):
             log.info('removing file: %s' % path)
             remove(path)
 
+    fullpath = os.path.join(job.workdir, logfile.lfn)  # /some/path/to/dirname/log.tgz
+    log.info('will create archive %s' % fullpath)
+
+    if archiver == 'native':
+        try:
+            create_log_archive(fullpath, job.workdir, arcname=tarball_name, exclude=exclude,
+                               nthreads=convert_to_int(getattr(config.Pilot, 'log_archiver_threads', 4), default=4),
+                               max_size=human2bytes(getattr(config.Pilot, 'maximum_log_file_size', '2 GB')),
+                               max_member_size=human2bytes(getattr(config.Pilot, 'maximum_log_member_size', '500 MB')))
+        except Exception as e:
+            log.warning('native log archiver failed: %s (will use tar)' % e)
+            remove(fullpath)
+            if exclude:
+                user.remove_redundant_files(job.workdir, islooping=islooping)
+        else:
+            verify_log_size(fullpath)
+            return
+
+    create_log_with_tar(job, fullpath, tarball_name)
+
+
+def create_log_with_tar(job, fullpath, tarball_name):
+    """
+    Create the log file with the tar command.
+    The workdir is renamed to the tarball name during the tarball creation, and tar is executed in its parent directory.
+
+    :param job: job object.
+    :param fullpath: path of the log file (string).
+    :param tarball_name: name of the directory in the log file (string).
+    :raises LogFileCreationFailure: in case of log file creation problem
+    :return:
+    """
+
+    log = get_logger(job.jobid)
+
     # rename the workdir for the tarball creation
     newworkdir = os.path.join(os.path.dirname(job.workdir), tarball_name)
     orgworkdir = job.workdir
     log.debug('renaming %s to %s' % (job.workdir, newworkdir))
     os.rename(job.workdir, newworkdir)
     job.workdir = newworkdir
+    fullpath = os.path.join(job.workdir, os.path.basename(fullpath))
 
-    fullpath = os.path.join(job.workdir, logfile.lfn)  # /some/path/to/dirname/log.tgz
-
-    log.info('will create archive %s' % fullpath)
     try:
-        #newdirnm = "tarball_PandaJob_%s" % job.jobid
-        #tarballnm = "%s.tar.gz" % newdirnm
-        #os.rename(job.workdir, newdirnm)
+        t0 = time.time()
         cmd = "pwd;tar cvfz %s %s --dereference --one-file-system; echo $?" % (fullpath, tarball_name)
-        exit_code, stdout, stderr = execute(cmd)
-
-        #with closing(tarfile.open(name=fullpath, mode='w:gz', dereference=True)) as archive:
-        #    archive.add(os.path.basename(job.workdir), recursive=True)
+        exit_code, stdout, stderr = execute(cmd, cwd=os.path.dirname(job.workdir))
     except Exception as e:
         raise LogFileCreationFailure(e)
     else:
-        if pilot_home != current_dir:
-            log.debug('cd from %s to %s after log creation' % (pilot_home, current_dir))
-            os.chdir(pilot_home)
         log.debug('stdout = %s' % stdout)
 
-        # verify the size of the log file
-        size = get_local_file_size(fullpath)
-        if size < 1024:
-            logger.warning('log file size too small: %d B' % size)
-        else:
-            logger.info('log file size: %d B' % size)
-
-    log.debug('renaming %s back to %s' % (job.workdir, orgworkdir))
-    try:
-        os.rename(job.workdir, orgworkdir)
-    except Exception as e:
-        log.debug('exception caught: %s' % e)
-    job.workdir = orgworkdir
+        # throughput stats, for comparison with the native log archiver
+        size = verify_log_size(fullpath)
+        log.info('created %s with tar: %d B in %.1f s' % (fullpath, size, time.time() - t0))
+    finally:
+        log.debug('renaming %s back to %s' % (job.workdir, orgworkdir))
+        try:
+            os.rename(job.workdir, orgworkdir)
+        except Exception as e:
+            log.debug('exception caught: %s' % e)
+        job.workdir = orgworkdir
 
     #fullpath = os.path.join(job.workdir, logfile.lfn)  # reset fullpath since workdir has changed since above
     #return {'scope': logfile.scope,
@@ -734,6 +770,23 @@ def create_log(job, logfile, tarball_name, args):
     #        'bytes': os.stat(fullpath).st_size}
 
 
+def verify_log_size(fullpath):
+    """
+    Verify the size of the log file.
+
+    :param fullpath: path of the log file (string).
+    :return: size in B (int).
+    """
+
+    size = get_local_file_size(fullpath) or 0
+    if size < 1024:
+        logger.warning('log file size too small: %d B' % size)
+    else:
+        logger.info('log file size: %d B' % size)
+
+    return size
+
+
 def _do_stageout(job, xdata, activity, title):
     """
     Use the `StageOutClient` in the Data API to perform stage-out.
@@ -26,30 +26,35 @@ except Exception:
 from json import dumps
 from re import findall
 
+from pilot.api.memorymonitor import unregister_memory_monitor
 from pilot.common.errorcodes import ErrorCodes
 from pilot.common.exception import ExcThread, PilotException  #, JobAlreadyRunning
 from pilot.info import infosys, JobData, InfoService, JobInfoProvider
 from pilot.util import https
 from pilot.util.auxiliary import get_batchsystem_jobid, get_job_scheduler_id, get_pilot_id, get_logger, \
-    set_pilot_state, get_pilot_state, check_for_final_server_update, pilot_version_banner, is_virtual_machine, is_python3
+    set_pilot_state, is_pilot_state, set_server_update, unregister_job, release_prefetched_job, \
+    check_for_final_server_update, pilot_version_banner, is_virtual_machine, is_python3
 from pilot.util.config import config
 from pilot.util.common import should_abort, was_pilot_killed
 from pilot.util.constants import PILOT_MULTIJOB_START_TIME, PILOT_PRE_GETJOB, PILOT_POST_GETJOB, PILOT_KILL_SIGNAL, LOG_TRANSFER_NOT_DONE, \
     LOG_TRANSFER_IN_PROGRESS, LOG_TRANSFER_DONE, LOG_TRANSFER_FAILED, SERVER_UPDATE_TROUBLE, SERVER_UPDATE_FINAL, \
-    SERVER_UPDATE_UPDATING, SERVER_UPDATE_NOT_DONE
+    SERVER_UPDATE_UPDATING, SERVER_UPDATE_NOT_DONE, PILOT_PREVIOUS_JOB_COMPLETED
 from pilot.util.container import execute
-from pilot.util.filehandling import get_files, tail, is_json, copy, remove, read_file, write_json, establish_logging, write_file
+from pilot.util.filehandling import get_files, is_json, copy, remove, read_file, write_json, establish_logging, write_file, \
+    read_tail
 from pilot.util.harvester import request_new_jobs, remove_job_request_file, parse_job_definition_file, \
     is_harvester_mode, get_worker_attributes_file, publish_job_report, publish_work_report, get_event_status_file, \
-    publish_stageout_files
+    publish_stageout_files, get_max_concurrent_jobs, partition_resources
 from pilot.util.jobmetrics import get_job_metrics
 from pilot.util.monitoring import job_monitor_tasks, check_local_space
 from pilot.util.monitoringtime import MonitoringTime
 from pilot.util.processes import cleanup, threads_aborted
+from pilot.util.tee import get_output_tee, unregister_output_tees
 from pilot.util.proxy import get_distinguished_name
 from pilot.util.queuehandling import scan_for_jobs, put_in_queue, queue_report
 from pilot.util.timing import add_to_pilot_timing, timing_report, get_postgetjob_time, get_time_since, time_stamp
 from pilot.util.workernode import get_disk_space, collect_workernode_info, get_node_name, get_cpu_model
+from pilot.util.workdirtracker import stop_workdir_tracker
 
 import logging
 logger = logging.getLogger(__name__)
@@ -225,7 +230,7 @@ def send_state(job, args, state, xml=None, metadata=None):  # noqa: C901
 
     if state == 'finished' or state == 'failed' or state == 'holding':
         final = True
-        os.environ['SERVER_UPDATE'] = SERVER_UPDATE_UPDATING
+        set_server_update(job=job, state=SERVER_UPDATE_UPDATING)
         log.info('job %s has %s - %s final server update' % (job.jobid, state, tag))
 
         # make sure that job.state is 'failed' if there's a set error code
@@ -250,7 +255,7 @@ def send_state(job, args, state, xml=None, metadata=None):  # noqa: C901
         # if in harvester mode write to files required by harvester
         if is_harvester_mode(args):
             # write part of the heartbeat message to worker attributes files needed by Harvester
-            path = get_worker_attributes_file(args)
+            path = get_worker_attributes_file(args, job.jobid)
             # add jobStatus (state) for Harvester
             data['jobStatus'] = state
             # publish work report
@@ -262,7 +267,7 @@ def send_state(job, args, state, xml=None, metadata=None):  # noqa: C901
             # check if we are in final state then write out information for output files
             if final:
                 # Use the job information to write Harvester event_status.dump file
-                event_status_file = get_event_status_file(args)
+                event_status_file = get_event_status_file(args, job.jobid)
                 if publish_stageout_files(job, event_status_file):
                     log.debug('wrote log and output files to file %s' % event_status_file)
                 else:
@@ -313,7 +318,7 @@ def send_state(job, args, state, xml=None, metadata=None):  # noqa: C901
                 handle_backchannel_command(res, job, args)
 
                 if final:
-                    os.environ['SERVER_UPDATE'] = SERVER_UPDATE_FINAL
+                    set_server_update(job=job, state=SERVER_UPDATE_FINAL)
                     log.debug('set SERVER_UPDATE=SERVER_UPDATE_FINAL')
                 return True
         else:
@@ -325,7 +330,7 @@ def send_state(job, args, state, xml=None, metadata=None):  # noqa: C901
         pass
 
     if final:
-        os.environ['SERVER_UPDATE'] = SERVER_UPDATE_TROUBLE
+        set_server_update(job=job, state=SERVER_UPDATE_TROUBLE)
         log.debug('set SERVER_UPDATE=SERVER_UPDATE_TROUBLE')
 
     return False
@@ -681,6 +686,7 @@ def get_list_of_log_files():
 def get_payload_log_tail(job):
     """
     Return the tail of the payload stdout or its latest updated log file.
+    If the payload stdout is copied by the pilot, its tail is taken from memory.
 
     :param job: job object.
     :return: tail of stdout (string).
@@ -689,6 +695,12 @@ def get_payload_log_tail(job):
     log = get_logger(job.jobid, logger)
     stdout_tail = ""
 
+    tee = get_output_tee(job.jobid, 'stdout')
+    if tee and tee.nbytes:
+        log.info('tail of payload stdout will be added to heartbeat')
+        stdout_tail = os.path.join(job.workdir, config.Payload.payloadstdout) + "\n" + tee.get_tail(nbytes=4096)
+        return stdout_tail[-2048:]
+
     # find the latest updated log file
     list_of_files = get_list_of_log_files()
     if not list_of_files:
@@ -700,7 +712,7 @@ def get_payload_log_tail(job):
         log.info('tail of file %s will be added to heartbeat' % latest_file)
 
         # now get the tail of the found log file and protect against potentially large tails
-        stdout_tail = latest_file + "\n" + tail(latest_file)
+        stdout_tail = latest_file + "\n" + read_tail(latest_file)
         stdout_tail = stdout_tail[-2048:]
     except Exception as e:
         log.warning('failed to get payload stdout tail: %s' % e)
@@ -812,6 +824,10 @@ def create_data_payload(queues, traces, args):
         except queue.Empty:
             continue
 
+        # job pipelining: the stage-in may have to wait for the previous job(s) to complete
+        if job.waitfor and not wait_for_previous_jobs(job, queues, args):
+            break
+
         if job.indata:
             # if the job has input data, put the job object in the data_in queue which will trigger stage-in
             set_pilot_state(job=job, state='stagein')
@@ -1029,7 +1045,7 @@ def proceed_with_getjob(timefloor, starttime, jobnumber, getjob_requests, harves
         logger.info('still updating previous job, will not ask for a new job yet')
         return False
 
-    os.environ['SERVER_UPDATE'] = SERVER_UPDATE_NOT_DONE
+    set_server_update(state=SERVER_UPDATE_NOT_DONE)
     return True
 
 
@@ -1059,14 +1075,17 @@ def getjob_server_command(url, port):
     return '{pandaserver}/server/panda/getJob'.format(pandaserver=url)
 
 
-def get_job_definition_from_file(path, harvester):
+def get_job_definition_from_file(path, harvester, maxjobs=1):
     """
     Get a job definition from a pre-placed file.
     In Harvester mode, also remove any existing job request files since it is no longer needed/wanted.
+    In Harvester multi-job mode (maxjobs > 1), all jobs from the file are returned with the cores of the worker node
+    shared between the jobs that run at the same time.
 
     :param path: path to job definition file.
     :param harvester: True if Harvester is being used (determined from args.harvester), otherwise False
-    :return: job definition dictionary.
+    :param maxjobs: max number of jobs run at the same time (int).
+    :return: job definition dictionary (list of dictionaries in multi-job mode).
     """
 
     # remove any existing Harvester job request files (silent in non-Harvester mode) and read the JSON
@@ -1083,7 +1102,13 @@ def get_job_definition_from_file(path, harvester):
                 copy(path, new_path)
                 remove(path)
 
-                # note: the pilot can only handle one job at the time from Harvester
+                if maxjobs > 1:
+                    return partition_resources(job_definition_list, infosys.queuedata.corecount, maxjobs)
+
+                # note: the pilot only handles one job at the time from Harvester unless in multi-job mode
+                if len(job_definition_list) > 1:
+                    logger.warning('ignoring %d additional job(s) from Harvester job definitions file (not in multi-job mode)'
+                                   % (len(job_definition_list) - 1))
                 return job_definition_list[0]
 
     # old style
@@ -1178,7 +1203,7 @@ def get_job_definition(args):
         res = get_fake_job()
     elif os.path.exists(path):
         logger.info('will read job definition from file %s' % path)
-        res = get_job_definition_from_file(path, args.harvester)
+        res = get_job_definition_from_file(path, args.harvester, get_max_concurrent_jobs(args))
     else:
         if args.harvester and args.harvester_submitmode.lower() == 'push':
             pass  # local job definition file not found (go to sleep)
@@ -1390,12 +1415,24 @@ def retrieve(queues, traces, args):  # noqa: C901
 
     jobnumber = 0  # number of downloaded jobs
     getjob_requests = 0  # number of getjob requests
+    prefetched_jobs = []  # jobs downloaded while the previous jobs were finishing (job pipelining)
 
     print_node_info()
 
     while not args.graceful_stop.is_set():
 
         time.sleep(0.5)
+
+        # the next job(s) have already been downloaded and queued
+        while prefetched_jobs and not args.graceful_stop.is_set():
+            logger.info('waiting for %d prefetched job(s)' % len(prefetched_jobs))
+            prefetched_jobs, completed = wait_for_jobs(prefetched_jobs, queues, traces, args, timefloor, starttime, jobnumber)
+            jobnumber += len(prefetched_jobs)
+            if completed:
+                getjob_requests = 0
+        if args.graceful_stop.is_set():
+            break
+
         getjob_requests += 1
 
         if not proceed_with_getjob(timefloor, starttime, jobnumber, getjob_requests, args.harvester, args.verify_proxy, traces):
@@ -1438,9 +1475,10 @@ def retrieve(queues, traces, args):  # noqa: C901
                         break
                     time.sleep(1)
             else:
-                # create the job object out of the raw dispatcher job dictionary
+                # create the job objects out of the raw dispatcher job dictionaries
+                # note: the Harvester job definition file can contain several jobs in multi-job mode
                 try:
-                    job = create_job(res, args.queue)
+                    jobs = [create_job(_res, args.queue) for _res in (res if isinstance(res, list) else [res])]
                 except PilotException as error:
                     raise error
                 else:
@@ -1456,30 +1494,21 @@ def retrieve(queues, traces, args):  # noqa: C901
                     #    logger.warning("%s" % e)
                 # write time stamps to pilot timing file
                 # note: PILOT_POST_GETJOB corresponds to START_TIME in Pilot 1
-                add_to_pilot_timing(job.jobid, PILOT_PRE_GETJOB, time_pre_getjob, args)
-                add_to_pilot_timing(job.jobid, PILOT_POST_GETJOB, time.time(), args)
-
-                # add the job definition to the jobs queue and increase the job counter,
-                # and wait until the job has finished
-                put_in_queue(job, queues.jobs)
-
-                jobnumber += 1
-                while not args.graceful_stop.is_set():
-                    if has_job_completed(queues, args):
-                        args.job_aborted.clear()
-                        args.abort_job.clear()
-                        logger.info('ready for new job')
-
-                        # re-establish logging
-                        logging.info('pilot has finished for previous job - re-establishing logging')
-                        logging.handlers = []
-                        logging.shutdown()
-                        establish_logging(args)
-                        pilot_version_banner()
-                        getjob_requests = 0
-                        add_to_pilot_timing('1', PILOT_MULTIJOB_START_TIME, time.time(), args)
-                        break
-                    time.sleep(0.5)
+                for job in jobs:
+                    add_to_pilot_timing(job.jobid, PILOT_PRE_GETJOB, time_pre_getjob, args)
+                    add_to_pilot_timing(job.jobid, PILOT_POST_GETJOB, time.time(), args)
+                    jobnumber += 1
+
+                # add the job definitions to the jobs queue (in multi-job mode, the remaining jobs are queued by
+                # wait_for_jobs() when running jobs have completed)
+                for job in jobs[:get_max_concurrent_jobs(args)]:
+                    put_in_queue(job, queues.jobs)
+
+                # wait until the job(s) have finished (and download the next job(s) in job pipelining mode)
+                prefetched_jobs, completed = wait_for_jobs(jobs, queues, traces, args, timefloor, starttime, jobnumber)
+                jobnumber += len(prefetched_jobs)
+                if completed:
+                    getjob_requests = 0
 
     # proceed to set the job_aborted flag?
     if threads_aborted():
@@ -1491,6 +1520,165 @@ def retrieve(queues, traces, args):  # noqa: C901
     logger.debug('[job] retrieve thread has finished')
 
 
+def wait_for_jobs(jobs, queues, traces, args, timefloor, starttime, jobnumber):
+    """
+    Wait until the given jobs have completed.
+    At most get_max_concurrent_jobs() jobs have been queued, the remaining jobs are queued when running jobs have
+    completed (Harvester multi-job mode).
+    In job pipelining mode, the next job(s) are downloaded and queued as soon as the payloads of the given jobs have
+    finished, i.e. while the jobs are in stage-out and the final server update (see prefetch_jobs()). A prefetched job
+    that completes before the given jobs is left to the wait_for_jobs() call for the prefetched jobs.
+
+    :param jobs: list of job objects.
+    :param queues: internal queues for job handling.
+    :param traces: tuple containing internal pilot states.
+    :param args: Pilot arguments (e.g. containing queue name, queuedata dictionary, etc).
+    :param timefloor: timefloor limit (s).
+    :param starttime: start time of retrieve() (s).
+    :param jobnumber: number of downloaded jobs.
+    :return: list of prefetched job objects, True if the jobs have completed (Boolean).
+    """
+
+    prefetched_jobs = []
+    held_jobs = []  # completed prefetched jobs, handled when waiting for the prefetched jobs
+    last_prefetch = 0
+    running = len(jobs)
+    queued = min(running, get_max_concurrent_jobs(args))
+    while not args.graceful_stop.is_set():
+        job = get_completed_job(queues, jobs, held_jobs)
+        if job:
+            report_completed_job(job, queues, args)
+            running -= 1
+            if queued < len(jobs):
+                logger.info('queueing job %s' % jobs[queued].jobid)
+                put_in_queue(jobs[queued], queues.jobs)
+                queued += 1
+            if running > 0:
+                logger.info('%d job(s) still running' % running)
+                continue
+            args.job_aborted.clear()
+            args.abort_job.clear()
+            logger.info('ready for new job')
+
+            for job in held_jobs:
+                put_in_queue(job, queues.completed_jobs)
+            if prefetched_jobs:
+                # the logging can not be re-established since the next job(s) are already being processed
+                for job in prefetched_jobs:
+                    add_to_pilot_timing(job.jobid, PILOT_PREVIOUS_JOB_COMPLETED, time.time(), args)
+                    release_prefetched_job(job)
+            else:
+                # re-establish logging
+                logging.info('pilot has finished for previous job - re-establishing logging')
+                logging.handlers = []
+                logging.shutdown()
+                establish_logging(args)
+                pilot_version_banner()
+            add_to_pilot_timing('1', PILOT_MULTIJOB_START_TIME, time.time(), args)
+            return prefetched_jobs, True
+
+        if not prefetched_jobs and is_pipelining_possible(jobs, args) and \
+                time.time() - last_prefetch > get_job_retrieval_delay(args.harvester):
+            last_prefetch = time.time()
+            prefetched_jobs = prefetch_jobs(jobs, queues, traces, args, timefloor, starttime, jobnumber)
+        time.sleep(0.5)
+
+    for job in held_jobs:
+        put_in_queue(job, queues.completed_jobs)
+
+    return prefetched_jobs, False
+
+
+def is_pipelining_possible(jobs, args):
+    """
+    Can the next job be downloaded while the given jobs are finishing?
+    This is the case in job pipelining mode once the payloads of all the given jobs have finished, so that two payloads
+    never run at the same time.
+
+    :param jobs: list of job objects.
+    :param args: Pilot arguments (e.g. containing queue name, queuedata dictionary, etc).
+    :return: Boolean.
+    """
+
+    if getattr(args, 'job_pipelining', 'off') not in ['getjob', 'stagein']:
+        return False
+
+    return all(job.state in ['stageout', 'finished', 'failed'] for job in jobs)
+
+
+def prefetch_jobs(jobs, queues, traces, args, timefloor, starttime, jobnumber):
+    """
+    Download the next job(s) while the given jobs are finishing (job pipelining) and put them in the jobs queue, which
+    creates their work directories. In 'stagein' mode the stage-in starts right away, in 'getjob' mode it waits for
+    the given jobs to complete (see create_data_payload()).
+    The checks of proceed_with_getjob() (e.g. timefloor) are respected. Their side effects (wrap-up instruction, pilot
+    error code) are left to the regular check after the given jobs have completed.
+
+    :param jobs: list of job objects.
+    :param queues: internal queues for job handling.
+    :param traces: tuple containing internal pilot states.
+    :param args: Pilot arguments (e.g. containing queue name, queuedata dictionary, etc).
+    :param timefloor: timefloor limit (s).
+    :param starttime: start time of retrieve() (s).
+    :param jobnumber: number of downloaded jobs.
+    :return: list of prefetched job objects.
+    """
+
+    wrap_up = os.environ.get('PILOT_WRAP_UP')
+    server_update = os.environ.get('SERVER_UPDATE', '')
+    error_code = traces.pilot['error_code']
+    proceed = proceed_with_getjob(timefloor, starttime, jobnumber, 1, args.harvester, args.verify_proxy, traces)
+    if wrap_up is None:
+        os.environ.pop('PILOT_WRAP_UP', None)
+    else:
+        os.environ['PILOT_WRAP_UP'] = wrap_up
+    os.environ['SERVER_UPDATE'] = server_update  # the final server update of the given jobs may still be pending
+    traces.pilot['error_code'] = error_code
+    if not proceed:
+        return []
+
+    time_pre_getjob = time.time()
+    res = get_job_definition(args)
+    if not res or (isinstance(res, dict) and 'StatusCode' in res and str(res['StatusCode']) != '0'):
+        logger.info('did not prefetch a job (will try again later)')
+        return []
+
+    waitfor = [job.jobid for job in jobs] if args.job_pipelining == 'getjob' else []
+    prefetched_jobs = [create_job(_res, args.queue) for _res in (res if isinstance(res, list) else [res])]
+    for job in prefetched_jobs:
+        job.waitfor = waitfor
+        job.prefetched = True  # the pilot and server update states of the given jobs must not be overwritten
+        add_to_pilot_timing(job.jobid, PILOT_PRE_GETJOB, time_pre_getjob, args)
+        add_to_pilot_timing(job.jobid, PILOT_POST_GETJOB, time.time(), args)
+    for job in prefetched_jobs[:get_max_concurrent_jobs(args)]:
+        put_in_queue(job, queues.jobs)
+    logger.info('prefetched job(s) %s while the previous job(s) are finishing' % [job.jobid for job in prefetched_jobs])
+
+    return prefetched_jobs
+
+
+def wait_for_previous_jobs(job, queues, args):
+    """
+    Wait until the jobs listed in job.waitfor have completed (job pipelining).
+
+    :param job: job object.
+    :param queues: internal queues for job handling.
+    :param args: Pilot arguments (e.g. containing queue name, queuedata dictionary, etc).
+    :return: True if the previous jobs have completed, False if graceful stop has been set.
+    """
+
+    log = get_logger(job.jobid, logger)
+    if job.waitfor:
+        log.info('stage-in will wait for the completion of the previous job(s): %s' % job.waitfor)
+    while not args.graceful_stop.is_set():
+        completed_jobids = list(queues.completed_jobids.queue)
+        if all(jobid in completed_jobids for jobid in job.waitfor):
+            return True
+        time.sleep(1)
+
+    return False
+
+
 def print_node_info():
     """
     Print information about the local node to the log.
@@ -1532,56 +1720,59 @@ def create_job(dispatcher_response, queue):
     return job
 
 
-def has_job_completed(queues, args):
+def get_completed_job(queues, jobs, held_jobs):
     """
-    Has the current job completed (finished or failed)?
-    Note: the job object was extracted from monitored_payloads queue before this function was called.
+    Return the next completed job among the given jobs.
+    A completed job that is not among the given jobs (a prefetched job that failed stage-in while the previous job was
+    still finishing) is added to held_jobs. Such jobs must be put back in the completed_jobs queue once the given jobs
+    have completed, to be handled by the wait_for_jobs() call for the prefetched jobs.
 
     :param queues: Pilot queues object.
-    :return: True is the payload has finished or failed
+    :param jobs: list of job objects.
+    :param held_jobs: list of completed job objects that are not among the given jobs (updated).
+    :return: completed job object (None if none of the given jobs has completed).
     """
 
-    # check if the job has finished
     try:
         job = queues.completed_jobs.get(block=True, timeout=1)
     except queue.Empty:
-        # logger.info("(job still running)")
-        pass
-    else:
-        log = get_logger(job.jobid, logger)
+        return None
 
-        make_job_report(job)
-        cmd = 'ls -lF %s' % os.environ.get('PILOT_HOME')
-        log.debug('%s:\n' % cmd)
-        ec, stdout, stderr = execute(cmd)
-        log.debug(stdout)
-
-        queue_report(queues)
-        job.reset_errors()
-        log.info("job %s has completed (purged errors)" % job.jobid)
-
-        # cleanup of any remaining processes
-        if job.pid:
-            job.zombies.append(job.pid)
-        cleanup(job, args)
-
-        return True
-
-    # is there anything in the finished_jobs queue?
-    #finished_queue_snapshot = list(queues.finished_jobs.queue)
-    #peek = [obj for obj in finished_queue_snapshot if jobid == obj.jobid]
-    #if peek:
-    #    logger.info("job %s has completed (finished)" % jobid)
-    #    return True
-
-    # is there anything in the failed_jobs queue?
-    #failed_queue_snapshot = list(queues.failed_jobs.queue)
-    #peek = [obj for obj in failed_queue_snapshot if jobid == obj.jobid]
-    #if peek:
-    #    logger.info("job %s has completed (failed)" % jobid)
-    #    return True
+    if job.jobid not in [_job.jobid for _job in jobs]:
+        logger.info('job %s has completed before the previous job(s) - will be handled later' % job.jobid)
+        held_jobs.append(job)
+        return None
 
-    return False
+    return job
+
+
+def report_completed_job(job, queues, args):
+    """
+    Report and clean up after a completed (finished or failed) job.
+    Note: the job object was extracted from monitored_payloads queue before this function was called.
+
+    :param job: job object.
+    :param queues: Pilot queues object.
+    :param args: Pilot arguments (e.g. containing queue name, queuedata dictionary, etc).
+    :return:
+    """
+
+    log = get_logger(job.jobid, logger)
+
+    make_job_report(job)
+    cmd = 'ls -lF %s' % os.environ.get('PILOT_HOME')
+    log.debug('%s:\n' % cmd)
+    ec, stdout, stderr = execute(cmd)
+    log.debug(stdout)
+
+    queue_report(queues)
+    job.reset_errors()
+    log.info("job %s has completed (purged errors)" % job.jobid)
+
+    # cleanup of any remaining processes
+    if job.pid:
+        job.zombies.append(job.pid)
+    cleanup(job, args)
 
 
 def get_job_from_queue(queues, state):
@@ -1773,8 +1964,8 @@ def queue_monitor(queues, traces, args):  # noqa: C901
                 #    logger.warning('will abort failed job (should prepare for final server update)')
                 break
             i += 1
-            state = get_pilot_state()  # the job object is not available, but the state is also kept in PILOT_JOB_STATE
-            if state != 'stage-out':
+            # the job object is not available, but the states of the jobs being processed are kept by set_pilot_state()
+            if not is_pilot_state('stage-out'):
                 # logger.info("no need to wait since job state=\'%s\'" % state)
                 break
             pause_queue_monitor(1) if not abort_thread else pause_queue_monitor(10)
@@ -1794,6 +1985,7 @@ def queue_monitor(queues, traces, args):  # noqa: C901
 
             # send final server update
             update_server(job, args)
+            unregister_job(job)
 
             # we can now stop monitoring this job, so remove it from the monitored_payloads queue and add it to the
             # completed_jobs queue which will tell retrieve() that it can download another job
@@ -1808,6 +2000,9 @@ def queue_monitor(queues, traces, args):  # noqa: C901
                 put_in_queue(job.jobid, queues.completed_jobids)
 
                 put_in_queue(job, queues.completed_jobs)
+                stop_workdir_tracker(job.workdir)
+                unregister_output_tees(job.jobid)
+                unregister_memory_monitor(job.workdir)
                 del _job
                 logger.debug('tmp job object deleted')
 
@@ -1996,13 +2191,11 @@ def job_monitor(queues, traces, args):  # noqa: C901
     :return:
     """
 
-    # initialize the monitoring time object
-    mt = MonitoringTime()
-
-    # peeking and current time; peeking_time gets updated if and when jobs are being monitored, update_time is only
-    # used for sending the heartbeat and is updated after a server update
+    # peeking and current time; peeking_time gets updated if and when jobs are being monitored, the update times are only
+    # used for sending the heartbeats and are updated after a server update (several jobs are monitored in multi-job mode)
     peeking_time = int(time.time())
-    update_time = peeking_time
+    update_times = {}  # job id -> time of the last server update
+    monitoring_times = {}  # job id -> MonitoringTime object with the times of the last monitoring tasks
 
     # overall loop counter (ignoring the fact that more than one job may be running)
     n = 0
@@ -2026,7 +2219,8 @@ def job_monitor(queues, traces, args):  # noqa: C901
                     for i in range(len(jobs)):
                         # send heartbeat if it is time (note that the heartbeat function might update the job object, e.g.
                         # by turning on debug mode, ie we need to get the heartbeat period in case it has changed)
-                        update_time = send_heartbeat_if_time(jobs[i], args, update_time)
+                        update_time = update_times.setdefault(jobs[i].jobid, int(time.time()))
+                        update_times[jobs[i].jobid] = send_heartbeat_if_time(jobs[i], args, update_time)
 
                     # sleep for a while if stage-in has not completed
                     time.sleep(1)
@@ -2043,39 +2237,8 @@ def job_monitor(queues, traces, args):  # noqa: C901
         if jobs:
             # update the peeking time
             peeking_time = int(time.time())
-            for i in range(len(jobs)):
-                log = get_logger(jobs[i].jobid)
-                current_id = jobs[i].jobid
-                log.info('monitor loop #%d: job %d:%s is in state \'%s\'' % (n, i, current_id, jobs[i].state))
-                if jobs[i].state == 'finished' or jobs[i].state == 'failed':
-                    log.info('will abort job monitoring soon since job state=%s (job is still in queue)' % jobs[i].state)
-                    break
-
-                # perform the monitoring tasks
-                exit_code, diagnostics = job_monitor_tasks(jobs[i], mt, args)
-                if exit_code != 0:
-                    try:
-                        fail_monitored_job(jobs[i], exit_code, diagnostics, queues, traces)
-                    except Exception as e:
-                        log.warning('(1) exception caught: %s (job id=%s)' % (e, current_id))
-                    break
-
-                # run this check again in case job_monitor_tasks() takes a long time to finish (and the job object
-                # has expired in the mean time)
-                try:
-                    _job = jobs[i]
-                except Exception:
-                    log.info('aborting job monitoring since job object (job id=%s) has expired' % current_id)
-                    break
-
-                # send heartbeat if it is time (note that the heartbeat function might update the job object, e.g.
-                # by turning on debug mode, ie we need to get the heartbeat period in case it has changed)
-                try:
-                    update_time = send_heartbeat_if_time(_job, args, update_time)
-                except Exception as e:
-                    log.warning('(2) exception caught: %s (job id=%s)' % (e, current_id))
-                    break
-        elif os.environ.get('PILOT_JOB_STATE') == 'stagein':
+            monitor_jobs(jobs, monitoring_times, update_times, queues, traces, args, n=n)
+        elif is_pilot_state('stagein'):
             logger.info('job monitoring is waiting for stage-in to finish')
         else:
             # check the waiting time in the job monitor. set global graceful_stop if necessary
@@ -2096,6 +2259,64 @@ def job_monitor(queues, traces, args):  # noqa: C901
     logger.debug('[job] job monitor thread has finished')
 
 
+def monitor_jobs(jobs, monitoring_times, update_times, queues, traces, args, n=0):
+    """
+    Perform the monitoring tasks for the given jobs and send their heartbeats if it is time.
+    Every job has its own `MonitoringTime` object, so that all jobs processed at the same time in multi-job mode are
+    verified at each time interval (a check of one job would otherwise postpone the same check of the other jobs).
+
+    :param jobs: list or queue of monitored job objects.
+    :param monitoring_times: dictionary of `MonitoringTime` objects per job id (updated).
+    :param update_times: dictionary of the last server update times per job id (updated).
+    :param queues: internal queues for job handling.
+    :param traces: tuple containing internal pilot states.
+    :param args: Pilot arguments (e.g. containing queue name, queuedata dictionary, etc).
+    :param n: monitoring loop counter (int).
+    :return:
+    """
+
+    for i in range(len(jobs)):
+        log = get_logger(jobs[i].jobid)
+        current_id = jobs[i].jobid
+        log.info('monitor loop #%d: job %d:%s is in state \'%s\'' % (n, i, current_id, jobs[i].state))
+        if jobs[i].state == 'finished' or jobs[i].state == 'failed':
+            log.info('will abort job monitoring soon since job state=%s (job is still in queue)' % jobs[i].state)
+            continue
+
+        # perform the monitoring tasks
+        mt = monitoring_times.setdefault(current_id, MonitoringTime())
+        exit_code, diagnostics = job_monitor_tasks(jobs[i], mt, args)
+        if exit_code != 0:
+            try:
+                fail_monitored_job(jobs[i], exit_code, diagnostics, queues, traces)
+            except Exception as e:
+                log.warning('(1) exception caught: %s (job id=%s)' % (e, current_id))
+            continue
+
+        # run this check again in case job_monitor_tasks() takes a long time to finish (and the job object
+        # has expired in the mean time)
+        try:
+            _job = jobs[i]
+        except Exception:
+            log.info('aborting job monitoring since job object (job id=%s) has expired' % current_id)
+            continue
+
+        # send heartbeat if it is time (note that the heartbeat function might update the job object, e.g.
+        # by turning on debug mode, ie we need to get the heartbeat period in case it has changed)
+        try:
+            update_time = update_times.setdefault(current_id, int(time.time()))
+            update_times[current_id] = send_heartbeat_if_time(_job, args, update_time)
+        except Exception as e:
+            log.warning('(2) exception caught: %s (job id=%s)' % (e, current_id))
+            continue
+
+    # forget the monitoring times of the jobs that are no longer monitored
+    current_ids = [job.jobid for job in list(jobs)]
+    for jobid in list(monitoring_times):
+        if jobid not in current_ids:
+            del monitoring_times[jobid]
+
+
 def send_heartbeat_if_time(job, args, update_time):
     """
     Send a heartbeat to the server if it is time to do so.
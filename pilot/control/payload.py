@@ -26,6 +26,7 @@ from pilot.util.auxiliary import get_logger, set_pilot_state
 from pilot.util.processes import get_cpu_consumption_time
 from pilot.util.config import config
 from pilot.util.filehandling import read_file, remove_core_dumps
+from pilot.util.harvester import get_max_concurrent_jobs
 from pilot.util.processes import threads_aborted
 from pilot.util.queuehandling import put_in_queue
 from pilot.common.errorcodes import ErrorCodes
@@ -49,6 +50,9 @@ def control(queues, traces, args):
 
     targets = {'validate_pre': validate_pre, 'execute_payloads': execute_payloads, 'validate_post': validate_post,
                'failed_post': failed_post}
+    # in Harvester multi-job mode, several payloads are executed at the same time
+    for i in range(1, get_max_concurrent_jobs(args)):
+        targets['execute_payloads_%d' % i] = execute_payloads
     threads = [ExcThread(bucket=queue.Queue(), target=target, kwargs={'queues': queues, 'traces': traces, 'args': args},
                          name=name) for name, target in list(targets.items())]  # Python 3
 
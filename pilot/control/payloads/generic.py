@@ -8,21 +8,28 @@
 # - Mario Lassnig, mario.lassnig@cern.ch, 2016-2017
 # - Daniel Drizhuk, d.drizhuk@gmail.com, 2017
 # - Tobias Wegner, tobias.wegner@cern.ch, 2017
-# - Paul Nilsson, paul.nilsson@cern.ch, 2017-2019
+# - Paul Nilsson, paul.nilsson@cern.ch, 2017-2020
 # - Wen Guan, wen.guan@cern.ch, 2018
 
 import time
 import os
 import signal
+import threading
 from subprocess import PIPE
 
+from pilot.api.memorymonitor import MemoryMonitoring
 from pilot.common.errorcodes import ErrorCodes
 from pilot.control.job import send_state
 from pilot.util.auxiliary import get_logger, set_pilot_state
+from pilot.util.config import config
 from pilot.util.container import execute
 from pilot.util.constants import UTILITY_BEFORE_PAYLOAD, UTILITY_WITH_PAYLOAD, UTILITY_AFTER_PAYLOAD_STARTED, \
     UTILITY_AFTER_PAYLOAD_FINISHED, PILOT_PRE_SETUP, PILOT_POST_SETUP, PILOT_PRE_PAYLOAD, PILOT_POST_PAYLOAD
 from pilot.util.filehandling import write_file
+from pilot.util.monitoring import get_local_size_limit_stdout
+from pilot.util.parameters import convert_to_int
+from pilot.util.processes import kill_processes
+from pilot.util.tee import OutputTee, register_output_tee, get_output_tee
 from pilot.util.timing import add_to_pilot_timing
 from pilot.common.exception import PilotException
 
@@ -39,6 +46,7 @@ class Executor(object):
         self.__out = out
         self.__err = err
         self.__traces = traces
+        self.__kill_request = threading.Event()  # set by the output tees, the payload is killed by wait_graceful()
 
     def get_job(self):
         """
@@ -142,6 +150,11 @@ class Executor(object):
             cmd = '%s %s' % (cmd_dictionary.get('command'), cmd_dictionary.get('args'))
             log.info('utility command to be executed after the payload: %s' % cmd)
 
+            if cmd_dictionary.get('command') == 'MemoryMonitor' and \
+                    getattr(config.Pilot, 'memory_monitor', 'external') == 'native':
+                self.start_memory_monitor(job)
+                return
+
             # how should this command be executed?
             utilitycommand = user.get_utility_command_setup(cmd_dictionary.get('command'), job)
             if not utilitycommand:
@@ -157,6 +170,20 @@ class Executor(object):
                 # also store the full command in case it needs to be restarted later (by the job_monitor() thread)
                 job.utilities[cmd_dictionary.get('command')] = [proc1, 1, utilitycommand]
 
+    def start_memory_monitor(self, job):
+        """
+        Start the native memory monitor, which samples the payload process tree from within the pilot.
+        The output files have the same format as those of prmon.
+
+        :param job: job object.
+        :return:
+        """
+
+        interval = convert_to_int(getattr(config.Pilot, 'memory_monitor_interval', 60), default=60)
+        monitor = MemoryMonitoring(pid=job.pid, workdir=job.workdir, interval=interval)
+        job.memorymonitor = 'prmon'
+        job.utilities['MemoryMonitor'] = [monitor.execute(), 1, 'native']
+
     def utility_after_payload_finished(self, job):
         """
         Prepare commands/utilities to run after payload has finished.
@@ -310,11 +337,14 @@ class Executor(object):
 
         log.info("\n\npayload execution command:\n\n%s\n" % cmd)
 
+        # the payload stdout/stderr can be written to the files by the pilot (see start_output_tees())
+        use_tee = getattr(config.Payload, 'output_tee', False)
+
         # replace platform and workdir with new function get_payload_options() or something from experiment specific
         # code
         try:
-            proc = execute(cmd, workdir=job.workdir, returnproc=True,
-                           usecontainer=True, stdout=out, stderr=err, cwd=job.workdir, job=job)
+            proc = execute(cmd, workdir=job.workdir, returnproc=True, usecontainer=True,
+                           stdout=PIPE if use_tee else out, stderr=PIPE if use_tee else err, cwd=job.workdir, job=job)
         except Exception as e:
             log.error('could not execute: %s' % str(e))
             return None
@@ -322,6 +352,9 @@ class Executor(object):
             log.error('failed to execute payload')
             return None
 
+        if use_tee:
+            self.start_output_tees(job, proc, out, err)
+
         log.info('started -- pid=%s executable=%s' % (proc.pid, cmd))
         job.pid = proc.pid
         job.pgrp = os.getpgid(job.pid)
@@ -331,6 +364,81 @@ class Executor(object):
 
         return proc
 
+    def start_output_tees(self, job, proc, out, err):
+        """
+        Start copying the payload stdout and stderr pipes to the output files.
+        The copies keep the end of the output in memory (for the heartbeats), count the stdout size and look for the
+        fatal error signatures of the user (see `get_fatal_output_signatures()` in the user common module).
+
+        :param job: job object.
+        :param proc: process object (Popen).
+        :param out: stdout file object.
+        :param err: stderr file object.
+        :return:
+        """
+
+        pilot_user = os.environ.get('PILOT_USER', 'generic').lower()
+        user = __import__('pilot.user.%s.common' % pilot_user, globals(), locals(), [pilot_user], 0)  # Python 2/3
+        signatures = user.get_fatal_output_signatures()
+
+        ringsize = convert_to_int(getattr(config.Payload, 'output_ring_buffer', 64), default=64) * 1024
+        killed = threading.Event()  # the payload should only be killed once
+        for name, stream, fobj in [('stdout', proc.stdout, out), ('stderr', proc.stderr, err)]:
+            error_codes = dict((category, error_code) for category, _, error_code in signatures.get(name, []))
+            tee = OutputTee(name, fobj, ringsize=ringsize,
+                            signatures=[(category, patterns) for category, patterns, _ in signatures.get(name, [])],
+                            limit=get_local_size_limit_stdout() if name == 'stdout' else None,
+                            callback=lambda tee, category, detail, error_codes=error_codes:
+                            self.handle_output_event(job, tee, category, detail, error_codes, killed))
+            tee.start(stream)
+            register_output_tee(job.jobid, tee)
+
+    def stop_output_tees(self, job):
+        """
+        Wait for the copies of the payload stdout and stderr to finish.
+
+        :param job: job object.
+        :return:
+        """
+
+        for name in ['stdout', 'stderr']:
+            tee = get_output_tee(job.jobid, name)
+            if tee:
+                tee.join()
+
+    def handle_output_event(self, job, tee, category, detail, error_codes, killed):
+        """
+        Handle a fatal error signature or the stdout size limit found in the payload output while the payload is
+        running. The payload is killed (once), unless this has been switched off in the pilot configuration.
+
+        :param job: job object.
+        :param tee: OutputTee object.
+        :param category: 'size' or signature category (string).
+        :param detail: number of bytes (size) or matched line (string).
+        :param error_codes: dictionary {category: error code}.
+        :param killed: threading.Event, set when the payload has been killed.
+        :return:
+        """
+
+        log = get_logger(job.jobid, logger)
+
+        if category == 'size':
+            error_code = errors.STDOUTTOOBIG
+            diagnostics = "Payload stdout file too big: %d B (larger than limit %d B)" % (detail, tee.limit)
+        else:
+            error_code = error_codes.get(category, errors.UNKNOWNPAYLOADFAILURE)
+            diagnostics = "identified a fatal error (%s) in payload %s: %s" % (category, tee.name, detail.strip())
+
+        if not getattr(config.Payload, 'kill_on_fatal_output', False) or killed.is_set():
+            log.warning(diagnostics)
+            return
+
+        # the payload is killed by the monitoring loop in wait_graceful(), not by the tee search thread
+        log.fatal('%s (will kill the payload)' % diagnostics)
+        killed.set()
+        job.piloterrorcodes, job.piloterrordiags = errors.add_error_code(error_code, msg=diagnostics)
+        self.__kill_request.set()
+
     def extract_setup(self, cmd):
         """
         Extract the setup from the payload command (cmd).
@@ -348,50 +456,76 @@ class Executor(object):
 
         return setup
 
-    def wait_graceful(self, args, proc, job):
+    def wait_for_exit(self, proc, finished):
         """
-        (add description)
-        :param args:
-        :param proc:
-        :param job:
+        Block until the payload process has finished, then set the finished event.
+        Intended to be run in a dedicated (daemon) thread so that wait_graceful() can react immediately on payload
+        exit instead of polling the process.
+
+        :param proc: process object (Popen).
+        :param finished: threading.Event to set when the process has exited.
         :return:
         """
 
+        try:
+            proc.wait()
+        except Exception as e:
+            logger.warning('exception caught while waiting for pid=%s: %s' % (proc.pid, e))
+        finally:
+            finished.set()
+
+    def wait_graceful(self, args, proc, job):
+        """
+        Wait for the payload to finish, or abort it if a graceful stop has been requested.
+        A waiter thread blocks on the payload process and sets an event as soon as it exits, so the payload exit is
+        detected immediately. In case of a graceful stop, the process group is sent SIGTERM, followed by SIGKILL
+        after three seconds if the payload is still alive.
+        The payload is also killed here when the output tees have found a fatal error in its output.
+
+        :param args: pilot arguments object.
+        :param proc: process object (Popen).
+        :param job: job object.
+        :return: exit code (int, None if the payload was killed).
+        """
+
         log = get_logger(job.jobid, logger)
 
-        breaker = False
+        finished = threading.Event()
+        waiter = threading.Thread(target=self.wait_for_exit, args=(proc, finished), name='payload_waiter')
+        waiter.daemon = True
+        waiter.start()
+
         exit_code = None
-        try:
-            iteration = long(0)  # Python 2, do not use 0L since it will create a syntax error in spite of the try
-        except Exception:
-            iteration = 0  # Python 3, long doesn't exist
+        t0 = time.time()
+        last_report = t0
         while True:
-            time.sleep(0.1)
-
-            iteration += 1
-            for i in range(60):  # Python 2/3
-                if args.graceful_stop.is_set():
-                    breaker = True
-                    log.info('breaking -- sending SIGTERM pid=%s' % proc.pid)
-                    os.killpg(os.getpgid(proc.pid), signal.SIGTERM)
-                    # proc.terminate()
-                    break
-                time.sleep(1)
-            if breaker:
-                log.info('breaking -- sleep 3s before sending SIGKILL pid=%s' % proc.pid)
-                time.sleep(3)
-                proc.kill()
+            # wake up as soon as the payload has finished, or check the graceful stop flag once per second
+            if finished.wait(1):
+                exit_code = proc.returncode
                 break
 
-            exit_code = proc.poll()
+            # a fatal error was found in the payload output (see handle_output_event())
+            if self.__kill_request.is_set():
+                self.__kill_request.clear()
+                log.info('killing the payload after a fatal error in its output')
+                kill_processes(job.pid)
+                continue
 
-            if iteration % 10 == 0:
-                log.info('running: iteration=%d pid=%s exit_code=%s' % (iteration, proc.pid, exit_code))
-            if exit_code is not None:
+            if args.graceful_stop.is_set():
+                log.info('breaking -- sending SIGTERM pid=%s' % proc.pid)
+                try:
+                    os.killpg(os.getpgid(proc.pid), signal.SIGTERM)
+                except Exception as e:
+                    log.warning('failed to send SIGTERM: %s' % e)
+                log.info('breaking -- waiting up to 3s before sending SIGKILL pid=%s' % proc.pid)
+                if not finished.wait(3):
+                    proc.kill()
                 break
-            else:
-                # send_state(job, args, 'running')
-                continue
+
+            now = time.time()
+            if now - last_report >= 600:
+                last_report = now
+                log.info('running: time=%d s pid=%s exit_code=%s' % (int(now - t0), proc.pid, exit_code))
 
         return exit_code
 
@@ -413,6 +547,7 @@ class Executor(object):
 
                 log.info('will wait for graceful exit')
                 exit_code = self.wait_graceful(self.__args, proc, self.__job)
+                self.stop_output_tees(self.__job)
                 state = 'finished' if exit_code == 0 else 'failed'
                 set_pilot_state(job=self.__job, state=state)
                 log.info('\n\nfinished pid=%s exit_code=%s state=%s\n' % (proc.pid, exit_code, self.__job.state))
@@ -440,12 +575,16 @@ class Executor(object):
                         utproc = self.__job.utilities[utcmd][0]
                         if utproc:
                             user = __import__('pilot.user.%s.common' % pilot_user, globals(), locals(), [pilot_user], 0)  # Python 2/3
-                            sig = user.get_utility_command_kill_signal(utcmd)
-                            log.info("stopping process \'%s\' with signal %d" % (utcmd, sig))
-                            try:
-                                os.killpg(os.getpgid(utproc.pid), sig)
-                            except Exception as e:
-                                log.warning('exception caught: %s (ignoring)' % e)
+                            if isinstance(utproc, MemoryMonitoring):
+                                log.info("stopping native memory monitor")
+                                utproc.stop()
+                            else:
+                                sig = user.get_utility_command_kill_signal(utcmd)
+                                log.info("stopping process \'%s\' with signal %d" % (utcmd, sig))
+                                try:
+                                    os.killpg(os.getpgid(utproc.pid), sig)
+                                except Exception as e:
+                                    log.warning('exception caught: %s (ignoring)' % e)
 
                             user.post_utility_command_action(utcmd, self.__job)
 
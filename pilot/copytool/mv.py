@@ -14,6 +14,7 @@ import re
 
 from pilot.common.exception import StageInFailure, StageOutFailure, ErrorCodes, PilotException
 from pilot.util.container import execute
+from pilot.util.filehandling import copy_with_checksum
 
 import logging
 logger = logging.getLogger(__name__)
@@ -202,7 +203,9 @@ def move(source, destination):
 
 def copy(source, destination):
     """
-    Tries to upload the given files using xrdcp directly.
+    Tries to copy the given file.
+    The file is copied in-process, and its checksums are calculated from the copied data (and cached), so that the
+    file does not need to be read again for checksum verification.
 
     :param source:
     :param destination:
@@ -210,11 +213,14 @@ def copy(source, destination):
     :return: exit_code, stdout, stderr
     """
 
-    executable = ['/usr/bin/env', 'cp', source, destination]
-    cmd = ' '.join(executable)
-    exit_code, stdout, stderr = execute(cmd)
+    try:
+        checksums = copy_with_checksum(source, destination)
+    except (IOError, OSError) as e:
+        return 1, "cp: %s" % e, str(e)
 
-    return exit_code, stdout, stderr
+    logger.debug('copied %s to %s (checksums: %s)' % (source, destination, checksums))
+
+    return 0, "", ""
 
 
 def symlink(source, destination):
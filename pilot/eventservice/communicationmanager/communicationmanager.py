@@ -16,6 +16,7 @@ import logging
 import os
 import threading
 import time
+import traceback
 try:
     import Queue as queue  # noqa: N813
 except Exception:
@@ -119,6 +120,8 @@ Communication manager thread
 
 class CommunicationManager(threading.Thread, PluginFactory):
 
+    num_workers = 4  # number of threads handling requests (requests of the same type are handled one by one)
+
     def __init__(self, *args, **kwargs):
         super(CommunicationManager, self).__init__()
         PluginFactory.__init__(self, *args, **kwargs)
@@ -145,6 +148,105 @@ class CommunicationManager(threading.Thread, PluginFactory):
         self.args = args
         self.kwargs = kwargs
 
+        self.cond = threading.Condition()  # notified on any new request, response or finished handler
+        self.num_notifications = 0
+        self.busy_types = set()  # request types being handled by the workers
+        self.tasks = queue.Queue()
+        self.stats = dict((name, {'processed': 0, 'wait_time': 0., 'max_wait_time': 0., 'handle_time': 0.})
+                          for name in self.queues)
+
+    def notify(self):
+        """
+        Wake up the dispatcher and the clients waiting for responses.
+        """
+
+        with self.cond:
+            self.num_notifications += 1
+            self.cond.notify_all()
+
+    def put_request(self, queue_name, req):
+        """
+        Queue the request and wake up the dispatcher.
+
+        :param queue_name: name of the queue.
+        :param req: CommunicationRequest object.
+        """
+
+        req.queued_time = time.time()
+        self.queues[queue_name].put(req)
+        self.notify()
+
+    def abort_request(self, req):
+        """
+        Release the client waiting for the response of the request (the manager is stopping).
+
+        :param req: CommunicationRequest object.
+        """
+
+        logger.info("Is going to stop, aborting request: %s" % req)
+        req.abort = True
+        resp_attrs = {'status': None,
+                      'content': None,
+                      'exception': exception.CommunicationFailure("Communication manager is stopping, abort this request")}
+        req.response = CommunicationResponse(resp_attrs)
+
+    def abort_requests(self):
+        """
+        Abort all queued requests.
+        """
+
+        for name in self.queues:
+            while not self.queues[name].empty():
+                try:
+                    req = self.queues[name].get(block=False)
+                except queue.Empty:
+                    break
+                self.abort_request(req)
+                self.notify()
+
+    def wait_response(self, req):
+        """
+        Wait for the response of the request.
+
+        :param req: CommunicationRequest object.
+        :returns: response content.
+        :raise: Exception catched when handling the request.
+        """
+
+        with self.cond:
+            while req.response is None:
+                if self.is_stop() and not self.is_alive():
+                    # the dispatcher has stopped, nobody will handle the request anymore
+                    self.abort_request(req)
+                    break
+                self.cond.wait(1)
+        if req.response.exception:
+            raise req.response.exception
+        if req.response.status is False:
+            return None
+        else:
+            return req.response.content
+
+    def get_stats(self):
+        """
+        Get the counters of the request queues.
+
+        :returns: dict of {'depth': <number of queued requests>, 'processed': <number of handled requests>,
+                  'avg_wait_time': <seconds>, 'max_wait_time': <seconds>, 'avg_handle_time': <seconds>} by queue name.
+        """
+
+        ret = {}
+        with self.cond:
+            for name in self.queues:
+                stats = self.stats[name]
+                processed = stats['processed']
+                ret[name] = {'depth': self.queues[name].qsize(),
+                             'processed': processed,
+                             'avg_wait_time': stats['wait_time'] / processed if processed else 0.,
+                             'max_wait_time': stats['max_wait_time'],
+                             'avg_handle_time': stats['handle_time'] / processed if processed else 0.}
+        return ret
+
     def stop(self):
         """
         Set stop signal(main run process will clean queued requests to release waiting clients and then quit)
@@ -152,6 +254,7 @@ class CommunicationManager(threading.Thread, PluginFactory):
         if not self.is_stop():
             logger.info("Stopping Communication Manager.")
             self.stop_event.set()
+            self.notify()
 
     def is_stop(self):
         """
@@ -186,19 +289,12 @@ class CommunicationManager(threading.Thread, PluginFactory):
             req_attrs[key] = value
 
         req = CommunicationRequest(req_attrs)
-        self.queues['request_get_jobs'].put(req)
+        self.put_request('request_get_jobs', req)
 
         if req.post_hook:
             return
 
-        while req.response is None:
-            time.sleep(1)
-        if req.response.exception:
-            raise req.response.exception
-        if req.response.status is False:
-            return None
-        else:
-            return req.response.content
+        return self.wait_response(req)
 
     def update_jobs(self, jobs, post_hook=None):
         """
@@ -216,19 +312,12 @@ class CommunicationManager(threading.Thread, PluginFactory):
                      'post_hook': post_hook}
 
         req = CommunicationRequest(req_attrs)
-        self.queues['update_jobs'].put(req)
+        self.put_request('update_jobs', req)
 
         if req.post_hook:
             return
 
-        while req.response is None:
-            time.sleep(1)
-        if req.response.exception:
-            raise req.response.exception
-        if req.response.status is False:
-            return None
-        else:
-            return req.response.content
+        return self.wait_response(req)
 
     def get_event_ranges(self, num_event_ranges=1, post_hook=None, job=None):
         """
@@ -257,19 +346,12 @@ class CommunicationManager(threading.Thread, PluginFactory):
         req_attrs['num_ranges'] = num_event_ranges
 
         req = CommunicationRequest(req_attrs)
-        self.queues['request_get_events'].put(req)
+        self.put_request('request_get_events', req)
 
         if req.post_hook:
             return
 
-        while req.response is None:
-            time.sleep(1)
-        if req.response.exception:
-            raise req.response.exception
-        if req.response.status is False:
-            return None
-        else:
-            return req.response.content
+        return self.wait_response(req)
 
     def update_events(self, update_events, post_hook=None):
         """
@@ -286,19 +368,12 @@ class CommunicationManager(threading.Thread, PluginFactory):
                      'update_events': update_events,
                      'post_hook': post_hook}
         req = CommunicationRequest(req_attrs)
-        self.queues['update_events'].put(req)
+        self.put_request('update_events', req)
 
         if req.post_hook:
             return
 
-        while req.response is None:
-            time.sleep(1)
-        if req.response.exception:
-            raise req.response.exception
-        if req.response.status is False:
-            return None
-        else:
-            return req.response.content
+        return self.wait_response(req)
 
     def get_plugin_confs(self):
         """
@@ -342,9 +417,71 @@ class CommunicationManager(threading.Thread, PluginFactory):
 
         return False
 
+    def handle_request(self, processor, process_type, req):
+        """
+        Handle the request and forward it to the next queue or set the response.
+
+        :param processor: dict of request handlers by request type as a key.
+        :param process_type: request type.
+        :param req: CommunicationRequest object.
+        """
+
+        t0 = time.time()
+        wait_time = t0 - getattr(req, 'queued_time', t0)
+
+        logger.info("Processing %s request: %s" % (process_type, req))
+        try:
+            res = processor[process_type]['handler'](req)
+        except Exception as e:
+            logger.error("Failed to process %s request: %s, %s" % (process_type, e, traceback.format_exc()))
+            res = CommunicationResponse({'status': False, 'content': None,
+                                         'exception': exception.UnknownException("Failed to process %s request: %s" % (process_type, e))})
+        logger.info("Processing %s respone: %s" % (process_type, res))
+
+        if res.status is False:
+            req.response = res
+        else:
+            next_queue = processor[process_type]['next_queue']
+            if next_queue:
+                self.put_request(next_queue, req)
+            else:
+                req.response = res
+            process_req_post_hook = processor[process_type]['process_req_post_hook']
+            if process_req_post_hook and req.post_hook:
+                req.post_hook(res)
+
+        with self.cond:
+            stats = self.stats[process_type]
+            stats['processed'] += 1
+            stats['wait_time'] += wait_time
+            stats['max_wait_time'] = max(stats['max_wait_time'], wait_time)
+            stats['handle_time'] += time.time() - t0
+
+    def process_requests(self, processor):
+        """
+        Worker loop: handle the requests passed by the dispatcher.
+
+        :param processor: dict of request handlers by request type as a key.
+        """
+
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            process_type, req = task
+            try:
+                self.handle_request(processor, process_type, req)
+            except Exception as e:
+                logger.error("Failed to handle %s request: %s, %s" % (process_type, e, traceback.format_exc()))
+            finally:
+                with self.cond:
+                    self.busy_types.discard(process_type)
+                self.notify()
+
     def run(self):
         """
-        Main loop to handle communication requests
+        Main loop to dispatch communication requests to the workers.
+        The loop wakes up as soon as a request is queued; requests of different types are handled concurrently.
         """
 
         confs = self.get_plugin_confs()
@@ -378,45 +515,47 @@ class CommunicationManager(threading.Thread, PluginFactory):
                                                'process_req_post_hook': True}
                      }
 
+        workers = []
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self.process_requests, args=(processor,), name='CommunicationWorker-%s' % i)
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
         while True:
+            with self.cond:
+                num_notifications = self.num_notifications
             has_req = False
+            if self.is_stop():
+                self.abort_requests()
             for process_type in processor:
                 if self.is_stop():
-                    while not self.queues[process_type].empty():
-                        req = self.queues[process_type].get()
-                        logger.info("Is going to stop, aborting request: %s" % req)
-                        req.abort = True
-                        resp_attrs = {'status': None,
-                                      'content': None,
-                                      'exception': exception.CommunicationFailure("Communication manager is stopping, abort this request")}
-                        req.response = CommunicationResponse(resp_attrs)
-                elif self.can_process_request(processor, process_type):
+                    continue
+
+                with self.cond:
+                    if process_type in self.busy_types:
+                        continue
+                if self.can_process_request(processor, process_type):
                     pre_check_resp = processor[process_type]['pre_check']()
                     if not pre_check_resp.status == 0:
                         continue
 
-                    logger.info("Processing %s" % process_type)
-
                     has_req = True
                     req = self.queues[process_type].get()
-
-                    logger.info("Processing %s request: %s" % (process_type, req))
-                    res = processor[process_type]['handler'](req)
-                    logger.info("Processing %s respone: %s" % (process_type, res))
-
-                    if res.status is False:
-                        req.response = res
-                    else:
-                        next_queue = processor[process_type]['next_queue']
-                        if next_queue:
-                            self.queues[next_queue].put(req)
-                        else:
-                            req.response = res
-                        process_req_post_hook = processor[process_type]['process_req_post_hook']
-                        if process_req_post_hook and req.post_hook:
-                            req.post_hook(res)
-            if not has_req:
-                if self.is_stop():
-                    break
-            time.sleep(1)
+                    with self.cond:
+                        self.busy_types.add(process_type)
+                    self.tasks.put((process_type, req))
+
+            with self.cond:
+                stopped = self.is_stop() and not self.busy_types
+                # sleep until a new request or response arrives (re-check the pre_check status every second)
+                if not stopped and not has_req and num_notifications == self.num_notifications:
+                    self.cond.wait(1)
+            if stopped:
+                # the workers may have forwarded requests to the next queues before they finished
+                self.abort_requests()
+                break
+
+        for worker in workers:
+            self.tasks.put(None)
         logger.info("Communication manager stopped.")
@@ -5,18 +5,192 @@
 # http://www.apache.org/licenses/LICENSE-2.0
 #
 # Authors:
-# - Paul Nilsson, paul.nilsson@cern.ch, 2018
+# - Paul Nilsson, paul.nilsson@cern.ch, 2018-2020
 
-import logging
+import copy
+import os
+import socket
+import tempfile
+import threading
+import traceback
+
+from pilot.common.exception import MessageFailure
+from pilot.eventservice.esprocess.esprocess import ESProcess
 
+import logging
 logger = logging.getLogger(__name__)
 
+"""
+Droid: worker of the HPC event service (one per node).
+The Droid gets the payload from Yoda and runs one ESProcess per core slot. The ESProcesses get their event ranges from
+Yoda, and their out messages are collected and sent back to Yoda with the next request (or when report_size messages
+are queued).
+"""
+
+
+class Droid(threading.Thread):
+
+    def __init__(self, transport, num_slots=None, name=None, workdir=None, report_size=10, process_class=ESProcess):
+        """
+        Init Droid.
+
+        :param transport: transport instance (see pilot.eventservice.transport).
+        :param num_slots: number of ESProcesses run at the same time (default: number of cores).
+        :param name: name of the Droid (default: host name and pid).
+        :param workdir: directory for the slot work directories (default: payload workdir or current directory).
+        :param report_size: number of queued out messages which triggers an update.
+        :param process_class: class of the processes driven by the slots.
+        """
+        threading.Thread.__init__(self, name='droid')
+
+        self.transport = transport
+        self.num_slots = num_slots or os.sysconf('SC_NPROCESSORS_ONLN')
+        self.node = name or '%s:%s' % (socket.gethostname(), os.getpid())
+        self.workdir = workdir
+        self.report_size = report_size
+        self.process_class = process_class
+
+        self.lock = threading.Lock()
+        self.messages = []
+        self.processes = []
+        self.exit_code = None
+
+    def request(self, command, **kwargs):
+        """
+        Send a request to Yoda.
+
+        :param command: name of the command.
+        :returns: response dict.
+        :raises: MessageFailure: when Yoda failed to handle the request.
+        """
+
+        message = {'command': command, 'node': self.node}
+        message.update(kwargs)
+        ret = self.transport.request(message)
+        if ret.get('status') != 0:
+            raise MessageFailure('yoda failed to handle %s request: %s' % (command, ret.get('error')))
+        return ret
+
+    def pop_messages(self):
+        with self.lock:
+            messages, self.messages = self.messages, []
+        return messages
+
+    def get_event_ranges(self, num_ranges=1):
+        """
+        Get event ranges hook of the ESProcesses: the queued out messages are sent with the request.
+
+        :param num_ranges: number of event ranges.
+        :returns: list of event ranges (empty if no more events).
+        """
+
+        messages = self.pop_messages()
+        try:
+            return self.request('get_event_ranges', num_ranges=num_ranges, messages=messages)['event_ranges']
+        except Exception:
+            with self.lock:
+                self.messages = messages + self.messages
+            raise
+
+    def handle_out_message(self, message):
+        """
+        Handle out message hook of the ESProcesses.
+
+        :param message: a dict of parsed message (see ESHook.handle_out_message).
+        """
 
-def run():
+        with self.lock:
+            self.messages.append(message)
+            if len(self.messages) < self.report_size:
+                return
+            messages, self.messages = self.messages, []
+
+        try:
+            self.request('update', messages=messages)
+        except Exception as e:
+            logger.warning('failed to send %s out messages (will retry): %s' % (len(messages), e))
+            with self.lock:
+                self.messages = messages + self.messages
+
+    def create_process(self, slot, payload):
+        """
+        Create the process of a slot. Each slot runs in its own work directory and talks to its payload through its own
+        message channel (yampl socket name).
+
+        :param slot: slot number.
+        :param payload: payload dict got from Yoda.
+        :returns: process instance.
+        """
+
+        payload = copy.deepcopy(payload)
+        name = 'droid_%s_slot_%s' % (self.node.replace(':', '_'), slot)
+        workdir = self.workdir or payload.get('workdir') or os.getcwd()
+        payload['workdir'] = os.path.join(workdir, name)
+
+        yampl = payload.setdefault('yampl', {})
+        socket_name = '%s_%s' % (yampl.get('socket_name') or 'EventService_EventRanges', name)
+        if yampl.get('transport') == 'socket' and not os.path.isabs(socket_name):
+            socket_name = os.path.join(tempfile.gettempdir(), socket_name + '.socket')
+        yampl['socket_name'] = socket_name
+
+        process = self.process_class(payload)
+        process.set_get_event_ranges_hook(self.get_event_ranges)
+        process.set_handle_out_message_hook(self.handle_out_message)
+        return process
+
+    def stop(self):
+        for process in self.processes:
+            process.stop()
+
+    def get_exit_code(self):
+        return self.exit_code
+
+    def run(self):
+        """
+        Register to Yoda, run the slot processes until all event ranges are processed and report the result.
+        """
+
+        try:
+            payload = self.request('register', num_slots=self.num_slots)['payload']
+            logger.info('droid %s got payload: %s' % (self.node, payload))
+
+            self.processes = [self.create_process(slot, payload) for slot in range(self.num_slots)]
+            for process in self.processes:
+                process.start()
+            for process in self.processes:
+                process.join()
+
+            exit_codes = [process.poll() for process in self.processes]
+            logger.info('droid %s processes finished with exit codes: %s' % (self.node, exit_codes))
+            self.exit_code = ([code for code in exit_codes if code] or [0])[0]
+        except Exception as e:
+            logger.error('droid %s failed: %s, %s' % (self.node, e, traceback.format_exc()))
+            self.exit_code = -1
+
+        try:
+            self.request('finish', messages=self.pop_messages(), exit_code=self.exit_code)
+        except Exception as e:
+            logger.error('droid %s failed to report to yoda: %s' % (self.node, e))
+        finally:
+            self.transport.close()
+
+
+def run(args, address):
     """
-    Dummy run function.
+    Run a Droid with one ESProcess per core.
 
-    :return:
+    :param args: pilot arguments.
+    :param address: address of the transport.
+    :returns: exit code.
     """
 
-    pass
+    from pilot.eventservice.transport import get_transport
+
+    droid = Droid(get_transport(address))
+    droid.start()
+    while droid.is_alive():
+        if args.graceful_stop.is_set():
+            droid.stop()
+        droid.join(1)
+
+    return droid.get_exit_code()
@@ -5,12 +5,19 @@
 #
 # Authors:
 # - Wen Guan, wen.guan@cern.ch, 2017
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
 
+import errno
 import logging
 import os
+import select
+import socket
+import struct
+import tempfile
 import threading
 import time
 import traceback
+from collections import deque
 
 from pilot.common.exception import PilotException, MessageFailure
 
@@ -130,3 +137,261 @@ class MessageThread(threading.Thread):
             # raise MessageFailure(e)
         self.terminate()
         logger.info('Message thread finished.')
+
+
+class SocketMessageThread(threading.Thread):
+    """
+    A thread to receive messages from payload through a Unix domain socket, an alternative to the yampl transport.
+    The thread blocks in select() until a message arrives (or stop() is called), so the messages are handled without
+    polling delay.
+
+    Every message is framed as a 4 byte length (network byte order) followed by the utf-8 encoded message; all
+    complete messages read at once are queued. The payload processes can open several connections. Replies are sent
+    to the connections in the order of their "Ready for events" requests; a message sent when no request is pending
+    (e.g. "No more events" when stopping) is sent to all connections.
+    """
+
+    header = struct.Struct('!I')
+
+    def __init__(self, message_queue, socket_name=None, context='local', **kwds):
+        """
+        Initialize the Unix socket server.
+
+        :param message_queue: a queue to transfer messages between current instance and ESProcess.
+        :param socket_name: path of the socket between current process and payload.
+        :param context: not used (kept for compatibility with MessageThread).
+        :param **kwds: other parameters.
+
+        :raises MessageFailure: when failed to setup message socket.
+        """
+
+        threading.Thread.__init__(self, **kwds)
+        self.setName("SocketMessageThread")
+        self.__message_queue = message_queue
+        self._socket_name = socket_name
+        self.__stop = threading.Event()  # note: Thread._stop is a method in Python 3
+
+        self.__lock = threading.Lock()
+        self.__connections = {}  # connection -> receive buffer
+        self.__requesters = deque()  # connections waiting for a reply
+        self.__closed = False  # set once the server socket and the wakeup pipe are closed
+
+        logger.info('start to setup unix socket server.')
+        try:
+            if self._socket_name is None or len(self._socket_name) == 0:
+                self._socket_name = os.path.join(tempfile.gettempdir(), 'EventService_EventRanges_%s.socket' % os.getpid())
+            if os.path.exists(self._socket_name):
+                os.remove(self._socket_name)
+            self.__message_server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.__message_server.bind(self._socket_name)
+            self.__message_server.listen(16)
+            self.__wakeup_r, self.__wakeup_w = os.pipe()
+        except Exception as e:
+            raise MessageFailure("Failed to setup unix socket server: %s" % e)
+        logger.info('finished to setup unix socket server(socket_name: %s).' % self._socket_name)
+
+    def get_yampl_socket_name(self):
+        return self._socket_name
+
+    def send(self, message):
+        """
+        Send messages to payload through the socket.
+
+        :param message: String of the message.
+
+        :raises MessageFailure: When failed to send a message to the payload.
+        """
+        logger.debug('Send a message to socket: %s' % message)
+        data = message.encode('utf-8')
+        data = self.header.pack(len(data)) + data
+        with self.__lock:
+            try:
+                if not self.__message_server:
+                    raise MessageFailure("No message server.")
+
+                if self.__requesters:
+                    connections = [self.__requesters.popleft()]
+                else:
+                    connections = list(self.__connections)
+                for conn in connections:
+                    conn.sendall(data)
+            except MessageFailure:
+                raise
+            except Exception as e:
+                raise MessageFailure(e)
+
+    def stop(self):
+        """
+        Set stop event.
+        """
+        logger.debug('set stop event')
+        self.__stop.set()
+        with self.__lock:
+            if self.__closed:
+                return
+            try:
+                os.write(self.__wakeup_w, b'x')
+            except OSError:
+                pass
+
+    def is_stopped(self):
+        """
+        Get status whether stop event is set.
+
+        :returns: True if stop event is set, otherwise False.
+        """
+        return self.__stop.isSet()
+
+    def terminate(self):
+        """
+        Terminate message server.
+        """
+        with self.__lock:
+            if self.__message_server:
+                logger.info("Terminating message server.")
+                for conn in self.__connections:
+                    conn.close()
+                self.__connections = {}
+                self.__requesters.clear()
+                self.__message_server.close()
+                self.__message_server = None
+                for fd in (self.__wakeup_r, self.__wakeup_w):
+                    os.close(fd)
+                self.__closed = True
+                if os.path.exists(self._socket_name):
+                    os.remove(self._socket_name)
+
+    def close_connection(self, conn):
+        with self.__lock:
+            self.__connections.pop(conn, None)
+            while conn in self.__requesters:
+                self.__requesters.remove(conn)
+        conn.close()
+
+    def receive(self, conn):
+        """
+        Read the available data of a connection and queue the complete messages.
+
+        :param conn: connection.
+        """
+
+        try:
+            data = conn.recv(65536)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            data = b''
+        if not data:
+            logger.debug('payload closed connection')
+            self.close_connection(conn)
+            return
+
+        buf = self.__connections.get(conn, b'') + data
+        while len(buf) >= self.header.size:
+            size = self.header.unpack(buf[:self.header.size])[0]
+            if len(buf) < self.header.size + size:
+                break
+            message = buf[self.header.size:self.header.size + size].decode('utf-8')
+            buf = buf[self.header.size + size:]
+            if "Ready for events" in message:
+                with self.__lock:
+                    self.__requesters.append(conn)
+            self.__message_queue.put(message)
+        with self.__lock:
+            if conn in self.__connections:
+                self.__connections[conn] = buf
+
+    def run(self):
+        """
+        Main thread loop to wait for messages from payload and
+        put received into message queue for other processes to fetch.
+        """
+        logger.info('Message thread starts to run.')
+        try:
+            while not self.is_stopped():
+                if not self.__message_server:
+                    raise MessageFailure("No message server.")
+
+                rlist = [self.__message_server, self.__wakeup_r] + list(self.__connections)
+                try:
+                    readable = select.select(rlist, [], [], 1)[0]
+                except (select.error, OSError) as e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                for obj in readable:
+                    if obj is self.__message_server:
+                        conn = self.__message_server.accept()[0]
+                        with self.__lock:
+                            self.__connections[conn] = b''
+                    elif obj == self.__wakeup_r:
+                        os.read(self.__wakeup_r, 1024)
+                    else:
+                        self.receive(obj)
+        except PilotException as e:
+            logger.error("Pilot Exception: Message thread got an exception, will finish: %s, %s" % (e.get_detail(), traceback.format_exc()))
+        except Exception as e:
+            logger.error("Message thread got an exception, will finish: %s" % str(e))
+        self.terminate()
+        logger.info('Message thread finished.')
+
+
+class SocketMessageClient(object):
+    """
+    Payload side of the SocketMessageThread transport.
+    """
+
+    def __init__(self, socket_name):
+        self.__socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.__socket.connect(socket_name)
+        self.__buf = b''
+        self.__messages = deque()
+
+    def send(self, message):
+        data = message.encode('utf-8')
+        self.__socket.sendall(SocketMessageThread.header.pack(len(data)) + data)
+
+    def recv(self, timeout=None):
+        """
+        Receive a message.
+
+        :param timeout: max time in seconds to wait for the message (wait forever if None).
+        :returns: message string, None if timed out or the connection was closed.
+        """
+
+        header = SocketMessageThread.header
+        self.__socket.settimeout(timeout)
+        while not self.__messages:
+            try:
+                data = self.__socket.recv(65536)
+            except socket.timeout:
+                return None
+            if not data:
+                return None
+            self.__buf += data
+            while len(self.__buf) >= header.size:
+                size = header.unpack(self.__buf[:header.size])[0]
+                if len(self.__buf) < header.size + size:
+                    break
+                self.__messages.append(self.__buf[header.size:header.size + size].decode('utf-8'))
+                self.__buf = self.__buf[header.size + size:]
+        return self.__messages.popleft()
+
+    def close(self):
+        self.__socket.close()
+
+
+def get_message_thread(message_queue, socket_name=None, context='local', transport='yampl'):
+    """
+    Create the message thread for the transport.
+
+    :param message_queue: a queue to transfer messages between current instance and ESProcess.
+    :param socket_name: name of the socket between current process and payload.
+    :param context: name of the (yampl) context between current process and payload.
+    :param transport: 'yampl' (default) or 'socket' (Unix domain socket).
+    :returns: message thread.
+    """
+
+    if transport == 'socket':
+        return SocketMessageThread(message_queue, socket_name, context)
+    return MessageThread(message_queue, socket_name, context)
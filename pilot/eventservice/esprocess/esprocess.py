@@ -9,6 +9,7 @@
 
 import json
 import logging
+import math
 import os
 import re
 import subprocess
@@ -22,7 +23,7 @@ except Exception:
     import queue  # Python 3
 
 from pilot.common.exception import PilotException, MessageFailure, SetupFailure, RunPayloadFailure, UnknownException
-from pilot.eventservice.esprocess.esmessage import MessageThread
+from pilot.eventservice.esprocess.esmessage import get_message_thread
 from pilot.util.container import containerise_executable
 from pilot.util.processes import kill_child_processes
 
@@ -40,6 +41,10 @@ class ESProcess(threading.Thread):
     """
     Main EventService Process.
     """
+
+    max_prefetch_factor = 4  # max number of prefetched event ranges per core
+    smoothing_factor = 0.3  # weight of the latest measurement in the averaged range processing time and fetch latency
+
     def __init__(self, payload):
         """
         Init ESProcess.
@@ -71,6 +76,12 @@ class ESProcess(threading.Thread):
         self.corecount = 1
 
         self.event_ranges_cache = []
+        self.__prefetch_cond = threading.Condition()
+        self.__prefetch_thread = None
+        self.__prefetch_error = None
+        self.__is_no_more_event_ranges = False
+        self.__range_time = None  # averaged wall time to process one event range by one worker
+        self.__fetch_latency = None  # averaged round-trip time of get_event_ranges
 
     def __del__(self):
         if self.__message_thread:
@@ -86,20 +97,23 @@ class ESProcess(threading.Thread):
             self.__stop_delay = delay
             event_ranges = "No more events"
             self.send_event_ranges_to_payload(event_ranges)
+            with self.__prefetch_cond:
+                self.__prefetch_cond.notify_all()
 
-    def init_message_thread(self, socketname=None, context='local'):
+    def init_message_thread(self, socketname=None, context='local', transport='yampl'):
         """
         init message thread.
 
         :param socket_name: name of the socket between current process and payload.
         :param context: name of the context between current process and payload, default is 'local'.
+        :param transport: 'yampl' (default) or 'socket' (Unix domain socket).
 
         :raises MessageFailure: when failed to init message thread.
         """
 
         logger.info("start to init message thread")
         try:
-            self.__message_thread = MessageThread(self.__message_queue, socketname, context)
+            self.__message_thread = get_message_thread(self.__message_queue, socketname, context, transport)
             self.__message_thread.start()
         except PilotException as e:
             logger.error("Failed to start message thread: %s" % e.get_detail())
@@ -261,7 +275,10 @@ class ESProcess(threading.Thread):
         """
 
         try:
-            self.init_message_thread()
+            # the message transport can be set in the payload: {'yampl': {'transport': 'socket', 'socket_name': ..}}
+            yampl = self.__payload.get('yampl', {})
+            self.init_message_thread(socketname=yampl.get('socket_name'), context=yampl.get('context', 'local'),
+                                     transport=yampl.get('transport', 'yampl'))
             self.init_payload_process()
         except Exception as e:
             # TODO: raise exceptions
@@ -326,21 +343,142 @@ class ESProcess(threading.Thread):
             return True
         return False
 
+    def get_low_water_mark(self):
+        """
+        Get the number of cached event ranges needed to keep all workers busy while the next request is in flight:
+        one range per core plus the ranges processed during two get_event_ranges round trips.
+
+        :returns: number of event ranges.
+        """
+
+        low_water_mark = self.corecount
+        if self.__range_time and self.__fetch_latency:
+            rate = self.corecount / self.__range_time
+            low_water_mark += int(math.ceil(2 * rate * self.__fetch_latency))
+
+        return min(low_water_mark, self.max_prefetch_factor * self.corecount)
+
+    def get_prefetch_size(self):
+        """
+        Get the number of event ranges to request, to fill the cache up to twice the low water mark.
+
+        :returns: number of event ranges.
+        """
+
+        num_ranges = 2 * self.get_low_water_mark() - len(self.event_ranges_cache)
+
+        return max(self.corecount, min(num_ranges, self.max_prefetch_factor * self.corecount))
+
+    def update_range_time(self, wall):
+        """
+        Update the averaged processing time of one event range with the wall time reported by the payload.
+
+        :param wall: wall time of the processed event range (string or number).
+        """
+
+        try:
+            wall = float(wall)
+        except (TypeError, ValueError):
+            return
+        if wall <= 0:
+            return
+
+        with self.__prefetch_cond:
+            if self.__range_time is None:
+                self.__range_time = wall
+            else:
+                self.__range_time += self.smoothing_factor * (wall - self.__range_time)
+
+    def is_prefetching(self):
+        """
+        Check whether the prefetcher is running and can deliver more event ranges.
+
+        :returns: True if the prefetcher is running, otherwise False.
+        """
+
+        return self.__prefetch_thread is not None and self.__prefetch_thread.is_alive() and \
+            not self.__is_no_more_event_ranges and self.__prefetch_error is None
+
+    def start_prefetcher(self):
+        """
+        Start the thread prefetching event ranges in the background.
+        """
+
+        self.__prefetch_thread = threading.Thread(target=self.prefetch_event_ranges, name='esprefetcher')
+        self.__prefetch_thread.daemon = True
+        self.__prefetch_thread.start()
+
+    def prefetch_event_ranges(self):
+        """
+        Prefetcher main loop: keep the number of cached event ranges above the low water mark.
+        The batch size adapts to the observed event range processing time and get_event_ranges latency.
+        """
+
+        logger.info('event range prefetcher started')
+        while not self.__stop.is_set():
+            with self.__prefetch_cond:
+                while not self.__stop.is_set() and len(self.event_ranges_cache) >= self.get_low_water_mark():
+                    self.__prefetch_cond.wait(1)
+                if self.__stop.is_set():
+                    break
+                num_ranges = self.get_prefetch_size()
+
+            t0 = time.time()
+            try:
+                event_ranges = self.get_event_ranges(num_ranges)
+            except Exception as e:
+                logger.error('failed to prefetch event ranges: %s' % e)
+                with self.__prefetch_cond:
+                    self.__prefetch_error = e
+                    self.__prefetch_cond.notify_all()
+                break
+            latency = time.time() - t0
+
+            with self.__prefetch_cond:
+                if self.__fetch_latency is None:
+                    self.__fetch_latency = latency
+                else:
+                    self.__fetch_latency += self.smoothing_factor * (latency - self.__fetch_latency)
+                if event_ranges:
+                    self.event_ranges_cache.extend(event_ranges)
+                else:
+                    self.__is_no_more_event_ranges = True
+                logger.debug('prefetched %s event ranges in %.2fs (cached: %s, low water mark: %s)' %
+                             (len(event_ranges or []), latency, len(self.event_ranges_cache), self.get_low_water_mark()))
+                self.__prefetch_cond.notify_all()
+                if self.__is_no_more_event_ranges:
+                    break
+        logger.info('event range prefetcher finished')
+
     def get_event_range_to_payload(self):
         """
-        Get one event range to be sent to payload
+        Get one event range to be sent to payload.
+        The event ranges are taken from the cache filled by the prefetcher (or requested directly if the prefetcher
+        is not running).
+
+        :raises: MessageFailure: when the prefetcher failed to get event ranges.
         """
-        logger.debug("Number of cached event ranges: %s" % len(self.event_ranges_cache))
-        if not self.event_ranges_cache:
-            event_ranges = self.get_event_ranges()
-            if event_ranges:
-                self.event_ranges_cache.extend(event_ranges)
 
-        if self.event_ranges_cache:
-            event_range = self.event_ranges_cache.pop(0)
-            return event_range
-        else:
-            return []
+        with self.__prefetch_cond:
+            logger.debug("Number of cached event ranges: %s" % len(self.event_ranges_cache))
+            while not self.event_ranges_cache and self.is_prefetching():
+                self.__prefetch_cond.wait(1)
+
+            if not self.event_ranges_cache:
+                if self.__prefetch_error is not None:
+                    error, self.__prefetch_error = self.__prefetch_error, None
+                    raise MessageFailure("Failed to get event ranges: %s" % error)
+                if not self.__is_no_more_event_ranges and not self.is_prefetching():
+                    event_ranges = self.get_event_ranges()
+                    if event_ranges:
+                        self.event_ranges_cache.extend(event_ranges)
+
+            if self.event_ranges_cache:
+                event_range = self.event_ranges_cache.pop(0)
+                self.__prefetch_cond.notify_all()  # let the prefetcher top up the cache
+                return event_range
+            else:
+                return []
 
     def get_event_ranges(self, num_ranges=None):
         """
@@ -452,21 +590,29 @@ class ESProcess(threading.Thread):
         try:
             message_status = self.parse_out_message(message)
             logger.debug('parsed out message: %s' % message_status)
+            if message_status.get('wall'):
+                self.update_range_time(message_status['wall'])
             logger.debug('calling handle_out_message hook(%s) to handle parsed message.' % self.handle_out_message_hook)
             self.handle_out_message_hook(message_status)
         except Exception as e:
             raise RunPayloadFailure("Failed to handle out message: %s" % e)
 
-    def handle_messages(self):
+    def handle_messages(self, timeout=None):
         """
         Monitor the message queue to get output or error messages from payload and response to different messages.
+        All queued messages are handled.
+
+        :param timeout: max time in seconds to wait for the first message (do not wait if None).
         """
 
-        try:
-            message = self.__message_queue.get(False)
-        except queue.Empty:
-            pass
-        else:
+        block = timeout is not None
+        while True:
+            try:
+                message = self.__message_queue.get(block, timeout)
+            except queue.Empty:
+                break
+            block = False
+
             logger.debug('received message from payload: %s' % message)
             if "Ready for events" in message:
                 event_ranges = self.get_event_range_to_payload()
@@ -582,13 +728,13 @@ class ESProcess(threading.Thread):
         logger.debug('initializing')
         self.init()
         logger.debug('initialization finished.')
+        self.start_prefetcher()
 
         logger.info('starts to main loop')
         while self.is_payload_running():
             try:
                 self.monitor()
-                self.handle_messages()
-                time.sleep(0.01)
+                self.handle_messages(timeout=1)
             except PilotException as e:
                 logger.error('PilotException caught in the main loop: %s, %s' % (e.get_detail(), traceback.format_exc()))
                 # TODO: define output message exception. If caught 3 output message exception, terminate
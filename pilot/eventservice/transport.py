@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
+
+import os
+import threading
+import time
+
+from multiprocessing.connection import Listener, Client
+
+from pilot.common.exception import MessageFailure
+
+import logging
+logger = logging.getLogger(__name__)
+
+"""
+Transports between Yoda (master) and the Droids (workers) of the HPC event service.
+A transport carries request/response messages (dicts): the Droids send requests and wait for the response,
+Yoda calls a handler function for every request and sends back its return value.
+"""
+
+AUTHKEY_ENV = 'PILOT_YODA_AUTHKEY'  # environment variable with the authentication key shared by Yoda and the Droids
+
+
+class BaseTransport(object):
+
+    def start_server(self, handler):
+        """
+        Start serving requests (Yoda side). The function returns immediately.
+
+        :param handler: function called with the request dict, returning the response dict.
+        """
+        raise NotImplementedError()
+
+    def stop_server(self):
+        """
+        Stop serving requests.
+        """
+        raise NotImplementedError()
+
+    def request(self, message):
+        """
+        Send a request and wait for the response (Droid side).
+
+        :param message: request dict.
+        :returns: response dict.
+        :raises: MessageFailure: when the request could not be sent or the response could not be received.
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        """
+        Close the client connection.
+        """
+        pass
+
+
+class SocketTransport(BaseTransport):
+    """
+    Transport based on multiprocessing connections.
+    An address with a host and port ('host:port') selects a TCP socket (needed between nodes), any other address is
+    the path of a Unix socket (Yoda and Droids on the same node).
+    The messages are pickled, so a TCP socket requires an authentication key: without one, anybody able to connect
+    could execute code in Yoda or the Droids.
+    """
+
+    def __init__(self, address, authkey=None, connect_timeout=300):
+        """
+        Init the transport.
+
+        :param address: Unix socket path or 'host:port'.
+        :param authkey: authentication key (bytes) shared by Yoda and the Droids (default: PILOT_YODA_AUTHKEY), required
+                        for TCP sockets.
+        :param connect_timeout: time in seconds a Droid waits for Yoda to be listening.
+        :raises: MessageFailure: for a TCP socket without authentication key.
+        """
+
+        self.address = address
+        self.authkey = authkey or get_authkey()
+        self.connect_timeout = connect_timeout
+
+        if isinstance(self.get_address(), tuple) and not self.authkey:
+            raise MessageFailure('an authentication key is required for TCP socket %s (set %s)' % (address, AUTHKEY_ENV))
+
+        self.__listener = None
+        self.__server_thread = None
+        self.__stop = threading.Event()
+
+        self.__conn = None
+        self.__lock = threading.Lock()
+
+    def get_address(self):
+        """
+        Get the address in the format of multiprocessing.connection.
+
+        :returns: tuple (host, port) for TCP sockets, path string for Unix sockets.
+        """
+
+        host, sep, port = self.address.rpartition(':')
+        if sep and host and port.isdigit() and '/' not in self.address:
+            return host, int(port)
+        return self.address
+
+    def start_server(self, handler):
+        address = self.get_address()
+        if isinstance(address, tuple) and not self.authkey:
+            raise MessageFailure('will not listen on TCP socket %s without authentication key' % self.address)
+        if not isinstance(address, tuple) and os.path.exists(address):
+            os.remove(address)  # left over from a previous run
+        self.__listener = Listener(address, authkey=self.authkey)
+        if isinstance(address, tuple):
+            self.address = '%s:%s' % self.__listener.address  # the actual port if 0 was given
+        logger.info('listening on %s' % (self.__listener.address,))
+
+        self.__stop.clear()
+        self.__server_thread = threading.Thread(target=self.accept_connections, args=(handler,), name='transport')
+        self.__server_thread.daemon = True
+        self.__server_thread.start()
+
+    def accept_connections(self, handler):
+        """
+        Accept connections and serve each of them in its own thread.
+
+        :param handler: function called with the request dict, returning the response dict.
+        """
+
+        while not self.__stop.is_set():
+            try:
+                conn = self.__listener.accept()
+            except Exception as e:
+                if not self.__stop.is_set():
+                    logger.warning('failed to accept connection: %s' % e)
+                continue
+            if self.__stop.is_set():
+                conn.close()
+                break
+            thread = threading.Thread(target=self.serve_connection, args=(conn, handler), name='transport-connection')
+            thread.daemon = True
+            thread.start()
+
+    def serve_connection(self, conn, handler):
+        """
+        Serve the requests of one client until it closes the connection.
+
+        :param conn: connection object.
+        :param handler: function called with the request dict, returning the response dict.
+        """
+
+        try:
+            while not self.__stop.is_set():
+                try:
+                    message = conn.recv()
+                except (EOFError, IOError, OSError):
+                    break
+                conn.send(handler(message))
+        except Exception as e:
+            logger.warning('connection closed with error: %s' % e)
+        finally:
+            conn.close()
+
+    def stop_server(self):
+        if not self.__listener:
+            return
+
+        self.__stop.set()
+        try:
+            # wake up the accepting thread
+            Client(self.__listener.address, authkey=self.authkey).close()
+        except Exception:
+            pass
+        self.__server_thread.join(5)
+        self.__listener.close()
+        self.__listener = None
+
+    def connect(self):
+        """
+        Connect to Yoda, waiting up to connect_timeout seconds for it to be listening.
+
+        :raises: MessageFailure: when the connection could not be established.
+        """
+
+        t0 = time.time()
+        while True:
+            try:
+                self.__conn = Client(self.get_address(), authkey=self.authkey)
+                return
+            except Exception as e:
+                if time.time() - t0 > self.connect_timeout:
+                    raise MessageFailure('failed to connect to %s: %s' % (self.address, e))
+                time.sleep(1)
+
+    def request(self, message):
+        with self.__lock:
+            try:
+                if not self.__conn:
+                    self.connect()
+                self.__conn.send(message)
+                return self.__conn.recv()
+            except MessageFailure:
+                raise
+            except Exception as e:
+                self.close()
+                raise MessageFailure('failed to send request to %s: %s' % (self.address, e))
+
+    def close(self):
+        if self.__conn:
+            self.__conn.close()
+            self.__conn = None
+
+
+def get_authkey():
+    """
+    Get the authentication key shared by Yoda and the Droids from the environment.
+
+    :returns: authentication key (bytes), None if not set.
+    """
+
+    authkey = os.environ.get(AUTHKEY_ENV)
+    return authkey.encode('utf-8') if authkey else None
+
+
+def get_transport(address, authkey=None):
+    """
+    Get the transport for the given address.
+
+    :param address: Unix socket path or 'host:port'.
+    :param authkey: authentication key (bytes, default: PILOT_YODA_AUTHKEY).
+    :raises: MessageFailure: for a TCP socket without authentication key.
+    :returns: transport instance.
+    """
+
+    return SocketTransport(address, authkey=authkey)
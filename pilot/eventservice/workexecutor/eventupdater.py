@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
+
+import json
+import threading
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+"""
+Aggregator of event range status updates.
+Finished (zip file) and failed event range updates are buffered and sent as one bulk updateEventRanges message
+per message version, when enough event ranges are buffered, the oldest update is old enough, or at the end of the job.
+After a failed update, the next attempt is delayed (the delay doubles with every failure, up to max_delay), so that a
+server which is down is not sent a bulk update at every flush.
+"""
+
+
+class EventRangeUpdater(object):
+
+    def __init__(self, update_hook, max_ranges=100, max_delay=60, retry_delay=5):
+        """
+        Init the updater.
+
+        :param update_hook: function sending an update_events message, returning the server response (None if failed).
+        :param max_ranges: number of buffered event ranges which triggers a flush.
+        :param max_delay: max time in seconds an update is buffered, and max delay after failed updates.
+        :param retry_delay: delay in seconds after the first failed update.
+        """
+
+        self.update_hook = update_hook
+        self.max_ranges = max_ranges
+        self.max_delay = max_delay
+        self.retry_delay = retry_delay
+
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.updates = {0: [], 1: []}  # buffered updates by message version
+        self.first_update_time = None
+        self.num_messages = 0  # number of update messages sent
+        self.delay = 0  # current delay after failed updates
+        self.next_attempt = None  # time before which no update is sent after a failed update
+
+    def add_finished(self, event_range_status):
+        """
+        Buffer the update of finished event ranges stored in one zip file.
+
+        :param event_range_status: dict {'zipFile': {...}, 'eventRanges': [{'eventRangeID': <id>, 'eventStatus': 'finished'}, ..]}.
+        """
+
+        self.add(1, [event_range_status])
+
+    def add_failed(self, event_ranges):
+        """
+        Buffer the update of failed event ranges.
+
+        :param event_ranges: list of {'eventRangeID': <id>, 'eventStatus': <status>, 'errorCode': <code>}.
+        """
+
+        self.add(0, event_ranges)
+
+    def add(self, version, updates):
+        with self.lock:
+            self.updates[version].extend(updates)
+            if self.first_update_time is None:
+                self.first_update_time = time.time()
+
+    def get_num_ranges(self):
+        """
+        Get the number of buffered event ranges.
+
+        :returns: number of event ranges.
+        """
+
+        with self.lock:
+            return len(self.updates[0]) + sum(len(update['eventRanges']) for update in self.updates[1])
+
+    def is_due(self):
+        """
+        Check whether the buffered updates should be sent.
+
+        :returns: True if the buffer reached the size or time threshold (and the delay after a failed update passed).
+        """
+
+        with self.lock:
+            first_update_time = self.first_update_time
+            next_attempt = self.next_attempt
+        if first_update_time is None or (next_attempt and time.time() < next_attempt):
+            return False
+
+        return self.get_num_ranges() >= self.max_ranges or time.time() - first_update_time >= self.max_delay
+
+    def is_empty(self):
+        with self.lock:
+            return not self.updates[0] and not self.updates[1]
+
+    def send(self, version, updates):
+        """
+        Send one bulk update message.
+
+        :returns: True if the server accepted the update.
+        """
+
+        message = {'version': version, 'eventRanges': json.dumps(updates)}
+        self.num_messages += 1
+        try:
+            ret = self.update_hook(message)
+        except Exception as e:
+            logger.warning('failed to update event ranges: %s' % e)
+            return False
+
+        if ret is None or (isinstance(ret, dict) and str(ret.get('StatusCode', 0)) != '0'):
+            logger.warning('failed to update event ranges, response: %s' % ret)
+            return False
+
+        return True
+
+    def flush(self, force=False):
+        """
+        Send the buffered updates if the size or time threshold is reached (or always if force is set).
+        Updates which failed to be sent are put back in front of the buffer and are retried by the first flush after
+        the retry delay. Note that an update which failed after the server received it (e.g. a timeout while waiting
+        for the response) is sent again.
+
+        :param force: send the buffered updates regardless of the thresholds.
+        :returns: True if no updates are left in the buffer.
+        """
+
+        with self.flush_lock:
+            if not force and not self.is_due():
+                return self.is_empty()
+
+            with self.lock:
+                updates, self.updates = self.updates, {0: [], 1: []}
+                first_update_time, self.first_update_time = self.first_update_time, None
+
+            failed = {}
+            for version in sorted(updates, reverse=True):
+                if updates[version] and not self.send(version, updates[version]):
+                    failed[version] = updates[version]
+
+            with self.lock:
+                for version in failed:
+                    self.updates[version] = failed[version] + self.updates[version]
+                if failed:
+                    self.first_update_time = min(first_update_time, self.first_update_time or first_update_time)
+                    self.delay = min(2 * self.delay or self.retry_delay, self.max_delay)
+                    self.next_attempt = time.time() + self.delay
+                    logger.info('will retry to update event ranges in %ss' % self.delay)
+                else:
+                    self.delay = 0
+                    self.next_attempt = None
+
+            return self.is_empty()
+
+    def close(self, nretry=3, sleep_time=10):
+        """
+        Send all buffered updates (at the end of the job).
+
+        :param nretry: number of attempts.
+        :param sleep_time: time in seconds between the attempts.
+        :returns: True if all updates were sent.
+        """
+
+        for trial in range(1, nretry + 1):
+            if self.flush(force=True):
+                return True
+            if trial < nretry:
+                logger.info('will retry to update %s event ranges in %ss' % (self.get_num_ranges(), sleep_time))
+                time.sleep(sleep_time)
+
+        logger.error('failed to update %s event ranges' % self.get_num_ranges())
+        return False
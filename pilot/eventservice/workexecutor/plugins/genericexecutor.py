@@ -8,8 +8,8 @@
 # - Wen Guan, wen.guan@cern.ch, 2018
 # - Alexey Anisenkov, anisyonk@cern.ch, 2019
 
-import json
 import os
+import tarfile
 import time
 import traceback
 
@@ -18,10 +18,11 @@ from pilot.common.exception import PilotException, StageOutFailure
 
 from pilot.common.errorcodes import ErrorCodes
 from pilot.eventservice.esprocess.esprocess import ESProcess
+from pilot.eventservice.workexecutor.eventupdater import EventRangeUpdater
 from pilot.info.filespec import FileSpec
 from pilot.info import infosys
 from pilot.util.auxiliary import get_logger
-from pilot.util.container import execute
+from pilot.util.filehandling import ChecksumWriter, get_cached_checksums, store_checksums
 
 from .baseexecutor import BaseExecutor
 
@@ -46,6 +47,7 @@ class GenericExecutor(BaseExecutor):
 
         self.proc = None
         self.exit_code = None
+        self.event_range_updater = EventRangeUpdater(self.update_events)
 
     def is_payload_started(self):
         return self.proc.is_payload_started() if self.proc else False
@@ -80,8 +82,8 @@ class GenericExecutor(BaseExecutor):
                               "eventRanges": event_ranges}
         for checksum_key in checksum:
             event_range_status["zipFile"][checksum_key] = checksum[checksum_key]
-        event_range_message = {'version': 1, 'eventRanges': json.dumps([event_range_status])}
-        self.update_events(event_range_message)
+        self.event_range_updater.add_finished(event_range_status)
+        self.event_range_updater.flush()
 
         job = self.get_job()
         job.nevents += len(event_ranges)
@@ -100,8 +102,8 @@ class GenericExecutor(BaseExecutor):
             status = message['status'] if message['status'] in ['failed', 'fatal'] else 'failed'
             # ToBeFixed errorCode
             event_ranges.append({"errorCode": errors.UNKNOWNPAYLOADFAILURE, "eventRangeID": message['id'], "eventStatus": status})
-            event_range_message = {'version': 0, 'eventRanges': json.dumps(event_ranges)}
-            self.update_events(event_range_message)
+        self.event_range_updater.add_failed(event_ranges)
+        self.event_range_updater.flush()
 
     def handle_out_message(self, message):
         """
@@ -140,24 +142,29 @@ class GenericExecutor(BaseExecutor):
 
         ret_messages = []
         try:
-            for out_msg in out_messages:
-                command = "tar -rf " + output_file + " --directory=%s %s" % (os.path.dirname(out_msg['output']), os.path.basename(out_msg['output']))
-                exit_code, stdout, stderr = execute(command)
-                if exit_code == 0:
-                    ret_messages.append(out_msg)
-                else:
-                    log.error("Failed to add event output to tar/zip file: out_message: %s, exit_code: %s, stdout: %s, stderr: %s" % (out_msg,
-                                                                                                                                      exit_code,
-                                                                                                                                      stdout,
-                                                                                                                                      stderr))
-                    if 'retries' in out_msg and out_msg['retries'] >= 3:
-                        log.error("Discard out messages because it has been retried more than 3 times: %s" % out_msg)
-                    else:
-                        if 'retries' in out_msg:
-                            out_msg['retries'] += 1
+            # write the archive in one pass and calculate its checksums from the written data
+            with open(output_file, 'wb') as fd:
+                writer = ChecksumWriter(fd)
+                tar = tarfile.open(fileobj=writer, mode='w', format=tarfile.GNU_FORMAT)
+                for out_msg in out_messages:
+                    try:
+                        tar.add(out_msg['output'], arcname=os.path.basename(out_msg['output']))
+                        ret_messages.append(out_msg)
+                    except (IOError, OSError, tarfile.TarError) as e:
+                        log.error("Failed to add event output to tar/zip file: out_message: %s, error: %s" % (out_msg, e))
+                        if 'retries' in out_msg and out_msg['retries'] >= 3:
+                            log.error("Discard out messages because it has been retried more than 3 times: %s" % out_msg)
                         else:
-                            out_msg['retries'] = 1
-                        self.__queued_out_messages.append(out_msg)
+                            if 'retries' in out_msg:
+                                out_msg['retries'] += 1
+                            else:
+                                out_msg['retries'] = 1
+                            self.__queued_out_messages.append(out_msg)
+                tar.close()
+            if ret_messages:
+                store_checksums(output_file, writer.get_checksums())
+            else:
+                os.remove(output_file)
         except Exception as e:
             log.error("Failed to tar/zip event ranges: %s" % str(e))
             self.__queued_out_messages += out_messages
@@ -180,6 +187,10 @@ class GenericExecutor(BaseExecutor):
         file_data = {'scope': 'transient',
                      'lfn': os.path.basename(output_file),
                      }
+        checksums = get_cached_checksums(output_file)  ## calculated while the file was written
+        if checksums:
+            file_data['checksum'] = 'ad:%s' % checksums['adler32']
+            file_data['filesize'] = os.path.getsize(output_file)
         file_spec = FileSpec(filetype='output', **file_data)
         xdata = [file_spec]
         kwargs = dict(workdir=job.workdir, cwd=job.workdir, usecontainer=False, job=job)
@@ -342,6 +353,7 @@ class GenericExecutor(BaseExecutor):
                     proc.stop()
                     break
                 self.stageout_es()
+                self.event_range_updater.flush()
 
                 exit_code = proc.poll()
                 if iteration % 60 == 0:
@@ -353,12 +365,14 @@ class GenericExecutor(BaseExecutor):
             log.info("ESProcess finished")
 
             self.stageout_es(force=True)
+            self.event_range_updater.close()
             self.clean()
 
             self.exit_code = proc.poll()
 
         except Exception as e:
             logger.error('Execute payload failed: %s, %s' % (str(e), traceback.format_exc()))
+            self.event_range_updater.close()
             self.clean()
             self.exit_code = -1
         logger.info('ES generic executor finished')
@@ -5,17 +5,198 @@
 # http://www.apache.org/licenses/LICENSE-2.0
 #
 # Authors:
-# - Paul Nilsson, paul.nilsson@cern.ch, 2018
+# - Paul Nilsson, paul.nilsson@cern.ch, 2018-2020
+
+import threading
+import time
+import traceback
+from collections import deque
+
+from pilot.common import exception
 
 import logging
 logger = logging.getLogger(__name__)
 
+"""
+Yoda: master of the HPC event service.
+Yoda holds the pool of event ranges and hands them out in batches to the Droids (one per node), which run the payloads
+and report the processed event ranges back. The event ranges are fetched from the source (get_event_ranges hook) in
+batches of at least batch_size, and the out messages of all Droids are passed to the handle_out_message hook.
+
+Requests sent by the Droids (dicts with a 'command' key):
+    {'command': 'register', 'node': <name>, 'num_slots': <n>} -> {'status': 0, 'payload': <payload dict>}
+    {'command': 'get_event_ranges', 'node': <name>, 'num_ranges': <n>, 'messages': [..]} -> {'status': 0, 'event_ranges': [..]}
+    {'command': 'update', 'node': <name>, 'messages': [..]} -> {'status': 0}
+    {'command': 'finish', 'node': <name>, 'messages': [..], 'exit_code': <code>} -> {'status': 0}
+An empty list of event ranges means that there are no more events.
+"""
+
+
+class Yoda(threading.Thread):
+
+    def __init__(self, transport, payload=None, get_event_ranges_hook=None, handle_out_message_hook=None,
+                 event_ranges=None, batch_size=100, num_droids=None):
+        """
+        Init Yoda.
+
+        :param transport: transport instance (see pilot.eventservice.transport).
+        :param payload: dict {'executable': <cmd string>, ..} sent to the Droids.
+        :param get_event_ranges_hook: function returning a list of event ranges for the requested number (empty if none left).
+        :param handle_out_message_hook: function called with every out message (see ESHook.handle_out_message).
+        :param event_ranges: initial list of event ranges.
+        :param batch_size: min number of event ranges to get from get_event_ranges_hook.
+        :param num_droids: number of Droids to wait for before finishing (default: finish once all registered Droids finished).
+        """
+        threading.Thread.__init__(self, name='yoda')
+
+        self.transport = transport
+        self.payload = payload
+        self.get_event_ranges_hook = get_event_ranges_hook
+        self.handle_out_message_hook = handle_out_message_hook
+        self.batch_size = batch_size
+        self.num_droids = num_droids
+
+        self.event_ranges = deque(event_ranges or [])
+        self.is_no_more_event_ranges = get_event_ranges_hook is None
+        self.lock = threading.Lock()  # protects the event range pool, only one get_event_ranges hook call at a time
+        self.cond = threading.Condition()  # notified when a Droid registers or finishes
+
+        self.droids = {}  # node -> {'num_slots': <n>, 'finished': <bool>, 'exit_code': <code>}
+        self.stats = {'dispatched': 0, 'finished': 0, 'failed': 0}
+        self.__stop = threading.Event()
+
+    def stop(self):
+        if not self.__stop.is_set():
+            self.__stop.set()
+            with self.cond:
+                self.cond.notify_all()
+
+    def is_stop(self):
+        return self.__stop.is_set()
+
+    def get_event_ranges(self, num_ranges):
+        """
+        Take event ranges from the pool, refill it from the source if needed.
+
+        :param num_ranges: number of event ranges.
+        :returns: list of event ranges (empty if no more events).
+        """
+
+        with self.lock:
+            if len(self.event_ranges) < num_ranges and not self.is_no_more_event_ranges:
+                event_ranges = self.get_event_ranges_hook(max(self.batch_size, num_ranges - len(self.event_ranges)))
+                logger.debug('got %s event ranges from source' % len(event_ranges or []))
+                if event_ranges:
+                    self.event_ranges.extend(event_ranges)
+                else:
+                    self.is_no_more_event_ranges = True
+
+            ret = []
+            while self.event_ranges and len(ret) < num_ranges:
+                ret.append(self.event_ranges.popleft())
+            self.stats['dispatched'] += len(ret)
+
+        return ret
+
+    def handle_out_messages(self, messages):
+        """
+        Pass the out messages of a Droid to the handle_out_message hook.
+
+        :param messages: list of parsed messages.
+        """
+
+        for message in messages or []:
+            with self.cond:
+                self.stats['finished' if message.get('status') == 'finished' else 'failed'] += 1
+            if self.handle_out_message_hook:
+                self.handle_out_message_hook(message)
+
+    def handle_request(self, request):
+        """
+        Handle a request from a Droid.
+
+        :param request: request dict.
+        :returns: response dict.
+        """
+
+        command = request.get('command')
+        node = request.get('node')
+        try:
+            self.handle_out_messages(request.get('messages'))
+
+            if command == 'register':
+                logger.info('droid %s registered with %s slots' % (node, request.get('num_slots')))
+                with self.cond:
+                    self.droids[node] = {'num_slots': request.get('num_slots'), 'finished': False, 'exit_code': None}
+                    self.cond.notify_all()
+                return {'status': 0, 'payload': self.payload}
+            elif command == 'get_event_ranges':
+                return {'status': 0, 'event_ranges': self.get_event_ranges(request.get('num_ranges', 1))}
+            elif command == 'update':
+                return {'status': 0}
+            elif command == 'finish':
+                logger.info('droid %s finished with exit code %s' % (node, request.get('exit_code')))
+                with self.cond:
+                    if node in self.droids:
+                        self.droids[node].update({'finished': True, 'exit_code': request.get('exit_code')})
+                    self.cond.notify_all()
+                return {'status': 0}
+            else:
+                return {'status': -1, 'error': 'unknown command: %s' % command}
+        except Exception as e:
+            logger.error('failed to handle request %s from droid %s: %s, %s' % (command, node, e, traceback.format_exc()))
+            return {'status': -1, 'error': str(e)}
+
+    def is_finished(self):
+        """
+        Check whether all Droids have finished.
+
+        :returns: True if all (expected) Droids registered and finished.
+        """
+
+        num_droids = self.num_droids or len(self.droids)
+        return len(self.droids) >= num_droids > 0 and all(droid['finished'] for droid in self.droids.values())
+
+    def get_exit_code(self):
+        """
+        Get the exit code: the first non-zero exit code of the Droids.
+        """
+
+        for droid in self.droids.values():
+            if droid['exit_code']:
+                return droid['exit_code']
+        return 0
+
+    def run(self):
+        """
+        Serve the Droids until all of them have finished or stop is called.
+        """
+
+        logger.info('yoda starts to serve droids')
+        t0 = time.time()
+        self.transport.start_server(self.handle_request)
+        try:
+            with self.cond:
+                while not self.is_stop() and not self.is_finished():
+                    self.cond.wait(1)
+        finally:
+            self.transport.stop_server()
+
+        logger.info('yoda finished in %.0fs: %s droids, stats: %s' % (time.time() - t0, len(self.droids), self.stats))
+
 
-def run():
+def run(args, address):
     """
-    Dummy run function.
+    Run Yoda for a job got from the server.
+    This is not supported yet: the outputs of the Droid slots are not staged out, the processed event ranges are not
+    reported as finished and no job updates are sent to the server, i.e. the event ranges of the job would be consumed
+    on the server and lost. Until this is done, the `Yoda` class can only be used with get_event_ranges and
+    handle_out_message hooks that take care of the event ranges.
 
-    :return:
+    :param args: pilot arguments.
+    :param address: address of the transport.
+    :raises NotImplemented: always (no job is downloaded).
     """
 
-    pass
+    raise exception.NotImplemented('Yoda does not support jobs from the server yet (no stage-out of the event service outputs, '
+                                   'no event range and job updates)')
@@ -35,6 +35,24 @@ class BaseData(object):
     """
 
     _keys = {}
+    _kmap = {}  # the translation map of data attributes from external format to internal schema
+
+    @classmethod
+    def get_ext_keys(self):
+        """
+            Return the names of all external data attributes considered by `_load_data()`
+            (translated via `_kmap` where defined)
+
+            :return: list of names
+        """
+
+        ret = set()
+        for knames in self._keys.values():
+            for kname in knames:
+                ext_names = self._kmap.get(kname) or kname
+                ret.update([ext_names] if isinstance(ext_names, str) else ext_names)
+
+        return sorted(ret)
 
     def _load_data(self, data, kmap={}, validators=None):
         """
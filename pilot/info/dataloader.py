@@ -16,8 +16,11 @@ Base loader class to retrive data from Ext sources (file, url)
 """
 
 import os
+import io
 import time
 import json
+import gzip
+import fcntl
 try:
     import urllib.request  # Python 3
     import urllib.error  # Python 3
@@ -29,6 +32,8 @@ from datetime import datetime, timedelta
 
 from pilot.util.timer import timeout
 
+from .indexedcache import IndexedCache, select_fields
+
 import logging
 logger = logging.getLogger(__name__)
 
@@ -38,6 +43,9 @@ class DataLoader(object):
         Base data loader
     """
 
+    compress = True  # store the cache files gzip compressed
+    lock_timeout = 60  # max time in seconds to wait for other process refreshing the cache file
+
     @classmethod
     def is_file_expired(self, fname, cache_time=0):
         """
@@ -70,13 +78,232 @@ class DataLoader(object):
 
         return lastupdate
 
-    @classmethod  # noqa: C901
+    @classmethod
+    def lock_file(self, fname, timeout=0):
+        """
+        Acquire an exclusive lock on the given (lock) file.
+
+        :param fname: lock file name.
+        :param timeout: max time in seconds to wait for the lock (do not wait if 0).
+        :return: open file object holding the lock (close it to release the lock) or None if not acquired.
+        """
+
+        try:
+            f = open(fname, 'a')
+        except IOError as e:
+            logger.warning('failed to open lock file=%s: %s' % (fname, e))
+            return None
+
+        t0 = time.time()
+        while True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return f
+            except IOError:
+                if time.time() - t0 >= timeout:
+                    f.close()
+                    return None
+            time.sleep(1)
+
+    @classmethod
+    def read_cache_file(self, fname):
+        """
+        Read the content of the cache file (plain or gzip compressed).
+
+        :param fname: cache file name.
+        :return: file content.
+        """
+
+        with open(fname, 'rb') as f:
+            content = f.read()
+        if content[:2] == b'\x1f\x8b':
+            content = gzip.GzipFile(fileobj=io.BytesIO(content)).read()
+        try:
+            content = content.decode('utf-8')
+        except UnicodeDecodeError:
+            pass
+
+        return content
+
+    @classmethod
+    def write_cache_file(self, fname, content, meta=None):
+        """
+        Save (gzip compressed) content into the cache file.
+        The file is written to a temporary name and then renamed, so other processes never read a partial file.
+
+        :param fname: cache file name.
+        :param content: content to save.
+        :param meta: dict of the source details used to revalidate the cache later (ETag, Last-Modified).
+        """
+
+        if not isinstance(content, bytes):
+            content = content.encode('utf-8')
+
+        tmpname = '%s.%s' % (fname, os.getpid())
+        try:
+            f = gzip.open(tmpname, 'wb') if self.compress else open(tmpname, 'wb')
+            with f:
+                f.write(content)
+            os.rename(tmpname, fname)
+        finally:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+
+        with open('%s.meta' % fname, 'w') as f:
+            json.dump(meta or {}, f)
+
+    @classmethod
+    def get_cache_meta(self, fname, url):
+        """
+        Return the source details saved along with the cache file.
+
+        :param fname: cache file name.
+        :param url: source of data.
+        :return: dict (empty if the cache file does not exist or was loaded from another source).
+        """
+
+        try:
+            with open('%s.meta' % fname) as f:
+                meta = json.load(f)
+        except Exception:
+            return {}
+
+        if meta.get('url') != url or not os.path.isfile(fname):
+            return {}
+
+        return meta
+
+    @classmethod
+    @timeout(seconds=20, mode='thread')
+    def read_source_file(self, fname):
+        """
+        Read the content of a local source file.
+
+        :param fname: file name.
+        :return: file content (None if the file does not exist).
+        """
+
+        if os.path.isfile(fname):
+            with open(fname, "rb") as f:
+                content = f.read()
+            return content
+
+    @classmethod
+    def fetch_file(self, fname, meta):
+        """
+        Read a local source file unless its size and modification time are those saved with the cache.
+
+        :param fname: source file name.
+        :param meta: dict of the source details saved with the cache file.
+        :return: content (None if the file is not modified), dict of the source details.
+        """
+
+        st = os.stat(fname)
+        newmeta = {'url': fname, 'source': [st.st_size, st.st_mtime]}
+        if meta and meta.get('source') == newmeta['source']:
+            return None, meta
+
+        return self.read_source_file(fname), newmeta
+
+    @classmethod
+    def fetch_url(self, url, meta):
+        """
+        Download data with a conditional request (If-None-Match/If-Modified-Since) based on the details saved with the
+        cache.
+
+        :param url: source url.
+        :param meta: dict of the source details saved with the cache file.
+        :return: content (None if the data is not modified), dict of the source details.
+        """
+
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        try:
+            try:
+                response = urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=20)  # Python 3
+            except NameError:
+                response = urllib2.urlopen(urllib2.Request(url, headers=headers), timeout=20)  # Python 2
+        except Exception as e:
+            if getattr(e, 'code', None) == 304:
+                return None, meta
+            raise
+        newmeta = {'url': url, 'etag': response.info().get('ETag'),
+                   'last_modified': response.info().get('Last-Modified')}
+
+        return response.read(), newmeta
+
+    @classmethod
+    def lock_cache_file(self, fname, cache_time):
+        """
+        Acquire the lock for refreshing the cache file.
+        Do not wait for another process refreshing the cache if stale data is available.
+
+        :param fname: cache file name.
+        :param cache_time: cache time in seconds.
+        :return: open lock file object (None if not acquired), True if the cache should be refreshed.
+        """
+
+        lock = self.lock_file('%s.lock' % fname, timeout=0 if os.path.isfile(fname) else self.lock_timeout)
+        if not lock and os.path.isfile(fname):
+            logger.info('cache file=%s is being refreshed by another process .. using current content' % fname)
+            return None, False
+        if not self.is_file_expired(fname, cache_time):
+            logger.info('cache file=%s has been refreshed by another process' % fname)
+            return lock, False
+
+        return lock, True
+
+    @classmethod
+    def refresh_cache(self, url, fname=None, nretry=3, sleep_time=60):
+        """
+        Load data from url or file resource and save it into the cache file fname (if given).
+        If the data is not modified since it was saved, the cache file is renewed instead.
+
+        :param url: source of data.
+        :param fname: cache file name.
+        :param nretry: number of retries.
+        :param sleep_time: sleep time between retry attempts (seconds or function returning the seconds).
+        :return: loaded data (None if failed or if the data is not modified).
+        """
+
+        native_access = '://' not in url  ## trival check for file access, non accurate.. FIXME later if need
+        for trial in range(1, nretry + 1):
+            try:
+                meta = self.get_cache_meta(fname, url) if fname else {}
+                logger.info('[attempt=%s/%s] loading data from %s=%s' % (trial, nretry, 'file' if native_access else 'url', url))
+                content, meta = self.fetch_file(url, meta) if native_access else self.fetch_url(url, meta)
+                if content is None:  ## not modified: renew the cache
+                    logger.info('data from "%s" resource is not modified, cache file=%s is still valid' % (url, fname))
+                    os.utime(fname, None)
+                    return None
+                if fname:  # save to cache
+                    self.write_cache_file(fname, content, meta)
+                    logger.info('saved data from "%s" resource into file=%s, length=%.1fKb' % (url, fname, len(content) / 1024.))
+                return content
+            except Exception as e:  # ignore errors, try to use old cache if any
+                logger.warning('failed to load data from url=%s, error: %s .. trying to use data from cache=%s' % (url, e, fname))
+            if trial < nretry:
+                xsleep_time = sleep_time() if callable(sleep_time) else sleep_time
+                logger.info("will try again after %ss.." % xsleep_time)
+                time.sleep(xsleep_time)
+
+        return None
+
+    @classmethod
     def load_url_data(self, url, fname=None, cache_time=0, nretry=3, sleep_time=60):
         """
         Download data from url or file resource and optionally save it into cache file fname.
         The file will not be (re-)loaded again if cache age from last file modification does not exceed cache_time
         seconds.
 
+        The cache file can be shared by concurrent pilots: only the process holding the lock refreshes it, while
+        the others use the stale content (or wait for the lock if there is no cache yet). The refresh is conditional
+        (If-None-Match/If-Modified-Since for urls, size and modification time for files), so unchanged data is not
+        downloaded again.
+
         If url is None then data will be read from cache file fname (if any)
 
         :param url: Source of data
@@ -87,51 +314,20 @@ class DataLoader(object):
         :return: data loaded from the url or file content if url passed is a filename.
         """
 
-        @timeout(seconds=20)
-        def _readfile(url):
-            if os.path.isfile(url):
-                with open(url, "r") as f:
-                    content = f.read()
-                return content
-
-        content = None
         if url and self.is_file_expired(fname, cache_time):  # load data into temporary cache file
-            for trial in range(1, nretry + 1):
-                if content:
-                    break
-                try:
-                    native_access = '://' not in url  ## trival check for file access, non accurate.. FIXME later if need
-                    if native_access:
-                        logger.info('[attempt=%s/%s] loading data from file=%s' % (trial, nretry, url))
-                        content = _readfile(url)
-                    else:
-                        logger.info('[attempt=%s/%s] loading data from url=%s' % (trial, nretry, url))
-                        try:
-                            content = urllib.request.urlopen(url, timeout=20).read()  # Python 3
-                        except Exception:
-                            content = urllib2.urlopen(url, timeout=20).read()  # Python 2
-                    if fname:  # save to cache
-                        with open(fname, "w+") as f:
-                            f.write(str(content))  # Python 3, added str (write() argument must be str, not bytes; JSON OK)
-                            logger.info('saved data from "%s" resource into file=%s, length=%.1fKb' %
-                                        (url, fname, len(content) / 1024.))
-                    return content
-                except Exception as e:  # ignore errors, try to use old cache if any
-                    logger.warning('failed to load data from url=%s, error: %s .. trying to use data from cache=%s' %
-                                   (url, e, fname))
-                    # will try to use old cache below
-                    if trial < nretry:
-                        xsleep_time = sleep_time() if callable(sleep_time) else sleep_time
-                        logger.info("will try again after %ss.." % xsleep_time)
-                        time.sleep(xsleep_time)
-
-        if content is not None:  # just loaded data
-            return content
+            lock, refresh = self.lock_cache_file(fname, cache_time) if fname else (None, True)
+            content = None
+            try:
+                content = self.refresh_cache(url, fname, nretry, sleep_time) if refresh else None
+            finally:
+                if lock:
+                    lock.close()
+            if content is not None:  # just loaded data
+                return content
 
         # read data from old cache fname
         try:
-            with open(fname, 'r') as f:
-                content = f.read()
+            content = self.read_cache_file(fname)
         except Exception as e:
             logger.warning("cache file=%s is not available: %s .. skipped" % (fname, e))
             return None
@@ -139,11 +335,49 @@ class DataLoader(object):
         return content
 
     @classmethod
-    def load_data(self, sources, priority, cache_time=60, parser=None):
+    def parse_json(self, content):
+        """
+        Default parser of the loaded data.
+
+        :param content: json string.
+        :raises Exception: if the data contains an error.
+        :return: parsed data.
+        """
+
+        dat = json.loads(content)
+        if dat and isinstance(dat, dict) and 'error' in dat:
+            raise Exception('response contains error, data=%s' % dat)
+
+        return dat
+
+    @classmethod
+    def get_index(self, idat, fields):
+        """
+        Return the compact index (`IndexedCache`) of the data of a source with a cache file.
+        A local source file is validated by itself, downloaded data by its cache file.
+
+        :param idat: source configuration (dict with 'fname', 'cache_time' and optional 'url').
+        :param fields: list of entry fields to be kept.
+        :return: `IndexedCache` object, True if the index can be used without loading the source (Boolean).
+        """
+
+        url = idat.get('url')
+        native_access = url and '://' not in url and os.path.isfile(url)
+        cache = IndexedCache(url if native_access else idat['fname'], fields, fname='%s.idx' % idat['fname'])
+
+        return cache, bool(native_access or not (url and self.is_file_expired(idat['fname'], idat['cache_time'])))
+
+    @classmethod
+    def load_data(self, sources, priority, cache_time=60, parser=None, names=None, fields=None):
         """
         Download data from various sources (prioritized).
         Try to get data from sources according to priority values passed
 
+        If `fields` is set then the data is expected to be a dict of entries (dicts) by name as a key:
+        only requested entries (`names`) stripped down to `fields` are returned, and the data of the sources
+        with a cache file and the default parser is read via the compact index (`IndexedCache`) of the cache file,
+        which is (re)created once the source is loaded.
+
         Expected format of source entry:
         sources = {'NAME':{'url':"source url", 'nretry':int, 'fname':'cache file (optional)', 'cache_time':int (optional), 'sleep_time':opt}}
 
@@ -151,6 +385,8 @@ class DataLoader(object):
         :param priority: Ordered list of source names
         :param cache_time: Default cache time in seconds. Can be overwritten by cache_time value passed in sources dict
         :param parser: Callback function to interpret/validate data which takes read data from source as input. Default is json.loads
+        :param names: list of entry names to be selected (all entries if empty). Considered only if `fields` is set
+        :param fields: list of entry fields to be kept
         :return: Data loaded and processed by parser callback
         """
 
@@ -166,23 +402,28 @@ class DataLoader(object):
             idat = dict([k, dat.get(k)] for k in accepted_keys if k in dat)
             idat.setdefault('cache_time', cache_time)
 
+            cache = None
+            if fields is not None and idat.get('fname') and not dat.get('parser'):
+                cache, valid = self.get_index(idat, fields)
+                data = cache.get(names) if valid else None
+                if data is not None:
+                    if data:
+                        return data
+                    continue
+
             content = self.load_url_data(**idat)
             if not content:
                 continue
-            if dat.get('parser'):
-                parser = dat.get('parser')
-            if not parser:
-                def jsonparser(c):
-                    dat = json.loads(c)
-                    if dat and isinstance(dat, dict) and 'error' in dat:
-                        raise Exception('response contains error, data=%s' % dat)
-                    return dat
-                parser = jsonparser
+            parser = dat.get('parser') or parser or self.parse_json
             try:
                 data = parser(content)
             except Exception as e:
                 logger.fatal("failed to parse data from source=%s .. skipped, error=%s" % (dat.get('url'), e))
                 data = None
+            if data and fields is not None and isinstance(data, dict):
+                if cache:
+                    cache.build(data)
+                data = dict((k, select_fields(v, fields)) for k, v in data.items() if not names or k in names)
             if data:
                 return data
 
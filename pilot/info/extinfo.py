@@ -21,6 +21,8 @@ import json
 import random
 from pilot.util.config import config
 from .dataloader import DataLoader, merge_dict_data
+from .queuedata import QueueData
+from .storagedata import StorageData
 
 import logging
 logger = logging.getLogger(__name__)
@@ -47,6 +49,8 @@ class ExtInfoProvider(DataLoader):
 
         For the moment PanDA source does not provide the full schedconfig description
 
+        Only the fields used by `QueueData` are loaded for the requested queues (all queues if empty).
+
         :param pandaqueues: list of PandaQueues to be loaded
         :param cache_time: Default cache time in seconds.
         :return:
@@ -77,7 +81,7 @@ class ExtInfoProvider(DataLoader):
 
         priority = priority or ['LOCAL', 'CVMFS', 'AGIS', 'PANDA']
 
-        return self.load_data(sources, priority, cache_time)
+        return self.load_data(sources, priority, cache_time, names=pandaqueues, fields=QueueData.get_ext_keys())
 
     @classmethod
     def load_queuedata(self, pandaqueue, priority=[], cache_time=60):
@@ -135,7 +139,7 @@ class ExtInfoProvider(DataLoader):
 
         priority = priority or ['LOCAL', 'PANDA', 'CVMFS', 'AGIS']
 
-        return self.load_data(sources, priority, cache_time)
+        return self.load_data(sources, priority, cache_time, names=pandaqueues, fields=QueueData.get_ext_keys())
 
     @classmethod
     def load_storage_data(self, ddmendpoints=[], priority=[], cache_time=60):
@@ -143,6 +147,8 @@ class ExtInfoProvider(DataLoader):
         Download DDM Storages details by given name (DDMEndpoint) from various sources (prioritized).
         Try to get data from LOCAL first, then CVMFS and AGIS
 
+        Only the fields used by `StorageData` are loaded for the requested endpoints (all endpoints if empty).
+
         :param pandaqueues: list of PandaQueues to be loaded
         :param cache_time: Default cache time in seconds.
         :return: dict of DDMEndpoint settings by DDMendpoint name as a key
@@ -174,7 +180,7 @@ class ExtInfoProvider(DataLoader):
 
         priority = priority or ['LOCAL', 'CVMFS', 'AGIS', 'PANDA']
 
-        return self.load_data(sources, priority, cache_time)
+        return self.load_data(sources, priority, cache_time, names=ddmendpoints, fields=StorageData.get_ext_keys())
 
     def resolve_queuedata(self, pandaqueue, schedconf_priority=None):
         """
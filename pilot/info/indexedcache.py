@@ -0,0 +1,171 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
+
+"""
+Compact on-disk index of the large JSON sources (schedconfig, DDM endpoints) used by the Information Service.
+
+The source JSON is a dict of entries keyed by name (PanDA queue, DDMEndpoint). The index file keeps only the
+requested fields of each entry, serialized one after another, followed by the offsets of the entries:
+
+    <header line: {"version": .., "source": [size, mtime], "fields": [..], "index_offset": ..}>
+    <entry 1><entry 2>...
+    <index: {"name": [offset, length], ..}>
+
+The file is mapped into memory and only the requested entries are parsed, so a pilot which needs one queue and
+a few endpoints does not parse (or keep in memory) the full source. The index is valid as long as size and
+modification time of the source file and the list of fields are unchanged; it is rebuilt otherwise.
+
+:author: Paul Nilsson
+:date: October 2020
+"""
+
+import os
+import json
+import mmap
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def select_fields(entry, fields=None):
+    """
+    Strip the entry down to the given fields.
+
+    :param entry: dict.
+    :param fields: list of fields to keep (keep all if None).
+    :return: dict.
+    """
+
+    if fields is None or not isinstance(entry, dict):
+        return entry
+
+    return dict((k, entry[k]) for k in fields if k in entry)
+
+
+class IndexedCache(object):
+    """
+        Index of JSON entries (dict of dicts) stored next to the source file
+    """
+
+    version = 1
+
+    def __init__(self, source, fields=None, fname=None):
+        """
+            :param source: path to the source JSON file (used to validate the index)
+            :param fields: list of entry fields to keep (keep all if None)
+            :param fname: path to the index file (default is `source` + '.idx')
+        """
+
+        self.source = source
+        self.fields = sorted(fields) if fields is not None else None
+        self.fname = fname or '%s.idx' % source
+
+    def get_signature(self):
+        """
+        Return the signature (size, modification time) of the source file.
+
+        :return: list or None if the source file does not exist.
+        """
+
+        try:
+            st = os.stat(self.source)
+        except OSError:
+            return None
+
+        return [st.st_size, getattr(st, 'st_mtime_ns', int(st.st_mtime * 1e9))]
+
+    def get(self, names=None):
+        """
+        Load entries from the index file.
+
+        :param names: list of entry names to load (all entries if empty).
+        :return: dict of entries by name as a key, or None if the index does not exist or is outdated.
+        """
+
+        signature = self.get_signature()
+        if not signature:
+            return None
+
+        try:
+            with open(self.fname, 'rb') as f:
+                header = json.loads(f.readline().decode('utf-8'))
+                if header.get('version') != self.version or header.get('source') != signature or \
+                        header.get('fields') != self.fields:
+                    logger.debug('index file=%s is outdated' % self.fname)
+                    return None
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError) as e:
+            logger.debug('index file=%s is not available: %s' % (self.fname, e))
+            return None
+
+        try:
+            index = json.loads(mm[header['index_offset']:].decode('utf-8'))
+            ret = {}
+            for name in (names or index):
+                if name in index:
+                    offset, length = index[name]
+                    ret[name] = json.loads(mm[offset:offset + length].decode('utf-8'))
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning('failed to read index file=%s: %s .. skipped' % (self.fname, e))
+            return None
+        finally:
+            mm.close()
+
+        logger.info('loaded %s entries from index file=%s' % (len(ret), self.fname))
+
+        return ret
+
+    def build(self, data, signature=None):
+        """
+        (Re)create the index file from the parsed source data.
+        The file is written to a temporary name and then renamed, so concurrent pilots never read a partial index.
+
+        :param data: dict of entries by name as a key.
+        :param signature: signature of the source the data was read from (default is the current one).
+        :return: True if the index was written.
+        """
+
+        signature = signature or self.get_signature()
+        if not signature or not isinstance(data, dict):
+            return False
+
+        entries, index = [], {}
+        for name in sorted(data):
+            entry = json.dumps(select_fields(data[name], self.fields), separators=(',', ':')).encode('utf-8')
+            entries.append((name, entry))
+
+        header = {'version': self.version, 'source': signature, 'fields': self.fields, 'index_offset': 0}
+        # the header must keep its length once the final offset is known: reserve digits for it
+        size = len(json.dumps(header).encode('utf-8')) + 21
+        offset = size
+        for name, entry in entries:
+            index[name] = [offset, len(entry)]
+            offset += len(entry)
+        header['index_offset'] = offset
+        hline = json.dumps(header).encode('utf-8')
+        hline += b' ' * (size - len(hline) - 1) + b'\n'
+
+        tmpname = '%s.%s' % (self.fname, os.getpid())
+        try:
+            with open(tmpname, 'wb') as f:
+                f.write(hline)
+                for name, entry in entries:
+                    f.write(entry)
+                f.write(json.dumps(index, separators=(',', ':')).encode('utf-8'))
+            os.rename(tmpname, self.fname)
+        except (IOError, OSError) as e:
+            logger.warning('failed to write index file=%s: %s .. skipped' % (self.fname, e))
+            try:
+                os.remove(tmpname)
+            except OSError:
+                pass
+            return False
+
+        logger.info('saved %s entries into index file=%s' % (len(entries), self.fname))
+
+        return True
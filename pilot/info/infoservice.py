@@ -91,7 +91,15 @@ class InfoService(object):
         if not self.queuedata or not self.queuedata.name:
             raise QueuedataFailure("Failed to resolve queuedata for queue=%s, wrong PandaQueue name?" % self.pandaqueue)
 
-        self.resolve_storage_data()  ## prefetch details for all storages
+        ## prefetch details for the storages associated to the queue, other storages are loaded on demand
+        ddmendpoints = set()
+        for ddms in (self.queuedata.astorages or {}).values():
+            ddmendpoints.update(ddms or [])
+        if ddmendpoints:
+            try:
+                self.resolve_storage_data(sorted(ddmendpoints))
+            except PilotException as e:
+                logger.warning('failed to prefetch storage details for queue=%s: %s' % (self.pandaqueue, e))
 
     @classmethod
     def whoami(self):
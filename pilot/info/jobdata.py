@@ -98,6 +98,9 @@ class JobData(BaseData):
     zombies = []                   # list of zombie process ids
     memorymonitor = ""             # memory monitor name, e.g. prmon
     actualcorecount = 0            # number of cores actually used by the payload
+    waitfor = []                   # job pipelining: ids of the previous jobs that must complete before stage-in
+    prefetched = False             # job pipelining: the previous jobs are still finishing (state is only kept in the job object)
+    serverupdate = ""              # server update state of the job (SERVER_UPDATE_*)
 
     # time variable used for on-the-fly cpu consumption time measurements done by job monitoring
     t0 = None                      # payload startup time
@@ -84,6 +84,9 @@ class QueueData(BaseData):
 
     maxtime = 0  # maximum allowed lifetime for pilot to run on the resource (0 will be ignored, fallback to default)
 
+    maxtransfers = 1  # maximum number of concurrent file transfers (stage-in/out) per copytool call
+    maxtransfers_ddm = 0  # maximum number of concurrent file transfers per DDMEndpoint (0 means no limit)
+
     pledgedcpu = 0  #
     es_stageout_gap = 0  ## time gap value in seconds for ES stageout
 
@@ -91,13 +94,28 @@ class QueueData(BaseData):
 
     # specify the type of attributes for proper data validation and casting
     _keys = {int: ['timefloor', 'maxwdir', 'pledgedcpu', 'es_stageout_gap',
-                   'corecount', 'maxrss', 'maxtime'],
+                   'corecount', 'maxrss', 'maxtime', 'maxtransfers', 'maxtransfers_ddm'],
              str: ['name', 'type', 'appdir', 'catchall', 'platform', 'container_options', 'container_type',
                    'resource', 'state', 'status', 'site'],
              dict: ['copytools', 'acopytools', 'astorages', 'aprotocols', 'acopytools_schemas'],
              bool: ['allow_lan', 'allow_wan', 'direct_access_lan', 'direct_access_wan', 'is_cvmfs', 'use_pcache']
              }
 
+    # the translation map of the queue data attributes from external data to internal schema
+    # 'internal_name':('ext_name1', 'extname2_if_any')
+    # 'internal_name2':'ext_name3'
+
+    # first defined ext field will be used
+    # if key is not explicitly specified then ext name will be used as is
+    ## fix me later to proper internal names if need
+    _kmap = {
+        'name': 'nickname',
+        'resource': 'panda_resource',
+        'platform': 'cmtconfig',
+        'site': ('atlas_site', 'gstat'),
+        'es_stageout_gap': 'zip_time_gap',
+    }
+
     def __init__(self, data):
         """
             :param data: input dictionary of queue data settings
@@ -116,23 +134,7 @@ class QueueData(BaseData):
             :param data: input dictionary of queue data settings
         """
 
-        # the translation map of the queue data attributes from external data to internal schema
-        # 'internal_name':('ext_name1', 'extname2_if_any')
-        # 'internal_name2':'ext_name3'
-
-        # first defined ext field will be used
-        # if key is not explicitly specified then ext name will be used as is
-        ## fix me later to proper internal names if need
-
-        kmap = {
-            'name': 'nickname',
-            'resource': 'panda_resource',
-            'platform': 'cmtconfig',
-            'site': ('atlas_site', 'gstat'),
-            'es_stageout_gap': 'zip_time_gap',
-        }
-
-        self._load_data(data, kmap)
+        self._load_data(data, self._kmap)
 
     def resolve_allowed_schemas(self, activity, copytool=None):
         """
@@ -62,6 +62,16 @@ class StorageData(BaseData):
              bool: ['is_deterministic']
              }
 
+    # the translation map of the storage data attributes from external data to internal schema
+    # first defined ext field name will be used
+    # if key is not explicitly specified then ext name will be used as is
+    ## fix me later to proper internal names if need
+    _kmap = {
+        # 'internal_name': ('ext_name1', 'extname2_if_any')
+        # 'internal_name2': 'ext_name3'
+        'pk': 'id',
+    }
+
     def __init__(self, data):
         """
             :param data: input dictionary of storage description by DDMEndpoint name as key
@@ -80,18 +90,7 @@ class StorageData(BaseData):
             :param data: input dictionary of storage description by DDMEndpoint name as key
         """
 
-        # the translation map of the queue data attributes from external data to internal schema
-        # first defined ext field name will be used
-        # if key is not explicitly specified then ext name will be used as is
-        ## fix me later to proper internal names if need
-
-        kmap = {
-            # 'internal_name': ('ext_name1', 'extname2_if_any')
-            # 'internal_name2': 'ext_name3'
-            'pk': 'id',
-        }
-
-        self._load_data(data, kmap)
+        self._load_data(data, self._kmap)
 
     ## custom function pattern to apply extra validation to the key values
     ##def clean__keyname(self, raw, value):
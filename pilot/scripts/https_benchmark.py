@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
+
+# Compare the per-call latency of the in-process HTTPS client (persistent connections) with the curl fallback,
+# using a local mock PanDA server with a self-signed certificate (requires the openssl command).
+# Usage: PYTHONPATH=. python pilot/scripts/https_benchmark.py [-n 50]
+
+import argparse
+import json
+import os
+import shutil
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer  # Python 3
+    from socketserver import ThreadingMixIn  # Python 3
+except Exception:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # Python 2
+    from SocketServer import ThreadingMixIn  # Python 2
+
+from pilot.util import https
+
+
+class MockPandaHandler(BaseHTTPRequestHandler):
+    """
+    Request handler that answers every POST with a small JSON document (keep-alive enabled).
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):  # noqa: N802
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        body = json.dumps({'StatusCode': 0, 'command': 'NULL'}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # e.g. the client closing a pooled connection without TLS shutdown
+
+
+def create_certificate(workdir):
+    """
+    Create a self-signed certificate for localhost, with certificate and key in the same file (like an X509 proxy).
+
+    :param workdir: directory for the certificate file (string).
+    :return: path to certificate file (string).
+    """
+
+    key = os.path.join(workdir, 'key.pem')
+    cert = os.path.join(workdir, 'cert.pem')
+    cmd = ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=localhost',
+           '-addext', 'subjectAltName=DNS:localhost', '-keyout', key, '-out', cert]
+    subprocess.check_call(cmd, stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+
+    path = os.path.join(workdir, 'x509up')
+    with open(path, 'w') as fp:
+        fp.write(open(cert).read() + open(key).read())
+
+    return path
+
+
+def measure(url, n):
+    """
+    Send n requests and return the per-call latencies.
+
+    :param url: URL (string).
+    :param n: number of calls (int).
+    :return: list of latencies in seconds.
+    """
+
+    latencies = []
+    for i in range(n):
+        t0 = time.time()
+        res = https.request(url, data={'jobId': i, 'state': 'running'})
+        latencies.append(time.time() - t0)
+        if res is None:
+            raise RuntimeError('request %d failed' % i)
+
+    return latencies
+
+
+def report(label, latencies):
+    """
+    Print the latency statistics.
+
+    :param label: label (string).
+    :param latencies: list of latencies in seconds.
+    :return: mean latency in seconds (float).
+    """
+
+    latencies = sorted(latencies)
+    mean = sum(latencies) / len(latencies)
+    print('%-20s calls=%d mean=%.2f ms median=%.2f ms max=%.2f ms' %
+          (label, len(latencies), mean * 1000, latencies[len(latencies) // 2] * 1000, latencies[-1] * 1000))
+
+    return mean
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', dest='n', type=int, default=50, help='Number of calls per client')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ['PILOT_HOME'] = workdir  # for the curl config files
+    try:
+        proxy = create_certificate(workdir)
+        os.environ['X509_USER_PROXY'] = proxy
+        os.environ['X509_CERT_DIR'] = workdir
+
+        server = ThreadingHTTPServer(('localhost', 0), MockPandaHandler)
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(certfile=proxy, keyfile=proxy)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        url = 'https://localhost:%d/server/panda/updateJob' % server.server_address[1]
+
+        https.https_setup(None, 'benchmark')
+        mean_pool = report('persistent client', measure(url, args.n))
+
+        # force the curl fallback
+        https._ctx.ssl_context = None
+        https.reset_connection_pool()
+        mean_curl = report('curl', measure(url, args.n))
+
+        print('speed-up: %.1fx' % (mean_curl / mean_pool))
+        server.shutdown()
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
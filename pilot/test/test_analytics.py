@@ -5,10 +5,12 @@
 # http://www.apache.org/licenses/LICENSE-2.0
 #
 # Authors:
-# - Paul Nilsson, paul.nilsson@cern.ch, 2018
+# - Paul Nilsson, paul.nilsson@cern.ch, 2018-2020
 
 import unittest
 import os
+import shutil
+import tempfile
 
 from pilot.api import analytics
 
@@ -74,6 +76,37 @@ class TestAnalytics(unittest.TestCase):
         self.assertEqual(type(slope), float)
         self.assertGreater(slope, 0)
 
+    def test_incremental_fit(self):
+        """
+        Make sure that a growing memory monitor output file gives the same fit as reading the complete file.
+
+        :return: (assertion).
+        """
+
+        with open('pilot/test/resource/memory_monitor_output.txt') as f:
+            lines = f.readlines()
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'memory_monitor_output.txt')
+            with open(filename, 'w') as f:
+                f.write(''.join(lines[:100]) + lines[100][:10])  # the last row is incomplete
+            data = self.client.get_fitted_data(filename, y_name='PSS', tails=False)
+            self.assertEqual(analytics.Analytics().get_table_reader(filename).nrows, 99)
+            self.assertNotEqual(data.get('slope'), '')
+
+            with open(filename, 'a') as f:
+                f.write(lines[100][10:] + ''.join(lines[101:]))
+            data = analytics.Analytics().get_fitted_data(filename, y_name='PSS', tails=False)
+
+            table = self.client.get_table(filename)
+            fit = self.client.fit(table['Time'][5:-2], table['PSS'][5:-2])
+            self.assertEqual(data.get('slope'), analytics.float_to_rounded_string(fit.slope(), precision=2))
+            self.assertEqual(data.get('chi2'), analytics.float_to_rounded_string(fit.chi2(), precision=0))
+            self.assertAlmostEqual(fit.slope(), analytics.Analytics._fits[(filename, 'Time', 'PSS', False)][0].slope())
+        finally:
+            shutil.rmtree(tmpdir)
+
 
 if __name__ == '__main__':
     unittest.main()
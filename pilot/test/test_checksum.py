@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
+
+import unittest
+import hashlib
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import zlib
+
+from pilot.util import filehandling
+from pilot.util.filehandling import calculate_checksum, copy_with_checksum, get_cached_checksums, ChecksumWriter
+
+
+class TestChecksum(unittest.TestCase):
+    """
+    Unit tests for the checksum calculation and cache.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'file.dat')
+        self.data = os.urandom(100000)
+        with open(self.path, 'wb') as fp:
+            fp.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def expected(self, data):
+        return "{0:08x}".format(zlib.adler32(data) & 0xffffffff), hashlib.md5(data).hexdigest()
+
+    def test_checksum_values(self):
+        """
+        Compare the checksums with the zlib and hashlib values.
+
+        :return: (assertion).
+        """
+
+        adler, md5 = self.expected(self.data)
+        self.assertEqual(calculate_checksum(self.path), adler)
+        self.assertEqual(calculate_checksum(self.path, algorithm='md5'), md5)
+        self.assertEqual(filehandling.calculate_adler32_checksum(self.path), adler)
+
+    def test_cache(self):
+        """
+        Make sure that the checksums are cached, and that the cache entry is invalidated when the file changes.
+
+        :return: (assertion).
+        """
+
+        calculate_checksum(self.path)
+        self.assertNotEqual(get_cached_checksums(self.path), None)
+
+        # the cached value is used as long as the file is unchanged
+        self.assertEqual(filehandling.calculate_checksums(self.path), get_cached_checksums(self.path))
+
+        data = self.data + b'x'
+        with open(self.path, 'wb') as fp:
+            fp.write(data)
+        mtime = time.time() + 10
+        os.utime(self.path, (mtime, mtime))
+
+        self.assertEqual(get_cached_checksums(self.path), None)
+        self.assertEqual(calculate_checksum(self.path), self.expected(data)[0])
+
+    def test_copy(self):
+        """
+        Make sure that the checksums of a copied file are calculated during the copy and cached for the destination.
+
+        :return: (assertion).
+        """
+
+        destination = os.path.join(self.tmpdir, 'copy.dat')
+        checksums = copy_with_checksum(self.path, destination)
+
+        adler, md5 = self.expected(self.data)
+        self.assertEqual(checksums, {'adler32': adler, 'md5': md5})
+        self.assertEqual(get_cached_checksums(destination), checksums)
+        with open(destination, 'rb') as fp:
+            self.assertEqual(fp.read(), self.data)
+
+    def test_writer(self):
+        """
+        Make sure that the checksums of a tar archive are calculated while the archive is written.
+
+        :return: (assertion).
+        """
+
+        archive = os.path.join(self.tmpdir, 'archive.tar')
+        with open(archive, 'wb') as fd:
+            writer = ChecksumWriter(fd)
+            tar = tarfile.open(fileobj=writer, mode='w', format=tarfile.GNU_FORMAT)
+            tar.add(self.path, arcname='file.dat')
+            tar.add(self.path, arcname='file2.dat')
+            tar.close()
+
+        with open(archive, 'rb') as fd:
+            data = fd.read()
+        self.assertEqual(writer.tell(), len(data))
+        self.assertEqual(writer.get_checksums(), dict(zip(['adler32', 'md5'], self.expected(data))))
+        self.assertEqual(tarfile.open(archive).getnames(), ['file.dat', 'file2.dat'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
+
+import unittest
+import functools
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+try:
+    from http.server import HTTPServer, SimpleHTTPRequestHandler  # Python 3
+except Exception:
+    HTTPServer = None
+
+from pilot.info.dataloader import DataLoader
+
+
+class TestDataLoader(unittest.TestCase):
+    """
+    Unit tests for the shared cache files of the DataLoader.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmpdir, 'source.json')
+        self.fname = os.path.join(self.tmpdir, 'cache.json')
+        with open(self.source, 'w') as f:
+            json.dump({'QUEUE': {'nickname': 'QUEUE'}}, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_compressed_cache(self):
+        """
+        The cache file is saved compressed and read back transparently.
+        """
+
+        content = DataLoader.load_url_data(self.source, self.fname)
+        self.assertEqual(json.loads(content), {'QUEUE': {'nickname': 'QUEUE'}})
+        with gzip.open(self.fname) as f:
+            self.assertEqual(json.loads(f.read().decode('utf-8')), {'QUEUE': {'nickname': 'QUEUE'}})
+
+        content = DataLoader.load_url_data(self.source, self.fname, cache_time=60)
+        self.assertEqual(json.loads(content), {'QUEUE': {'nickname': 'QUEUE'}})
+
+    def test_unmodified_source(self):
+        """
+        The expired cache is renewed without rewriting if the source file is not changed.
+        """
+
+        DataLoader.load_url_data(self.source, self.fname)
+        os.utime(self.fname, (0, 0))
+        inode = os.stat(self.fname).st_ino
+
+        content = DataLoader.load_url_data(self.source, self.fname, cache_time=60)
+        self.assertEqual(json.loads(content), {'QUEUE': {'nickname': 'QUEUE'}})
+        self.assertEqual(os.stat(self.fname).st_ino, inode)
+        self.assertFalse(DataLoader.is_file_expired(self.fname, 60))
+
+    def test_locked_cache(self):
+        """
+        The stale cache is used while another process holds the lock.
+        """
+
+        DataLoader.load_url_data(self.source, self.fname)
+        os.utime(self.fname, (0, 0))
+        with open(self.source, 'w') as f:
+            json.dump({'QUEUE': {'nickname': 'NEW'}}, f)
+
+        lock = DataLoader.lock_file('%s.lock' % self.fname)
+        self.assertTrue(lock)
+        try:
+            content = DataLoader.load_url_data(self.source, self.fname, cache_time=60)
+            self.assertEqual(json.loads(content), {'QUEUE': {'nickname': 'QUEUE'}})
+        finally:
+            lock.close()
+
+        content = DataLoader.load_url_data(self.source, self.fname, cache_time=60)
+        self.assertEqual(json.loads(content), {'QUEUE': {'nickname': 'NEW'}})
+
+    @unittest.skipIf(HTTPServer is None, "Python 3 only")
+    def test_not_modified_url(self):
+        """
+        The url is revalidated with If-Modified-Since.
+        """
+
+        class Handler(SimpleHTTPRequestHandler):
+            requests = []
+
+            def log_message(self, *args):
+                pass
+
+            def send_response(self, code, message=None):
+                Handler.requests.append(code)
+                SimpleHTTPRequestHandler.send_response(self, code, message)
+
+        server = HTTPServer(('127.0.0.1', 0), functools.partial(Handler, directory=self.tmpdir))
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            url = 'http://127.0.0.1:%s/source.json' % server.server_address[1]
+            DataLoader.load_url_data(url, self.fname)
+            os.utime(self.fname, (0, 0))
+            content = DataLoader.load_url_data(url, self.fname, cache_time=60)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(json.loads(content), {'QUEUE': {'nickname': 'QUEUE'}})
+        self.assertEqual(Handler.requests, [200, 304])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
+
+import unittest
+import threading
+import time
+
+from pilot.api.data import StageInClient
+from pilot.common.exception import PilotException
+from pilot.info import FileSpec
+from pilot.util.tracereport import TraceReport
+
+
+class DummyCopytool(object):
+    """
+    Copytool replacement that records the concurrency of the copy_in() calls.
+    """
+
+    def __init__(self, failures=None):
+        self.lock = threading.Lock()
+        self.active = {}
+        self.max_active = {}
+        self.calls = []
+        self.failures = failures or {}  # lfn -> number of failing attempts
+
+    def copy_in(self, files, **kwargs):
+        fspec = files[0]
+        with self.lock:
+            self.calls.append(fspec.lfn)
+            self.active[fspec.ddmendpoint] = self.active.get(fspec.ddmendpoint, 0) + 1
+            total = sum(self.active.values())
+            self.max_active['all'] = max(self.max_active.get('all', 0), total)
+            self.max_active[fspec.ddmendpoint] = max(self.max_active.get(fspec.ddmendpoint, 0),
+                                                     self.active[fspec.ddmendpoint])
+        kwargs['trace_report'].update(filename=fspec.lfn)
+        kwargs.pop('copytools', None)
+        time.sleep(0.05)
+        with self.lock:
+            self.active[fspec.ddmendpoint] -= 1
+            failures = self.failures.get(fspec.lfn, 0)
+            if failures:
+                self.failures[fspec.lfn] = failures - 1
+                fspec.status = 'failed'
+                raise PilotException('transfer failed for %s' % fspec.lfn)
+        fspec.status = 'transferred'
+        return files
+
+
+class TestConcurrentTransfers(unittest.TestCase):
+    """
+    Unit tests for concurrent transfers in the staging client.
+    """
+
+    def setUp(self):
+        self.client = StageInClient(acopytools='mv')
+        self.trace_report = TraceReport(filename='original')
+        self.files = [FileSpec(filetype='input', lfn='file%d' % i, ddmendpoint='DDM%d' % (i % 2))
+                      for i in range(8)]
+
+    def test_concurrency(self):
+        """
+        Make sure that files are transferred concurrently, within the per ddmendpoint limit.
+
+        :return: (assertion).
+        """
+
+        copytool = DummyCopytool()
+        files = self.client.copy_files(copytool.copy_in, self.files, maxtransfers=4, maxtransfers_ddm=1,
+                                       trace_report=self.trace_report, copytools={'mv': {}})
+
+        self.assertEqual(sorted(copytool.calls), sorted(f.lfn for f in self.files))
+        self.assertTrue(all(f.status == 'transferred' for f in files))
+        self.assertEqual(copytool.max_active.get('DDM0'), 1)
+        self.assertEqual(copytool.max_active.get('DDM1'), 1)
+        self.assertEqual(copytool.max_active.get('all'), 2)
+
+        # the shared trace report must not be modified by the concurrent transfers
+        self.assertEqual(self.trace_report.get('filename'), 'original')
+
+    def test_retry(self):
+        """
+        Make sure that a failed transfer is retried, and that the error is raised if the retries are exhausted.
+
+        :return: (assertion).
+        """
+
+        copytool = DummyCopytool(failures={'file1': 1, 'file2': 2})
+        self.assertRaises(PilotException, self.client.copy_files, copytool.copy_in, self.files, maxtransfers=4,
+                          trace_report=self.trace_report)
+
+        self.assertEqual(copytool.calls.count('file1'), 2)
+        self.assertEqual(copytool.calls.count('file2'), 2)
+        self.assertEqual([f.lfn for f in self.files if f.status != 'transferred'], ['file2'])
+
+    def test_serial(self):
+        """
+        Make sure that all files are passed at once to the copytool without concurrency.
+
+        :return: (assertion).
+        """
+
+        calls = []
+        self.client.copy_files(lambda files, **kwargs: calls.append(files), self.files)
+
+        self.assertEqual(calls, [self.files])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,9 +11,11 @@ import logging
 import os
 import socket
 import sys
+import threading
 import time
 
 from pilot.eventservice.communicationmanager.communicationmanager import CommunicationRequest, CommunicationResponse, CommunicationManager
+from pilot.eventservice.communicationmanager.plugins.pandacommunicator import PandaCommunicator
 from pilot.util.https import https_setup
 from pilot.util.timing import time_stamp
 
@@ -68,6 +70,114 @@ class TestESCommunicationrRequestResponse(unittest.TestCase):
         self.assertEqual(resp.status, 0)
 
 
+class SlowUpdateCommunicator(PandaCommunicator):
+    """
+    Communicator for tests: event ranges are returned immediately, event updates take one second.
+    """
+
+    def get_events(self, req):
+        return CommunicationResponse({'status': 0, 'content': [{'eventRangeID': '%s' % i} for i in range(req.num_ranges)]})
+
+    def update_events(self, req):
+        time.sleep(1)
+        return CommunicationResponse({'status': 0, 'content': {'StatusCode': 0}})
+
+
+class SlowRequestCommunicator(SlowUpdateCommunicator):
+    """
+    Communicator for tests: requesting event ranges takes one second.
+    """
+
+    def request_get_events(self, req):
+        time.sleep(1)
+        return CommunicationResponse({'status': 0})
+
+
+class TestCommunicationManager(CommunicationManager):
+
+    def get_plugin_confs(self):
+        return {'class': 'pilot.test.test_escommunicator.SlowUpdateCommunicator'}
+
+
+class SlowRequestCommunicationManager(CommunicationManager):
+
+    def get_plugin_confs(self):
+        return {'class': 'pilot.test.test_escommunicator.SlowRequestCommunicator'}
+
+
+class TestESCommunicationManagerDispatch(unittest.TestCase):
+    """
+    Unit tests for the request dispatching of the event service communicator manager.
+    """
+
+    def test_dispatch(self):
+        """
+        Make sure that requests are handled without polling delay and a slow update does not block getting events.
+        """
+
+        communicator_manager = TestCommunicationManager()
+        communicator_manager.start()
+        try:
+            job = {'PandaID': 1, 'jobsetID': 2, 'taskID': 3}
+            t0 = time.time()
+            events = communicator_manager.get_event_ranges(num_event_ranges=2, job=job)
+            self.assertEqual(len(events), 2)
+            self.assertTrue(time.time() - t0 < 0.5)
+
+            communicator_manager.update_events(update_events={}, post_hook=lambda res: None)
+            time.sleep(0.1)
+            t0 = time.time()
+            events = communicator_manager.get_event_ranges(num_event_ranges=1, job=job)
+            self.assertEqual(len(events), 1)
+            self.assertTrue(time.time() - t0 < 0.5)
+
+            res = communicator_manager.update_events(update_events={})
+            self.assertEqual(res['StatusCode'], 0)
+
+            stats = communicator_manager.get_stats()
+            self.assertEqual(stats['processing_get_events']['processed'], 2)
+            self.assertEqual(stats['update_events']['processed'], 2)
+            self.assertEqual(stats['update_events']['depth'], 0)
+            self.assertTrue(stats['update_events']['avg_handle_time'] >= 1)
+        finally:
+            communicator_manager.stop()
+            communicator_manager.join(5)
+        self.assertFalse(communicator_manager.is_alive())
+
+    def test_stop(self):
+        """
+        Make sure that a request forwarded to the next queue while the manager stops is aborted.
+        """
+
+        communicator_manager = SlowRequestCommunicationManager()
+        communicator_manager.start()
+        result = []
+
+        def get_event_ranges():
+            try:
+                result.append(communicator_manager.get_event_ranges(num_event_ranges=1, job={'PandaID': 1}))
+            except Exception as e:
+                result.append(e)
+
+        client = threading.Thread(target=get_event_ranges)
+        client.start()
+        time.sleep(0.3)
+        communicator_manager.stop()
+        client.join(10)
+        communicator_manager.join(5)
+        self.assertFalse(client.is_alive())
+        self.assertFalse(communicator_manager.is_alive())
+        self.assertEqual(len(result), 1)
+        self.assertTrue(isinstance(result[0], Exception))
+
+        # requests queued after the dispatcher has stopped are aborted too
+        req = CommunicationRequest({'request_type': CommunicationRequest.RequestType.RequestEvents,
+                                    'num_event_ranges': 1, 'post_hook': None, 'response': None})
+        communicator_manager.put_request('request_get_events', req)
+        self.assertRaises(Exception, communicator_manager.wait_response, req)
+        self.assertTrue(req.abort)
+
+
 class TestESCommunicationManagerPanda(unittest.TestCase):
     """
     Unit tests for event service communicator manager.
@@ -10,6 +10,7 @@
 import json
 import logging
 import os
+import select
 import subprocess
 import sys
 import threading
@@ -22,7 +23,7 @@ except Exception:
 
 from pilot.eventservice.esprocess.eshook import ESHook
 from pilot.eventservice.esprocess.esmanager import ESManager
-from pilot.eventservice.esprocess.esmessage import MessageThread
+from pilot.eventservice.esprocess.esmessage import MessageThread, SocketMessageThread, SocketMessageClient
 from pilot.eventservice.esprocess.esprocess import ESProcess
 
 if sys.version_info < (2, 7):
@@ -148,6 +149,71 @@ class TestESMessageThread(unittest.TestCase):
         self.assertFalse(msg_thread.is_alive())
 
 
+class TestESSocketMessageThread(unittest.TestCase):
+    """
+    Unit tests for the Unix socket message transport.
+    """
+
+    def test_socket_msg_thread(self):
+        """
+        Messages are received without polling and replies go to the requesting connection.
+        """
+
+        _queue = queue.Queue()
+        msg_thread = SocketMessageThread(_queue)
+        msg_thread.start()
+
+        client1 = SocketMessageClient(msg_thread.get_yampl_socket_name())
+        client2 = SocketMessageClient(msg_thread.get_yampl_socket_name())
+        try:
+            client1.send('Ready for events')
+            self.assertEqual(_queue.get(timeout=5), 'Ready for events')
+            client2.send('Ready for events')
+            client2.send('/tmp/out.pool.root,ID:1-1,CPU:1,WALL:1')
+            self.assertEqual(_queue.get(timeout=5), 'Ready for events')
+            self.assertEqual(_queue.get(timeout=5), '/tmp/out.pool.root,ID:1-1,CPU:1,WALL:1')
+
+            msg_thread.send('range 1')
+            msg_thread.send('range 2')
+            self.assertEqual(client1.recv(timeout=5), 'range 1')
+            self.assertEqual(client2.recv(timeout=5), 'range 2')
+
+            # not requested: sent to all connections
+            msg_thread.send('No more events')
+            self.assertEqual(client1.recv(timeout=5), 'No more events')
+            self.assertEqual(client2.recv(timeout=5), 'No more events')
+        finally:
+            client1.close()
+            client2.close()
+            msg_thread.stop()
+            msg_thread.join(5)
+
+        self.assertFalse(msg_thread.is_alive())
+        self.assertFalse(os.path.exists(msg_thread.get_yampl_socket_name()))
+
+    def test_stop_after_terminate(self):
+        """
+        Stopping a terminated message thread does not write to its closed (and maybe reused) wakeup pipe.
+        """
+
+        msg_thread = SocketMessageThread(queue.Queue())
+        wakeup_w = msg_thread._SocketMessageThread__wakeup_w
+        msg_thread.terminate()
+
+        # the descriptor of the closed wakeup pipe is reused
+        fd_r, fd_w = os.pipe()
+        os.dup2(fd_w, wakeup_w)
+        os.close(fd_w)
+        fd_w = wakeup_w
+        try:
+            msg_thread.stop()
+            self.assertTrue(msg_thread.is_stopped())
+            self.assertEqual(select.select([fd_r], [], [], 0.1)[0], [])
+        finally:
+            os.close(fd_r)
+            os.close(fd_w)
+
+
 @unittest.skipIf(not check_env(), "No CVMFS")
 class TestESProcess(unittest.TestCase):
     """
@@ -196,6 +262,60 @@ class TestESProcess(unittest.TestCase):
         self.assertEqual(ret['id'], '130-2068634812-21368-1-4')
 
 
+class TestESProcessPrefetcher(unittest.TestCase):
+    """
+    Unit tests for the event range prefetcher of the event service process.
+    """
+
+    def setUp(self):
+        self.requests = []
+        self.available = 100
+        self.process = ESProcess({'executable': 'echo'})
+        self.process.corecount = 2
+        self.process.set_get_event_ranges_hook(self.get_event_ranges)
+
+    def get_event_ranges(self, num_ranges):
+        time.sleep(0.1)
+        self.requests.append(num_ranges)
+        num_ranges = min(num_ranges, self.available)
+        self.available -= num_ranges
+        return [{'eventRangeID': '%s' % (self.available + i)} for i in range(num_ranges)]
+
+    def test_prefetch(self):
+        """
+        Make sure that the cache is filled in the background and all event ranges are delivered.
+        """
+
+        self.process.start_prefetcher()
+        time.sleep(0.5)
+        self.assertTrue(len(self.process.event_ranges_cache) >= self.process.get_low_water_mark())
+
+        event_ranges = []
+        while True:
+            event_range = self.process.get_event_range_to_payload()
+            if not event_range:
+                break
+            event_ranges.append(event_range['eventRangeID'])
+        self.assertEqual(len(set(event_ranges)), 100)
+
+    def test_adaptive_batch_size(self):
+        """
+        Make sure that the batch size grows for short event ranges and is limited by the max prefetch factor.
+        """
+
+        self.assertEqual(self.process.get_prefetch_size(), 4)
+
+        self.process.start_prefetcher()
+        time.sleep(0.5)
+        self.process.update_range_time('0.01')
+        self.assertEqual(self.process.get_low_water_mark(), 2 * self.process.max_prefetch_factor)
+        self.process.event_ranges_cache = []
+        self.assertEqual(self.process.get_prefetch_size(), 2 * self.process.max_prefetch_factor)
+
+        self.process.update_range_time(1000)
+        self.assertTrue(self.process.get_low_water_mark() < 2 * self.process.max_prefetch_factor)
+
+
 class TestEventService(unittest.TestCase):
     """
     Unit tests for event service functions.
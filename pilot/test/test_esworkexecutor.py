@@ -7,6 +7,7 @@
 # - Wen Guan, wen.guan@cern.ch, 2017-2018
 # - Paul Nilsson, paul.nilsson@cern.ch, 2019
 
+import json
 import logging
 import os
 import sys
@@ -16,6 +17,7 @@ import traceback
 
 from pilot.api.es_data import StageInESClient
 from pilot.eventservice.communicationmanager.communicationmanager import CommunicationManager
+from pilot.eventservice.workexecutor.eventupdater import EventRangeUpdater
 from pilot.eventservice.workexecutor.workexecutor import WorkExecutor
 from pilot.control.job import create_job
 from pilot.util.https import https_setup
@@ -41,6 +43,93 @@ def check_env():
     return os.path.exists('/cvmfs/atlas.cern.ch/repo/')
 
 
+class TestEventRangeUpdater(unittest.TestCase):
+    """
+    Unit tests for the aggregation of event range status updates.
+    """
+
+    def setUp(self):
+        self.messages = []
+        self.fail = False
+
+    def update_events(self, message):
+        self.messages.append(message)
+        if self.fail:
+            return None
+        return {'StatusCode': 0}
+
+    def get_updated_ranges(self):
+        ranges = []
+        for message in self.messages:
+            for update in json.loads(message['eventRanges']):
+                if message['version'] == 1:
+                    ranges.extend(event_range['eventRangeID'] for event_range in update['eventRanges'])
+                else:
+                    ranges.append(update['eventRangeID'])
+        return ranges
+
+    def test_bulk_update(self):
+        """
+        Make sure that the updates are sent in bulk once the size threshold is reached.
+        """
+
+        updater = EventRangeUpdater(self.update_events, max_ranges=10, max_delay=3600)
+        for i in range(9):
+            updater.add_failed([{'eventRangeID': 'failed-%s' % i, 'eventStatus': 'failed', 'errorCode': 1}])
+            self.assertTrue(not updater.flush())
+        self.assertEqual(self.messages, [])
+
+        updater.add_finished({'zipFile': {'lfn': 'test.tar'}, 'eventRanges': [{'eventRangeID': 'finished-0', 'eventStatus': 'finished'}]})
+        self.assertTrue(updater.flush())
+        self.assertEqual(len(self.messages), 2)
+        self.assertEqual(sorted(self.get_updated_ranges()), ['failed-%s' % i for i in range(9)] + ['finished-0'])
+
+    def test_retry(self):
+        """
+        Make sure that the updates failed to be sent are retried without duplicates.
+        """
+
+        updater = EventRangeUpdater(self.update_events, max_ranges=2, max_delay=0)
+        self.fail = True
+        updater.add_failed([{'eventRangeID': '1', 'eventStatus': 'failed', 'errorCode': 1}])
+        self.assertFalse(updater.flush())
+        updater.add_failed([{'eventRangeID': '2', 'eventStatus': 'failed', 'errorCode': 1}])
+
+        self.fail = False
+        self.messages = []
+        self.assertTrue(updater.close(sleep_time=0))
+        self.assertEqual(self.get_updated_ranges(), ['1', '2'])
+        self.assertTrue(updater.flush(force=True))
+        self.assertEqual(len(self.messages), 1)
+
+    def test_retry_delay(self):
+        """
+        Make sure that the delay between the attempts to send failed updates doubles up to max_delay.
+        """
+
+        updater = EventRangeUpdater(self.update_events, max_ranges=1, max_delay=20, retry_delay=5)
+        self.fail = True
+        updater.add_failed([{'eventRangeID': '1', 'eventStatus': 'failed', 'errorCode': 1}])
+        for delay in [5, 10, 20, 20]:
+            self.assertFalse(updater.flush())
+            self.assertEqual(updater.delay, delay)
+            self.assertFalse(updater.is_due())
+            updater.next_attempt = time.time()  # the retry delay has passed
+        self.assertEqual(len(self.messages), 4)
+
+        # no update is sent before the retry delay has passed
+        updater.next_attempt = time.time() + 3600
+        self.assertFalse(updater.flush())
+        self.assertFalse(updater.flush())
+        self.assertEqual(len(self.messages), 4)
+
+        self.fail = False
+        self.assertTrue(updater.flush(force=True))
+        self.assertEqual(updater.delay, 0)
+        self.assertEqual(updater.next_attempt, None)
+        self.assertEqual(len(self.messages), 5)
+
+
 @unittest.skipIf(not check_env(), "No CVMFS")
 class TestESWorkExecutorGrid(unittest.TestCase):
     """
@@ -15,6 +15,7 @@ import unittest
 import uuid
 
 from pilot.api import data
+from pilot.util.harvester import get_max_concurrent_jobs, partition_resources, get_worker_attributes_file
 
 
 def check_env():
@@ -443,3 +444,53 @@ class TestHarvesterStageOut(unittest.TestCase):
 
         for file in result:
             self.assertEqual(file['errno'], 0)
+
+
+class TestHarvesterMultiJob(unittest.TestCase):
+    """
+    Tests for the Harvester multi-job mode.
+    """
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+        class Args(object):
+            harvester = True
+            harvester_maxjobs = 4
+            harvester_workdir = self.workdir
+        self.args = Args()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_partition_resources(self):
+        """
+        The cores of the node are shared between the jobs that run at the same time.
+        """
+
+        jobs = partition_resources([{'PandaID': '1'}, {'PandaID': '2', 'coreCount': '2'}], 8, 4)
+        self.assertEqual([job['coreCount'] for job in jobs], [1, 2])
+
+        jobs = partition_resources([{'PandaID': str(i), 'coreCount': 4} for i in range(4)], 8, 4)
+        self.assertEqual([job['coreCount'] for job in jobs], [2, 2, 2, 2])
+
+        # only two jobs run at the same time
+        jobs = partition_resources([{'PandaID': str(i), 'coreCount': 4} for i in range(4)], 8, 2)
+        self.assertEqual([job['coreCount'] for job in jobs], [4, 4, 4, 4])
+
+        jobs = partition_resources([{'PandaID': '1', 'coreCount': 8}, {'PandaID': '2', 'coreCount': 4},
+                                    {'PandaID': '3', 'coreCount': 2}], 8, 2)
+        self.assertEqual([job['coreCount'] for job in jobs], [5, 2, 1])
+
+    def test_access_point(self):
+        """
+        Each job has its own worker attributes file in multi-job mode.
+        """
+
+        self.assertEqual(get_max_concurrent_jobs(self.args), 4)
+        path = get_worker_attributes_file(self.args, '1234')
+        self.assertEqual(os.path.dirname(path), os.path.join(self.workdir, '1234'))
+        self.assertTrue(os.path.isdir(os.path.dirname(path)))
+
+        self.args.harvester_maxjobs = 1
+        self.assertEqual(os.path.dirname(get_worker_attributes_file(self.args, '1234')), self.workdir)
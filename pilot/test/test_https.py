@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
+
+import unittest
+import errno
+import socket
+import ssl
+import threading
+
+from pilot.util import https
+from pilot.util.https import is_stale_connection_error, httplib, HTTPSConnectionPool
+
+
+class PlainConnectionPool(HTTPSConnectionPool):
+    """
+    Connection pool using plain HTTP connections (the test server does not speak TLS).
+    """
+
+    def get_connection(self, host, port):
+        return httplib.HTTPConnection(host, port, timeout=self.timeout), False
+
+
+class SilentServer(threading.Thread):
+    """
+    Server that reads a request including its body and never answers.
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        self.received = b''
+        self.done = threading.Event()
+
+    def run(self):
+        conn = self.server.accept()[0]
+        while b'\r\n\r\n' not in self.received or not self.received.endswith(b'data=1'):
+            data = conn.recv(65536)
+            if not data:
+                break
+            self.received += data
+        self.done.wait(10)
+        conn.close()
+        self.server.close()
+
+
+class TestConnectionPool(unittest.TestCase):
+    """
+    Unit tests for the pooled HTTPS connections.
+    """
+
+    def test_stale_connection_error(self):
+        """
+        Only errors showing that the server closed an idle connection are retried, never timeouts.
+        """
+
+        self.assertTrue(is_stale_connection_error(httplib.BadStatusLine('')))
+        self.assertTrue(is_stale_connection_error(socket.error(errno.ECONNRESET, 'Connection reset by peer')))
+        self.assertTrue(is_stale_connection_error(socket.error(errno.EPIPE, 'Broken pipe')))
+        self.assertFalse(is_stale_connection_error(socket.timeout('timed out')))
+        self.assertFalse(is_stale_connection_error(socket.error(errno.ECONNREFUSED, 'Connection refused')))
+
+
+class TestRequest(unittest.TestCase):
+    """
+    Unit tests for the fallback from in-process requests to curl.
+    """
+
+    def setUp(self):
+        self.ctx = (https._ctx.ssl_context, https._ctx.user_agent)
+        self.send_with_curl = https.send_with_curl
+        self.curl_requests = []
+        https._ctx.ssl_context = ssl.create_default_context()
+        https._ctx.user_agent = 'pilot-test'
+        https.send_with_curl = self.curl
+
+    def tearDown(self):
+        https._ctx.ssl_context, https._ctx.user_agent = self.ctx
+        https.send_with_curl = self.send_with_curl
+        https.reset_connection_pool()
+
+    def curl(self, url, data, plain):
+        self.curl_requests.append(url)
+        return {'StatusCode': '0'}
+
+    def test_timeout_after_sent_request(self):
+        """
+        A request that timed out after it was sent is not sent again with curl.
+        """
+
+        server = SilentServer()
+        server.start()
+        https._pool = PlainConnectionPool(https._ctx.ssl_context, timeout=1)
+        try:
+            ret = https.request('https://127.0.0.1:%d/server/panda/updateJob' % server.port, {'data': 1})
+        finally:
+            server.done.set()
+        self.assertIsNone(ret)
+        self.assertTrue(server.received.endswith(b'data=1'))
+        self.assertEqual(self.curl_requests, [])
+
+    def test_connection_failure(self):
+        """
+        A request that could not be sent since the connection failed is sent with curl.
+        """
+
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        port = server.getsockname()[1]
+        server.close()  # nothing listens on the port
+        https._pool = PlainConnectionPool(https._ctx.ssl_context, timeout=1)
+        url = 'https://127.0.0.1:%d/server/panda/updateJob' % port
+        ret = https.request(url, {'data': 1})
+        self.assertEqual(ret, {'StatusCode': '0'})
+        self.assertEqual(self.curl_requests, [url])
+
+
+if __name__ == '__main__':
+    unittest.main()
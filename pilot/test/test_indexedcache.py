@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
+
+import unittest
+import json
+import os
+import shutil
+import tempfile
+
+from pilot.info.dataloader import DataLoader
+from pilot.info.indexedcache import IndexedCache
+from pilot.info.queuedata import QueueData
+
+
+class TestIndexedCache(unittest.TestCase):
+    """
+    Unit tests for the indexed cache of the schedconfig/ddmendpoints data.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmpdir, 'agis_schedconf.json')
+        self.data = {'QUEUE_%d' % i: {'nickname': 'QUEUE_%d' % i, 'maxwdir': 1000 + i, 'catchall': '',
+                                      'description': 'x' * 100} for i in range(100)}
+        self.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, data):
+        with open(self.source, 'w') as f:
+            json.dump(data, f)
+
+    def test_build_and_get(self):
+        """
+        Only the requested entries and fields are loaded from the index.
+        """
+
+        cache = IndexedCache(self.source, ['nickname', 'maxwdir'])
+        self.assertIsNone(cache.get(['QUEUE_1']))
+        self.assertTrue(cache.build(self.data))
+
+        self.assertEqual(cache.get(['QUEUE_1', 'QUEUE_99', 'UNKNOWN']),
+                         {'QUEUE_1': {'nickname': 'QUEUE_1', 'maxwdir': 1001},
+                          'QUEUE_99': {'nickname': 'QUEUE_99', 'maxwdir': 1099}})
+        self.assertEqual(len(cache.get()), 100)
+
+        # index built for other fields is not valid
+        self.assertIsNone(IndexedCache(self.source, ['nickname']).get(['QUEUE_1']))
+
+    def test_outdated(self):
+        """
+        The index is not used once the source file is updated.
+        """
+
+        cache = IndexedCache(self.source, ['nickname'])
+        cache.build(self.data)
+
+        self.data['NEW_QUEUE'] = {'nickname': 'NEW_QUEUE'}
+        self.write(self.data)
+        self.assertIsNone(cache.get(['NEW_QUEUE']))
+
+    def test_load_data(self):
+        """
+        DataLoader creates the index for the cache file and reads from it afterwards.
+        """
+
+        fname = os.path.join(self.tmpdir, 'agis_schedconf.cache.json')
+        sources = {'LOCAL': {'url': self.source, 'nretry': 1, 'fname': fname}}
+        fields = QueueData.get_ext_keys()
+
+        data = DataLoader.load_data(sources, ['LOCAL'], names=['QUEUE_5'], fields=fields)
+        self.assertEqual(data, {'QUEUE_5': {'nickname': 'QUEUE_5', 'maxwdir': 1005, 'catchall': ''}})
+        self.assertTrue(os.path.exists(fname + '.idx'))
+
+        # the source is not parsed again while unchanged
+        os.remove(fname)
+        data = DataLoader.load_data(sources, ['LOCAL'], names=['QUEUE_7'], fields=fields)
+        self.assertEqual(data, {'QUEUE_7': {'nickname': 'QUEUE_7', 'maxwdir': 1007, 'catchall': ''}})
+        self.assertFalse(os.path.exists(fname))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
+
+import unittest
+
+from pilot.control.job import monitor_jobs
+from pilot.info.jobdata import JobData
+from pilot.util import monitoring
+
+
+class Args(object):
+    verify_proxy = False
+
+
+class TestJobMonitor(unittest.TestCase):
+    """
+    Unit tests for the monitoring of the jobs processed at the same time in multi-job mode.
+    """
+
+    def setUp(self):
+        self.checked = []
+        self.functions = {}
+        for name in ('check_payload_stdout', 'check_local_space', 'check_work_dir', 'check_output_file_sizes'):
+            self.functions[name] = getattr(monitoring, name)
+            setattr(monitoring, name, self.check)
+        monitoring.check_payload_stdout = self.check_payload_stdout
+
+    def tearDown(self):
+        for name, function in self.functions.items():
+            setattr(monitoring, name, function)
+
+    def check(self, *args):
+        return 0, ""
+
+    def check_payload_stdout(self, job):
+        self.checked.append(job.jobid)
+        return 0, ""
+
+    def test_monitor_jobs(self):
+        """
+        The disk space of all jobs is verified in the same time interval.
+        """
+
+        jobs = [JobData({'PandaID': str(i)}) for i in range(1, 3)]
+        for job in jobs:
+            job.state = 'starting'
+        monitoring_times = {}
+        update_times = {}
+
+        monitor_jobs(jobs, monitoring_times, update_times, None, None, Args())
+        self.assertEqual(self.checked, [])
+        self.assertEqual(sorted(monitoring_times), ['1', '2'])
+
+        # the disk space verification time has passed for both jobs
+        for mt in monitoring_times.values():
+            mt.update('ct_diskspace', modtime=mt.get('ct_diskspace') - 3600)
+        monitor_jobs(jobs, monitoring_times, update_times, None, None, Args())
+        self.assertEqual(self.checked, ['1', '2'])
+
+        # the monitoring times of a job that is no longer monitored are removed
+        monitor_jobs(jobs[1:], monitoring_times, update_times, None, None, Args())
+        self.assertEqual(list(monitoring_times), ['2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
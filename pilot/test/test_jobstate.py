@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
+
+import os
+import unittest
+from collections import namedtuple
+
+try:
+    import Queue as queue  # Python 2
+except Exception:
+    import queue  # Python 3
+
+from pilot.control.job import get_completed_job
+from pilot.info.jobdata import JobData
+from pilot.util.auxiliary import get_pilot_state, set_pilot_state, is_pilot_state, set_server_update, unregister_job, \
+    release_prefetched_job, check_for_final_server_update
+from pilot.util.constants import SERVER_UPDATE_NOT_DONE, SERVER_UPDATE_RUNNING, SERVER_UPDATE_UPDATING, SERVER_UPDATE_FINAL
+
+
+class TestJobState(unittest.TestCase):
+    """
+    Unit tests for the pilot and server update states of jobs prefetched in job pipelining mode and of jobs
+    processed at the same time in multi-job mode.
+    """
+
+    def setUp(self):
+        self.environ = dict((key, os.environ.get(key)) for key in ('PILOT_JOB_STATE', 'SERVER_UPDATE'))
+        self.jobs = [JobData({'PandaID': str(i)}) for i in range(1, 3)]
+
+    def tearDown(self):
+        for job in self.jobs:
+            unregister_job(job)
+        for key, value in self.environ.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+    def test_prefetched_job(self):
+        """
+        The state of a prefetched job is kept in the job object until the previous job has completed.
+        """
+
+        job, prefetched_job = self.jobs
+        set_pilot_state(job=job, state='stageout')
+        set_server_update(job=job, state=SERVER_UPDATE_UPDATING)
+
+        prefetched_job.prefetched = True
+        set_pilot_state(job=prefetched_job, state='stagein')
+        set_server_update(job=prefetched_job, state=SERVER_UPDATE_RUNNING)
+        self.assertEqual(get_pilot_state(), 'stageout')
+        self.assertEqual(get_pilot_state(job=prefetched_job), 'stagein')
+        self.assertEqual(os.environ['SERVER_UPDATE'], SERVER_UPDATE_UPDATING)
+        self.assertEqual(prefetched_job.serverupdate, SERVER_UPDATE_RUNNING)
+
+        set_server_update(job=job, state=SERVER_UPDATE_FINAL)
+        check_for_final_server_update(True)  # returns at once since the final update of the previous job is done
+        unregister_job(job)
+
+        release_prefetched_job(prefetched_job)
+        self.assertFalse(prefetched_job.prefetched)
+        self.assertEqual(get_pilot_state(), 'stagein')
+        self.assertEqual(os.environ['SERVER_UPDATE'], SERVER_UPDATE_RUNNING)
+
+    def test_multijob(self):
+        """
+        The server update and pilot states of the jobs processed at the same time do not overwrite each other.
+        """
+
+        job1, job2 = self.jobs
+        set_pilot_state(job=job1, state='stagein')
+        set_server_update(job=job1, state=SERVER_UPDATE_RUNNING)
+        set_pilot_state(job=job2, state='running')
+        set_server_update(job=job2, state=SERVER_UPDATE_RUNNING)
+        self.assertTrue(is_pilot_state('stagein'))
+        self.assertTrue(is_pilot_state('running'))
+
+        # the final update of the first job is done while the second job is still running
+        set_server_update(job=job1, state=SERVER_UPDATE_UPDATING)
+        self.assertEqual(os.environ['SERVER_UPDATE'], SERVER_UPDATE_UPDATING)
+        set_server_update(job=job1, state=SERVER_UPDATE_FINAL)
+        self.assertEqual(os.environ['SERVER_UPDATE'], SERVER_UPDATE_RUNNING)
+        unregister_job(job1)
+        self.assertFalse(is_pilot_state('stagein'))
+
+        # a new job is not started while a job is being processed
+        set_server_update(state=SERVER_UPDATE_NOT_DONE)
+        self.assertEqual(os.environ['SERVER_UPDATE'], SERVER_UPDATE_RUNNING)
+        set_server_update(job=job2, state=SERVER_UPDATE_FINAL)
+        self.assertEqual(os.environ['SERVER_UPDATE'], SERVER_UPDATE_FINAL)
+        unregister_job(job2)
+        set_server_update(state=SERVER_UPDATE_NOT_DONE)
+        self.assertEqual(os.environ['SERVER_UPDATE'], SERVER_UPDATE_NOT_DONE)
+
+    def test_completed_prefetched_job(self):
+        """
+        A prefetched job that completes before the previous job is not counted as the completion of the previous job.
+        """
+
+        job, prefetched_job = self.jobs
+        queues = namedtuple('queues', ['completed_jobs'])
+        queues.completed_jobs = queue.Queue()
+        queues.completed_jobs.put(prefetched_job)  # e.g. failed stage-in
+
+        held_jobs = []
+        self.assertIsNone(get_completed_job(queues, [job], held_jobs))
+        self.assertEqual(held_jobs, [prefetched_job])
+
+        queues.completed_jobs.put(job)
+        self.assertIs(get_completed_job(queues, [job], held_jobs), job)
+
+
+if __name__ == '__main__':
+    unittest.main()
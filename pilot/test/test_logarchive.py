@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
+
+import unittest
+import gzip
+import io
+import os
+import random
+import shutil
+import subprocess
+import tarfile
+import tempfile
+
+from pilot.util.logarchive import ParallelGzipWriter, create_log_archive
+
+
+class TestLogArchive(unittest.TestCase):
+    """
+    Unit tests for the native log archiver.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.workdir = os.path.join(self.tmpdir, 'PanDA_Pilot-1')
+        os.makedirs(os.path.join(self.workdir, 'athenaMP-workers-1', 'worker_0'))
+        os.makedirs(os.path.join(self.workdir, 'python', 'lib'))
+        self.write('payload.stdout', b'some output line\n' * 10000)
+        self.write('random.dat', bytearray(random.getrandbits(8) for _ in range(300000)))
+        self.write('athenaMP-workers-1/worker_0/AthenaMP.log', b'worker log\n')
+        self.write('athenaMP-workers-1/worker_0/tmp.HITS.pool.root', b'hits')
+        self.write('python/lib/module.py', b'pass\n')
+        self.write('jobReport.json', b'{}')
+        self.write('setup.py', b'pass\n')
+        os.symlink(os.path.join(self.workdir, 'payload.stdout'), os.path.join(self.workdir, 'link.stdout'))
+        os.symlink(os.path.join(self.tmpdir, 'missing'), os.path.join(self.workdir, 'broken'))
+        self.path = os.path.join(self.workdir, 'log.tgz')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, data):
+        with open(os.path.join(self.workdir, name), 'wb') as f:
+            f.write(data)
+
+    def read_archive(self):
+        with tarfile.open(self.path, 'r:gz') as archive:
+            return dict((member.name, archive.extractfile(member).read() if member.isfile() else None) for member in archive)
+
+    def test_gzip_writer(self):
+        """
+        The blocks compressed by the threads form a valid gzip stream.
+        """
+
+        data = b''.join(os.urandom(1000) + b'x' * 5000 for _ in range(50))
+        output = io.BytesIO()
+        writer = ParallelGzipWriter(output, nthreads=3, blocksize=10000)
+        for i in range(0, len(data), 777):
+            writer.write(data[i:i + 777])
+        writer.close()
+
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(output.getvalue())).read(), data)
+        self.assertEqual(writer.bytes_in, len(data))
+        self.assertEqual(writer.bytes_out, len(output.getvalue()))
+        self.assertTrue(writer.nblocks > 10)
+
+        output = io.BytesIO()
+        ParallelGzipWriter(output).close()
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(output.getvalue())).read(), b'')
+
+    def test_archive(self):
+        """
+        The tarball contains the dereferenced files but not the broken links and itself, and can be read by tar.
+        """
+
+        stats = create_log_archive(self.path, self.workdir, arcname='tarball_PandaJob_1', nthreads=3, blocksize=65536)
+        members = self.read_archive()
+        self.assertEqual(members['tarball_PandaJob_1/link.stdout'], b'some output line\n' * 10000)
+        self.assertEqual(len(members['tarball_PandaJob_1/random.dat']), 300000)
+        self.assertTrue('tarball_PandaJob_1/athenaMP-workers-1/worker_0/AthenaMP.log' in members)
+        self.assertFalse('tarball_PandaJob_1/broken' in members)
+        self.assertFalse('tarball_PandaJob_1/log.tgz' in members)
+        self.assertEqual(stats['files'], 8)
+        self.assertEqual(stats['bytes_out'], os.path.getsize(self.path))
+
+        ret = subprocess.call(['tar', 'tzf', self.path], stdout=open(os.devnull, 'w'))
+        self.assertEqual(ret, 0)
+
+    def test_exclude_and_limits(self):
+        """
+        Excluded paths are left out, large files are truncated and the size limit stops the archiving.
+        """
+
+        def exclude(relpath, isdir):
+            return relpath == 'python' or relpath.endswith('.pool.root')
+
+        stats = create_log_archive(self.path, self.workdir, exclude=exclude, max_member_size=1000)
+        members = self.read_archive()
+        self.assertFalse([name for name in members if 'python' in name or name.endswith('pool.root')])
+        self.assertEqual(members['PanDA_Pilot-1/payload.stdout'], (b'some output line\n' * 10000)[:1000])
+        self.assertEqual(stats['excluded'], 2)
+        self.assertEqual(stats['truncated'], 3)
+
+        stats = create_log_archive(self.path, self.workdir, max_size=1, blocksize=1024)
+        self.assertTrue(stats['skipped'] > 0)
+        self.assertTrue(len(self.read_archive()) < 10)
+
+    def test_redundant_file_filter(self):
+        """
+        The ATLAS filter leaves out the files removed by remove_redundant_files().
+        """
+
+        from pilot.user.atlas.common import get_redundant_file_filter
+
+        exclude = get_redundant_file_filter(self.workdir)
+        create_log_archive(self.path, self.workdir, arcname='log', exclude=exclude)
+        self.assertEqual(sorted(name for name, data in self.read_archive().items() if data is not None),
+                         ['log/athenaMP-workers-1/worker_0/AthenaMP.log', 'log/jobReport.json', 'log/link.stdout',
+                          'log/payload.stdout', 'log/random.dat'])
+        self.assertTrue(exclude('workDir', True))
+        self.assertFalse(get_redundant_file_filter(self.workdir, islooping=True)('workDir', True))
+        self.assertTrue(exclude('core.1234', False))
+        self.assertTrue(exclude('lib/libfoo.a', False))
+
+    def test_redundant_file_removal(self):
+        """
+        The files left out by the ATLAS filter are the ones removed by remove_redundant_files().
+        """
+
+        from pilot.user.atlas import common
+
+        for name in ['workDir', 'singularity', 'src/sub', '.git', 'athenaMP-workers-2/.hidden', 'lib', 'log.dir']:
+            os.makedirs(os.path.join(self.workdir, name))
+        for name in ['core', 'core.1234', 'workDir/out.txt', 'singularity/image', 'src/sub/file.c', 'src/file.c',
+                     '.hidden.py', '.git/config', 'athenaMP-workers-2/.hidden/core.1', 'athenaMP-workers-2/x.HITS',
+                     'lib/libfoo.a', '.a', 'EventService_premerge_1.tar', 'runargs.py', 'log.dir/tmp.1', 'tmp.txt',
+                     'HITS.pool.root', 'fort.1', 'Fort.1']:
+            self.write(name, b'data')
+
+        def get_members(exclude=None):
+            create_log_archive(self.path, self.workdir, arcname='log', exclude=exclude)
+            return sorted(name for name, data in self.read_archive().items() if data is not None)
+
+        # the absolute paths of the internal list (e.g. /work) are not removed by the test
+        get_redundants = common.get_redundants
+        common.get_redundants = lambda: [_dir for _dir in get_redundants() if not _dir.startswith('/')]
+        try:
+            outputfiles = ['HITS.pool.root', 'x.HITS']
+            members = get_members(exclude=common.get_redundant_file_filter(self.workdir, outputfiles=outputfiles))
+            common.remove_redundant_files(self.workdir, outputfiles=outputfiles)
+        finally:
+            common.get_redundants = get_redundants
+        os.remove(self.path)
+
+        self.assertEqual(get_members(), members)
+        self.assertFalse(os.path.lexists(os.path.join(self.workdir, 'broken')))
+        for name in ['log/.hidden.py', 'log/.git/config', 'log/runargs.py', 'log/log.dir/tmp.1', 'log/HITS.pool.root',
+                     'log/Fort.1']:
+            self.assertTrue(name in members, name)
+        for name in ['log/core', 'log/src/file.c', 'log/workDir/out.txt', 'log/athenaMP-workers-2/x.HITS',
+                     'log/lib/libfoo.a', 'log/.a', 'log/fort.1', 'log/tmp.txt']:
+            self.assertFalse(name in members, name)
+
+
+if __name__ == '__main__':
+    unittest.main()
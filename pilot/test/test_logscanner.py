@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
+
+import unittest
+import os
+import shutil
+import tempfile
+
+from pilot.util.filehandling import LogScanner, grep, read_tail, tail
+
+
+class TestLogScanner(unittest.TestCase):
+    """
+    Unit tests for the single pass log scanner.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.stdout = os.path.join(self.tmpdir, 'payload.stdout')
+        self.stderr = os.path.join(self.tmpdir, 'payload.stderr')
+        lines = []
+        for i in range(2000):
+            lines.append('line %d: nothing to see here\n' % i)
+            if i % 500 == 7:
+                lines.append('AthAlgSeq.sysExecute() ERROR St9bad_alloc (%d)\n' % i)
+            if i == 1234:
+                lines.append('Error SQLiteStatement prepare 5 database is locked, std::bad_alloc\n')
+        with open(self.stdout, 'w') as f:
+            f.write(''.join(lines) + 'last line without newline')
+        with open(self.stderr, 'w') as f:
+            f.write('cp: No space left on device\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_scan(self):
+        """
+        Compare the scan results with grep, with blocks that split lines.
+
+        :return: (assertion).
+        """
+
+        scanner = LogScanner()
+        scanner.blocksize = 1000
+        scanner.add('out_of_memory', self.stdout, ["St9bad_alloc", "std::bad_alloc"])
+        scanner.add('nfssqlite_locking', self.stdout, ["prepare 5 database is locked", "Error SQLiteStatement"])
+        scanner.add('out_of_space', self.stderr, ["No space left on device"])
+        scanner.add('missing', os.path.join(self.tmpdir, 'missing'), ["anything"])
+        matches = scanner.scan()
+
+        self.assertEqual(matches.get('out_of_memory'), grep(["St9bad_alloc|std::bad_alloc"], self.stdout))
+        self.assertEqual(len(matches.get('out_of_memory')), 5)
+        self.assertEqual(len(scanner.get_lines('nfssqlite_locking')), 1)  # the line is in both categories
+        self.assertEqual(scanner.get_lines('out_of_space'), ['cp: No space left on device\n'])
+        self.assertEqual(scanner.get_lines('missing'), [])
+        self.assertEqual(scanner.get_tail(self.stdout), tail(self.stdout))
+
+    def test_tail(self):
+        """
+        Compare read_tail() with the posix tail command.
+
+        :return: (assertion).
+        """
+
+        for nlines in [1, 5, 20, 3000]:
+            self.assertEqual(read_tail(self.stdout, nlines=nlines, blocksize=100), tail(self.stdout, nlines=nlines))
+        self.assertEqual(read_tail(self.stderr, nlines=3), tail(self.stderr, nlines=3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
+
+import unittest
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from pilot.api.memorymonitor import MemoryMonitoring, get_memory_monitor, unregister_memory_monitor
+from pilot.util.filehandling import read_json, TableReader
+
+
+@unittest.skipIf(not os.path.exists('/proc/self/stat'), "No /proc file system")
+class TestMemoryMonitoring(unittest.TestCase):
+    """
+    Unit tests for the native memory monitor.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        # a payload with a child process, which allocates 50 MB and writes 1 MB
+        script = "import os, subprocess, sys, time\n" \
+                 "child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(5)'])\n" \
+                 "data = b'x' * 50 * 1024 * 1024\n" \
+                 "open(os.devnull, 'wb').write(data[:1024 * 1024])\n" \
+                 "time.sleep(5)\n"
+        self.proc = subprocess.Popen([sys.executable, '-c', script])
+        time.sleep(0.5)
+
+    def tearDown(self):
+        self.proc.kill()
+        self.proc.wait()
+        unregister_memory_monitor(self.tmpdir)
+        shutil.rmtree(self.tmpdir)
+
+    def test_sampling(self):
+        """
+        Make sure that the process tree is sampled, and that the output files and summary are in prmon format.
+
+        :return: (assertion).
+        """
+
+        monitor = MemoryMonitoring(pid=self.proc.pid, workdir=self.tmpdir, interval=0.2)
+        self.assertEqual(monitor.execute(), monitor)
+        self.assertEqual(monitor.poll(), None)
+        self.assertEqual(get_memory_monitor(self.tmpdir), monitor)
+        time.sleep(1)
+        monitor.stop()
+        self.assertEqual(monitor.poll(), 0)
+
+        results = monitor.get_results()
+        self.assertEqual(results['Max']['nprocs'], 2)
+        self.assertTrue(results['Max']['rss'] > 50 * 1024)
+        self.assertTrue(results['Max']['vmem'] >= results['Max']['rss'])
+        self.assertTrue(results['Max']['rchar'] > 0)
+        self.assertTrue(results['Max']['wchar'] >= 1024 * 1024)
+        self.assertTrue(0 < results['Avg']['rss'] <= results['Max']['rss'])
+
+        # the text output contains one row per sample, and the JSON summary the same results
+        reader = TableReader(monitor.get_filename())
+        reader.update()
+        table = reader.get_table()
+        self.assertEqual(sorted(table.keys()), sorted(monitor.columns))
+        self.assertEqual(len(table['Time']), monitor.nsamples)
+        self.assertEqual(max(table['rss']), results['Max']['rss'])
+        self.assertEqual(read_json(os.path.join(self.tmpdir, monitor.summary)), results)
+
+    def test_no_samples(self):
+        """
+        Make sure that there are no results before the first sample.
+
+        :return: (assertion).
+        """
+
+        monitor = MemoryMonitoring(pid=self.proc.pid, workdir=self.tmpdir)
+        self.assertEqual(monitor.get_results(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
+
+import unittest
+import os
+import subprocess
+import time
+
+from pilot.util.processes import ProcessTable, find_processes_in_group, get_number_of_child_processes
+
+
+class TestProcesses(unittest.TestCase):
+    """
+    Unit tests for the process table snapshot.
+    """
+
+    def setUp(self):
+        # skip tests if running on a Mac -- Macs don't have /proc
+        self.mac = False
+        if os.environ.get('MACOSX') == 'true' or not os.path.exists('/proc/self/stat'):
+            self.mac = True
+
+        # start a small process tree: bash -> (sleep, sleep)
+        self.proc = subprocess.Popen(['/bin/bash', '-c', 'sleep 30 & sleep 30 & wait'])
+        time.sleep(0.5)
+
+    def tearDown(self):
+        children = []
+        find_processes_in_group(children, self.proc.pid)
+        for pid in reversed(children):
+            try:
+                os.kill(pid, 9)
+            except OSError:
+                pass
+        self.proc.wait()
+
+    def test_descendants(self):
+        """
+        Make sure that the process tree is found, with the parent first.
+
+        :return: (assertion).
+        """
+
+        if self.mac:
+            return True
+
+        table = ProcessTable()
+        pids = table.get_descendants(self.proc.pid)
+
+        self.assertEqual(len(pids), 3)
+        self.assertEqual(pids[0], self.proc.pid)
+        self.assertEqual(get_number_of_child_processes(self.proc.pid, table=table), 3)
+
+        # the test process itself should be in the tree below the pilot (i.e. this) process
+        self.assertIn(self.proc.pid, table.get_descendants(os.getpid()))
+        self.assertEqual(table.get_descendants(0), [])
+
+    def test_tree_summary(self):
+        """
+        Verify the summed up resource usage of a process tree.
+
+        :return: (assertion).
+        """
+
+        if self.mac:
+            return True
+
+        table = ProcessTable()
+        summary = table.get_tree_summary(self.proc.pid)
+
+        self.assertEqual(summary.get('nprocs'), 3)
+        self.assertEqual(summary.get('threads'), 3)
+        self.assertTrue(summary.get('rss') > 0)
+        self.assertTrue(summary.get('cpu') >= 0.0)
+        self.assertEqual(table.get_rss(self.proc.pid), summary.get('rss'))
+
+    def test_parse_stat(self):
+        """
+        Make sure that a command name with spaces and parentheses is parsed correctly.
+
+        :return: (assertion).
+        """
+
+        if self.mac:
+            return True
+
+        table = ProcessTable()
+        path = os.path.join(os.path.dirname(__file__), 'stat_test')
+        fields = ['S', '1', '2'] + ['0'] * 8 + ['100', '200', '0', '0'] + ['20', '0', '4', '0', '1', '1000', '10']
+        fields += ['0'] * 14 + ['3']
+        with open(path, 'w') as fp:
+            fp.write('123 (a (b) c) ' + ' '.join(fields) + '\n')
+        try:
+            info = table.read_stat(path)
+        finally:
+            os.remove(path)
+
+        self.assertEqual(info.get('comm'), 'a (b) c')
+        self.assertEqual(info.get('ppid'), 1)
+        self.assertEqual(info.get('pgrp'), 2)
+        self.assertEqual(info.get('threads'), 4)
+        self.assertEqual(info.get('rss'), 10 * table.pagesize)
+        self.assertEqual(info.get('processor'), 3)
+        self.assertAlmostEqual(info.get('cpu'), 300.0 / table.hz)
+
+
+if __name__ == '__main__':
+    unittest.main()
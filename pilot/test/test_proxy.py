@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
+
+import unittest
+import binascii
+import calendar
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from pilot.common.errorcodes import ErrorCodes
+from pilot.util.proxy import get_proxy_info, VOMS_AC_OID
+
+errors = ErrorCodes()
+
+
+def der(tag, content):
+    """
+    DER encode an element.
+    """
+
+    if len(content) < 0x80:
+        length = bytearray([len(content)])
+    else:
+        length = bytearray([0x82, len(content) >> 8, len(content) & 0xff])
+
+    return bytes(bytearray([tag]) + length + bytearray(content))
+
+
+def get_voms_extension(notafter):
+    """
+    Return a VOMS extension value (SEQUENCE OF SEQUENCE OF AttributeCertificate) with one attribute certificate.
+    """
+
+    validity = der(0x30, der(0x18, time.strftime('%Y%m%d%H%M%SZ', time.gmtime(notafter - 3600 * 24)).encode('ascii')) +
+                   der(0x18, time.strftime('%Y%m%d%H%M%SZ', time.gmtime(notafter)).encode('ascii')))
+    acinfo = der(0x30, der(0x02, b'\x01') + der(0x30, b'') + der(0xa0, b'') + der(0x30, der(0x06, b'\x2a\x03')) +
+                 der(0x02, b'\x05') + validity + der(0x30, b''))
+    ac = der(0x30, acinfo + der(0x30, der(0x06, b'\x2a\x03')) + der(0x03, b'\x00'))
+
+    return der(0x30, der(0x30, ac))
+
+
+class TestProxy(unittest.TestCase):
+    """
+    Unit tests for the in-process proxy verification, with self-signed proxies generated by openssl.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.x509 = os.environ.get('X509_USER_PROXY')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        if self.x509 is None:
+            os.environ.pop('X509_USER_PROXY', None)
+        else:
+            os.environ['X509_USER_PROXY'] = self.x509
+
+    def create_proxy(self, name, days, vomsnotafter=None):
+        """
+        Create a self-signed proxy file (certificate followed by the key) valid for the given number of days.
+        """
+
+        path = os.path.join(self.tmpdir, name)
+        cmd = ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-subj', '/CN=pilot/CN=proxy', '-days', str(days),
+               '-keyout', path + '.key', '-out', path]
+        if vomsnotafter:
+            hexvalue = binascii.hexlify(get_voms_extension(vomsnotafter)).decode('ascii')
+            cmd += ['-addext', '%s=DER:%s' % (VOMS_AC_OID, hexvalue)]
+        try:
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError:
+            self.skipTest('openssl is not available')
+        stdout, stderr = process.communicate()
+        if process.returncode != 0:
+            self.skipTest('openssl failed: %s' % stderr)
+        with open(path + '.key', 'rb') as f:
+            key = f.read()
+        with open(path, 'ab') as f:
+            f.write(key)
+
+        return path
+
+    def test_proxy_info(self):
+        """
+        The validity of the certificate and of the VOMS attribute certificate are read from the proxy file.
+        """
+
+        vomsnotafter = int(time.time()) + 3600 * 12
+        path = self.create_proxy('x509up', 2, vomsnotafter=vomsnotafter)
+        info = get_proxy_info(path)
+        self.assertTrue(abs(info['notafter'] - (time.time() + 3600 * 48)) < 600)
+        self.assertEqual(info['vomsnotafter'], vomsnotafter)
+
+        path = self.create_proxy('x509up_novoms', 2)
+        self.assertEqual(get_proxy_info(path)['vomsnotafter'], None)
+
+        with open(os.path.join(self.tmpdir, 'invalid'), 'w') as f:
+            f.write('-----BEGIN CERTIFICATE-----\nAAAA\n-----END CERTIFICATE-----\n')
+        self.assertRaises(ValueError, get_proxy_info, os.path.join(self.tmpdir, 'invalid'))
+
+    def test_cache(self):
+        """
+        The proxy file is only parsed again when it has been replaced.
+        """
+
+        path = self.create_proxy('x509up', 1, vomsnotafter=int(time.time()) + 3600)
+        info = get_proxy_info(path)
+        self.assertTrue(get_proxy_info(path) is info)
+
+        os.rename(self.create_proxy('x509up_new', 3, vomsnotafter=int(time.time()) + 7200), path)
+        new_info = get_proxy_info(path)
+        self.assertFalse(new_info is info)
+        self.assertTrue(new_info['notafter'] > info['notafter'])
+
+    def test_verify_proxy(self):
+        """
+        The ATLAS proxy verification uses the parsed proxy file.
+        """
+
+        from pilot.user.atlas.proxy import verify_proxy
+
+        os.environ['X509_USER_PROXY'] = self.create_proxy('x509up', 2, vomsnotafter=int(time.time()) + 3600 * 30)
+        self.assertEqual(verify_proxy(limit=24), (0, ""))
+        self.assertEqual(verify_proxy(limit=36)[0], errors.NOVOMSPROXY)
+        self.assertEqual(verify_proxy(limit=72)[0], errors.NOPROXY)
+
+        os.environ['X509_USER_PROXY'] = self.create_proxy('x509up_novoms', 2)
+        self.assertEqual(verify_proxy(limit=1)[0], errors.NOVOMSPROXY)
+
+    def test_utctime(self):
+        """
+        UTCTime years before 50 are in the 21st century.
+        """
+
+        from pilot.util.proxy import convert_der_time
+
+        data = bytearray(b'491231235959Z')
+        self.assertEqual(convert_der_time(data, 0x17, 0, len(data)), calendar.timegm((2049, 12, 31, 23, 59, 59)))
+        data = bytearray(b'20991231235959.5Z')
+        self.assertEqual(convert_der_time(data, 0x18, 0, len(data)), calendar.timegm((2099, 12, 31, 23, 59, 59)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
+
+import unittest
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from pilot.util.tee import OutputTee, register_output_tee, get_output_tee, unregister_output_tees
+
+
+class TestOutputTee(unittest.TestCase):
+    """
+    Unit tests for the payload output tee.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'payload.stdout')
+        self.events = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def callback(self, tee, category, detail):
+        self.events.append((category, detail))
+
+    def run_payload(self, script, **kwargs):
+        """
+        Run a python script with its stdout going through a tee.
+
+        :param script: python code (string).
+        :return: OutputTee object.
+        """
+
+        out = open(self.filename, 'wb')
+        proc = subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.PIPE)
+        tee = OutputTee('stdout', out, callback=self.callback, **kwargs)
+        tee.start(proc.stdout)
+        proc.wait()
+        self.assertTrue(tee.join())
+        out.close()
+
+        return tee
+
+    def test_copy(self):
+        """
+        Make sure that the output is copied to the file and that the tail is kept in memory.
+
+        :return: (assertion).
+        """
+
+        tee = self.run_payload("import sys\nfor i in range(10000): sys.stdout.write('line %d\\n' % i)", ringsize=100)
+
+        with open(self.filename) as f:
+            data = f.read()
+        self.assertEqual(len(data.splitlines()), 10000)
+        self.assertEqual(tee.nbytes, len(data))
+        self.assertEqual(tee.get_tail(), data[-100:])
+        self.assertEqual(tee.get_tail(nbytes=10), data[-10:])
+        self.assertEqual(self.events, [])
+
+    def test_events(self):
+        """
+        Make sure that the size limit and the signatures are reported once per occurrence.
+
+        :return: (assertion).
+        """
+
+        script = "import sys\nfor i in range(1000): sys.stdout.write('line %d\\n' % i)\n" \
+                 "sys.stdout.write('terminate called after throwing an instance of std::bad_alloc\\n')\n" \
+                 "sys.stdout.write('x' * 100)"
+        signatures = [('out_of_memory', ["std::bad_alloc"]), ('no_newline', ["x{100}"])]
+        tee = self.run_payload(script, signatures=signatures, limit=1000)
+
+        self.assertEqual([category for category, _ in self.events], ['size', 'out_of_memory', 'no_newline'])
+        self.assertTrue(self.events[0][1] > 1000)
+        self.assertEqual(tee.get_matches('out_of_memory'),
+                         ['terminate called after throwing an instance of std::bad_alloc\n'])
+
+    def test_blocked_callback(self):
+        """
+        Make sure that the payload is not blocked while the signature search is blocked (e.g. in the callback).
+
+        :return: (assertion).
+        """
+
+        release = threading.Event()
+
+        def callback(tee, category, detail):
+            self.events.append((category, detail))
+            release.wait()
+
+        out = open(self.filename, 'wb')
+        script = "import sys\nfor i in range(100000): sys.stdout.write('std::bad_alloc %d\\n' % i)"
+        proc = subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.PIPE)
+        tee = OutputTee('stdout', out, signatures=[('out_of_memory', ["std::bad_alloc"])], callback=callback)
+        tee.max_pending = 65536
+        tee.start(proc.stdout)
+
+        t0 = time.time()
+        while proc.poll() is None and time.time() - t0 < 30:
+            time.sleep(0.1)
+        exit_code = proc.poll()
+        release.set()
+        self.assertEqual(exit_code, 0)
+        self.assertTrue(tee.join())
+        out.close()
+
+        with open(self.filename) as f:
+            self.assertEqual(len(f.read().splitlines()), 100000)
+        self.assertTrue(tee.unsearched > 0)
+        self.assertTrue(len(self.events) < 100000)
+
+    def test_registry(self):
+        """
+        Make sure that the tees can be found per job.
+
+        :return: (assertion).
+        """
+
+        tee = OutputTee('stdout', None)
+        register_output_tee(1234, tee)
+        self.assertEqual(get_output_tee('1234'), tee)
+        self.assertEqual(get_output_tee('1234', 'stderr'), None)
+        unregister_output_tees(1234)
+        self.assertEqual(get_output_tee('1234'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
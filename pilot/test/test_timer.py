@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
+
+import unittest
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from pilot.util.timer import timeout, TimeoutException
+
+
+def get_pid(delay=0):
+    time.sleep(delay)
+    return os.getpid()
+
+
+def get_state():
+    return os.getpid(), os.environ.get('PILOT_TEST_TIMER'), os.getcwd()
+
+
+def fail():
+    raise ValueError('failed')
+
+
+class TestTimer(unittest.TestCase):
+    """
+    Unit tests for the timeout decorator.
+    """
+
+    def test_process(self):
+        """
+        Make sure that the worker processes are reused, and replaced when killed at timeout.
+
+        :return: (assertion).
+        """
+
+        pid = timeout(10)(get_pid)()
+        self.assertNotEqual(pid, os.getpid())
+        self.assertEqual(timeout(10, mode='process')(get_pid)(), pid)
+
+        self.assertRaises(TimeoutException, timeout(1)(get_pid), delay=30)
+        self.assertRaises(ValueError, timeout(10)(fail))
+
+        _pid = timeout(10)(get_pid)()
+        self.assertNotEqual(_pid, pid)
+        try:
+            os.kill(pid, 0)
+            alive = True
+        except OSError:
+            alive = False
+        self.assertFalse(alive)
+
+    def test_state(self):
+        """
+        Make sure that the worker processes use the current environment and directory, and are replaced when the
+        logging has been re-established.
+
+        :return: (assertion).
+        """
+
+        tmpdir = os.path.realpath(tempfile.mkdtemp())
+        cwd = os.getcwd()
+        handler = logging.NullHandler()
+        try:
+            pid = timeout(10)(get_state)()[0]
+            os.environ['PILOT_TEST_TIMER'] = 'job2'
+            os.chdir(tmpdir)
+            self.assertEqual(timeout(10)(get_state)(), (pid, 'job2', tmpdir))
+
+            logging.getLogger().addHandler(handler)
+            self.assertNotEqual(timeout(10)(get_state)()[0], pid)
+        finally:
+            logging.getLogger().removeHandler(handler)
+            os.environ.pop('PILOT_TEST_TIMER', None)
+            os.chdir(cwd)
+            shutil.rmtree(tmpdir)
+
+    def test_local_function(self):
+        """
+        Make sure that functions that cannot be pickled are still executed (in a new process).
+
+        :return: (assertion).
+        """
+
+        @timeout(seconds=10)
+        def _get_pid():
+            return os.getpid()
+
+        self.assertNotEqual(_get_pid(), os.getpid())
+
+    def test_thread(self):
+        """
+        Verify the thread mode.
+
+        :return: (assertion).
+        """
+
+        self.assertEqual(timeout(10, mode='thread')(get_pid)(), os.getpid())
+        self.assertRaises(TimeoutException, timeout(0.5, mode='thread')(get_pid), delay=2)
+        self.assertRaises(ValueError, timeout(10, mode='thread')(fail))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
+
+import unittest
+
+from pilot.util.constants import PILOT_PRE_GETJOB, PILOT_POST_GETJOB, PILOT_PRE_STAGEIN, PILOT_POST_STAGEIN, \
+    PILOT_PREVIOUS_JOB_COMPLETED
+from pilot.util.timing import get_pipelining_time
+
+
+class Args(object):
+    def __init__(self, timing):
+        self.timing = timing
+
+
+class TestPipeliningTime(unittest.TestCase):
+    """
+    Unit tests for the idle time saved by job pipelining.
+    """
+
+    def test_no_pipelining(self):
+        """
+        Jobs which were not prefetched did not save any time.
+        """
+
+        args = Args({'1': {PILOT_PRE_GETJOB: 100, PILOT_POST_GETJOB: 110}})
+        self.assertEqual(get_pipelining_time('1', args), 0)
+        self.assertEqual(get_pipelining_time('2', args), 0)
+
+    def test_overlap(self):
+        """
+        Only the getjob and stage-in time before the completion of the previous job is saved.
+        """
+
+        args = Args({'1': {PILOT_PRE_GETJOB: 100, PILOT_POST_GETJOB: 110, PILOT_PRE_STAGEIN: 115, PILOT_POST_STAGEIN: 145,
+                           PILOT_PREVIOUS_JOB_COMPLETED: 130}})
+        self.assertEqual(get_pipelining_time('1', args), 10 + 15)
+
+        # stage-in waited for the previous job
+        args = Args({'1': {PILOT_PRE_GETJOB: 100, PILOT_POST_GETJOB: 110, PILOT_PRE_STAGEIN: 131, PILOT_POST_STAGEIN: 145,
+                           PILOT_PREVIOUS_JOB_COMPLETED: 130}})
+        self.assertEqual(get_pipelining_time('1', args), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
+
+import unittest
+import os
+import shutil
+import tempfile
+
+from pilot.util.tracereport import TraceDispatcher
+
+
+class DummyDispatcher(TraceDispatcher):
+    """
+    Trace dispatcher that records the posted batches instead of sending them.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(DummyDispatcher, self).__init__(*args, **kwargs)
+        self.online = True
+        self.batches = []
+
+    def post(self, traces):
+        if self.online:
+            self.batches.append(traces)
+        return self.online
+
+
+class TestTraceDispatcher(unittest.TestCase):
+    """
+    Unit tests for the trace dispatcher.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.spool = os.path.join(self.tmpdir, 'traces.spool')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_batching(self):
+        """
+        Make sure that queued traces are sent in batches, and that flush() sends everything.
+
+        :return: (assertion).
+        """
+
+        dispatcher = DummyDispatcher(url='https://localhost/traces/', spool=self.spool)
+        dispatcher.start()
+        for i in range(120):
+            dispatcher.put({'filename': 'file%d' % i})
+        dispatcher.stop()
+        self.assertFalse(dispatcher.thread.is_alive())
+
+        sent = [trace.get('filename') for batch in dispatcher.batches for trace in batch]
+        self.assertEqual(sorted(sent), sorted(['file%d' % i for i in range(120)]))
+        self.assertTrue(len(dispatcher.batches) >= 3)
+        self.assertTrue(max(len(batch) for batch in dispatcher.batches) <= dispatcher.batch_size)
+        self.assertFalse(os.path.exists(self.spool))
+
+    def test_spooling(self):
+        """
+        Make sure that traces are spooled when the server is unreachable, and resent when it is back.
+
+        :return: (assertion).
+        """
+
+        dispatcher = DummyDispatcher(url='https://localhost/traces/', spool=self.spool)
+        dispatcher.online = False
+        for i in range(5):
+            dispatcher.put({'filename': 'file%d' % i})
+        dispatcher.flush()
+
+        self.assertTrue(os.path.exists(self.spool))
+        self.assertEqual(len(dispatcher.read_spool()), 5)
+        self.assertEqual(dispatcher.batches, [])
+
+        # the spooled traces are sent together with the next batch
+        dispatcher.online = True
+        dispatcher.put({'filename': 'file5'})
+        dispatcher.flush()
+
+        self.assertEqual(len(dispatcher.batches), 1)
+        self.assertEqual([trace.get('filename') for trace in dispatcher.batches[0]], ['file%d' % i for i in range(6)])
+        self.assertFalse(os.path.exists(self.spool))
+
+    def test_full_queue(self):
+        """
+        Make sure that traces are spooled directly when the queue is full.
+
+        :return: (assertion).
+        """
+
+        dispatcher = DummyDispatcher(url='https://localhost/traces/', spool=self.spool, maxsize=2)
+        for i in range(4):
+            dispatcher.put({'filename': 'file%d' % i})
+
+        self.assertEqual(len(dispatcher.read_spool()), 2)
+        dispatcher.flush()
+        self.assertEqual(sum(len(batch) for batch in dispatcher.batches), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
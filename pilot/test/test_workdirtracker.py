@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
+
+import unittest
+import os
+import shutil
+import tempfile
+import time
+
+from pilot.util.workdirtracker import WorkdirTracker, get_workdir_tracker, stop_workdir_tracker
+
+
+class TestWorkdirTracker(unittest.TestCase):
+    """
+    Unit tests for the workdir activity tracker.
+    """
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.workdir, 'a', 'b'))
+        self.write('a/b/old.dat', 10000, mtime=time.time() - 3600)
+        self.write('log.txt', 100)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def write(self, name, size, mtime=None):
+        path = os.path.join(self.workdir, name)
+        with open(path, 'wb') as fp:
+            fp.write(b'x' * size)
+        if mtime:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def wait_for(self, tracker, condition):
+        """
+        Wait for the tracker to see the changes (in inotify mode they are handled in a separate thread).
+        """
+
+        for _ in range(50):
+            if condition():
+                return True
+            time.sleep(0.1)
+        return condition()
+
+    def du(self):
+        size = 0
+        for root, dirs, files in os.walk(self.workdir):
+            for name in dirs + files:
+                size += os.lstat(os.path.join(root, name)).st_blocks * 512
+        return size + os.lstat(self.workdir).st_blocks * 512
+
+    def verify(self, use_inotify):
+        tracker = WorkdirTracker(self.workdir, accept=lambda path: not path.endswith('.txt'), use_inotify=use_inotify)
+        tracker.start()
+        try:
+            mtime, path = tracker.get_last_touched()
+            self.assertIn(path, [os.path.join(self.workdir, 'a'), os.path.join(self.workdir, 'a', 'b')])  # not the log
+            self.assertEqual(tracker.get_size(), self.du())
+
+            # new files in new directories
+            os.makedirs(os.path.join(self.workdir, 'c', 'd'))
+            new = self.write('c/d/new.dat', 50000)
+            # (the new directories can have the same modification time as the new file)
+            touched = [new, os.path.dirname(new), os.path.dirname(os.path.dirname(new))]
+            self.assertTrue(self.wait_for(tracker, lambda: tracker.get_last_touched()[0] >= os.path.getmtime(new)))
+            self.assertIn(tracker.get_last_touched()[1], touched)
+            self.assertTrue(self.wait_for(tracker, lambda: tracker.get_size() == self.du()))
+
+            # removed directory tree
+            shutil.rmtree(os.path.join(self.workdir, 'a'))
+            self.assertTrue(self.wait_for(tracker, lambda: tracker.get_size() == self.du()))
+            self.assertTrue(tracker.get_last_touched()[0] >= os.path.getmtime(new))  # not lowered by the removal
+        finally:
+            tracker.stop()
+
+    def test_size_accounting(self):
+        """
+        Verify the per directory sizes, the peak size and the growth rate.
+
+        :return: (assertion).
+        """
+
+        tracker = WorkdirTracker(self.workdir, use_inotify=False)
+        tracker.start()
+        size = tracker.get_size()
+        self.assertEqual(tracker.get_size(os.path.join(self.workdir, 'a', 'b')),
+                         os.lstat(os.path.join(self.workdir, 'a', 'b')).st_blocks * 512 +
+                         os.lstat(os.path.join(self.workdir, 'a', 'b', 'old.dat')).st_blocks * 512)
+
+        # grow the work directory, then remove the new file again
+        path = self.write('a/new.dat', 1000000)
+        tracker.samples.append((tracker.samples[-1][0] + 10, tracker.get_size() - 10))  # pretend time has passed
+        self.assertTrue(tracker.get_size() > size)
+        self.assertTrue(tracker.get_growth_rate() > 0)
+        self.assertTrue(tracker.get_time_to_limit(size * 100) > 0)
+        os.remove(path)
+        tracker.refresh([path])
+        self.assertEqual(tracker.get_size(), self.du())
+        self.assertTrue(tracker.get_peak_size(reset=True) >= size + 1000000)
+        self.assertEqual(tracker.get_peak_size(), self.du())
+
+    def test_scan(self):
+        """
+        Verify the tracker with incremental scanning.
+
+        :return: (assertion).
+        """
+
+        self.verify(False)
+
+    def test_inotify(self):
+        """
+        Verify the tracker with inotify (falls back to scanning where inotify is not available).
+
+        :return: (assertion).
+        """
+
+        self.verify(True)
+
+    def test_stopped_tracker(self):
+        """
+        Verify that the work directory of a finished job is not tracked again.
+
+        :return: (assertion).
+        """
+
+        tracker = get_workdir_tracker(self.workdir)
+        self.assertTrue(get_workdir_tracker(self.workdir) is tracker)
+        stop_workdir_tracker(self.workdir)
+        self.assertEqual(get_workdir_tracker(self.workdir), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
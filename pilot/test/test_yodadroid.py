@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
+
+import unittest
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+from pilot.common.exception import MessageFailure
+from pilot.eventservice.droid import Droid
+from pilot.eventservice.transport import SocketTransport, AUTHKEY_ENV
+from pilot.eventservice.yoda import Yoda
+
+# payload processing the event ranges got through the Unix socket message transport of ESProcess
+PAYLOAD = '''
+import json
+import os
+from pilot.eventservice.esprocess.esmessage import SocketMessageClient
+
+client = SocketMessageClient(os.environ['PILOT_EVENTRANGECHANNEL'])
+while True:
+    client.send('Ready for events')
+    message = client.recv(timeout=60)
+    if not message or 'No more events' in message:
+        break
+    for event_range in json.loads(message):
+        client.send('%s,ID:%s,CPU:1,WALL:1' % (os.path.join(os.getcwd(), 'out'), event_range['eventRangeID']))
+client.close()
+'''
+
+
+class FakeProcess(threading.Thread):
+    """
+    Process processing the event ranges without a payload.
+    """
+
+    def __init__(self, payload):
+        threading.Thread.__init__(self)
+        self.payload = payload
+        self.get_event_ranges_hook = None
+        self.handle_out_message_hook = None
+
+    def set_get_event_ranges_hook(self, hook):
+        self.get_event_ranges_hook = hook
+
+    def set_handle_out_message_hook(self, hook):
+        self.handle_out_message_hook = hook
+
+    def stop(self):
+        pass
+
+    def poll(self):
+        return 0
+
+    def run(self):
+        while True:
+            event_ranges = self.get_event_ranges_hook(2)
+            if not event_ranges:
+                break
+            for event_range in event_ranges:
+                self.handle_out_message_hook({'id': event_range['eventRangeID'], 'status': 'finished',
+                                              'output': os.path.join(self.payload['workdir'], 'out'), 'wall': 1})
+
+
+class TestYodaDroid(unittest.TestCase):
+    """
+    Unit tests for the Yoda/Droid HPC event service engine.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.event_ranges = [{'eventRangeID': str(i)} for i in range(50)]
+        self.requests = []
+        self.messages = []
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def get_event_ranges(self, num_ranges):
+        self.requests.append(num_ranges)
+        ret, self.event_ranges = self.event_ranges[:num_ranges], self.event_ranges[num_ranges:]
+        return ret
+
+    def handle_out_message(self, message):
+        with self.lock:
+            self.messages.append(message)
+
+    def run_yoda_droids(self, yoda_transport, droid_transports, payload=None, process_class=FakeProcess):
+        yoda = Yoda(yoda_transport, payload=payload or {'executable': 'echo'}, get_event_ranges_hook=self.get_event_ranges,
+                    handle_out_message_hook=self.handle_out_message, batch_size=10, num_droids=len(droid_transports))
+        yoda.start()
+        droids = [Droid(transport(), num_slots=2, name='node%s' % i, workdir=self.tmpdir, report_size=3,
+                        process_class=process_class) for i, transport in enumerate(droid_transports)]
+        for droid in droids:
+            droid.start()
+        for droid in droids:
+            droid.join(30)
+        yoda.join(30)
+
+        self.assertFalse(yoda.is_alive())
+        self.assertEqual([droid.get_exit_code() for droid in droids], [0] * len(droids))
+        self.assertEqual(yoda.get_exit_code(), 0)
+        self.assertEqual(sorted(int(message['id']) for message in self.messages), list(range(50)))
+        self.assertEqual(yoda.stats, {'dispatched': 50, 'finished': 50, 'failed': 0})
+
+        return droids
+
+    def test_unix_socket(self):
+        """
+        Event ranges are fetched from the source in batches and processed once by the Droids.
+        """
+
+        address = os.path.join(self.tmpdir, 'yoda.socket')
+        self.run_yoda_droids(SocketTransport(address), [lambda: SocketTransport(address)] * 2)
+        self.assertTrue(all(num_ranges == 10 for num_ranges in self.requests))
+
+    def test_esprocess_slots(self):
+        """
+        Each ESProcess slot of a Droid talks to its payload through its own message channel.
+        """
+
+        from pilot.eventservice.esprocess.esprocess import ESProcess
+
+        script = os.path.join(self.tmpdir, 'payload.py')
+        with open(script, 'w') as f:
+            f.write(PAYLOAD)
+        pythonpath = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        payload = {'executable': 'echo $PILOT_EVENTRANGECHANNEL; PYTHONPATH=%s %s %s' % (pythonpath, sys.executable, script),
+                   'yampl': {'transport': 'socket'}}
+
+        address = os.path.join(self.tmpdir, 'yoda.socket')
+        droids = self.run_yoda_droids(SocketTransport(address), [lambda: SocketTransport(address)], payload=payload,
+                                      process_class=ESProcess)
+        socket_names = [process._ESProcess__payload['yampl']['socket_name'] for process in droids[0].processes]
+        self.assertEqual(len(set(socket_names)), 2)
+
+    def test_tcp_authkey(self):
+        """
+        A TCP socket requires an authentication key.
+        """
+
+        authkey = os.environ.pop(AUTHKEY_ENV, None)
+        try:
+            self.assertRaises(MessageFailure, SocketTransport, '127.0.0.1:0')
+            SocketTransport(os.path.join(self.tmpdir, 'yoda.socket'))  # not needed for Unix sockets
+
+            os.environ[AUTHKEY_ENV] = 'secret'
+            self.assertEqual(SocketTransport('127.0.0.1:0').authkey, b'secret')
+        finally:
+            if authkey is None:
+                os.environ.pop(AUTHKEY_ENV, None)
+            else:
+                os.environ[AUTHKEY_ENV] = authkey
+
+    def test_tcp_socket(self):
+        """
+        Droids on other nodes connect through a TCP socket.
+        """
+
+        transport = SocketTransport('127.0.0.1:0', authkey=b'secret')
+        yoda = Yoda(transport, event_ranges=[{'eventRangeID': 'x'}])
+        yoda.start()
+        try:
+            # wait until the server is listening and the port is known
+            for _ in range(100):
+                if not transport.address.endswith(':0'):
+                    break
+                yoda.join(0.1)
+            droid_transport = SocketTransport(transport.address, authkey=b'secret')
+            response = droid_transport.request({'command': 'get_event_ranges', 'node': 'node', 'num_ranges': 5})
+            self.assertEqual(response, {'status': 0, 'event_ranges': [{'eventRangeID': 'x'}]})
+            response = droid_transport.request({'command': 'get_event_ranges', 'node': 'node', 'num_ranges': 5})
+            self.assertEqual(response, {'status': 0, 'event_ranges': []})
+            droid_transport.close()
+        finally:
+            yoda.stop()
+            yoda.join(10)
+        self.assertFalse(yoda.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -33,7 +33,7 @@ from pilot.util.config import config
 from pilot.util.constants import UTILITY_BEFORE_PAYLOAD, UTILITY_WITH_PAYLOAD, UTILITY_AFTER_PAYLOAD_STARTED,\
     UTILITY_AFTER_PAYLOAD, UTILITY_AFTER_PAYLOAD_FINISHED, UTILITY_WITH_STAGEIN
 from pilot.util.container import execute
-from pilot.util.filehandling import remove, get_guid, remove_dir_tree, read_list, remove_core_dumps
+from pilot.util.filehandling import remove, get_guid, remove_dir_tree, read_list
 
 #from pilot.info import FileSpec
 
@@ -184,7 +184,7 @@ def get_payload_command(job):
         cmd = replace_lfns_with_turls(cmd, job.workdir, "PoolFileCatalog.xml", lfns, writetofile=job.writetofile)
 
     # Explicitly add the ATHENA_PROC_NUMBER (or JOB value)
-    cmd = add_athena_proc_number(cmd)
+    cmd = add_athena_proc_number(cmd, corecount=job.corecount)
 
     log.info('payload run command: %s' % cmd)
 
@@ -292,30 +292,36 @@ def get_generic_payload_command(cmd, job, prepareasetup, userjob):
     return cmd
 
 
-def add_athena_proc_number(cmd):
+def add_athena_proc_number(cmd, corecount=None):
     """
     Add the ATHENA_PROC_NUMBER and ATHENA_CORE_NUMBER to the payload command if necessary.
+    If the job core count is given, the values are derived from it as in verify_ncores() instead of being read from
+    the environment, which is shared by the jobs processed at the same time in Harvester multi-job mode.
 
     :param cmd: payload execution command (string).
+    :param corecount: job core count (int).
     :return: updated payload execution command (string).
     """
 
     # get the values if they exist
-    try:
-        value1 = int(os.environ['ATHENA_PROC_NUMBER_JOB'])
-    except Exception as e:
-        logger.warning('failed to convert ATHENA_PROC_NUMBER_JOB to int: %s' % e)
-        value1 = None
-    try:
-        value2 = int(os.environ['ATHENA_CORE_NUMBER'])
-    except Exception as e:
-        logger.warning('failed to convert ATHENA_CORE_NUMBER to int: %s' % e)
-        value2 = None
+    if corecount:
+        value1, value2 = get_athena_core_numbers(corecount)
+    else:
+        try:
+            value1 = int(os.environ['ATHENA_PROC_NUMBER_JOB'])
+        except Exception as e:
+            logger.warning('failed to convert ATHENA_PROC_NUMBER_JOB to int: %s' % e)
+            value1 = None
+        try:
+            value2 = int(os.environ['ATHENA_CORE_NUMBER'])
+        except Exception as e:
+            logger.warning('failed to convert ATHENA_CORE_NUMBER to int: %s' % e)
+            value2 = None
 
     if "ATHENA_PROC_NUMBER" not in cmd:
         if "ATHENA_PROC_NUMBER" in os.environ:
             cmd = 'export ATHENA_PROC_NUMBER=%s;' % os.environ['ATHENA_PROC_NUMBER'] + cmd
-        elif "ATHENA_PROC_NUMBER_JOB" in os.environ and value1:
+        elif value1:
             if value1 > 1:
                 cmd = 'export ATHENA_PROC_NUMBER=%d;' % value1 + cmd
             else:
@@ -325,7 +331,7 @@ def add_athena_proc_number(cmd):
     else:
         logger.info("ATHENA_PROC_NUMBER already in job command")
 
-    if 'ATHENA_CORE_NUMBER' in os.environ and value2:
+    if value2:
         if value2 > 1:
             cmd = 'export ATHENA_CORE_NUMBER=%d;' % value2 + cmd
         else:
@@ -1217,32 +1223,6 @@ def get_exit_info(jobreport_dictionary):
     return jobreport_dictionary['exitCode'], jobreport_dictionary['exitMsg']
 
 
-def cleanup_payload(workdir, outputfiles=[]):
-    """
-    Cleanup of payload (specifically AthenaMP) sub directories prior to log file creation.
-    Also remove core dumps.
-
-    :param workdir: working directory (string)
-    :param outputfiles: list of output files
-    :return:
-    """
-
-    remove_core_dumps(workdir)
-
-    for ampdir in glob('%s/athenaMP-workers-*' % workdir):
-        for (p, d, f) in os.walk(ampdir):
-            for filename in f:
-                if 'core' in filename or 'pool.root' in filename or 'tmp.' in filename:
-                    path = os.path.join(p, filename)
-                    path = os.path.abspath(path)
-                    remove(path)
-                for outfile in outputfiles:
-                    if outfile in filename:
-                        path = os.path.join(p, filename)
-                        path = os.path.abspath(path)
-                        remove(path)
-
-
 def get_redundant_path():
     """
     Return the path to the file containing the redundant files and directories to be removed prior to log file creation.
@@ -1341,137 +1321,151 @@ def get_redundants():
     return dir_list
 
 
-def remove_archives(workdir):
-    """
-    Explicitly remove any soft linked archives (.a files) since they will be dereferenced by the tar command
-    (--dereference option).
-
-    :param workdir: working directory (string)
-    :return:
-    """
-
-    matches = []
-    for root, dirnames, filenames in os.walk(workdir):
-        for filename in fnmatch.filter(filenames, '*.a'):
-            matches.append(os.path.join(root, filename))
-    for root, dirnames, filenames in os.walk(os.path.dirname(workdir)):
-        for filename in fnmatch.filter(filenames, 'EventService_premerge_*.tar'):
-            matches.append(os.path.join(root, filename))
-    if matches != []:
-        for f in matches:
-            remove(f)
+def ls(workdir):
+    cmd = 'ls -lF %s' % workdir
+    ec, stdout, stderr = execute(cmd)
+    logger.debug('%s:\n' % stdout + stderr)
 
 
-def cleanup_broken_links(workdir):
+def remove_redundant_files(workdir, outputfiles=[], islooping=False):
     """
-    Run a second pass to clean up any broken links prior to log file creation.
+    Remove redundant files and directories prior to creating the log file.
+    The files and directories to remove are selected by the same filter as the ones the native log archiver leaves out
+    (see get_redundant_file_filter()). Symbolic links to directories are removed, not followed.
 
-    :param workdir: working directory (string)
+    :param workdir: working directory (string).
+    :param outputfiles: list of output files.
+    :param islooping: looping job (Boolean).
     :return:
     """
 
-    broken = []
-    for root, dirs, files in os.walk(workdir):
-        for filename in files:
-            path = os.path.join(root, filename)
-            if os.path.islink(path):
-                target_path = os.readlink(path)
-                # Resolve relative symlinks
-                if not os.path.isabs(target_path):
-                    target_path = os.path.join(os.path.dirname(path), target_path)
-                if not os.path.exists(target_path):
-                    broken.append(path)
+    logger.debug("removing redundant files prior to log creation")
+    workdir = os.path.abspath(workdir)
+
+    ls(workdir)
+
+    is_redundant = get_redundant_file_filter(workdir, outputfiles=outputfiles, islooping=islooping)
+    for root, dirnames, filenames in os.walk(workdir):
+        relroot = os.path.relpath(root, workdir).replace(os.sep, '/')
+        relroot = '' if relroot == '.' else relroot + '/'
+        kept = []
+        for dirname in dirnames:
+            path = os.path.join(root, dirname)
+            if is_redundant(relroot + dirname, True):
+                logger.debug('removing %s' % path)
+                if os.path.islink(path):
+                    remove(path)
+                else:
+                    remove_dir_tree(path)
             else:
-                # If it's not a symlink we're not interested.
-                continue
+                kept.append(dirname)
+        dirnames[:] = kept
 
-    if broken:
-        for p in broken:
-            remove(p)
+        for filename in filenames:
+            if is_redundant(relroot + filename, False):
+                path = os.path.join(root, filename)
+                logger.debug('removing %s' % path)
+                remove(path)
 
+    remove_redundant_files_outside(workdir)
 
-def ls(workdir):
-    cmd = 'ls -lF %s' % workdir
-    ec, stdout, stderr = execute(cmd)
-    logger.debug('%s:\n' % stdout + stderr)
+    ls(workdir)
 
 
-def remove_redundant_files(workdir, outputfiles=[], islooping=False):  # noqa: C901
+def remove_redundant_files_outside(workdir):
     """
-    Remove redundant files and directories prior to creating the log file.
+    Remove the redundant files outside of the work directory: event service premerge tarballs in the parent directory
+    and the redundant paths given as absolute paths.
 
     :param workdir: working directory (string).
-    :param outputfiles: list of output files.
     :return:
     """
 
-    logger.debug("removing redundant files prior to log creation")
-    workdir = os.path.abspath(workdir)
+    for root, dirnames, filenames in os.walk(os.path.dirname(workdir)):
+        for filename in fnmatch.filter(filenames, 'EventService_premerge_*.tar'):
+            remove(os.path.join(root, filename))
 
-    ls(workdir)
+    for _dir in get_redundants():
+        if _dir.startswith('/'):
+            for path in glob(_dir):
+                logger.debug('removing %s' % path)
+                if os.path.isfile(path):
+                    remove(path)
+                else:
+                    remove_dir_tree(path)
 
-    # get list of redundant files and directories (to be removed)
-    dir_list = get_redundants()
 
-    # remove core and pool.root files from AthenaMP sub directories
-    try:
-        logger.debug('cleaning up payload')
-        cleanup_payload(workdir, outputfiles)
-    except Exception as e:
-        logger.warning("failed to execute cleanup_payload(): %s" % e)
+def is_glob_match(parts, pattern):
+    """
+    Does the path match the pattern, following the rules of glob() (e.g. a wildcard does not match a leading dot)?
 
-    # explicitly remove any soft linked archives (.a files) since they will be dereferenced by the tar command
-    # (--dereference option)
-    logger.debug('removing archives')
-    remove_archives(workdir)
+    :param parts: path components (list).
+    :param pattern: pattern components (list).
+    :return: Boolean.
+    """
 
-    # note: these should be partial file/dir names, not containing any wildcards
-    exceptions_list = ["runargs", "runwrapper", "jobReport", "log."]
+    if len(parts) != len(pattern):
+        return False
+    for part, _pattern in zip(parts, pattern):
+        if part.startswith('.') and not _pattern.startswith('.'):
+            return False
+        if not fnmatch.fnmatchcase(part, _pattern):
+            return False
 
-    to_delete = []
-    for _dir in dir_list:
-        files = glob(os.path.join(workdir, _dir))
-        exclude = []
-
-        if files:
-            for exc in exceptions_list:
-                for f in files:
-                    if exc in f:
-                        exclude.append(os.path.abspath(f))
-            _files = []
-            for f in files:
-                if f not in exclude:
-                    _files.append(os.path.abspath(f))
-            to_delete += _files
-
-    exclude_files = []
-    for of in outputfiles:
-        exclude_files.append(os.path.join(workdir, of))
-
-    for f in to_delete:
-        if f not in exclude_files:
-            logger.debug('removing %s' % f)
-            if os.path.isfile(f):
-                remove(f)
-            else:
-                remove_dir_tree(f)
+    return True
 
-    # run a second pass to clean up any broken links
-    logger.debug('cleaning up broken links')
-    cleanup_broken_links(workdir)
 
-    # remove any present user workDir
-    path = os.path.join(workdir, 'workDir')
-    if os.path.exists(path) and not islooping:
-        logger.debug('removing workDir')
-        remove_dir_tree(path)
+def get_redundant_file_filter(workdir, outputfiles=[], islooping=False):
+    """
+    Return the filter selecting the redundant files and directories in the work directory. It is used by
+    remove_redundant_files() and by the native log archiver, which leaves out the selected files instead of removing
+    them, so that the work directory does not have to be cleaned up (walked) before the log file is created.
+    Patterns with absolute paths refer to directories outside of the work directory (see
+    remove_redundant_files_outside()).
 
-    path = os.path.join(workdir, "singularity")
-    if os.path.exists(path):
-        logger.debug('removing singularity')
-        remove_dir_tree(path)
+    :param workdir: working directory (string).
+    :param outputfiles: list of output files.
+    :param islooping: looping job (Boolean).
+    :return: function(relative path, is directory) returning True if the path is redundant.
+    """
 
-    ls(workdir)
+    workdir = os.path.abspath(workdir)
+    patterns = [_dir.rstrip('/').split('/') for _dir in get_redundants() if not _dir.startswith('/')]
+    # note: these should be partial file/dir names, not containing any wildcards
+    exceptions_list = ["runargs", "runwrapper", "jobReport", "log."]
+    toplevel = ['singularity'] + ([] if islooping else ['workDir'])  # user and container directories
+
+    def is_redundant(relpath, isdir):
+        parts = relpath.split('/')
+        filename = parts[-1]
+        path = os.path.join(workdir, relpath)
+
+        # core dumps (see remove_core_dumps())
+        if len(parts) == 1 and not isdir and (filename == 'core' or is_glob_match(parts, ['core.*'])):
+            return True
+        # core, pool.root, temporary and output files in AthenaMP sub directories
+        if len(parts) > 1 and not isdir and is_glob_match(parts[:1], ['athenaMP-workers-*']):
+            if any(name in filename for name in ['core', 'pool.root', 'tmp.'] + outputfiles):
+                return True
+        # soft linked archives (dereferenced by tar) and event service premerge tarballs
+        if not isdir and (fnmatch.fnmatch(filename, '*.a') or fnmatch.fnmatch(filename, 'EventService_premerge_*.tar')):
+            return True
+        # broken links
+        if not isdir and os.path.islink(path) and not os.path.exists(path):
+            return True
+        if len(parts) == 1 and isdir and filename in toplevel:
+            return True
+
+        # the redundant files and directories except the output files and the exceptions (anywhere in the path)
+        if relpath in outputfiles or any(exc in path for exc in exceptions_list):
+            return False
+        for pattern in patterns:
+            if is_glob_match(parts, pattern):
+                return True
+
+        return False
+
+    return is_redundant
 
 
 def download_command(process, workdir, label='preprocess'):
@@ -1616,6 +1610,19 @@ def post_utility_command_action(name, job):
         post_memory_monitor_action(job)
 
 
+def get_fatal_output_signatures():
+    """
+    Return the error signatures in the payload stdout/stderr that are fatal for the payload.
+    The payload output is scanned for these signatures while the payload is running (see `OutputTee`).
+
+    :return: dictionary {stream name: list of (category, list of regexp patterns, error code)}.
+    """
+
+    return {'stdout': [('out_of_memory', ["St9bad_alloc", "std::bad_alloc"], errors.PAYLOADOUTOFMEMORY)],
+            'stderr': [('out_of_memory', ["FATAL out of memory: taking the application down"],
+                        errors.PAYLOADOUTOFMEMORY)]}
+
+
 def get_utility_command_kill_signal(name):
     """
     Return the proper kill signal used to stop the utility command.
@@ -1669,6 +1676,25 @@ def verify_lfn_length(outdata):
     return ec, diagnostics
 
 
+def get_athena_core_numbers(corecount):
+    """
+    Return the ATHENA_PROC_NUMBER_JOB and ATHENA_CORE_NUMBER values for the given job core count (see verify_ncores()).
+
+    :param corecount: number of cores (int).
+    :return: ATHENA_PROC_NUMBER_JOB (int or None if ATHENA_PROC_NUMBER is set), ATHENA_CORE_NUMBER (int).
+    """
+
+    try:
+        athena_proc_number = int(os.environ.get('ATHENA_PROC_NUMBER', None))
+    except Exception:
+        athena_proc_number = None
+
+    if athena_proc_number:
+        return None, athena_proc_number
+
+    return corecount, corecount
+
+
 def verify_ncores(corecount):
     """
     Verify that nCores settings are correct
@@ -5,7 +5,7 @@
 # http://www.apache.org/licenses/LICENSE-2.0
 #
 # Authors:
-# - Paul Nilsson, paul.nilsson@cern.ch, 2018
+# - Paul Nilsson, paul.nilsson@cern.ch, 2018-2020
 
 import json
 import os
@@ -16,7 +16,7 @@ from pilot.common.errorcodes import ErrorCodes
 from pilot.common.exception import PilotException, BadXML
 from pilot.util.auxiliary import get_logger
 from pilot.util.config import config
-from pilot.util.filehandling import get_guid, tail, grep, open_file, read_file, scan_file  #, write_file
+from pilot.util.filehandling import get_guid, tail, open_file, read_file, LogScanner  #, write_file
 from pilot.util.math import convert_mb_to_b
 from pilot.util.workernode import get_local_disk_space
 
@@ -28,6 +28,15 @@ logger = logging.getLogger(__name__)
 
 errors = ErrorCodes()
 
+# error signatures to look for in the payload output: (category, file [stdout/stderr], list of regexp patterns)
+ERROR_SIGNATURES = [
+    ('out_of_memory', 'stderr', ["FATAL out of memory: taking the application down"]),
+    ('out_of_memory', 'stdout', ["St9bad_alloc", "std::bad_alloc"]),
+    ('out_of_space', 'stderr', ["No space left on device"]),
+    ('nfssqlite_locking', 'stdout', ["prepare 5 database is locked", "Error SQLiteStatement"]),
+    ('user_code_missing', 'stdout', ["ERROR: unable to fetch source tarball from web"]),
+]
+
 
 def interpret(job):
     """
@@ -76,23 +85,26 @@ def interpret_payload_exit_info(job):
     :return:
     """
 
+    # scan the payload stdout and stderr once for all known error signatures
+    scanner = scan_payload_logs(job)
+
     # try to identify out of memory errors in the stderr
-    if is_out_of_memory(job):
+    if is_out_of_memory(job, scanner=scanner):
         job.piloterrorcodes, job.piloterrordiags = errors.add_error_code(errors.PAYLOADOUTOFMEMORY, priority=True)
         return
 
     # look for specific errors in the stdout (tail)
-    if is_installation_error(job):
+    if is_installation_error(job, scanner=scanner):
         job.piloterrorcodes, job.piloterrordiags = errors.add_error_code(errors.MISSINGINSTALLATION, priority=True)
         return
 
     # did AtlasSetup fail?
-    if is_atlassetup_error(job):
+    if is_atlassetup_error(job, scanner=scanner):
         job.piloterrorcodes, job.piloterrordiags = errors.add_error_code(errors.ATLASSETUPFATAL, priority=True)
         return
 
     # did the payload run out of space?
-    if is_out_of_space(job):
+    if is_out_of_space(job, scanner=scanner):
         job.piloterrorcodes, job.piloterrordiags = errors.add_error_code(errors.NOLOCALSPACE, priority=True)
 
         # double check local space
@@ -101,12 +113,12 @@ def interpret_payload_exit_info(job):
         return
 
     # look for specific errors in the stdout (full)
-    if is_nfssqlite_locking_problem(job):
+    if is_nfssqlite_locking_problem(job, scanner=scanner):
         job.piloterrorcodes, job.piloterrordiags = errors.add_error_code(errors.NFSSQLITE, priority=True)
         return
 
     # is the user tarball missing on the server?
-    if is_user_code_missing(job):
+    if is_user_code_missing(job, scanner=scanner):
         job.piloterrorcodes, job.piloterrordiags = errors.add_error_code(errors.MISSINGUSERCODE, priority=True)
         return
 
@@ -115,79 +127,108 @@ def interpret_payload_exit_info(job):
         job.piloterrorcodes, job.piloterrordiags = errors.add_error_code(errors.UNKNOWNPAYLOADFAILURE, priority=True)
 
 
-def is_out_of_memory(job):
+def scan_payload_logs(job):
     """
-    Did the payload run out of memory?
+    Scan the payload stdout and stderr for all known error signatures (see ERROR_SIGNATURES).
+    Each file is only read once.
 
     :param job: job object.
-    :return: Boolean. (note: True means the error was found)
+    :return: LogScanner object (with the scan results).
     """
 
-    out_of_memory = False
     log = get_logger(job.jobid)
 
-    stdout = os.path.join(job.workdir, config.Payload.payloadstdout)
-    stderr = os.path.join(job.workdir, config.Payload.payloadstderr)
+    paths = {'stdout': os.path.join(job.workdir, config.Payload.payloadstdout),
+             'stderr': os.path.join(job.workdir, config.Payload.payloadstderr)}
 
-    files = {stderr: ["FATAL out of memory: taking the application down"], stdout: ["St9bad_alloc", "std::bad_alloc"]}
-    for path in files:
-        if os.path.exists(path):
-            log.info('looking for out-of-memory errors in %s' % os.path.basename(path))
-            if os.path.getsize(path) > 0:
-                matched_lines = grep(files[path], path)
-                if len(matched_lines) > 0:
-                    log.warning("identified an out of memory error in %s %s:" % (job.payload, os.path.basename(path)))
-                    for line in matched_lines:
-                        log.info(line)
-                    out_of_memory = True
-        else:
-            log.warning('file does not exist: %s (cannot look for out-of-memory error in it)')
+    scanner = LogScanner()
+    for category, name, patterns in ERROR_SIGNATURES:
+        scanner.add(category, paths[name], patterns)
+
+    log.info('scanning payload stdout and stderr for known error messages')
+    scanner.scan()
+
+    return scanner
+
+
+def report_matched_lines(scanner, category, warning_message):
+    """
+    Report the lines that matched the error signatures of the given category.
+
+    :param scanner: LogScanner object.
+    :param category: error signature category (string).
+    :param warning_message: warning message to be printed if any lines have been found (string).
+    :return: Boolean. (note: True means the error was found)
+    """
 
-    return out_of_memory
+    matched_lines = scanner.get_lines(category)
+    if matched_lines:
+        logger.warning(warning_message)
+        for line in matched_lines:
+            logger.info(line)
 
+    return len(matched_lines) > 0
 
-def is_user_code_missing(job):
+
+def is_out_of_memory(job, scanner=None):
+    """
+    Did the payload run out of memory?
+
+    :param job: job object.
+    :param scanner: optional LogScanner object with the scan results of the payload stdout and stderr.
+    :return: Boolean. (note: True means the error was found)
+    """
+
+    scanner = scanner or scan_payload_logs(job)
+
+    return report_matched_lines(scanner, 'out_of_memory',
+                                "identified an out of memory error in %s stdout/stderr:" % job.payload)
+
+
+def is_user_code_missing(job, scanner=None):
     """
     Is the user code (tarball) missing on the server?
 
     :param job: job object.
+    :param scanner: optional LogScanner object with the scan results of the payload stdout and stderr.
     :return: Boolean. (note: True means the error was found)
     """
 
-    stdout = os.path.join(job.workdir, config.Payload.payloadstdout)
-    error_messages = ["ERROR: unable to fetch source tarball from web"]
+    scanner = scanner or scan_payload_logs(job)
 
-    return scan_file(stdout,
-                     error_messages,
-                     warning_message="identified an \'%s\' message in %s" % (error_messages[0], os.path.basename(stdout)))
+    return report_matched_lines(scanner, 'user_code_missing',
+                                "identified an \'ERROR: unable to fetch source tarball from web\' message in %s" %
+                                config.Payload.payloadstdout)
 
 
-def is_out_of_space(job):
+def is_out_of_space(job, scanner=None):
     """
     Did the disk run out of space?
 
     :param job: job object.
+    :param scanner: optional LogScanner object with the scan results of the payload stdout and stderr.
     :return: Boolean. (note: True means the error was found)
     """
 
-    stderr = os.path.join(job.workdir, config.Payload.payloadstderr)
-    error_messages = ["No space left on device"]
+    scanner = scanner or scan_payload_logs(job)
 
-    return scan_file(stderr,
-                     error_messages,
-                     warning_message="identified a \'%s\' message in %s" % (error_messages[0], os.path.basename(stderr)))
+    return report_matched_lines(scanner, 'out_of_space',
+                                "identified a \'No space left on device\' message in %s" % config.Payload.payloadstderr)
 
 
-def is_installation_error(job):
+def is_installation_error(job, scanner=None):
     """
     Did the payload fail to run? (Due to faulty/missing installation).
 
     :param job: job object.
+    :param scanner: optional LogScanner object with the scan results of the payload stdout and stderr.
     :return: Boolean. (note: True means the error was found)
     """
 
+    scanner = scanner or scan_payload_logs(job)
+
     stdout = os.path.join(job.workdir, config.Payload.payloadstdout)
-    _tail = tail(stdout)
+    _tail = scanner.get_tail(stdout)
     res_tmp = _tail[:1024]
     if res_tmp[0:3] == "sh:" and 'setup.sh' in res_tmp and 'No such file or directory' in res_tmp:
         return True
@@ -195,16 +236,19 @@ def is_installation_error(job):
         return False
 
 
-def is_atlassetup_error(job):
+def is_atlassetup_error(job, scanner=None):
     """
     Did AtlasSetup fail with a fatal error?
 
     :param job: job object.
+    :param scanner: optional LogScanner object with the scan results of the payload stdout and stderr.
     :return: Boolean. (note: True means the error was found)
     """
 
+    scanner = scanner or scan_payload_logs(job)
+
     stdout = os.path.join(job.workdir, config.Payload.payloadstdout)
-    _tail = tail(stdout)
+    _tail = scanner.get_tail(stdout)
     res_tmp = _tail[:2048]
     if "AtlasSetup(FATAL): Fatal exception" in res_tmp:
         log = get_logger(job.jobid)
@@ -214,20 +258,19 @@ def is_atlassetup_error(job):
         return False
 
 
-def is_nfssqlite_locking_problem(job):
+def is_nfssqlite_locking_problem(job, scanner=None):
     """
     Were there any NFS SQLite locking problems?
 
     :param job: job object.
+    :param scanner: optional LogScanner object with the scan results of the payload stdout and stderr.
     :return: Boolean. (note: True means the error was found)
     """
 
-    stdout = os.path.join(job.workdir, config.Payload.payloadstdout)
-    error_messages = ["prepare 5 database is locked", "Error SQLiteStatement"]
+    scanner = scanner or scan_payload_logs(job)
 
-    return scan_file(stdout,
-                     error_messages,
-                     warning_message="identified an NFS/Sqlite locking problem in %s" % os.path.basename(stdout))
+    return report_matched_lines(scanner, 'nfssqlite_locking',
+                                "identified an NFS/Sqlite locking problem in %s" % config.Payload.payloadstdout)
 
 
 def extract_special_information(job):
@@ -83,7 +83,7 @@ def memory_usage(job):
         return exit_code, diagnostics
 
     maxdict = summary_dictionary.get('Max', {})
-    maxpss_int = maxdict.get('maxPSS', -1)
+    maxpss_int = maxdict.get('maxPSS', maxdict.get('pss', -1))  # MemoryMonitor or prmon format
 
     # Only proceed if values are set
     if maxpss_int != -1:
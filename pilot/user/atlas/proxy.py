@@ -5,15 +5,17 @@
 # http://www.apache.org/licenses/LICENSE-2.0
 #
 # Authors:
-# - Paul Nilsson, paul.nilsson@cern.ch, 2018
+# - Paul Nilsson, paul.nilsson@cern.ch, 2018-2020
 
 # from pilot.util.container import execute
 
 import os
+import time
 import logging
 
 from pilot.user.atlas.setup import get_file_system_root_path
 from pilot.util.container import execute
+from pilot.util.proxy import get_proxy_info
 from pilot.common.errorcodes import ErrorCodes
 
 logger = logging.getLogger(__name__)
@@ -35,9 +37,15 @@ def verify_proxy(limit=None):
     if limit is None:
         limit = 48
 
+    # first parse the proxy file in-process, the proxy tools are only used if this fails
+    x509 = os.environ.get('X509_USER_PROXY', '')
+    if x509 != '':
+        ec, diagnostics = verify_proxy_file(x509, limit)
+        if ec is not None:
+            return ec, diagnostics
+
     # add setup for arcproxy if it exists
     #arcproxy_setup = "%s/atlas.cern.ch/repo/sw/arc/client/latest/slc6/x86_64/setup.sh" % get_file_system_root_path()
-    x509 = os.environ.get('X509_USER_PROXY', '')
     if x509 != '':
         envsetup = 'export X509_USER_PROXY=%s;' % x509
     else:
@@ -69,6 +77,44 @@ def verify_proxy(limit=None):
     return exit_code, diagnostics
 
 
+def verify_proxy_file(path, limit):
+    """
+    Verify the proxy by parsing the proxy file (the certificate chain and the VOMS attribute certificates).
+    The parsed proxy is cached until the file changes.
+
+    :param path: path of the proxy file (string).
+    :param limit: time limit in hours (int).
+    :return: exit code (int, None if the proxy file could not be parsed), error diagnostics (string).
+    """
+
+    try:
+        info = get_proxy_info(path)
+    except Exception as e:
+        logger.warning('failed to parse proxy file %s (will use the proxy tools): %s' % (path, e))
+        return None, ""
+
+    now = time.time()
+    validity = int(info['notafter'] - now)
+    if validity < limit * 3600:
+        diagnostics = "grid proxy certificate does not exist or is too short (lifetime %d s)" % validity
+        logger.warning(diagnostics)
+        return errors.NOPROXY, diagnostics
+
+    if info['vomsnotafter'] is None:
+        diagnostics = "voms proxy certificate does not exist (no VOMS attributes in %s)" % path
+        logger.warning(diagnostics)
+        return errors.NOVOMSPROXY, diagnostics
+
+    validity = int(min(info['notafter'], info['vomsnotafter']) - now)
+    if validity < limit * 3600:
+        diagnostics = "voms proxy certificate does not exist or is too short (lifetime %d s)" % validity
+        logger.warning(diagnostics)
+        return errors.NOVOMSPROXY, diagnostics
+
+    logger.info("voms proxy verified (%d s)" % validity)
+    return 0, ""
+
+
 def verify_arcproxy(envsetup, limit):
     """
     Verify the proxy using arcproxy.
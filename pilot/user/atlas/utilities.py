@@ -13,6 +13,7 @@ from getpass import getuser
 from re import search
 
 # from pilot.info import infosys
+from pilot.api.memorymonitor import get_memory_monitor
 from .setup import get_asetup
 from pilot.util.auxiliary import get_logger, is_python3
 from pilot.util.container import execute
@@ -740,6 +741,11 @@ def get_memory_values(workdir, name=""):
     :return: memory values dictionary.
     """
 
+    # the native memory monitor keeps the summary up to date in memory
+    monitor = get_memory_monitor(workdir)
+    if monitor:
+        return monitor.get_results()
+
     summary_dictionary = {}
 
     # Get the path to the proper memory info file (priority ordered)
@@ -75,6 +75,19 @@ def remove_redundant_files(workdir, outputfiles=[]):
     pass
 
 
+def get_redundant_file_filter(workdir, outputfiles=[], islooping=False):
+    """
+    Return a filter for the log file archiver which leaves out redundant files and directories.
+
+    :param workdir: working directory (string).
+    :param outputfiles: list of output files.
+    :param islooping: looping job (Boolean).
+    :return: function(relative path, is directory) returning True if the path should be left out (or None).
+    """
+
+    return None
+
+
 def get_utility_commands(order=None, job=None):
     """
     Return a dictionary of utility commands and arguments to be executed in parallel with the payload.
@@ -135,6 +148,17 @@ def post_utility_command_action(name, job):
     pass
 
 
+def get_fatal_output_signatures():
+    """
+    Return the error signatures in the payload stdout/stderr that are fatal for the payload.
+    The payload output is scanned for these signatures while the payload is running (see `OutputTee`).
+
+    :return: dictionary {stream name: list of (category, list of regexp patterns, error code)}.
+    """
+
+    return {}
+
+
 def get_utility_command_kill_signal(name):
     """
     Return the proper kill signal used to stop the utility command.
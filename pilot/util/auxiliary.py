@@ -12,6 +12,7 @@ import sys
 
 from collections import Set, Mapping, deque, OrderedDict
 from numbers import Number
+from threading import Lock
 from time import sleep
 
 try:
@@ -23,7 +24,8 @@ except NameError:
 
 from pilot.common.errorcodes import ErrorCodes
 from pilot.util.container import execute
-from pilot.util.constants import SUCCESS, FAILURE, SERVER_UPDATE_FINAL, SERVER_UPDATE_NOT_DONE, SERVER_UPDATE_TROUBLE, get_pilot_version
+from pilot.util.constants import SUCCESS, FAILURE, SERVER_UPDATE_FINAL, SERVER_UPDATE_NOT_DONE, SERVER_UPDATE_TROUBLE, \
+    SERVER_UPDATE_RUNNING, SERVER_UPDATE_UPDATING, get_pilot_version
 from pilot.util.filehandling import dump
 
 import logging
@@ -31,6 +33,13 @@ logger = logging.getLogger(__name__)
 
 errors = ErrorCodes()
 
+_jobs = {}  # job id -> job object, for the jobs being processed (see set_pilot_state())
+_jobs_lock = Lock()
+
+# server update states, from the least to the most advanced
+SERVER_UPDATE_ORDER = [SERVER_UPDATE_UPDATING, SERVER_UPDATE_RUNNING, SERVER_UPDATE_NOT_DONE, SERVER_UPDATE_TROUBLE,
+                       SERVER_UPDATE_FINAL]
+
 
 def pilot_version_banner():
     """
@@ -302,18 +311,106 @@ def set_pilot_state(job=None, state=''):
     Note: this function should update the global/singleton object but currently uses an environmental variable
     (PILOT_JOB_STATE).
     The function does not update job.state if it is already set to finished or failed.
-    The environmental variable PILOT_JOB_STATE will always be set, in case the job object does not exist.
+    The environmental variable PILOT_JOB_STATE will be set, in case the job object does not exist, unless the job was
+    prefetched while the previous jobs are still finishing (job pipelining).
+    The job is registered as being processed, see is_pilot_state() (several jobs are processed in multi-job mode).
 
     :param job: optional job object.
     :param state: internal pilot state (string).
     :return:
     """
 
-    os.environ['PILOT_JOB_STATE'] = state
-
     if job and job.state != 'failed':
         job.state = state
 
+    if not (job and job.prefetched):
+        os.environ['PILOT_JOB_STATE'] = state
+        if job:
+            register_job(job)
+
+
+def is_pilot_state(state):
+    """
+    Is any of the jobs being processed in the given pilot state?
+    The environmental variable PILOT_JOB_STATE is queried if no job is being processed.
+
+    :param state: internal pilot state (string).
+    :return: Boolean.
+    """
+
+    with _jobs_lock:
+        jobs = list(_jobs.values())
+    if jobs:
+        return any(job.state == state for job in jobs)
+
+    return os.environ.get('PILOT_JOB_STATE', 'unknown') == state
+
+
+def set_server_update(job=None, state=''):
+    """
+    Set the server update state (SERVER_UPDATE_*) of the job.
+    The environmental variable SERVER_UPDATE, used by check_for_final_server_update(), is set to the least advanced
+    server update state of the jobs being processed, unless the job was prefetched while the previous jobs are still
+    finishing (job pipelining). Without a job object, the state is only set if no job is being processed.
+
+    :param job: optional job object.
+    :param state: server update state (string).
+    :return:
+    """
+
+    if job:
+        job.serverupdate = state
+        if job.prefetched:
+            return
+        register_job(job)
+
+    with _jobs_lock:
+        states = [_job.serverupdate for _job in _jobs.values() if _job.serverupdate]
+        if states:
+            state = next((_state for _state in SERVER_UPDATE_ORDER if _state in states), states[-1])
+        elif job:
+            return
+        os.environ['SERVER_UPDATE'] = state
+
+
+def register_job(job):
+    """
+    Register a job as being processed (see set_pilot_state() and set_server_update()).
+
+    :param job: job object.
+    :return:
+    """
+
+    with _jobs_lock:
+        _jobs[job.jobid] = job
+
+
+def unregister_job(job):
+    """
+    Unregister a job once its final server update has been done.
+
+    :param job: job object.
+    :return:
+    """
+
+    with _jobs_lock:
+        _jobs.pop(job.jobid, None)
+
+
+def release_prefetched_job(job):
+    """
+    Publish the state of a prefetched job once the previous jobs have completed (job pipelining).
+
+    :param job: job object.
+    :return:
+    """
+
+    job.prefetched = False
+    if job.state:
+        set_pilot_state(job=job, state=job.state)
+    if job.serverupdate:
+        set_server_update(job=job, state=job.serverupdate)
+
 
 def check_for_final_server_update(update_server):
     """
@@ -45,6 +45,7 @@ PILOT_PRE_STAGEOUT = 'PILOT_PRE_STAGEOUT'
 PILOT_POST_STAGEOUT = 'PILOT_POST_STAGEOUT'
 PILOT_PRE_FINAL_UPDATE = 'PILOT_PRE_FINAL_UPDATE'
 PILOT_POST_FINAL_UPDATE = 'PILOT_POST_FINAL_UPDATE'
+PILOT_PREVIOUS_JOB_COMPLETED = 'PILOT_PREVIOUS_JOB_COMPLETED'  # job pipelining: when the previous job completed
 PILOT_END_TIME = 'PILOT_END_TIME'
 PILOT_KILL_SIGNAL = 'PILOT_KILL_SIGNAL'
 
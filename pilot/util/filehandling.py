@@ -5,7 +5,7 @@
 # http://www.apache.org/licenses/LICENSE-2.0
 #
 # Authors:
-# - Paul Nilsson, paul.nilsson@cern.ch, 2017-2018
+# - Paul Nilsson, paul.nilsson@cern.ch, 2017-2020
 
 import collections
 import hashlib
@@ -13,12 +13,14 @@ import io
 import os
 import re
 import tarfile
+import threading
 import time
 import uuid
+from array import array
 from glob import glob
 from json import load
 from json import dump as dumpjson
-from shutil import copy2, rmtree
+from shutil import copy2, copymode, rmtree
 import sys
 from zlib import adler32
 
@@ -709,11 +711,357 @@ def _define_tabledict_keys(header, fields, separator):
     return tabledict, keylist
 
 
+class TableReader(object):
+    """
+    Incremental reader of a table of data in a text file that keeps growing (e.g. the memory monitor output).
+    The reader remembers how far the file has been read, and only parses the new (complete) rows at every update. The
+    values are stored in array('d') columns, together with the running sum of every column.
+    See `get_table_from_file()` for the format of the file.
+    Usage: reader = TableReader(filename)
+           reader.update()  # -> number of new rows
+           table = reader.get_table()  # {'Time': array('d', [..]), 'VMEM': array('d', [..]), ..}
+    """
+
+    def __init__(self, filename, header=None, separator="\t"):
+        """
+        Init function.
+
+        :param filename: name of input text file, full path (string).
+        :param header: header string.
+        :param separator: separator character (char).
+        """
+
+        self.filename = filename
+        self.header = header
+        self.separator = separator
+        self.reset()
+
+    def reset(self):
+        """
+        Forget all data read so far.
+
+        :return:
+        """
+
+        self.offset = 0  # byte offset of the first unread row
+        self.inode = None
+        self.keylist = []  # ordered list of column names
+        self.columns = {}  # column name -> array('d')
+        self.sums = {}  # column name -> sum of all values
+        self.nrows = 0
+        if self.header:
+            self.define_columns(self.header.split(self.separator))
+
+    def define_columns(self, fields):
+        """
+        Define the columns from the header fields.
+
+        :param fields: list of column names.
+        :return:
+        """
+
+        tabledict, self.keylist = _define_tabledict_keys(None, fields, self.separator)
+        self.columns = dict((key, array('d')) for key in self.keylist)
+        self.sums = dict((key, 0.0) for key in self.keylist)
+
+    def update(self):
+        """
+        Read the rows that were added to the file since the last update.
+        The file is read from the beginning again if it was replaced or truncated.
+
+        :return: number of new rows (int) (None if the file could not be read).
+        """
+
+        try:
+            with open(self.filename, 'rb') as f:
+                st = os.fstat(f.fileno())
+                if st.st_ino != self.inode or st.st_size < self.offset:
+                    if self.inode is not None:
+                        logger.info('file %s has been replaced or truncated - will read it from the beginning' %
+                                    self.filename)
+                    self.reset()
+                    self.inode = st.st_ino
+                f.seek(self.offset)
+                data = f.read()
+        except (IOError, OSError) as e:
+            logger.warning("failed to read file: %s, %s" % (self.filename, e))
+            return None
+
+        # only complete lines are parsed, an incomplete last line will be read again at the next update
+        end = data.rfind(b'\n')
+        if end < 0:
+            return 0
+        self.offset += end + 1
+
+        nrows = self.nrows
+        for line in data[:end].decode('utf-8', 'replace').split('\n'):
+            self.add_row(line)
+
+        return self.nrows - nrows
+
+    def add_row(self, line):
+        """
+        Parse a line of the file and add the values to the columns.
+        Rows that do not match the header are skipped.
+
+        :param line: line (string).
+        :return:
+        """
+
+        fields = line.rstrip('\r').split(self.separator)
+        if not self.keylist:
+            self.define_columns(fields)
+            return
+
+        if line.strip() == '':
+            return
+
+        while fields and fields[-1].strip() == '':  # e.g. a trailing separator
+            fields.pop()
+        try:
+            values = [float(field) for field in fields]
+        except ValueError as e:
+            logger.warning("failed to convert row to float: %s (skipping row '%s')" % (e, line))
+            return
+
+        if len(values) != len(self.keylist):
+            logger.warning('wrong number of fields in row (skipping row \'%s\')' % line)
+            return
+
+        for key, value in zip(self.keylist, values):
+            self.columns[key].append(value)
+            self.sums[key] += value
+        self.nrows += 1
+
+    def get_table(self):
+        """
+        Return the table read so far.
+
+        :return: dictionary {column name: array('d')}.
+        """
+
+        return self.columns
+
+    def get_mean(self, key):
+        """
+        Return the mean value of the given column.
+
+        :param key: column name (string).
+        :return: mean value (float) (None if there are no values).
+        """
+
+        if not self.nrows or key not in self.sums:
+            return None
+
+        return self.sums[key] / self.nrows
+
+
+class ChecksumCalculator(object):
+    """
+    Incremental calculation of the adler32 and md5 checksums in a single pass over the data.
+    Usage: calculator = ChecksumCalculator()
+           calculator.update(data)  # for each chunk of data
+           calculator.get_checksums()  # -> {'adler32': .., 'md5': ..}
+    """
+
+    def __init__(self):
+        """
+        Init function.
+        """
+
+        self.adler32 = 1  # default adler32 starting value
+        self.md5 = hashlib.md5()
+        self.size = 0
+
+    def update(self, data):
+        """
+        Add a chunk of data to the checksums.
+
+        :param data: data (bytes).
+        :return:
+        """
+
+        self.adler32 = adler32(data, self.adler32)
+        self.md5.update(data)
+        self.size += len(data)
+
+    def get_checksums(self):
+        """
+        Return the checksum values.
+
+        :return: dictionary {'adler32': value, 'md5': value} (hex strings).
+        """
+
+        asum = self.adler32
+        if asum < 0:
+            asum += 2**32
+
+        return {'adler32': "{0:08x}".format(asum), 'md5': self.md5.hexdigest()}
+
+
+class ChecksumWriter(object):
+    """
+    File-like object writing to the given file object and calculating the checksums of the written data,
+    e.g. for tarfile.open(fileobj=ChecksumWriter(fd), mode='w').
+    """
+
+    def __init__(self, fileobj):
+        """
+        Init function.
+
+        :param fileobj: file object opened for writing (binary mode).
+        """
+
+        self.fileobj = fileobj
+        self.calculator = ChecksumCalculator()
+
+    def write(self, data):
+        """
+        Write the data and add it to the checksums.
+
+        :param data: data (bytes).
+        :return:
+        """
+
+        self.calculator.update(data)
+        self.fileobj.write(data)
+
+    def tell(self):
+        """
+        Return the number of written bytes.
+
+        :return: size (int).
+        """
+
+        return self.calculator.size
+
+    def get_checksums(self):
+        """
+        Return the checksum values of the written data.
+
+        :return: dictionary {'adler32': value, 'md5': value} (hex strings).
+        """
+
+        return self.calculator.get_checksums()
+
+
+# cache of already calculated checksums, keyed by (device, inode, size, modification time) of the file
+_checksum_cache = {}
+_checksum_cache_lock = threading.Lock()
+
+
+def get_checksum_cache_key(filename):
+    """
+    Return the key for the checksum cache for the given file.
+
+    :param filename: file name (string).
+    :return: key (tuple).
+    """
+
+    stat = os.stat(filename)
+
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime
+
+
+def get_cached_checksums(filename):
+    """
+    Return the cached checksums for the given file, if the file has not changed since they were calculated.
+
+    :param filename: file name (string).
+    :return: dictionary {'adler32': value, 'md5': value} (None if not cached).
+    """
+
+    try:
+        key = get_checksum_cache_key(filename)
+    except OSError:
+        return None
+
+    with _checksum_cache_lock:
+        return _checksum_cache.get(key)
+
+
+def store_checksums(filename, checksums):
+    """
+    Store checksums calculated for the given file (e.g. while the file was written) in the checksum cache.
+
+    :param filename: file name (string).
+    :param checksums: dictionary {'adler32': value, 'md5': value}.
+    :return:
+    """
+
+    try:
+        key = get_checksum_cache_key(filename)
+    except OSError as e:
+        logger.warning('cannot cache checksums for %s: %s' % (filename, e))
+        return
+
+    with _checksum_cache_lock:
+        if len(_checksum_cache) > 10000:  # should not happen, but keep the memory bounded
+            _checksum_cache.clear()
+        _checksum_cache[key] = checksums
+
+
+def calculate_checksums(filename):
+    """
+    Return the adler32 and md5 checksums for the given file.
+    Both checksums are calculated in a single read of the file, and the result is cached, i.e. the file is not read
+    again as long as it does not change.
+    The file is assumed to exist.
+
+    :param filename: file name (string).
+    :return: dictionary {'adler32': value, 'md5': value}.
+    """
+
+    checksums = get_cached_checksums(filename)
+    if checksums:
+        return checksums
+
+    calculator = ChecksumCalculator()
+    blocksize = 4 * 1024 * 1024  # read buffer size, 4 Mb
+
+    with io.open(filename, mode="rb") as fd:
+        for chunk in iter(lambda: fd.read(blocksize), b''):
+            calculator.update(chunk)
+
+    checksums = calculator.get_checksums()
+    store_checksums(filename, checksums)
+
+    return checksums
+
+
+def copy_with_checksum(source, destination):
+    """
+    Copy a file and calculate its checksums from the copied data.
+    The checksums are stored in the checksum cache for the destination file, so that a later checksum verification
+    does not need to read the file again.
+
+    :param source: source file name (string).
+    :param destination: destination file name (string).
+    :return: dictionary {'adler32': value, 'md5': value}.
+    """
+
+    calculator = ChecksumCalculator()
+    blocksize = 4 * 1024 * 1024
+
+    with io.open(source, mode="rb") as fsrc:
+        with io.open(destination, mode="wb") as fdst:
+            for chunk in iter(lambda: fsrc.read(blocksize), b''):
+                calculator.update(chunk)
+                fdst.write(chunk)
+    copymode(source, destination)
+
+    checksums = calculator.get_checksums()
+    store_checksums(destination, checksums)
+
+    return checksums
+
+
 def calculate_checksum(filename, algorithm='adler32'):
     """
     Calculate the checksum value for the given file.
     The default algorithm is adler32. Md5 is also be supported.
     Valid algorithms are 1) adler32/adler/ad32/ad, 2) md5/md5sum/md.
+    Note: the adler32 and md5 checksums are calculated together and cached (see `calculate_checksums()`).
 
     :param filename: file name (string).
     :param algorithm: optional algorithm string.
@@ -725,9 +1073,9 @@ def calculate_checksum(filename, algorithm='adler32'):
         raise FileHandlingFailure('file does not exist: %s' % filename)
 
     if algorithm == 'adler32' or algorithm == 'adler' or algorithm == 'ad' or algorithm == 'ad32':
-        return calculate_adler32_checksum(filename)
+        return calculate_checksums(filename).get('adler32')
     elif algorithm == 'md5' or algorithm == 'md5sum' or algorithm == 'md':
-        return calculate_md5_checksum(filename)
+        return calculate_checksums(filename).get('md5')
     else:
         msg = 'unknown checksum algorithm: %s' % algorithm
         logger.warning(msg)
@@ -850,6 +1198,219 @@ def scan_file(path, error_messages, warning_message=None):
     return found_problem
 
 
+class LogScanner(object):
+    """
+    Single pass scanner for error signatures in (large) log files.
+    The patterns registered for a file are combined into one regular expression, which is applied to large blocks of
+    the file rather than to every line, and each file is only read once however many categories of patterns it has.
+    Every matching line is checked against all patterns for the file, so a line can be found for several categories.
+    Note: like grep, the patterns are expected to match within a single line.
+    Usage: scanner = LogScanner()
+           scanner.add('out_of_space', stderr, ["No space left on device"])
+           scanner.scan()
+           scanner.get_lines('out_of_space')  # -> list of matched lines
+    """
+
+    blocksize = 4 * 1024 * 1024  # read buffer size, 4 Mb
+
+    def __init__(self, nlines=10):
+        """
+        Init function.
+
+        :param nlines: number of lines to keep from the end of each file (int).
+        """
+
+        self.nlines = nlines
+        self.signatures = collections.OrderedDict()  # path -> list of (category, pattern)
+        self.matches = {}  # category -> list of matched lines
+        self.tails = {}  # path -> last lines of the file (string)
+
+    def add(self, category, path, patterns):
+        """
+        Register patterns to look for in the given file.
+
+        :param category: name of the category of the patterns (string).
+        :param path: path to file (string).
+        :param patterns: list of regexp patterns.
+        :return:
+        """
+
+        self.signatures.setdefault(path, [])
+        for pattern in patterns:
+            self.signatures[path].append((category, pattern))
+        self.matches.setdefault(category, [])
+
+    def scan(self):
+        """
+        Scan all registered files.
+
+        :return: dictionary {category: list of matched lines}.
+        """
+
+        for path in self.signatures:
+            if not os.path.exists(path):
+                logger.warning('file does not exist: %s (cannot scan it)' % path)
+                continue
+            try:
+                self.scan_file(path, self.signatures[path])
+                self.tails[path] = read_tail(path, nlines=self.nlines)
+            except (IOError, OSError) as e:
+                logger.warning('failed to scan %s: %s' % (path, e))
+
+        return self.matches
+
+    def scan_file(self, path, signatures):
+        """
+        Scan the given file for the given signatures.
+
+        :param path: path to file (string).
+        :param signatures: list of (category, pattern).
+        :return:
+        """
+
+        combined, compiled = self.compile(signatures)
+
+        with io.open(path, mode='rb') as f:
+            remainder = b''
+            while True:
+                data = f.read(self.blocksize)
+                if not data:
+                    buf = remainder
+                else:
+                    # only search complete lines, the last partial line is kept for the next block
+                    buf = remainder + data
+                    end = buf.rfind(b'\n') + 1
+                    buf, remainder = buf[:end], buf[end:]
+                self.search(buf, combined, compiled)
+                if not data:
+                    break
+
+    def compile(self, signatures):
+        """
+        Compile the given signatures, and their combination.
+
+        :param signatures: list of (category, pattern).
+        :return: combined compiled pattern, list of (category, compiled pattern).
+        """
+
+        compiled = [(category, re.compile(encode_pattern(pattern))) for category, pattern in signatures]
+        combined = re.compile(b'|'.join(b'(?:' + encode_pattern(pattern) + b')' for _, pattern in signatures))
+
+        return combined, compiled
+
+    def search(self, buf, combined, compiled):
+        """
+        Find all lines in the buffer that match the combined pattern, and add them to the matching categories.
+
+        :param buf: block of complete lines (bytes).
+        :param combined: compiled combined pattern.
+        :param compiled: list of (category, compiled pattern).
+        :return: list of (category, line) for the matched lines in this buffer.
+        """
+
+        found = []
+        pos = 0
+        while True:
+            match = combined.search(buf, pos)
+            if not match:
+                break
+            start = buf.rfind(b'\n', 0, match.start()) + 1
+            end = buf.find(b'\n', match.end())
+            end = len(buf) if end < 0 else end + 1
+            line = buf[start:end]
+            categories = []
+            for category, pattern in compiled:
+                if category not in categories and pattern.search(line):
+                    categories.append(category)
+            line = decode_line(line)
+            for category in categories:
+                self.matches[category].append(line)
+                found.append((category, line))
+            pos = end
+
+        return found
+
+    def get_lines(self, category):
+        """
+        Return the lines that matched the patterns of the given category.
+
+        :param category: category name (string).
+        :return: list of matched lines.
+        """
+
+        return self.matches.get(category, [])
+
+    def get_tail(self, path):
+        """
+        Return the last lines of the given (scanned) file.
+
+        :param path: path to file (string).
+        :return: file tail (string).
+        """
+
+        return self.tails.get(path, "")
+
+
+def encode_pattern(pattern):
+    """
+    Return the pattern as bytes (for searching in data read in binary mode).
+
+    :param pattern: regexp pattern (string).
+    :return: pattern (bytes).
+    """
+
+    if isinstance(pattern, bytes):
+        return pattern
+
+    return pattern.encode('utf-8')
+
+
+def decode_line(line):
+    """
+    Return a line read in binary mode as a native string.
+
+    :param line: line (bytes).
+    :return: line (string).
+    """
+
+    if isinstance(line, str):  # Python 2
+        return line
+
+    return line.decode('utf-8', 'replace')
+
+
+def read_tail(filename, nlines=10, blocksize=65536):
+    """
+    Return the last n lines of a file (like the output of the posix tail function, without running it).
+    As for `tail()`, a final newline is removed.
+
+    :param filename: name of file (string).
+    :param nlines: number of lines (int).
+    :param blocksize: size of the blocks read from the end of the file (int).
+    :return: file tail (string).
+    """
+
+    with io.open(filename, mode='rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b''
+        # a trailing newline does not start a new line
+        while position > 0 and data.count(b'\n', 0, len(data) - 1) < nlines:
+            size = min(blocksize, position)
+            position -= size
+            f.seek(position)
+            data = f.read(size) + data
+
+    if nlines <= 0:
+        return ""
+    if data.endswith(b'\n'):
+        data = b'\n'.join(data[:-1].split(b'\n')[-nlines:])
+    else:
+        data = b'\n'.join(data.split(b'\n')[-nlines:])
+
+    return decode_line(data)
+
+
 def verify_file_list(list_of_files):
     """
     Make sure that the files in the given list exist, return the list of files that does exist.
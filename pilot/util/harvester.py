@@ -13,7 +13,7 @@ import socket
 
 from pilot.common.exception import FileHandlingFailure
 from pilot.util.config import config
-from pilot.util.filehandling import write_json, touch, remove, read_json, get_checksum_value
+from pilot.util.filehandling import write_json, touch, remove, read_json, get_checksum_value, mkdirs
 from pilot.util.timing import time_stamp
 
 import logging
@@ -127,45 +127,116 @@ def get_initial_work_report():
     return work_report
 
 
-def get_event_status_file(args):
+def get_max_concurrent_jobs(args):
     """
-    Return the name of the event_status.dump file as defined in the pilot config file
-    and from the pilot arguments.
+    Return the max number of jobs from the Harvester job definition file that are run at the same time.
+    A value larger than one defines the multi-job mode, where the cores and memory of the worker node are shared
+    between the jobs (see partition_resources()).
 
     :param args: Pilot arguments object.
-    :return: event staus file name.
+    :return: number of jobs (int).
     """
 
-    logger.debug('config.Harvester.__dict__ : {0}'.format(config.Harvester.__dict__))
+    if not getattr(args, 'harvester', False):
+        return 1
+
+    try:
+        return max(1, int(getattr(args, 'harvester_maxjobs', 1)))
+    except (TypeError, ValueError):
+        return 1
+
+
+def partition_resources(job_definitions, corecount, maxjobs):
+    """
+    Share the cores of the worker node between the jobs from the Harvester job definition file.
+    At most maxjobs jobs run at the same time, the remaining jobs are started when running jobs have completed.
+    Each job keeps its requested number of cores (coreCount, default 1) if any maxjobs jobs fit on the node, otherwise
+    the cores are shared in proportion to the requests (at least one core per job).
+    Note: the memory limit of a job follows its core count (see the ucore scale factor of the memory check).
+
+    :param job_definitions: list of job definition dictionaries (updated in place).
+    :param corecount: number of cores of the worker node (int, 0 if unknown).
+    :param maxjobs: max number of jobs run at the same time (int).
+    :return: list of job definition dictionaries.
+    """
+
+    requested = []
+    for job_definition in job_definitions:
+        try:
+            requested.append(max(1, int(job_definition.get('coreCount') or 1)))
+        except (TypeError, ValueError):
+            requested.append(1)
+
+    # the jobs with the largest requests define the number of cores needed at the same time
+    total = sum(sorted(requested, reverse=True)[:max(1, maxjobs)])
+    if corecount and total > corecount:
+        cores = [max(1, n * corecount // total) for n in requested]
+    else:
+        cores = requested
+
+    for job_definition, n in zip(job_definitions, cores):
+        job_definition['coreCount'] = n
+        logger.info('job %s will use %d core(s)' % (job_definition.get('PandaID'), n))
+
+    return job_definitions
+
+
+def get_access_point(args, jobid=None):
+    """
+    Return the directory where the files for Harvester are placed.
+    In multi-job mode each job has its own access point, named after the job id, in the Harvester work directory.
+
+    :param args: Pilot arguments object.
+    :param jobid: job id (string, only used in multi-job mode).
+    :return: path (string).
+    """
 
     if args.harvester_workdir != '':
         work_dir = args.harvester_workdir
     else:
         work_dir = os.environ['PILOT_HOME']
+
+    if jobid and get_max_concurrent_jobs(args) > 1:
+        work_dir = os.path.join(work_dir, str(jobid))
+        if not os.path.exists(work_dir):
+            mkdirs(work_dir)
+
+    return work_dir
+
+
+def get_event_status_file(args, jobid=None):
+    """
+    Return the name of the event_status.dump file as defined in the pilot config file
+    and from the pilot arguments.
+
+    :param args: Pilot arguments object.
+    :param jobid: job id (string, only used in multi-job mode).
+    :return: event staus file name.
+    """
+
+    logger.debug('config.Harvester.__dict__ : {0}'.format(config.Harvester.__dict__))
+
     event_status_file = config.Harvester.stageoutnfile
-    event_status_file = os.path.join(work_dir, event_status_file)
+    event_status_file = os.path.join(get_access_point(args, jobid), event_status_file)
     logger.debug('event_status_file = {}'.format(event_status_file))
 
     return event_status_file
 
 
-def get_worker_attributes_file(args):
+def get_worker_attributes_file(args, jobid=None):
     """
     Return the name of the worker attributes file as defined in the pilot config file
     and from the pilot arguments.
 
     :param args: Pilot arguments object.
+    :param jobid: job id (string, only used in multi-job mode).
     :return: worker attributes file name.
     """
 
     logger.debug('config.Harvester.__dict__ : {0}'.format(config.Harvester.__dict__))
 
-    if args.harvester_workdir != '':
-        work_dir = args.harvester_workdir
-    else:
-        work_dir = os.environ['PILOT_HOME']
     worker_attributes_file = config.Harvester.workerattributesfile
-    worker_attributes_file = os.path.join(work_dir, worker_attributes_file)
+    worker_attributes_file = os.path.join(get_access_point(args, jobid), worker_attributes_file)
     logger.debug('worker_attributes_file = {}'.format(worker_attributes_file))
 
     return worker_attributes_file
@@ -306,12 +377,13 @@ def publish_job_report(job, args, job_report_file="jobReport.json"):
     :return True or False
     """
 
+    access_point = get_access_point(args, job.jobid)
     src_file = os.path.join(job.workdir, job_report_file)
-    dst_file = os.path.join(args.harvester_workdir, job_report_file)
+    dst_file = os.path.join(access_point, job_report_file)
 
     try:
         logger.info(
-            "copy of payload report [{0}] to access point: {1}".format(job_report_file, args.harvester_workdir))
+            "copy of payload report [{0}] to access point: {1}".format(job_report_file, access_point))
         # shrink jobReport
         job_report = read_json(src_file)
         if 'executor' in job_report:
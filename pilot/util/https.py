@@ -7,19 +7,31 @@
 # Authors:
 # - Daniel Drizhuk, d.drizhuk@gmail.com, 2017
 # - Mario Lassnig, mario.lassnig@cern.ch, 2017
-# - Paul Nilsson, paul.nilsson@cern.ch, 2017
+# - Paul Nilsson, paul.nilsson@cern.ch, 2017-2020
 
 import collections
+import errno
 import subprocess  # Python 2/3
 try:
     import commands  # Python 2
 except Exception:
     pass
+try:
+    import http.client as httplib  # Python 3
+except Exception:
+    import httplib  # Python 2
+try:
+    from urllib.parse import urlparse  # Python 3
+except Exception:
+    from urlparse import urlparse  # Python 2
 import json
 import os
 import platform
+import socket
 import ssl
 import sys
+import threading
+import zlib
 try:
     import urllib.request  # Python 3
     import urllib.error  # Python 3
@@ -37,6 +49,18 @@ logger = logging.getLogger(__name__)
 
 _ctx = collections.namedtuple('_ctx', 'ssl_context user_agent capath cacert')
 
+# connection pool for in-process requests, created on first use (see get_connection_pool())
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class RequestNotSent(socket.error):
+    """
+    The connection to the server could not be established, i.e. the request was not sent and can safely be sent again.
+    """
+
+    pass
+
 
 def _tester(func, *args):
     """
@@ -139,16 +163,255 @@ def https_setup(args, version):
         try:
             _ctx.ssl_context = ssl.create_default_context(capath=_ctx.capath,
                                                           cafile=_ctx.cacert)
+            if _ctx.cacert:
+                # the X509 proxy contains both the certificate chain and the key (cf. curl --cert and --key)
+                _ctx.ssl_context.load_cert_chain(certfile=_ctx.cacert, keyfile=_ctx.cacert)
         except Exception as e:
             logger.warn('SSL communication is impossible due to SSL error: %s -- falling back to curl' % str(e))
             _ctx.ssl_context = None
 
+    # any existing connections were set up with the previous context
+    reset_connection_pool()
+
+
+class HTTPSConnectionPool(object):
+    """
+    Pool of persistent (keep-alive) HTTPS connections, keyed by host and port.
+    Connections are taken from the pool for the duration of a single request and returned afterwards, unless the
+    server asked for the connection to be closed. The TLS handshake is thus done once per connection instead of once
+    per request.
+    """
+
+    def __init__(self, ssl_context, timeout=120, maxsize=4):
+        """
+        Init function.
+
+        :param ssl_context: `ssl.SSLContext` object (as set up by `https_setup`).
+        :param timeout: socket timeout in seconds (int).
+        :param maxsize: maximum number of idle connections to keep per host (int).
+        """
+
+        self.ssl_context = ssl_context
+        self.timeout = timeout
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.connections = {}  # (host, port) -> list of idle connections
+        self.nrequests = 0
+        self.nconnections = 0
+
+    def get_connection(self, host, port):
+        """
+        Return an idle connection to the given host, or a new one if there is none.
+
+        :param host: host name (string).
+        :param port: port number (int).
+        :return: connection object, reused (Boolean).
+        """
+
+        with self.lock:
+            idle = self.connections.get((host, port))
+            if idle:
+                return idle.pop(), True
+            self.nconnections += 1
+
+        return httplib.HTTPSConnection(host, port, timeout=self.timeout, context=self.ssl_context), False
+
+    def put_connection(self, host, port, connection):
+        """
+        Return a connection to the pool (it is closed if the pool is full).
+
+        :param host: host name (string).
+        :param port: port number (int).
+        :param connection: connection object.
+        :return:
+        """
+
+        with self.lock:
+            idle = self.connections.setdefault((host, port), [])
+            if len(idle) < self.maxsize:
+                idle.append(connection)
+                return
+
+        connection.close()
+
+    def close(self):
+        """
+        Close all idle connections.
+
+        :return:
+        """
+
+        with self.lock:
+            for idle in self.connections.values():
+                for connection in idle:
+                    connection.close()
+            self.connections = {}
+
+    def request(self, url, body, headers):
+        """
+        Send a POST request over a pooled connection.
+        If a reused connection turns out to have been closed by the server before the response started (connection
+        reset, broken pipe or no status line), the request is repeated once on a new connection. Timeouts and errors
+        while reading the response are never retried, since the server may already have processed the request.
+
+        :param url: URL of the resource (string).
+        :param body: request body (string).
+        :param headers: request headers (dictionary).
+        :raises: RequestNotSent if the connection (or the TLS handshake) failed before the request was sent,
+                 socket.error, httplib.HTTPException for other transport errors.
+        :return: status code (int), response content (bytes).
+        """
+
+        parsed = urlparse(url)
+        host = parsed.hostname
+        port = parsed.port or 443
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+
+        with self.lock:
+            self.nrequests += 1
+
+        while True:
+            connection, reused = self.get_connection(host, port)
+            if not reused:
+                try:
+                    connection.connect()
+                except (socket.error, httplib.HTTPException) as e:
+                    connection.close()
+                    raise RequestNotSent('failed to connect to %s:%d: %s' % (host, port, e))
+            try:
+                connection.request('POST', path, body, headers)
+                response = connection.getresponse()
+            except (socket.error, httplib.HTTPException) as e:
+                connection.close()
+                if reused and is_stale_connection_error(e):
+                    logger.debug('reused connection to %s:%d was closed (%s) - retrying on new connection' % (host, port, e))
+                    continue
+                raise
+
+            try:
+                content = response.read()
+            except Exception:
+                connection.close()
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self.put_connection(host, port, connection)
+
+            if response.getheader('Content-Encoding') == 'gzip':
+                content = zlib.decompress(content, 16 + zlib.MAX_WBITS)
+
+            return response.status, content
+
+
+def is_stale_connection_error(error):
+    """
+    Is the error the sign of an idle connection closed by the server, i.e. the request was not processed?
+    Timeouts are not, the server may still be processing the request.
+
+    :param error: exception raised while sending the request or waiting for the status line.
+    :return: Boolean.
+    """
+
+    if isinstance(error, socket.timeout):
+        return False
+    if isinstance(error, httplib.BadStatusLine):  # includes RemoteDisconnected (Python 3)
+        return True
+
+    return getattr(error, 'errno', None) in (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+
+def get_connection_pool():
+    """
+    Return the connection pool for in-process requests.
+    The pool is created on first use with the SSL context set up by `https_setup`.
+
+    :return: `HTTPSConnectionPool` object (None if there is no SSL context).
+    """
+
+    global _pool
+
+    ssl_context = _ctx.ssl_context
+    if not isinstance(ssl_context, getattr(ssl, 'SSLContext', ())):  # https_setup() not called, or failed
+        return None
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = HTTPSConnectionPool(ssl_context)
+
+    return _pool
+
+
+def reset_connection_pool():
+    """
+    Close all pooled connections and drop the pool (it will be recreated on next use).
+
+    :return:
+    """
+
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = None
+
+
+def send_with_pool(pool, url, data, plain):
+    """
+    Send a request over a persistent connection from the connection pool.
+
+    :param pool: `HTTPSConnectionPool` object.
+    :param url: the URL of the resource (string).
+    :param data: data to send (dictionary).
+    :param plain: if true, treats the response as a plain text (Boolean).
+    :raises: RequestNotSent if the request was not sent, socket.error, httplib.HTTPException for transport errors.
+    :return: response (dictionary, or string if plain, None if something went wrong).
+    """
+
+    try:
+        body = urllib.parse.urlencode(data or {})  # Python 3
+    except Exception:
+        body = urllib.urlencode(data or {})  # Python 2
+    headers = {'User-Agent': _ctx.user_agent,
+               'Content-Type': 'application/x-www-form-urlencoded',
+               'Accept-Encoding': 'gzip'}
+    if not plain:
+        headers['Accept'] = 'application/json'
+
+    logger.info('request: %s (persistent connection)' % url)
+    status, content = pool.request(url, body.encode('utf-8'), headers)
+    if is_python3():
+        content = content.decode('utf-8', 'replace')
+
+    if status != 200:
+        logger.warn('server error (%s): %s' % (status, content))
+        return None
+
+    if plain:
+        return content
+
+    try:
+        ret = json.loads(content)
+    except Exception as e:
+        logger.warning('json.loads() failed to parse output=%s: %s' % (content, e))
+        return None
+
+    return ret
+
 
 def request(url, data=None, plain=False, secure=True):  # noqa: C901
     """
     This function sends a request using HTTPS.
     Sends :mailheader:`User-Agent` and certificates previously being set up by `https_setup`.
-    If `ssl.SSLContext` is available, uses `urllib2` as a request processor. Otherwise uses :command:`curl`.
+    If `ssl.SSLContext` is available, the request is sent over a persistent connection from the connection pool
+    (see `HTTPSConnectionPool`). Otherwise, or if the connection to the server could not be established, uses
+    :command:`curl`. A request that failed after it was sent (e.g. a timeout while waiting for the response) is not
+    sent again, since the server may already have processed it.
+    Insecure requests (``secure`` is `False`) are sent with `urllib2`.
 
     If ``data`` is provided, encodes it as a URL form data and sends it to the server.
 
@@ -173,10 +436,62 @@ def request(url, data=None, plain=False, secure=True):  # noqa: C901
         - `None` -- if something went wrong
     """
 
-    _ctx.ssl_context = None  # certificates are not available on the grid, use curl
-
     logger.debug('server update dictionary = \n%s' % str(data))
 
+    if secure:
+        pool = get_connection_pool()
+        if pool:
+            try:
+                return send_with_pool(pool, url, data, plain)
+            except RequestNotSent as e:
+                logger.warning('in-process request could not be sent: %s (will fall back to curl)' % e)
+            except (socket.error, httplib.HTTPException) as e:
+                logger.warning('in-process request failed: %s (will not be sent again)' % e)
+                return None
+
+        return send_with_curl(url, data, plain)
+
+    try:
+        req = urllib.request.Request(url, urllib.parse.urlencode(data))  # Python 3
+    except Exception:
+        req = urllib2.Request(url, urllib.urlencode(data))  # Python 2
+    if not plain:
+        req.add_header('Accept', 'application/json')
+
+    if is_python3():  # Python 3
+        try:
+            output = urllib.request.urlopen(req)
+        except urllib.error.HTTPError as e:
+            logger.warn('server error (%s): %s' % (e.code, e.read()))
+            return None
+        except urllib.error.URLError as e:
+            logger.warn('connection error: %s' % e.reason)
+            return None
+    else:  # Python 2
+        try:
+            output = urllib2.urlopen(req)
+        except urllib2.HTTPError as e:
+            logger.warn('server error (%s): %s' % (e.code, e.read()))
+            return None
+        except urllib2.URLError as e:
+            logger.warn('connection error: %s' % e.reason)
+            return None
+
+    return output.read() if plain else json.load(output)
+
+
+def send_with_curl(url, data, plain):  # noqa: C901
+    """
+    Send a request using curl.
+    This is the fallback for when the in-process client cannot be used (no SSL context, or connection errors).
+
+    :param url: the URL of the resource (string).
+    :param data: data to send (dictionary).
+    :param plain: if true, treats the response as a plain text (Boolean).
+    :return: response (dictionary, or string if plain, None if something went wrong).
+    """
+
+    data = data or {}
     strdata = ""
     for key in data:
         try:
@@ -198,68 +513,35 @@ def request(url, data=None, plain=False, secure=True):  # noqa: C901
     else:
         dat = '--config %s %s' % (tmpname, url)
 
-    if _ctx.ssl_context is None and secure:
-        req = 'curl -sS --compressed --connect-timeout %s --max-time %s '\
-              '--capath %s --cert %s --cacert %s --key %s '\
-              '-H %s %s %s' % (100, 120,
-                               pipes.quote(_ctx.capath or ''), pipes.quote(_ctx.cacert or ''),
-                               pipes.quote(_ctx.cacert or ''), pipes.quote(_ctx.cacert or ''),
-                               pipes.quote('User-Agent: %s' % _ctx.user_agent),
-                               "-H " + pipes.quote('Accept: application/json') if not plain else '',
-                               dat)
-        logger.info('request: %s' % req)
+    req = 'curl -sS --compressed --connect-timeout %s --max-time %s '\
+          '--capath %s --cert %s --cacert %s --key %s '\
+          '-H %s %s %s' % (100, 120,
+                           pipes.quote(_ctx.capath or ''), pipes.quote(_ctx.cacert or ''),
+                           pipes.quote(_ctx.cacert or ''), pipes.quote(_ctx.cacert or ''),
+                           pipes.quote('User-Agent: %s' % _ctx.user_agent),
+                           "-H " + pipes.quote('Accept: application/json') if not plain else '',
+                           dat)
+    logger.info('request: %s' % req)
+    try:
         try:
-            try:
-                status, output = subprocess.getstatusoutput(req)  # Python 3
-            except Exception:
-                status, output = commands.getstatusoutput(req)  # Python 2
-        except Exception as e:
-            logger.warning('exception: %s' % e)
+            status, output = subprocess.getstatusoutput(req)  # Python 3
+        except Exception:
+            status, output = commands.getstatusoutput(req)  # Python 2
+    except Exception as e:
+        logger.warning('exception: %s' % e)
+        return None
+    else:
+        if status != 0:
+            logger.warn('request failed (%s): %s' % (status, output))
             return None
-        else:
-            if status != 0:
-                logger.warn('request failed (%s): %s' % (status, output))
-                return None
 
-        if plain:
-            return output
-        else:
-            try:
-                ret = json.loads(output)
-            except Exception as e:
-                logger.warning('json.loads() failed to parse output=%s: %s' % (output, e))
-                return None
-            else:
-                return ret
-        # return output if plain else json.loads(output)
+    if plain:
+        return output
     else:
         try:
-            req = urllib.request.Request(url, urllib.parse.urlencode(data))  # Python 3
-        except Exception:
-            req = urllib2.Request(url, urllib.urlencode(data))  # Python 2
-        if not plain:
-            req.add_header('Accept', 'application/json')
-        if secure:
-            req.add_header('User-Agent', _ctx.user_agent)
-        context = _ctx.ssl_context if secure else None
-
-        if is_python3():  # Python 3
-            try:
-                output = urllib.request.urlopen(req, context=context)
-            except urllib.error.HTTPError as e:
-                logger.warn('server error (%s): %s' % (e.code, e.read()))
-                return None
-            except urllib.error.URLError as e:
-                logger.warn('connection error: %s' % e.reason)
-                return None
-        else:  # Python 2
-            try:
-                output = urllib2.urlopen(req, context=context)
-            except urllib2.HTTPError as e:
-                logger.warn('server error (%s): %s' % (e.code, e.read()))
-                return None
-            except urllib2.URLError as e:
-                logger.warn('connection error: %s' % e.reason)
-                return None
-
-        return output.read() if plain else json.load(output)
+            ret = json.loads(output)
+        except Exception as e:
+            logger.warning('json.loads() failed to parse output=%s: %s' % (output, e))
+            return None
+        else:
+            return ret
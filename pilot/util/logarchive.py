@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
+
+import os
+import stat
+import struct
+import tarfile
+import time
+import zlib
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+import logging
+logger = logging.getLogger(__name__)
+
+"""
+In-process creation of the log tarball.
+The work directory is walked once, the files are streamed through tarfile into a gzip writer which compresses blocks
+of the stream in several threads (zlib releases the GIL). Every block is written as a complete gzip member, and a
+multi-member gzip file is read as one stream by gunzip, tar and the gzip/tarfile modules.
+"""
+
+
+def compress_block(data, compresslevel):
+    """
+    Compress a block of data into a complete gzip member.
+
+    :param data: uncompressed data (bytes).
+    :param compresslevel: compression level (1-9).
+    :return: gzip member (bytes).
+    """
+
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+    header = struct.pack('<BBBBIBB', 0x1f, 0x8b, 8, 0, 0, 0, 255)  # magic, deflate, no flags, no mtime, unknown OS
+    trailer = struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data) & 0xffffffff)
+
+    return header + compressor.compress(data) + compressor.flush() + trailer
+
+
+class ParallelGzipWriter(object):
+    """
+    Write-only file object producing a gzip stream compressed by several threads.
+    Blocks are compressed in parallel and written to the output file in order. The number of blocks in flight is
+    bounded, so the memory usage is about 2 * nthreads * blocksize.
+    """
+
+    def __init__(self, fileobj, nthreads=4, blocksize=1024 * 1024, compresslevel=6):
+        """
+        Init function.
+
+        :param fileobj: output file object (opened in binary mode).
+        :param nthreads: number of compression threads (int).
+        :param blocksize: size of the independently compressed blocks in B (int).
+        :param compresslevel: compression level (1-9).
+        """
+
+        self.fileobj = fileobj
+        self.nthreads = max(1, nthreads)
+        self.blocksize = blocksize
+        self.compresslevel = compresslevel
+
+        self.pool = ThreadPool(self.nthreads)
+        self.pending = deque()  # compression results in stream order
+        self.chunks = []
+        self.nchunks = 0  # number of bytes in chunks
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.nblocks = 0
+        self.closed = False
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('write to closed file')
+
+        self.chunks.append(bytes(data))
+        self.nchunks += len(data)
+        self.bytes_in += len(data)
+        if self.nchunks >= self.blocksize:
+            self.submit()
+            self.flush_results(2 * self.nthreads)
+
+    def submit(self):
+        """
+        Send the buffered data to the compression threads.
+        """
+
+        data = b''.join(self.chunks)
+        self.chunks = []
+        self.nchunks = 0
+        for i in range(0, len(data), self.blocksize):
+            self.pending.append(self.pool.apply_async(compress_block, (data[i:i + self.blocksize], self.compresslevel)))
+
+    def flush_results(self, maxpending=0):
+        """
+        Write the compressed blocks to the output file: the finished blocks at the head of the queue and, if needed,
+        wait for blocks until no more than maxpending blocks are in flight.
+
+        :param maxpending: max number of blocks left in flight (int).
+        """
+
+        while self.pending and (len(self.pending) > maxpending or self.pending[0].ready()):
+            member = self.pending.popleft().get()
+            self.fileobj.write(member)
+            self.bytes_out += len(member)
+            self.nblocks += 1
+
+    def close(self):
+        if self.closed:
+            return
+
+        try:
+            if self.chunks:
+                self.submit()
+            elif not self.nblocks and not self.pending:
+                # an empty stream is still a valid gzip file
+                self.pending.append(self.pool.apply_async(compress_block, (b'', self.compresslevel)))
+            self.flush_results()
+            self.fileobj.flush()
+        finally:
+            self.closed = True
+            self.pool.terminate()
+            self.pool.join()
+
+
+class TruncatedFile(object):
+    """
+    Read-only file object returning at most size bytes of a file, padded with zeros if the file shrinks while it is
+    being read (the size of the member has already been written to the tar header).
+    """
+
+    def __init__(self, fileobj, size):
+        self.fileobj = fileobj
+        self.left = size
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.left:
+            size = self.left
+        data = self.fileobj.read(size)
+        if len(data) < size:
+            data += b'\0' * (size - len(data))
+        self.left -= size
+        return data
+
+
+def create_log_archive(path, directory, arcname=None, exclude=None, nthreads=4, compresslevel=6, max_size=None,  # noqa: C901
+                       max_member_size=None, blocksize=1024 * 1024):
+    """
+    Create a gzipped tarball of a directory, like 'tar cfz path arcname --dereference --one-file-system'.
+    The symbolic links are followed, broken links and directories on other file systems are skipped, as is the
+    tarball itself if it is created inside the directory.
+
+    :param path: path of the tarball (string).
+    :param directory: directory to archive (string).
+    :param arcname: name of the directory in the tarball (default: the base name of the directory).
+    :param exclude: optional function called with the path relative to directory ('/' separated) and a Boolean (True
+    for directories), returning True if the file or directory should be left out.
+    :param nthreads: number of compression threads (int).
+    :param compresslevel: compression level (1-9).
+    :param max_size: optional max size of the tarball in B. Once reached, the remaining files are skipped. The limit is
+    checked between files and does not include the blocks still being compressed.
+    :param max_member_size: optional max size of the files in B. Larger files are truncated.
+    :param blocksize: size of the independently compressed blocks in B (int).
+    :return: statistics dictionary.
+    """
+
+    t0 = time.time()
+    directory = os.path.abspath(directory)
+    if arcname is None:
+        arcname = os.path.basename(directory)
+    stats = {'files': 0, 'directories': 0, 'excluded': 0, 'truncated': 0, 'skipped': 0, 'bytes_in': 0, 'bytes_out': 0}
+
+    with open(path, 'wb') as fileobj:
+        output = os.fstat(fileobj.fileno())
+        writer = ParallelGzipWriter(fileobj, nthreads=nthreads, blocksize=blocksize, compresslevel=compresslevel)
+        try:
+            archive = tarfile.open(mode='w|', fileobj=writer, dereference=True, format=tarfile.GNU_FORMAT)
+            device = os.stat(directory).st_dev
+            visited = set()  # directories (device, inode), to detect symbolic link loops
+            for root, dirnames, filenames in os.walk(directory, followlinks=True):
+                relroot = os.path.relpath(root, directory).replace(os.sep, '/')
+                relroot = '' if relroot == '.' else relroot + '/'
+                try:
+                    _stat = os.stat(root)
+                except OSError:
+                    dirnames[:] = []
+                    continue
+                if (_stat.st_dev, _stat.st_ino) in visited:
+                    dirnames[:] = []
+                    continue
+                visited.add((_stat.st_dev, _stat.st_ino))
+                tarinfo = archive.gettarinfo(root, (arcname + '/' + relroot).rstrip('/'))
+                archive.addfile(tarinfo)
+                stats['directories'] += 1
+                if _stat.st_dev != device:
+                    dirnames[:] = []  # mount point: its content is left out
+                    continue
+
+                kept = []
+                for dirname in sorted(dirnames):
+                    if exclude and exclude(relroot + dirname, True):
+                        stats['excluded'] += 1
+                    else:
+                        kept.append(dirname)
+                dirnames[:] = kept
+
+                for filename in sorted(filenames):
+                    relpath = relroot + filename
+                    if exclude and exclude(relpath, False):
+                        stats['excluded'] += 1
+                        continue
+                    filepath = os.path.join(root, filename)
+                    try:
+                        _stat = os.stat(filepath)
+                    except OSError:
+                        logger.debug('skipping broken link: %s' % filepath)
+                        continue
+                    if (_stat.st_dev, _stat.st_ino) == (output.st_dev, output.st_ino):
+                        continue
+                    writer.flush_results(2 * writer.nthreads)
+                    if max_size and writer.bytes_out >= max_size:
+                        stats['skipped'] += 1
+                        continue
+                    add_file(archive, filepath, arcname + '/' + relpath, _stat, max_member_size, stats)
+            archive.close()
+        finally:
+            writer.close()
+
+    if stats['skipped']:
+        logger.warning('log file size limit (%d B) reached: %d file(s) left out' % (max_size, stats['skipped']))
+    stats['bytes_in'] = writer.bytes_in
+    stats['bytes_out'] = writer.bytes_out
+    stats['time'] = time.time() - t0
+    stats['throughput'] = writer.bytes_in / stats['time'] / 1024 ** 2 if stats['time'] > 0 else 0.0  # MB/s
+    logger.info('created %s with %d file(s): %d B -> %d B in %.1f s (%.1f MB/s, %d thread(s))' %
+                (path, stats['files'], stats['bytes_in'], stats['bytes_out'], stats['time'], stats['throughput'], nthreads))
+
+    return stats
+
+
+def add_file(archive, filepath, name, _stat, max_member_size, stats):
+    """
+    Add a file (or a special file) to the archive, truncated to max_member_size.
+
+    :param archive: tarfile object.
+    :param filepath: path of the file (string).
+    :param name: name of the member (string).
+    :param _stat: os.stat() result of the file.
+    :param max_member_size: optional max size in B (int).
+    :param stats: statistics dictionary (updated).
+    """
+
+    tarinfo = archive.gettarinfo(filepath, name)
+    if not stat.S_ISREG(_stat.st_mode):
+        archive.addfile(tarinfo)
+        stats['files'] += 1
+        return
+
+    if max_member_size and tarinfo.size > max_member_size:
+        logger.warning('truncating %s from %d B to %d B in the log file' % (name, tarinfo.size, max_member_size))
+        tarinfo.size = max_member_size
+        stats['truncated'] += 1
+
+    try:
+        fileobj = open(filepath, 'rb')
+    except IOError as e:
+        logger.warning('failed to open %s: %s' % (filepath, e))
+        return
+    with fileobj:
+        archive.addfile(tarinfo, TruncatedFile(fileobj, tarinfo.size))
+    stats['files'] += 1
@@ -5,16 +5,17 @@
 # http://www.apache.org/licenses/LICENSE-2.0
 #
 # Authors:
-# - Paul Nilsson, paul.nilsson@cern.ch, 2018-2019
+# - Paul Nilsson, paul.nilsson@cern.ch, 2018-2020
 
 from pilot.common.errorcodes import ErrorCodes
 from pilot.util.auxiliary import whoami, get_logger, set_pilot_state
 from pilot.util.config import config
 from pilot.util.container import execute
-from pilot.util.filehandling import remove_files, find_latest_modified_file, verify_file_list
+from pilot.util.filehandling import remove_files
 from pilot.util.parameters import convert_to_int
 from pilot.util.processes import kill_processes
 from pilot.util.timing import time_stamp
+from pilot.util.workdirtracker import get_workdir_tracker
 
 import os
 import time
@@ -78,6 +79,7 @@ def get_time_for_last_touch(job, mt, looping_limit):
     """
     Return the time when the files in the workdir were last touched.
     in case no file was touched since the last check, the returned value will be the same as the previous time.
+    The modification times are tracked continuously by the workdir tracker, i.e. the workdir is not searched here.
 
     :param job: job object.
     :param mt: `MonitoringTime` object.
@@ -87,42 +89,42 @@ def get_time_for_last_touch(job, mt, looping_limit):
 
     log = get_logger(job.jobid)
 
+    tracker = get_job_workdir_tracker(job)
+    if not tracker:
+        log.info('work directory is no longer tracked (job has finished)')
+        return mt.ct_looping_last_touched
+    mtime, path = tracker.get_last_touched()
+
+    # only consider files that were modified within the looping limit (e.g. input files can have old mod times)
+    if mtime and int(mtime) > int(time.time()) - looping_limit:
+        log.info("file %s is the most recently updated file (at time=%d)" % (path, mtime))
+
+        # store the time of the last file modification
+        mt.update('ct_looping_last_touched', modtime=int(mtime))
+    else:
+        log.warning('found no recently updated files')
+
+    return mt.ct_looping_last_touched
+
+
+def get_job_workdir_tracker(job):
+    """
+    Return the activity tracker for the work directory of the given job.
+    Files that should be ignored by the looping job algorithm (see `remove_unwanted_files()` in the user specific
+    loopingjob_definitions module) do not count as activity.
+
+    :param job: job object.
+    :return: WorkdirTracker object (None if the job has finished).
+    """
+
     pilot_user = os.environ.get('PILOT_USER', 'generic').lower()
     loopingjob_definitions = __import__('pilot.user.%s.loopingjob_definitions' % pilot_user,
                                         globals(), locals(), [pilot_user], 0)  # Python 2/3
 
-    # locate all files that were modified the last N minutes
-    cmd = "find %s -mmin -%d" % (job.workdir, int(looping_limit / 60))
-    exit_code, stdout, stderr = execute(cmd)
-    if exit_code == 0:
-        if stdout != "":
-            files = stdout.split("\n")  # find might add a \n even for single entries
-
-            # remove unwanted list items (*.py, *.pyc, workdir, ...)
-            files = loopingjob_definitions.remove_unwanted_files(job.workdir, files)
-            if files:
-                log.info('found %d files that were recently updated' % len(files))
-
-                updated_files = verify_file_list(files)
-
-                # now get the mod times for these file, and identify the most recently update file
-                latest_modified_file, mtime = find_latest_modified_file(updated_files)
-                if latest_modified_file:
-                    log.info("file %s is the most recently updated file (at time=%d)" % (latest_modified_file, mtime))
-                else:
-                    log.warning('looping job algorithm failed to identify latest updated file')
-                    return mt.ct_looping_last_touched
-
-                # store the time of the last file modification
-                mt.update('ct_looping_last_touched', modtime=mtime)
-            else:
-                log.warning("found no recently updated files!")
-        else:
-            log.warning('found no recently updated files')
-    else:
-        log.warning('find command failed: %d, %s, %s' % (exit_code, stdout, stderr))
+    def accept(path):
+        return bool(loopingjob_definitions.remove_unwanted_files(job.workdir, [path]))
 
-    return mt.ct_looping_last_touched
+    return get_workdir_tracker(job.workdir, accept=accept)
 
 
 def kill_looping_job(job):
@@ -14,15 +14,17 @@ import time
 from subprocess import PIPE
 from glob import glob
 
+from pilot.api.memorymonitor import MemoryMonitoring
 from pilot.common.errorcodes import ErrorCodes
 from pilot.util.auxiliary import get_logger
 from pilot.util.config import config
 from pilot.util.container import execute
-from pilot.util.filehandling import get_directory_size, remove_files, get_local_file_size
-from pilot.util.loopingjob import looping_job
+from pilot.util.filehandling import remove_files, get_local_file_size
+from pilot.util.loopingjob import looping_job, get_job_workdir_tracker
 from pilot.util.math import convert_mb_to_b, human2bytes
 from pilot.util.parameters import convert_to_int, get_maximum_input_sizes
-from pilot.util.processes import get_current_cpu_consumption_time, kill_processes, get_number_of_child_processes
+from pilot.util.processes import get_current_cpu_consumption_time, kill_processes, get_number_of_child_processes, \
+    ProcessTable
 from pilot.util.workernode import get_local_disk_space, check_hz
 
 import logging
@@ -31,7 +33,7 @@ logger = logging.getLogger(__name__)
 errors = ErrorCodes()
 
 
-def job_monitor_tasks(job, mt, args):
+def job_monitor_tasks(job, mt, args):  # noqa: C901
     """
     Perform the tasks for the job monitoring.
     The function is called once a minute. Individual checks will be performed at any desired time interval (>= 1
@@ -49,12 +51,15 @@ def job_monitor_tasks(job, mt, args):
     log = get_logger(job.jobid)
     current_time = int(time.time())
 
+    # take one snapshot of the process table that is shared by all process checks in this monitoring cycle
+    table = ProcessTable() if job.pid and os.path.exists('/proc/self/stat') else None
+
     # update timing info for running jobs (to avoid an update after the job has finished)
     if job.state == 'running':
         # confirm that the worker node has a proper SC_CLK_TCK (problems seen on MPPMU)
         check_hz()
         try:
-            cpuconsumptiontime = get_current_cpu_consumption_time(job.pid)
+            cpuconsumptiontime = get_current_cpu_consumption_time(job.pid, table=table)
         except Exception as e:
             diagnostics = "Exception caught: %s" % e
             log.warning(diagnostics)
@@ -74,9 +79,13 @@ def job_monitor_tasks(job, mt, args):
             job.cpuconsumptionunit = "s"
             job.cpuconversionfactor = 1.0
             log.info('CPU consumption time for pid=%d: %f (rounded to %d)' % (job.pid, cpuconsumptiontime, job.cpuconsumptiontime))
+        if table:
+            summary = table.get_tree_summary(job.pid)
+            log.info('payload process tree: %d processes, %d threads, RSS=%d B' %
+                     (summary.get('nprocs'), summary.get('threads'), summary.get('rss')))
 
         # check how many cores the payload is using
-        check_number_used_cores(job)
+        check_number_used_cores(job, table=table)
 
         # check memory usage (optional) for jobs in running state
         exit_code, diagnostics = verify_memory_usage(current_time, mt, job)
@@ -106,7 +115,7 @@ def job_monitor_tasks(job, mt, args):
 
     # is it time to verify the number of running processes?
     if job.pid:
-        exit_code, diagnostics = verify_running_processes(current_time, mt, job.pid)
+        exit_code, diagnostics = verify_running_processes(current_time, mt, job.pid, table=table)
         if exit_code != 0:
             return exit_code, diagnostics
 
@@ -117,16 +126,21 @@ def job_monitor_tasks(job, mt, args):
     return exit_code, diagnostics
 
 
-def check_number_used_cores(job):
+def check_number_used_cores(job, table=None):
     """
     Check the number of cores used by the payload.
     The number of actual used cores is reported with job metrics (if set).
+    The processors are taken from the process table snapshot if available, otherwise from ps.
 
     :param job: job object.
+    :param table: optional `ProcessTable` snapshot.
     :return:
     """
 
-    if job.pgrp:
+    if job.pgrp and table:
+        job.actualcorecount = len(table.get_processors_in_group(job.pgrp))
+        logger.debug('set number of actual cores to: %d' % job.actualcorecount)
+    elif job.pgrp:
         cmd = "ps axo pgid,psr | sort | grep %d | uniq | wc -l" % job.pgrp
         exit_code, stdout, stderr = execute(cmd, mute=True)
         logger.debug('%s:\n%s' % (cmd, stdout))
@@ -279,7 +293,7 @@ def verify_disk_usage(current_time, mt, job):
     return 0, ""
 
 
-def verify_running_processes(current_time, mt, pid):
+def verify_running_processes(current_time, mt, pid, table=None):
     """
     Verify the number of running processes.
     The function sets the environmental variable PILOT_MAXNPROC to the maximum number of found (child) processes
@@ -289,6 +303,7 @@ def verify_running_processes(current_time, mt, pid):
     :param current_time: current time at the start of the monitoring loop (int).
     :param mt: measured time object.
     :param pid: payload process id (int).
+    :param table: optional `ProcessTable` snapshot.
     :return: exit code (int), error diagnostics (string).
     """
 
@@ -297,7 +312,7 @@ def verify_running_processes(current_time, mt, pid):
     process_verification_time = convert_to_int(config.Pilot.process_verification_time, default=300)
     if current_time - mt.get('ct_process') > process_verification_time:
         # time to check the number of processes
-        nproc = get_number_of_child_processes(pid)
+        nproc = get_number_of_child_processes(pid, table=table)
         try:
             nproc_env = int(os.environ.get('PILOT_MAXNPROC', 0))
         except Exception as e:
@@ -345,6 +360,10 @@ def utility_monitor(job):
                 log.warning('detected crashed utility subprocess - will restart it')
                 utility_command = job.utilities[utcmd][2]
 
+                if isinstance(utproc, MemoryMonitoring):
+                    job.utilities[utcmd] = [utproc.execute(), utility_subprocess_launches + 1, utility_command]
+                    continue
+
                 try:
                     proc1 = execute(utility_command, workdir=job.workdir, returnproc=True, usecontainer=False,
                                     stdout=PIPE, stderr=PIPE, cwd=job.workdir, queuedata=job.infosys.queuedata)
@@ -488,7 +507,8 @@ def check_local_space():
 def check_work_dir(job):
     """
     Check the size of the work directory.
-    The function also updates the workdirsizes list in the job object.
+    The function also updates the workdirsizes list in the job object (with the peak size since the previous check),
+    and warns if the work directory is projected to reach the size limit before the next check.
 
     :param job: job object.
     :return: exit code (int), error diagnostics (string)
@@ -504,7 +524,13 @@ def check_work_dir(job):
         maxwdirsize = get_max_allowed_work_dir_size(job.infosys.queuedata)
 
         if os.path.exists(job.workdir):
-            workdirsize = get_directory_size(directory=job.workdir)
+            # the size is kept up to date by the workdir tracker (which is also used by the looping job algorithm)
+            tracker = get_job_workdir_tracker(job)
+            if not tracker:
+                log.info('skipping size check of workdir since the job has finished')
+                return exit_code, diagnostics
+            workdirsize = tracker.get_size()
+            peaksize = tracker.get_peak_size(reset=True)
 
             # is user dir within allowed size limit?
             if workdirsize > maxwdirsize:
@@ -527,14 +553,17 @@ def check_work_dir(job):
                     remove_files(job.workdir, lfns)
 
                     # remeasure the size of the workdir at this point since the value is stored below
-                    workdirsize = get_directory_size(directory=job.workdir)
+                    tracker.refresh([os.path.join(job.workdir, lfn) for lfn in lfns])
+                    workdirsize = tracker.get_size()
+                peaksize = workdirsize
             else:
-                log.info("size of work directory %s: %d B (within %d B limit)" %
-                         (job.workdir, workdirsize, maxwdirsize))
+                log.info("size of work directory %s: %d B (within %d B limit, peak size since last check: %d B)" %
+                         (job.workdir, workdirsize, maxwdirsize, peaksize))
+                check_work_dir_growth(job, tracker, maxwdirsize)
 
             # Store the measured disk space (the max value will later be sent with the job metrics)
-            if workdirsize > 0:
-                job.add_workdir_size(workdirsize)
+            if peaksize > 0:
+                job.add_workdir_size(peaksize)
         else:
             log.warning('job work dir does not exist: %s' % job.workdir)
     else:
@@ -543,6 +572,35 @@ def check_work_dir(job):
     return exit_code, diagnostics
 
 
+def check_work_dir_growth(job, tracker, maxwdirsize):
+    """
+    Report the growth rate of the work directory, and warn if it is projected to reach the size limit before the next
+    size check.
+
+    :param job: job object.
+    :param tracker: `WorkdirTracker` object for the work directory.
+    :param maxwdirsize: max allowed work dir size in B (int).
+    :return: projected time until the limit is reached in seconds (int) (None if the work directory is not growing).
+    """
+
+    log = get_logger(job.jobid)
+
+    rate = tracker.get_growth_rate()
+    if rate is None:
+        return None
+
+    time_to_limit = tracker.get_time_to_limit(maxwdirsize)
+    if time_to_limit is None:
+        log.info('work directory growth rate: %.1f B/s' % rate)
+    else:
+        log.info('work directory growth rate: %.1f B/s (size limit will be reached in %d s)' % (rate, time_to_limit))
+        disk_space_verification_time = convert_to_int(config.Pilot.disk_space_verification_time, default=300)
+        if time_to_limit < disk_space_verification_time:
+            log.warning('work directory is projected to reach the size limit before the next check')
+
+    return time_to_limit
+
+
 def get_max_allowed_work_dir_size(queuedata):
     """
     Return the maximum allowed size of the work directory.
@@ -22,36 +22,257 @@ import logging
 logger = logging.getLogger(__name__)
 
 
-def find_processes_in_group(cpids, pid):
+class ProcessTable(object):
+    """
+    Snapshot of the process table.
+    The snapshot is built by reading /proc/<pid>/stat once for all processes on the node, and keeps a ppid->children
+    index in memory, so that questions about a whole process tree (descendants, CPU time, RSS, number of threads)
+    can be answered without spawning any ps commands.
+    Usage: table = ProcessTable()
+           children = table.get_descendants(pid)
+    """
+
+    def __init__(self, proc='/proc'):
+        """
+        Take the initial snapshot of the process table.
+
+        :param proc: path to the proc file system (string).
+        """
+
+        self.proc = proc
+        self.processes = {}  # pid -> dictionary of process info
+        self.children = {}  # ppid -> list of child pids
+        try:
+            self.hz = os.sysconf(os.sysconf_names['SC_CLK_TCK'])
+        except Exception as e:
+            logger.warning('failed to get SC_CLK_TCK: %s' % e)
+            self.hz = 100
+        try:
+            self.pagesize = os.sysconf(os.sysconf_names['SC_PAGESIZE'])
+        except Exception as e:
+            logger.warning('failed to get SC_PAGESIZE: %s' % e)
+            self.pagesize = 4096
+
+        self.update()
+
+    def update(self):
+        """
+        Refresh the snapshot of the process table.
+
+        :return:
+        """
+
+        processes = {}
+        children = {}
+        try:
+            entries = os.listdir(self.proc)
+        except OSError as e:
+            logger.warning('failed to read %s: %s' % (self.proc, e))
+            entries = []
+
+        for entry in entries:
+            if not entry.isdigit():
+                continue
+            info = self.read_stat(os.path.join(self.proc, entry, 'stat'))
+            if not info:  # process has gone away
+                continue
+            pid = int(entry)
+            processes[pid] = info
+            children.setdefault(info['ppid'], []).append(pid)
+
+        for pids in children.values():
+            pids.sort()
+
+        self.processes = processes
+        self.children = children
+
+    def read_stat(self, path):
+        """
+        Read and parse a /proc/<pid>/stat file.
+        Note: the command name is enclosed in parentheses and may contain spaces, so the remaining fields are split
+        from the last closing parenthesis.
+
+        :param path: path to stat file (string).
+        :return: dictionary with process info (None if the file could not be read).
+        """
+
+        try:
+            with open(path) as fp:
+                data = fp.read()
+        except (IOError, OSError):
+            return None
+
+        pos = data.rfind(')')
+        if pos < 0:
+            return None
+        fields = data[pos + 2:].split()  # fields[0] is field 3 (state) in proc(5)
+        try:
+            info = {'comm': data[data.find('(') + 1:pos],
+                    'state': fields[0],
+                    'ppid': int(fields[1]),
+                    'pgrp': int(fields[2]),
+                    'cpu': float(sum(int(f) for f in fields[11:15])) / self.hz,  # utime+stime+cutime+cstime
+                    'utime': float(fields[11]) / self.hz,
+                    'stime': float(fields[12]) / self.hz,
+                    'threads': int(fields[17]),
+                    'vsize': int(fields[20]),
+                    'rss': int(fields[21]) * self.pagesize,
+                    'processor': int(fields[36]) if len(fields) > 36 else None}
+        except (IndexError, ValueError) as e:
+            logger.warning('failed to parse %s: %s' % (path, e))
+            return None
+
+        return info
+
+    def get_descendants(self, pid):
+        """
+        Return the pids of all processes in the tree below the given pid, including the pid itself.
+        The order is the same as returned by find_processes_in_group(), i.e. parents before children.
+
+        :param pid: parent process id (int).
+        :return: list of pids.
+        """
+
+        pids = []
+        if not pid or pid not in self.processes:
+            return pids
+
+        # (guard against pid reuse while the snapshot was taken)
+        seen = set()
+        stack = [pid]
+        while stack:
+            _pid = stack.pop()
+            if _pid in seen:
+                continue
+            seen.add(_pid)
+            pids.append(_pid)
+            stack.extend(reversed(self.children.get(_pid, [])))
+
+        return pids
+
+    def get_tree_summary(self, pid):
+        """
+        Return the summed up resource usage of the whole process tree below (and including) the given pid.
+
+        :param pid: parent process id (int).
+        :return: dictionary with number of processes, CPU time (s), RSS (B) and number of threads.
+        """
+
+        summary = {'nprocs': 0, 'cpu': 0.0, 'rss': 0, 'threads': 0}
+        for _pid in self.get_descendants(pid):
+            info = self.processes[_pid]
+            summary['nprocs'] += 1
+            summary['cpu'] += info['cpu']
+            summary['rss'] += info['rss']
+            summary['threads'] += info['threads']
+
+        return summary
+
+    def get_cpu_consumption_time(self, pid):
+        """
+        Return the CPU consumption time (system+user time, including that of waited-for children) of a process tree.
+
+        :param pid: parent process id (int).
+        :return: system+user time (float).
+        """
+
+        return self.get_tree_summary(pid).get('cpu')
+
+    def get_rss(self, pid):
+        """
+        Return the resident set size of a process tree.
+
+        :param pid: parent process id (int).
+        :return: RSS in B (int).
+        """
+
+        return self.get_tree_summary(pid).get('rss')
+
+    def get_number_of_threads(self, pid):
+        """
+        Return the number of threads in a process tree.
+
+        :param pid: parent process id (int).
+        :return: number of threads (int).
+        """
+
+        return self.get_tree_summary(pid).get('threads')
+
+    def get_processors_in_group(self, pgrp):
+        """
+        Return the set of processors on which the processes of the given process group last ran.
+
+        :param pgrp: process group id (int).
+        :return: set of processor numbers.
+        """
+
+        return set(info['processor'] for info in self.processes.values()
+                   if info['pgrp'] == pgrp and info['processor'] is not None)
+
+
+def get_process_table(table=None):
+    """
+    Return the given process table snapshot, or a new one if not set.
+
+    :param table: `ProcessTable` object (or None).
+    :return: `ProcessTable` object.
+    """
+
+    return table if table is not None else ProcessTable()
+
+
+def find_processes_in_group(cpids, pid, table=None):
     """
     Find all processes that belong to the same group.
-    Recursively search for the children processes belonging to pid and return their pid's.
+    Search for the children processes belonging to pid and return their pid's.
     pid is the parent pid and cpids is a list that has to be initialized before calling this function and it contains
     the pids of the children AND the parent.
+    Note: the process tree is taken from a /proc snapshot (a new one is taken if table is not set); on systems without
+    /proc, the process table is read with ps.
 
     :param cpids: list of pid's for all child processes to the parent pid, as well as the parent pid itself (int).
     :param pid: parent process id (int).
+    :param table: optional `ProcessTable` snapshot.
     :return: (updated cpids input parameter list).
     """
 
     if not pid:
         return
 
-    cpids.append(pid)
+    if table is None and not os.path.exists('/proc/self/stat'):
+        find_processes_in_group_ps(cpids, pid)
+        return
 
-    cmd = "ps -eo pid,ppid -m | grep %d" % pid
-    exit_code, psout, stderr = execute(cmd, mute=True)
+    pids = get_process_table(table).get_descendants(pid)
+    cpids.extend(pids if pids else [pid])
 
-    lines = psout.split("\n")
-    if lines != ['']:
-        for i in range(0, len(lines)):
-            try:
-                thispid = int(lines[i].split()[0])
-                thisppid = int(lines[i].split()[1])
-            except Exception as e:
-                logger.warning('exception caught: %s' % e)
-            if thisppid == pid:
-                find_processes_in_group(cpids, thispid)
+
+def find_processes_in_group_ps(cpids, pid):
+    """
+    Find all processes that belong to the same group using a single ps command.
+    Used on systems without /proc (see find_processes_in_group()).
+
+    :param cpids: list of pid's for all child processes to the parent pid, as well as the parent pid itself (int).
+    :param pid: parent process id (int).
+    :return: (updated cpids input parameter list).
+    """
+
+    children = {}
+    exit_code, psout, stderr = execute("ps -eo pid,ppid", mute=True)
+    for line in psout.split("\n"):
+        try:
+            thispid, thisppid = [int(item) for item in line.split()[:2]]
+        except Exception:
+            continue  # header line
+        children.setdefault(thisppid, []).append(thispid)
+
+    stack = [pid]
+    while stack:
+        _pid = stack.pop()
+        if _pid in cpids:
+            continue
+        cpids.append(_pid)
+        stack.extend(reversed(sorted(children.get(_pid, []))))
 
 
 def is_zombie(pid):
@@ -127,11 +348,12 @@ def dump_stack_trace(pid):
         logger.info("skipping pstack dump for zombie process")
 
 
-def kill_processes(pid):
+def kill_processes(pid, table=None):
     """
     Kill process beloging to given process group.
 
     :param pid: process id (int).
+    :param table: optional `ProcessTable` snapshot.
     :return:
     """
 
@@ -147,7 +369,7 @@ def kill_processes(pid):
     if not status:
         # firstly find all the children process IDs to be killed
         children = []
-        find_processes_in_group(children, pid)
+        find_processes_in_group(children, pid, table=table)
 
         # reverse the process order so that the athena process is killed first (otherwise the stdout will be truncated)
         if not children:
@@ -181,16 +403,17 @@ def kill_processes(pid):
     kill_orphans()
 
 
-def kill_child_processes(pid):
+def kill_child_processes(pid, table=None):
     """
     Kill child processes.
 
     :param pid: process id (int).
+    :param table: optional `ProcessTable` snapshot.
     :return:
     """
     # firstly find all the children process IDs to be killed
     children = []
-    find_processes_in_group(children, pid)
+    find_processes_in_group(children, pid, table=table)
 
     # reverse the process order so that the athena process is killed first (otherwise the stdout will be truncated)
     children.reverse()
@@ -290,18 +513,19 @@ def kill_process(pid):
 
 
 # called checkProcesses() in Pilot 1, used by process monitoring
-def get_number_of_child_processes(pid):
+def get_number_of_child_processes(pid, table=None):
     """
     Get the number of child processes for a given parent process.
 
     :param pid: parent process id (int).
+    :param table: optional `ProcessTable` snapshot.
     :return: number of child processes (int).
     """
 
     children = []
     n = 0
     try:
-        find_processes_in_group(children, pid)
+        find_processes_in_group(children, pid, table=table)
     except Exception as e:
         logger.warning("exception caught in find_processes_in_group: %s" % e)
     else:
@@ -479,25 +703,20 @@ def get_instant_cpu_consumption_time(pid):
     return cpu_consumption_time
 
 
-def get_current_cpu_consumption_time(pid):
+def get_current_cpu_consumption_time(pid, table=None):
     """
-    Get the current CPU consumption time (system+user time) for a given process, by looping over all child processes.
+    Get the current CPU consumption time (system+user time) for a given process, by summing over all child processes
+    in a process table snapshot.
 
     :param pid: process id (int).
+    :param table: optional `ProcessTable` snapshot.
     :return: system+user time for a given pid (float).
     """
 
-    # get all the child processes
-    children = []
-    find_processes_in_group(children, pid)
-
-    cpuconsumptiontime = 0
-    for _pid in children:
-        _cpuconsumptiontime = get_instant_cpu_consumption_time(_pid)
-        if _cpuconsumptiontime:
-            cpuconsumptiontime += _cpuconsumptiontime
+    if table is None and not os.path.exists('/proc/self/stat'):
+        return 0.0
 
-    return cpuconsumptiontime
+    return get_process_table(table).get_cpu_consumption_time(pid)
 
 
 def get_core_count(job):
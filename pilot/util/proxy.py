@@ -5,13 +5,32 @@
 # http://www.apache.org/licenses/LICENSE-2.0
 #
 # Authors:
-# - Paul Nilsson, paul.nilsson@cern.ch, 2017-2019
+# - Paul Nilsson, paul.nilsson@cern.ch, 2017-2020
+
+import base64
+import calendar
+import os
+import re
+import threading
+import time
 
 from pilot.util.container import execute
 
+try:
+    from cryptography import x509
+    from cryptography.hazmat.backends import default_backend
+except ImportError:
+    x509 = None
+
 import logging
 logger = logging.getLogger(__name__)
 
+VOMS_AC_OID = '1.3.6.1.4.1.8005.100.100.5'  # X.509 extension holding the VOMS attribute certificates
+_VOMS_AC_OID_DER = b'\x2b\x06\x01\x04\x01\xbe\x45\x64\x64\x05'
+
+_proxy_info_cache = {}  # path -> ((inode, mtime, size), proxy info dictionary)
+_proxy_info_lock = threading.Lock()
+
 
 def get_distinguished_name():
     """
@@ -46,3 +65,200 @@ def get_distinguished_name():
         logger.warning("user=self set but cannot get proxy: %d, %s" % (exit_code, stdout))
 
     return dn
+
+
+def read_der(data, offset=0):
+    """
+    Read a DER encoded element (tag, length, value).
+
+    :param data: DER data (bytearray).
+    :param offset: offset of the element (int).
+    :raises ValueError: for invalid or unsupported (long form tags, indefinite length) encodings.
+    :return: tag (int), offset of the value (int), offset of the end of the element (int).
+    """
+
+    if offset + 2 > len(data):
+        raise ValueError('truncated DER element at offset %d' % offset)
+    tag = data[offset]
+    if tag & 0x1f == 0x1f:
+        raise ValueError('unsupported DER tag at offset %d' % offset)
+    length = data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        nbytes = length & 0x7f
+        if nbytes == 0 or nbytes > 4:
+            raise ValueError('unsupported DER length at offset %d' % offset)
+        length = 0
+        for byte in data[offset:offset + nbytes]:
+            length = (length << 8) | byte
+        offset += nbytes
+    end = offset + length
+    if end > len(data):
+        raise ValueError('truncated DER element at offset %d' % offset)
+
+    return tag, offset, end
+
+
+def get_der_children(data, start, end):
+    """
+    Return the elements of a constructed DER element.
+
+    :param data: DER data (bytearray).
+    :param start: offset of the value of the constructed element (int).
+    :param end: offset of the end of the constructed element (int).
+    :return: list of (tag, value offset, end offset).
+    """
+
+    children = []
+    while start < end:
+        element = read_der(data, start)
+        children.append(element)
+        start = element[2]
+
+    return children
+
+
+def convert_der_time(data, tag, start, end):
+    """
+    Convert an UTCTime or GeneralizedTime value to epoch time.
+
+    :param data: DER data (bytearray).
+    :param tag: tag of the time element (int).
+    :param start: offset of the value (int).
+    :param end: offset of the end of the value (int).
+    :raises ValueError: for unsupported time formats.
+    :return: epoch time (int).
+    """
+
+    value = bytes(data[start:end]).decode('ascii')
+    if not value.endswith('Z'):
+        raise ValueError('unsupported time format: %s' % value)
+    value = value[:-1].split('.')[0]  # fractional seconds are ignored
+    if tag == 0x17:  # UTCTime, YYMMDDHHMMSS
+        year = int(value[:2])
+        value = '%d%s' % (year + 1900 if year >= 50 else year + 2000, value[2:])
+
+    return calendar.timegm(time.strptime(value, '%Y%m%d%H%M%S'))
+
+
+def get_validity(data, children):
+    """
+    Return the end of the validity period from the first element containing two time values (notBefore, notAfter).
+
+    :param data: DER data (bytearray).
+    :param children: elements of the certificate or attribute certificate info (list of (tag, start, end)).
+    :return: epoch time (int) or None.
+    """
+
+    for tag, start, end in children:
+        if tag != 0x30:
+            continue
+        times = get_der_children(data, start, end)
+        if len(times) == 2 and all(_tag in (0x17, 0x18) for _tag, _start, _end in times):
+            return convert_der_time(data, *times[1])
+
+    return None
+
+
+def get_voms_validity(data, start, end):
+    """
+    Return the end of the validity period of the VOMS attribute certificates in the VOMS extension value
+    (SEQUENCE OF SEQUENCE OF AttributeCertificate).
+
+    :param data: DER data (bytearray).
+    :param start: offset of the extension value (int).
+    :param end: offset of the end of the extension value (int).
+    :return: epoch time of the earliest expiring attribute certificate (int) or None.
+    """
+
+    validities = []
+    tag, start, end = read_der(data, start)
+    for _tag, _start, _end in get_der_children(data, start, end):
+        for ac_tag, ac_start, ac_end in get_der_children(data, _start, _end):
+            acinfo = get_der_children(data, ac_start, ac_end)[0]
+            validity = get_validity(data, get_der_children(data, acinfo[1], acinfo[2]))
+            if validity:
+                validities.append(validity)
+
+    return min(validities) if validities else None
+
+
+def parse_certificate(der):
+    """
+    Get the end of the validity period of a certificate and of its VOMS attribute certificates.
+
+    :param der: DER encoded certificate (bytes).
+    :raises ValueError: for invalid certificates.
+    :return: certificate notAfter (epoch time), VOMS notAfter (epoch time or None).
+    """
+
+    data = bytearray(der)
+    if x509:
+        try:
+            certificate = x509.load_der_x509_certificate(bytes(der), default_backend())
+            notafter = calendar.timegm(certificate.not_valid_after.utctimetuple())
+            try:
+                value = bytearray(certificate.extensions.get_extension_for_oid(x509.ObjectIdentifier(VOMS_AC_OID)).value.value)
+            except x509.ExtensionNotFound:
+                return notafter, None
+            return notafter, get_voms_validity(value, 0, len(value))
+        except Exception as e:
+            logger.debug('cryptography failed to parse certificate (will use the internal parser): %s' % e)
+
+    tag, start, end = read_der(data, 0)  # Certificate
+    tag, start, end = read_der(data, start)  # TBSCertificate
+    children = get_der_children(data, start, end)
+    notafter = get_validity(data, children)
+    if notafter is None:
+        raise ValueError('certificate validity not found')
+
+    vomsnotafter = None
+    for tag, start, end in children:
+        if tag != 0xa3:  # [3] extensions
+            continue
+        tag, start, end = read_der(data, start)
+        for _tag, _start, _end in get_der_children(data, start, end):
+            extension = get_der_children(data, _start, _end)
+            oid = bytes(data[extension[0][1]:extension[0][2]])
+            if oid == _VOMS_AC_OID_DER:
+                vomsnotafter = get_voms_validity(data, extension[-1][1], extension[-1][2])
+
+    return notafter, vomsnotafter
+
+
+def get_proxy_info(path):
+    """
+    Get the validity of a proxy from its PEM file.
+    The file is parsed once per version, the result is cached using the inode, modification time and size of the file.
+
+    :param path: path of the proxy file (string).
+    :raises ValueError: if the proxy could not be parsed.
+    :raises OSError: if the proxy file could not be read.
+    :return: dictionary {'notafter': epoch time, 'vomsnotafter': epoch time or None} for the certificate chain.
+    """
+
+    _stat = os.stat(path)
+    key = (_stat.st_ino, _stat.st_mtime, _stat.st_size)
+    with _proxy_info_lock:
+        if path in _proxy_info_cache and _proxy_info_cache[path][0] == key:
+            return _proxy_info_cache[path][1]
+
+    with open(path, 'rb') as f:
+        pem = f.read()
+    certificates = re.findall(br'-----BEGIN CERTIFICATE-----(.+?)-----END CERTIFICATE-----', pem, re.DOTALL)
+    if not certificates:
+        raise ValueError('no certificate found in %s' % path)
+
+    notafters = []
+    vomsnotafters = []
+    for certificate in certificates:
+        notafter, vomsnotafter = parse_certificate(base64.b64decode(b''.join(certificate.split())))
+        notafters.append(notafter)
+        if vomsnotafter:
+            vomsnotafters.append(vomsnotafter)
+
+    info = {'notafter': min(notafters), 'vomsnotafter': min(vomsnotafters) if vomsnotafters else None}
+    with _proxy_info_lock:
+        _proxy_info_cache[path] = (key, info)
+
+    return info
@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
+
+import errno
+import os
+import threading
+import time
+from collections import deque
+
+from pilot.util.filehandling import LogScanner, decode_line
+
+import logging
+logger = logging.getLogger(__name__)
+
+_tees = {}  # job id -> {stream name: OutputTee}
+_tees_lock = threading.Lock()
+
+
+class OutputTee(object):
+    """
+    Pilot side copy of a payload output stream (stdout or stderr) to its file.
+    The payload writes into a pipe, which is read by a thread that writes the data to the output file, keeps the last
+    part of the output in a ring buffer (e.g. for the heartbeat) and counts the bytes (for the size limit). The reading
+    thread never waits for anything but the output file, so the payload is not blocked more than when writing to the
+    file itself. The new lines are searched for fatal error signatures by a second thread; if that thread falls behind
+    by more than max_pending bytes, the new output is not searched until it has caught up (the output is still copied).
+    Usage: tee = OutputTee('stdout', out, signatures=[('out_of_memory', ["std::bad_alloc"])], callback=handler)
+           tee.start(proc.stdout)
+           ..
+           tee.join()
+    The callback is called (from the search thread) with the tee, the event category ('size' for the size limit, else
+    the signature category) and the matched line (or number of bytes).
+    """
+
+    chunksize = 65536  # max number of bytes read from the pipe at a time
+    max_line_length = 1024 * 1024  # longer lines are not searched for signatures
+    max_pending = 16 * 1024 * 1024  # max number of bytes waiting to be searched for signatures
+
+    GAP = object()  # marks output that was not searched
+    EOF = object()  # marks the end of the stream
+
+    def __init__(self, name, out, ringsize=65536, signatures=None, limit=None, callback=None):
+        """
+        Init function.
+
+        :param name: name of the stream (string).
+        :param out: output file object (opened in binary mode).
+        :param ringsize: size of the ring buffer in B (int).
+        :param signatures: optional list of (category, list of regexp patterns) to look for.
+        :param limit: optional size limit in B (int).
+        :param callback: optional function called for signature matches and when the size limit is exceeded.
+        """
+
+        self.name = name
+        self.out = out
+        self.ringsize = ringsize
+        self.ring = bytearray()
+        self.nbytes = 0
+        self.limit = limit
+        self.limit_exceeded = False
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.thread = None
+        self.search_thread = None
+        self.write_error = None
+
+        self.pending = deque()  # data and events waiting for the search thread
+        self.pending_bytes = 0
+        self.unsearched = 0  # number of bytes that were not searched for signatures
+        self.cond = threading.Condition()
+
+        self.scanner = LogScanner()
+        _signatures = []
+        for category, patterns in signatures or []:
+            _signatures += [(category, pattern) for pattern in patterns]
+            self.scanner.add(category, name, patterns)
+        self.combined, self.compiled = self.scanner.compile(_signatures) if _signatures else (None, None)
+        self.remainder = b''
+
+    def start(self, stream):
+        """
+        Start copying the given stream in a separate thread.
+
+        :param stream: stream to read from (e.g. proc.stdout of a Popen object).
+        :return:
+        """
+
+        self.search_thread = threading.Thread(target=self.run_search, name='tee_search_%s' % self.name)
+        self.search_thread.daemon = True
+        self.search_thread.start()
+
+        self.thread = threading.Thread(target=self.run, args=(stream,), name='tee_%s' % self.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self, stream):
+        """
+        Copy the stream until end of file.
+
+        :param stream: stream to read from.
+        :return:
+        """
+
+        fd = stream.fileno()
+        while True:
+            try:
+                data = os.read(fd, self.chunksize)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                logger.warning('failed to read payload %s: %s' % (self.name, e))
+                break
+            if not data:
+                break
+            try:
+                self.process(data)
+            except Exception as e:  # keep draining the pipe whatever happens
+                logger.warning('failed to process payload %s: %s' % (self.name, e))
+
+        self.put_pending(self.EOF)
+        if self.unsearched:
+            logger.warning('%d B of the payload %s were not searched for fatal errors' % (self.unsearched, self.name))
+
+        try:
+            stream.close()
+        except (IOError, OSError):
+            pass
+
+    def process(self, data):
+        """
+        Process a chunk of output data.
+
+        :param data: data (bytes).
+        :return:
+        """
+
+        try:
+            self.out.write(data)
+            self.out.flush()
+        except (IOError, OSError, ValueError) as e:  # ValueError for a closed file
+            if not self.write_error:
+                logger.warning('failed to write payload %s to file: %s' % (self.name, e))
+            self.write_error = e
+
+        with self.lock:
+            self.ring += data
+            if len(self.ring) > self.ringsize:
+                del self.ring[:len(self.ring) - self.ringsize]
+            self.nbytes += len(data)
+
+        if self.limit and self.nbytes > self.limit and not self.limit_exceeded:
+            self.limit_exceeded = True
+            self.put_pending(('size', self.nbytes))
+
+        if self.combined:
+            self.put_pending(data)
+
+    def put_pending(self, item):
+        """
+        Pass data or an event to the search thread.
+        Data is dropped (and replaced by a gap marker) if the search thread has fallen behind by more than max_pending
+        bytes, the reading thread never waits for the search thread.
+
+        :param item: data (bytes), GAP, EOF or event tuple (category, detail).
+        :return:
+        """
+
+        with self.cond:
+            if isinstance(item, bytes):
+                if self.pending_bytes + len(item) > self.max_pending:
+                    if not self.unsearched:
+                        logger.warning('payload %s is not searched for fatal errors while the search catches up' %
+                                       self.name)
+                    self.unsearched += len(item)
+                    if not self.pending or self.pending[-1] is not self.GAP:
+                        self.pending.append(self.GAP)
+                    self.cond.notify()
+                    return
+                self.pending_bytes += len(item)
+            self.pending.append(item)
+            self.cond.notify()
+
+    def run_search(self):
+        """
+        Search the output passed by the reading thread for the signatures and report the events, until end of file.
+
+        :return:
+        """
+
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                item = self.pending.popleft()
+                if isinstance(item, bytes):
+                    self.pending_bytes -= len(item)
+
+            try:
+                if item is self.EOF:
+                    # the last line might not end with a newline
+                    if self.remainder:
+                        self.search(self.remainder)
+                        self.remainder = b''
+                    break
+                elif item is self.GAP:
+                    self.remainder = b''  # the output is not contiguous
+                elif isinstance(item, tuple):
+                    self.notify(*item)
+                else:
+                    self.search_lines(item)
+            except Exception as e:
+                logger.warning('failed to search payload %s: %s' % (self.name, e))
+
+    def search_lines(self, data):
+        """
+        Search the complete lines of a chunk of output data, the last partial line is kept for the next chunk.
+
+        :param data: data (bytes).
+        :return:
+        """
+
+        buf = self.remainder + data
+        end = buf.rfind(b'\n') + 1
+        buf, self.remainder = buf[:end], buf[end:]
+        if len(self.remainder) > self.max_line_length:
+            self.remainder = b''
+        if buf:
+            self.search(buf)
+
+    def search(self, buf):
+        """
+        Look for the signatures in the given buffer of lines.
+
+        :param buf: lines (bytes).
+        :return:
+        """
+
+        if not self.combined:
+            return
+
+        for category, line in self.scanner.search(buf, self.combined, self.compiled):
+            self.notify(category, line)
+
+    def notify(self, category, detail):
+        """
+        Call the callback for an event.
+
+        :param category: 'size' or signature category (string).
+        :param detail: matched line or number of bytes.
+        :return:
+        """
+
+        if not self.callback:
+            return
+
+        try:
+            self.callback(self, category, detail)
+        except Exception as e:
+            logger.warning('exception caught in payload %s callback: %s' % (self.name, e))
+
+    def get_matches(self, category):
+        """
+        Return the lines that matched the signatures of the given category so far.
+
+        :param category: signature category (string).
+        :return: list of lines.
+        """
+
+        return self.scanner.get_lines(category)
+
+    def get_tail(self, nbytes=None):
+        """
+        Return the end of the output, from the ring buffer.
+
+        :param nbytes: optional max number of bytes (int).
+        :return: output tail (string).
+        """
+
+        with self.lock:
+            data = bytes(self.ring[-nbytes:] if nbytes else self.ring)
+
+        return decode_line(data)
+
+    def join(self, timeout=30):
+        """
+        Wait for the end of the stream.
+        Note: processes started by the payload might still keep the stream open after the payload has finished.
+
+        :param timeout: max time to wait in seconds (int).
+        :return: True if the stream has ended (Boolean).
+        """
+
+        t0 = time.time()
+        if self.thread:
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                logger.warning('payload %s is still open after %d s - will not wait for it' % (self.name, timeout))
+                return False
+        if self.search_thread:
+            self.search_thread.join(max(timeout - (time.time() - t0), 1))
+
+        return True
+
+
+def register_output_tee(jobid, tee):
+    """
+    Register an output tee for the given job.
+
+    :param jobid: job id (string).
+    :param tee: OutputTee object.
+    :return:
+    """
+
+    with _tees_lock:
+        _tees.setdefault(str(jobid), {})[tee.name] = tee
+
+
+def get_output_tee(jobid, name='stdout'):
+    """
+    Return the output tee for the given job and stream.
+
+    :param jobid: job id (string).
+    :param name: stream name (string).
+    :return: OutputTee object (None if not registered).
+    """
+
+    with _tees_lock:
+        return _tees.get(str(jobid), {}).get(name)
+
+
+def unregister_output_tees(jobid):
+    """
+    Remove the output tees of the given job.
+
+    :param jobid: job id (string).
+    :return:
+    """
+
+    with _tees_lock:
+        _tees.pop(str(jobid), None)
@@ -6,7 +6,7 @@
 #
 # Authors:
 # - Alexey Anisenkov, anisyonk@cern.ch, 2018
-# - Paul Nilsson, paul.nilsson@cern.ch, 2019
+# - Paul Nilsson, paul.nilsson@cern.ch, 2019-2020
 
 """
 Standalone implementation of time-out check on function call.
@@ -19,6 +19,8 @@ Timer stops execution of wrapped function if it reaches the limit of provided ti
 
 from __future__ import print_function  # Python 2 (2to3 complains about this)
 
+import atexit
+import logging
 import os
 import signal
 import sys
@@ -160,23 +162,256 @@ class TimedProcess(object):
             raise ret[1]
 
 
+def _worker_loop(conn):
+    """
+        Main loop of a worker process of the `WorkerPool`: execute the received calls and send back the results
+        (the function, arguments and results are pickled)
+    """
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)  ## do not run the signal handlers of the parent process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, IOError, OSError):
+            break
+        if task is None:
+            break
+
+        func, args, kwargs, environ, cwd = task
+        try:
+            ## run the call in the current environment and directory of the pilot
+            if environ != os.environ:
+                os.environ.clear()
+                os.environ.update(environ)
+            if cwd != os.getcwd():
+                os.chdir(cwd)
+            ret = (True, func(*args, **kwargs))
+        except Exception as e:
+            print('Exception occurred while executing %s' % func, file=sys.stderr)
+            traceback.print_exc(file=sys.stderr)
+            ret = (False, e)
+
+        try:
+            conn.send(ret)
+        except Exception as e:  ## e.g. the result can not be pickled
+            conn.send((False, Exception('failed to send result of %s: %s' % (func, e))))
+
+
+class WorkerPool(object):
+    """
+        Pool of pre-forked worker processes (`multiprocessing` module) executing function calls with a time limit.
+        (completely isolated memory space, like TimedProcess, but without forking a new process for every call)
+        The function and its arguments must be picklable; a worker that reaches the time limit is killed and replaced.
+        Up to `size` idle workers are kept; more workers are started if several calls are executed concurrently.
+        Every call is executed with the current environment and working directory of the pilot. The workers inherit the
+        logging handlers when they are forked, so they are replaced when the logging has been re-established (per job).
+    """
+
+    def __init__(self, size=1):
+        """
+            :param size: number of idle worker processes to keep.
+        """
+
+        self.size = size
+        self.idle = []  ## list of (process, connection, logging handlers)
+        self.lock = threading.Lock()
+
+    def start_worker(self):
+
+        conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_worker_loop, args=(child_conn,))
+        process.daemon = True
+        process.start()
+        child_conn.close()
+
+        return process, conn, get_logging_handlers()
+
+    def get_worker(self):
+
+        handlers = get_logging_handlers()
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                worker = self.idle.pop()
+            if worker[0].is_alive() and worker[2] == handlers:
+                return worker
+            self.stop_worker(worker)  ## exited, or forked with the logging handlers of a previous job
+
+        return self.start_worker()
+
+    def release_worker(self, worker):
+
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(worker)
+                return
+
+        self.stop_worker(worker)
+
+    def stop_worker(self, worker, kill=False):
+
+        process, conn = worker[:2]
+        if not kill:
+            try:
+                conn.send(None)
+            except Exception:
+                kill = True
+        conn.close()
+        kill_process(process, force=kill)
+
+    def prefork(self):
+        """
+            Start the idle worker processes
+        """
+
+        with self.lock:
+            nworkers = self.size - len(self.idle)
+        for _ in range(nworkers):
+            self.release_worker(self.start_worker())
+
+    def run(self, func, args, kwargs, timeout=None):
+        """
+            :raise: TimeoutException if timeout value is reached before function finished
+        """
+
+        worker = self.get_worker()
+        process, conn = worker[:2]
+
+        try:
+            conn.send((func, args, kwargs, dict(os.environ), os.getcwd()))
+        except Exception as e:  ## pickling failed, fallback to a dedicated process
+            self.release_worker(worker)
+            print('cannot pass %s to worker process (%s), will fork a new process' % (func, e), file=sys.stderr)
+            return TimedProcess(timeout).run(func, args, kwargs)
+
+        if not conn.poll(timeout):
+            self.stop_worker(worker, kill=True)
+            raise TimeoutException("Timeout reached", timeout=timeout)
+
+        try:
+            ret = conn.recv()
+        except (EOFError, IOError, OSError):
+            self.stop_worker(worker, kill=True)
+            raise Exception('worker process %s exited while executing %s' % (process.pid, func))
+
+        self.release_worker(worker)
+
+        if ret[0]:
+            return ret[1]
+        else:
+            raise ret[1]
+
+    def close(self):
+        """
+            Stop the idle worker processes
+        """
+
+        with self.lock:
+            workers, self.idle = self.idle, []
+        for worker in workers:
+            self.stop_worker(worker)
+
+
+def get_logging_handlers():
+    """
+        Return the identity of the current logging handlers (they are replaced when the logging is re-established)
+    """
+
+    return tuple(id(handler) for handler in logging.getLogger().handlers)
+
+
+def kill_process(process, force=False):
+    """
+        Wait for the process to finish, terminate it if necessary (or immediately if force is set)
+    """
+
+    if force and process.is_alive():
+        process.terminate()
+
+    while process.is_alive():
+        process.join(1)
+        if process.is_alive():  ## still alive, force terminate
+            process.terminate()
+            process.join(1)
+        if process.is_alive() and process.pid:  ## still alive, hard kill
+            os.kill(process.pid, signal.SIGKILL)
+
+    multiprocessing.active_children()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool():
+    """
+        Return the global worker pool (created on first use)
+    """
+
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool()
+            _pool.prefork()
+            atexit.register(_pool.close)
+
+    return _pool
+
+
+class TimedPool(object):
+    """
+        Timer implementation executing the function in a process of the global pre-forked `WorkerPool`
+    """
+
+    def __init__(self, timeout):
+        """
+            :param timeout: timeout value for operation in seconds.
+        """
+
+        self.timeout = timeout
+        self.is_timeout = False
+
+    def run(self, func, args, kwargs, timeout=None):
+
+        timeout = timeout if timeout is not None else self.timeout
+
+        try:
+            return get_worker_pool().run(func, args, kwargs, timeout=timeout)
+        except TimeoutException:
+            self.is_timeout = True
+            raise
+
+
 if getattr(os, 'fork', None):
-    Timer = TimedProcess
+    Timer = TimedPool
 else:  ## Windows
     Timer = TimedThread
 
+Timers = {'thread': TimedThread,  ## cheap, for I/O only calls (the thread can not be killed at timeout)
+          'process': Timer,  ## isolated memory space, the process is killed at timeout
+          'fork': TimedProcess if getattr(os, 'fork', None) else TimedThread}  ## a new process for every call
+
 
-def timeout(seconds):
+def timeout(seconds, mode='process'):
     """
     Decorator for a function which causes it to timeout (stop execution) once passed given number of seconds.
+    The mode selects how the function is executed:
+      'process' - in a pre-forked worker process which is killed at timeout (function and arguments must be picklable)
+      'thread' - in a thread of the current process (no isolation, the thread is left running at timeout)
+      'fork' - in a new process for every call
     :raise: TimeoutException in case of timeout interrupt
     """
 
+    timer = Timers[mode]
+
     def decorate(function):
 
         @wraps(function)
         def wrapper(*args, **kwargs):
-            return Timer(seconds).run(function, args, kwargs)
+            return timer(seconds).run(function, args, kwargs)
 
         return wrapper
 
@@ -22,7 +22,8 @@ from pilot.util.auxiliary import get_logger
 from pilot.util.config import config
 from pilot.util.constants import PILOT_START_TIME, PILOT_PRE_GETJOB, PILOT_POST_GETJOB, PILOT_PRE_SETUP, \
     PILOT_POST_SETUP, PILOT_PRE_STAGEIN, PILOT_POST_STAGEIN, PILOT_PRE_PAYLOAD, PILOT_POST_PAYLOAD, PILOT_PRE_STAGEOUT,\
-    PILOT_POST_STAGEOUT, PILOT_PRE_FINAL_UPDATE, PILOT_POST_FINAL_UPDATE, PILOT_END_TIME, PILOT_MULTIJOB_START_TIME
+    PILOT_POST_STAGEOUT, PILOT_PRE_FINAL_UPDATE, PILOT_POST_FINAL_UPDATE, PILOT_END_TIME, PILOT_MULTIJOB_START_TIME, \
+    PILOT_PREVIOUS_JOB_COMPLETED
 from pilot.util.filehandling import read_json, write_json
 #from pilot.util.mpi import get_ranks_info
 
@@ -186,6 +187,30 @@ def get_total_pilot_time(job_id, args):
     return get_time_difference(job_id, PILOT_START_TIME, PILOT_END_TIME, args)
 
 
+def get_pipelining_time(job_id, args):
+    """
+    High level function that returns the idle time saved by job pipelining for the given job_id.
+    This is the part of the getjob and stage-in operations that was done before the previous job had completed
+    (PILOT_PREVIOUS_JOB_COMPLETED).
+
+    :param job_id: PanDA job id (string).
+    :param args: pilot arguments.
+    :return: time in seconds (int).
+    """
+
+    timing = args.timing.get(job_id, {})
+    completed = timing.get(PILOT_PREVIOUS_JOB_COMPLETED)
+    if not completed:
+        return 0
+
+    saved = 0
+    for start, end in [(PILOT_PRE_GETJOB, PILOT_POST_GETJOB), (PILOT_PRE_STAGEIN, PILOT_POST_STAGEIN)]:
+        if start in timing and end in timing:
+            saved += max(0, min(timing[end], completed) - timing[start])
+
+    return int(saved)
+
+
 def get_postgetjob_time(job_id, args):
     """
     Return the post getjob time.
@@ -364,6 +389,7 @@ def timing_report(job_id, args):
     time_stagein = get_stagein_time(job_id, args)
     time_payload = get_payload_execution_time(job_id, args)
     time_stageout = get_stageout_time(job_id, args)
+    time_pipelining = get_pipelining_time(job_id, args)
     log.info('.' * 30)
     log.info('. Timing measurements:')
     log.info('. get job = %d s' % time_getjob)
@@ -373,6 +399,8 @@ def timing_report(job_id, args):
     log.info('. stage-in = %d s' % time_stagein)
     log.info('. payload execution = %d s' % time_payload)
     log.info('. stage-out = %d s' % time_stageout)
+    if time_pipelining:
+        log.info('. idle time saved by job pipelining = %d s' % time_pipelining)
     log.info('.' * 30)
 
     return time_getjob, time_stagein, time_payload, time_stageout, time_total_setup
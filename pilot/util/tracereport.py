@@ -6,19 +6,27 @@
 # Authors:
 # - Alexey Anisenkov, alexey.anisenkov@cern.ch, 2017
 # - Pavlo Svirin, pavlo.svirin@cern.ch, 2018
-# - Paul Nilsson, paul.nilsson@cern.ch, 2018
+# - Paul Nilsson, paul.nilsson@cern.ch, 2018-2020
 
+import atexit
 import hashlib
 import socket
+import ssl
+import threading
 import time
 from sys import exc_info
-from json import dumps  #, loads
-from os import environ, getuid
+from json import dumps, loads
+from os import environ, getuid, getcwd, remove, path
+
+try:
+    import Queue as queue  # noqa: N813
+except Exception:
+    import queue  # Python 3
 
 from pilot.util.config import config
 from pilot.util.constants import get_pilot_version, get_rucio_client_version
 from pilot.util.container import execute
-#from pilot.util.https import request
+from pilot.util.https import HTTPSConnectionPool
 
 import logging
 logger = logging.getLogger(__name__)
@@ -120,25 +128,38 @@ class TraceReport(dict):
 
     def send(self):
         """
-        Send trace to rucio server using curl.
+        Send trace to rucio server.
+        The trace is handed over to the trace dispatcher, which sends it asynchronously together with other traces
+        (see `TraceDispatcher`), so the caller does not wait for the tracing server.
 
         :return: Boolean.
         """
 
-        url = config.Rucio.url
-        logger.info("tracing server: %s" % url)
         logger.info("sending tracing report: %s" % str(self))
 
         if not self.verify_trace():
             logger.warning('cannot send trace since not all fields are set')
             return False
 
+        # the trace report object is reused for later states, so send a copy
+        get_trace_dispatcher().put(dict(self))
+
+        return True
+
+    def send_with_curl(self):
+        """
+        Send trace to rucio server using curl.
+        This is the fallback for when the trace dispatcher cannot send the traces in-process.
+
+        :return: Boolean.
+        """
+
+        url = config.Rucio.url
+        logger.info("tracing server: %s" % url)
+
         try:
             # take care of the encoding
-            #data = {'API': '0_3_0', 'operation': 'addReport', 'report': self}
             data = dumps(self).replace('"', '\\"')
-            #loaded = loads(data)
-            #logger.debug('self object converted to json dictionary: %s' % loaded)
 
             ssl_certificate = self.get_ssl_certificate()
 
@@ -148,13 +169,11 @@ class TraceReport(dict):
             exit_code, stdout, stderr = execute(cmd)
             if exit_code:
                 logger.warning('failed to send traces to rucio: %s' % stdout)
-            #request(url, loaded)
-            #if status is not None:
-            #    logger.warning('failed to send traces to rucio: %s' % status)
-            #    raise Exception(status)
+                return False
         except Exception:
             # if something fails, log it but ignore
             logger.error('tracing failed: %s' % str(exc_info()))
+            return False
         else:
             logger.info("tracing report sent")
 
@@ -168,3 +187,275 @@ class TraceReport(dict):
         """
 
         return environ.get('X509_USER_PROXY', '/tmp/x509up_u%s' % getuid())
+
+
+class TraceDispatcher(object):
+    """
+    Background sender of trace reports.
+    Traces are put on a bounded in-memory queue and sent in batches (as a JSON list) by a daemon thread over a
+    persistent connection. Traces that cannot be sent are appended to a spool file and resent with the next
+    successful batch, or when the dispatcher is stopped (flushed) at the end of the pilot.
+    """
+
+    batch_size = 50  # maximum number of traces per request
+    batch_wait = 1  # time to wait for more traces before a batch is sent (s)
+
+    def __init__(self, url=None, spool=None, maxsize=1000):
+        """
+        Init function.
+
+        :param url: tracing server URL (string, default config.Rucio.url).
+        :param spool: path to the spool file (string, default config.Rucio.trace_spool in PILOT_HOME).
+        :param maxsize: maximum number of queued traces; further traces are spooled directly (int).
+        """
+
+        self.url = url or config.Rucio.url
+        self.spool = spool or path.join(environ.get('PILOT_HOME', getcwd()), config.Rucio.trace_spool)
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.lock = threading.Lock()  # held while a batch is being sent or spooled
+        self.pool = None
+        self.thread = None
+        self.nsent = 0
+        self.nspooled = 0
+
+    def start(self):
+        """
+        Start the dispatcher thread.
+
+        :return:
+        """
+
+        self.thread = threading.Thread(target=self.run, name='trace_dispatcher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, trace):
+        """
+        Queue a trace for sending.
+
+        :param trace: trace (dictionary).
+        :return:
+        """
+
+        try:
+            self.queue.put_nowait(trace)
+        except queue.Full:
+            logger.warning('trace queue is full - spooling trace')
+            with self.lock:
+                self.write_spool([trace])
+
+    def get_batch(self, block=True):
+        """
+        Return the next batch of traces from the queue.
+        A None entry (put by stop()) ends the batch.
+
+        :param block: wait for the first trace (Boolean).
+        :return: list of traces.
+        """
+
+        batch = []
+        try:
+            trace = self.queue.get() if block else self.queue.get_nowait()
+        except queue.Empty:
+            return batch
+        batch.append(trace)
+
+        deadline = time.time() + (self.batch_wait if block else 0)
+        while trace is not None and len(batch) < self.batch_size:
+            try:
+                trace = self.queue.get(True, max(deadline - time.time(), 0.001)) if block else \
+                    self.queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(trace)
+
+        return batch
+
+    def run(self):
+        """
+        Main loop of the dispatcher thread.
+
+        :return:
+        """
+
+        while True:
+            batch = self.get_batch()
+            traces = [trace for trace in batch if trace is not None]
+            if traces:
+                with self.lock:
+                    self.dispatch(traces)
+            for _ in batch:
+                self.queue.task_done()
+            if None in batch:
+                break
+
+    def dispatch(self, batch):
+        """
+        Send a batch of traces, together with any previously spooled traces. Spool them if that fails.
+
+        :param batch: list of traces.
+        :return: Boolean (True if sent).
+        """
+
+        traces = self.read_spool() + batch
+        if self.post(traces):
+            self.nsent += len(traces)
+            logger.info('sent %d trace report(s)' % len(traces))
+            if path.exists(self.spool):
+                remove(self.spool)
+            return True
+
+        self.write_spool(batch)
+        return False
+
+    def post(self, traces):
+        """
+        Post traces to the tracing server.
+        The traces are sent as a JSON list over a persistent connection. If an SSL context cannot be created, each
+        trace is sent with curl instead.
+
+        :param traces: list of traces.
+        :return: Boolean (True if sent).
+        """
+
+        if self.pool is None:
+            try:
+                # the traces are sent without server certificate verification (cf. curl -k)
+                context = ssl.create_default_context()
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            except Exception as e:
+                logger.warning('cannot create SSL context for traces: %s (will use curl)' % e)
+                return all([TraceReport(trace).send_with_curl() for trace in traces])
+            self.pool = HTTPSConnectionPool(context, timeout=120, maxsize=1)
+
+        headers = {'Content-Type': 'application/json'}
+        try:
+            status, content = self.pool.request(self.url, dumps(traces).encode('utf-8'), headers)
+        except Exception as e:
+            logger.warning('failed to send traces to rucio: %s' % e)
+            return False
+
+        if status // 100 != 2:
+            logger.warning('failed to send traces to rucio (%s): %s' % (status, content))
+            return False
+
+        return True
+
+    def read_spool(self):
+        """
+        Read the traces from the spool file.
+
+        :return: list of traces.
+        """
+
+        traces = []
+        if not path.exists(self.spool):
+            return traces
+
+        try:
+            with open(self.spool) as fp:
+                for line in fp:
+                    if line.strip():
+                        traces.append(loads(line))
+        except Exception as e:
+            logger.warning('failed to read trace spool file %s: %s' % (self.spool, e))
+
+        return traces
+
+    def write_spool(self, traces):
+        """
+        Append traces to the spool file (one JSON trace per line).
+
+        :param traces: list of traces.
+        :return:
+        """
+
+        try:
+            with open(self.spool, 'a') as fp:
+                for trace in traces:
+                    fp.write(dumps(trace) + '\n')
+        except Exception as e:
+            logger.warning('failed to spool %d trace(s) to %s: %s' % (len(traces), self.spool, e))
+        else:
+            self.nspooled += len(traces)
+            logger.info('spooled %d trace(s) to %s' % (len(traces), self.spool))
+
+    def flush(self, timeout=30):
+        """
+        Send all queued and spooled traces.
+        To be called at the end of the pilot; traces that still cannot be sent are left in the spool file.
+
+        :param timeout: maximum time to wait for a batch that is being sent by the dispatcher thread (int).
+        :return:
+        """
+
+        with self.lock:
+            batch = self.get_batch(block=False)
+            while batch:
+                traces = [trace for trace in batch if trace is not None]
+                if traces:
+                    self.dispatch(traces)
+                for _ in batch:
+                    self.queue.task_done()
+                batch = self.get_batch(block=False)
+            if path.exists(self.spool):
+                self.dispatch([])
+
+        # wait for any batch already taken from the queue by the dispatcher thread
+        deadline = time.time() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks and time.time() < deadline:
+                self.queue.all_tasks_done.wait(deadline - time.time())
+
+        if self.pool:
+            self.pool.close()
+
+    def stop(self, timeout=30):
+        """
+        Flush all traces and stop the dispatcher thread.
+
+        :param timeout: maximum time to wait for the dispatcher thread (int).
+        :return:
+        """
+
+        self.flush(timeout=timeout)
+        if self.thread and self.thread.is_alive():
+            try:
+                self.queue.put_nowait(None)
+            except queue.Full:
+                return
+            self.thread.join(timeout)
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_trace_dispatcher():
+    """
+    Return the trace dispatcher (started on first use, and stopped at exit).
+
+    :return: `TraceDispatcher` object.
+    """
+
+    global _dispatcher
+
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = TraceDispatcher()
+            _dispatcher.start()
+            atexit.register(_dispatcher.stop)
+
+    return _dispatcher
+
+
+def flush_traces():
+    """
+    Send any pending trace reports.
+
+    :return:
+    """
+
+    if _dispatcher is not None:
+        _dispatcher.flush()
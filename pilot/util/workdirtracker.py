@@ -0,0 +1,633 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2020
+
+import atexit
+import collections
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import stat
+import struct
+import sys
+import threading
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+# inotify constants (see /usr/include/sys/inotify.h)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | \
+    IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+_stopped_workdirs = set()  # work directories of finished jobs, not to be tracked again
+_atexit_registered = False
+
+
+def get_libc():
+    """
+    Return the C library if it provides the inotify functions (Linux), otherwise None.
+
+    :return: ctypes library object (or None).
+    """
+
+    if not sys.platform.startswith('linux'):
+        return None
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError) as e:
+        logger.debug('inotify is not available: %s' % e)
+        libc = None
+
+    return libc
+
+
+def decode_name(name):
+    """
+    Convert a file name read from the inotify file descriptor to a native string.
+
+    :param name: file name (bytes).
+    :return: file name (string).
+    """
+
+    name = name.rstrip(b'\0')
+    if sys.version_info[0] >= 3:
+        return name.decode(sys.getfilesystemencoding(), 'surrogateescape')
+
+    return name
+
+
+class WorkdirTracker(object):
+    """
+    Continuous tracking of the activity in a work directory.
+    The tracker keeps the size and modification time of all files and directories below the work directory in memory,
+    so that the time of the last modification and the total size can be returned without walking the directory tree.
+    The disk usage is also summed up per directory (including everything below it), and the peak size and the growth
+    rate of the work directory are recorded.
+    The entries are kept up to date with inotify events (handled in a separate thread) if the kernel supports it, and
+    otherwise by an incremental scan when the tracker is queried. The incremental scan only lists directories whose
+    modification time has changed; all known entries are still stat'ed, since a file modification does not change
+    the modification time of its directory.
+    Usage: tracker = WorkdirTracker(workdir)
+           tracker.start()
+           mtime, path = tracker.get_last_touched()
+    """
+
+    def __init__(self, workdir, accept=None, use_inotify=True):
+        """
+        Init function.
+
+        :param workdir: work directory (string).
+        :param accept: optional function returning True for paths that count as activity (e.g. to ignore log files).
+        :param use_inotify: use inotify if available (Boolean).
+        """
+
+        self.workdir = os.path.abspath(workdir)
+        self.accept = accept
+        self.lock = threading.Lock()
+        self.entries = {}  # path -> (disk usage in B, mtime, is directory, counts as activity)
+        self.dirs = {}  # directory path -> mtime at the time it was last listed
+        self.children = {}  # directory path -> set of paths directly below it
+        self.size = 0
+        self.dirsizes = {}  # directory path -> disk usage of the directory and everything below it
+        self.peak_size = 0  # peak size since the last reset of the peak
+        self.samples = collections.deque(maxlen=10)  # (time, size) of the latest size queries, for the growth rate
+        self.last_touched = None
+        self.last_touched_path = None
+        self.libc = get_libc() if use_inotify else None
+        self.fd = None
+        self.watches = {}  # watch descriptor -> directory path
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.mode = 'scan'
+
+    def start(self):
+        """
+        Make the initial scan of the work directory and start tracking it with inotify, if possible.
+
+        :return:
+        """
+
+        if self.libc:
+            fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                logger.warning('inotify_init1 failed: %s' % os.strerror(ctypes.get_errno()))
+            else:
+                self.fd = fd
+                self.mode = 'inotify'
+
+        with self.lock:
+            self.scan_dir(self.workdir)
+
+        if self.mode == 'inotify':
+            self.thread = threading.Thread(target=self.run, name='workdir_tracker')
+            self.thread.daemon = True
+            self.thread.start()
+
+        logger.info('tracking activity in %s using %s (%d entries, %d B)' %
+                    (self.workdir, self.mode, len(self.entries), self.size))
+
+    def stop(self, timeout=5):
+        """
+        Stop tracking the work directory.
+
+        :param timeout: time to wait for the inotify thread to finish (int).
+        :return:
+        """
+
+        self.stop_event.set()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+        self.close()
+
+    def close(self):
+        """
+        Close the inotify file descriptor.
+
+        :return:
+        """
+
+        with self.lock:
+            if self.fd is not None:
+                try:
+                    os.close(self.fd)
+                except OSError:
+                    pass
+                self.fd = None
+                self.watches = {}
+
+    def get_last_touched(self):
+        """
+        Return the latest modification time of any (accepted) file or directory in the work directory.
+        Deleted files do not lower the returned time.
+
+        :return: modification time (float) (None if nothing was found), path (string).
+        """
+
+        self.update()
+        with self.lock:
+            return self.last_touched, self.last_touched_path
+
+    def get_size(self, path=None):
+        """
+        Return the current disk usage of the work directory (as reported by du), or of a directory below it.
+        The size of the work directory is also recorded for the growth rate.
+
+        :param path: optional directory path (string).
+        :return: size in B (int).
+        """
+
+        self.update()
+        with self.lock:
+            if path and os.path.abspath(path) != self.workdir:
+                return self.dirsizes.get(os.path.abspath(path), 0)
+
+            now = time.time()
+            if not self.samples or now - self.samples[-1][0] >= 1:
+                self.samples.append((now, self.size))
+            return self.size
+
+    def get_peak_size(self, reset=False):
+        """
+        Return the peak size of the work directory.
+        In inotify mode, the peak includes sizes that were only reached between the queries.
+
+        :param reset: reset the peak to the current size, i.e. the next call will return the peak since this call.
+        :return: size in B (int).
+        """
+
+        self.update()
+        with self.lock:
+            peak = self.peak_size
+            if reset:
+                self.peak_size = self.size
+            return peak
+
+    def get_growth_rate(self):
+        """
+        Return the growth rate of the work directory, from a least squares fit of the latest sizes returned by
+        `get_size()`.
+
+        :return: growth rate in B/s (float) (None if there are fewer than two measurements).
+        """
+
+        with self.lock:
+            samples = list(self.samples)
+
+        if len(samples) < 2:
+            return None
+
+        t0 = samples[0][0]
+        n = float(len(samples))
+        mean_t = sum(t - t0 for t, _ in samples) / n
+        mean_s = sum(size for _, size in samples) / n
+        var_t = sum((t - t0 - mean_t) ** 2 for t, _ in samples)
+        if var_t == 0:
+            return None
+
+        return sum((t - t0 - mean_t) * (size - mean_s) for t, size in samples) / var_t
+
+    def get_time_to_limit(self, limit):
+        """
+        Return the projected time until the work directory reaches the given size limit, at the current growth rate.
+
+        :param limit: size limit in B (int).
+        :return: time in seconds (int) (None if the work directory is not growing).
+        """
+
+        rate = self.get_growth_rate()
+        if not rate or rate <= 0:
+            return None
+
+        with self.lock:
+            size = self.size
+
+        return max(0, int((limit - size) / rate))
+
+    def refresh(self, paths):
+        """
+        Update the entries for the given paths immediately (e.g. after removing files), instead of waiting for the
+        inotify events or the next scan.
+
+        :param paths: list of paths.
+        :return:
+        """
+
+        with self.lock:
+            for path in paths:
+                path = os.path.abspath(path)
+                if path in self.dirs:
+                    self.update_dir_entry(path)
+                else:
+                    self.update_path(path)
+
+    def update(self):
+        """
+        Bring the tracked entries up to date.
+        In inotify mode, the entries are updated continuously by the tracker thread, so this is only needed in scan
+        mode (or if the inotify tracking had to be abandoned).
+
+        :return:
+        """
+
+        if self.mode == 'scan' and not self.stop_event.is_set():
+            with self.lock:
+                self.scan_dir(self.workdir)
+
+    def add_watch(self, path):
+        """
+        Add an inotify watch for the given directory.
+        If the watch cannot be added (e.g. too many watches), the tracker falls back to scan mode.
+
+        :param path: directory path (string).
+        :return:
+        """
+
+        if self.fd is None or self.mode != 'inotify':
+            return
+
+        _path = path.encode(sys.getfilesystemencoding(), 'surrogateescape') if sys.version_info[0] >= 3 else path
+        wd = self.libc.inotify_add_watch(self.fd, _path, WATCH_MASK)
+        if wd >= 0:
+            self.watches[wd] = path
+            return
+
+        error = ctypes.get_errno()
+        if error in (errno.ENOENT, errno.ENOTDIR):  # removed in the meantime
+            return
+
+        logger.warning('failed to add inotify watch for %s: %s (will scan the work directory instead)' %
+                       (path, os.strerror(error)))
+        self.mode = 'scan'
+
+    def set_entry(self, path, st):
+        """
+        Add or update the entry for the given path.
+
+        :param path: path (string).
+        :param st: os.lstat() result for path.
+        :return:
+        """
+
+        usage = st.st_blocks * 512 if hasattr(st, 'st_blocks') else st.st_size
+        isdir = stat.S_ISDIR(st.st_mode)
+        previous = self.entries.get(path)
+        if previous and previous[2] != isdir:  # e.g. a file was replaced by a directory
+            self.remove_entry(path)
+            previous = None
+        if previous:
+            self.account(path, isdir, usage - previous[0])
+            accepted = previous[3]
+        else:
+            accepted = path != self.workdir and (not self.accept or self.accept(path))
+            if path != self.workdir:
+                self.children.setdefault(os.path.dirname(path), set()).add(path)
+            self.account(path, isdir, usage)
+        self.entries[path] = (usage, st.st_mtime, isdir, accepted)
+
+        if accepted and (self.last_touched is None or st.st_mtime > self.last_touched):
+            self.last_touched = st.st_mtime
+            self.last_touched_path = path
+
+    def remove_entry(self, path):
+        """
+        Remove the given path from the tracked entries (including all entries below it, if it is a directory).
+
+        :param path: path (string).
+        :return:
+        """
+
+        entry = self.entries.pop(path, None)
+        if not entry:
+            return
+
+        self.account(path, entry[2], -entry[0])
+        self.children.get(os.path.dirname(path), set()).discard(path)
+        if entry[2]:
+            self.dirs.pop(path, None)
+            for child in list(self.children.pop(path, [])):
+                self.remove_entry(child)
+            self.dirsizes.pop(path, None)
+            for wd in [wd for wd, _path in self.watches.items() if _path == path]:
+                del self.watches[wd]
+
+    def account(self, path, isdir, delta):
+        """
+        Add a change of the disk usage of the given path to the total size, and to the sizes of the directories
+        containing it.
+
+        :param path: path (string).
+        :param isdir: True if path is a directory (Boolean).
+        :param delta: change of disk usage in B (int).
+        :return:
+        """
+
+        self.size += delta
+        if self.size > self.peak_size:
+            self.peak_size = self.size
+
+        directory = path if isdir else os.path.dirname(path)
+        while directory.startswith(self.workdir):
+            self.dirsizes[directory] = self.dirsizes.get(directory, 0) + delta
+            if directory == self.workdir:
+                break
+            directory = os.path.dirname(directory)
+
+    def update_path(self, path):
+        """
+        Stat the given path and update its entry (removing it if it does not exist anymore).
+        New directories are scanned.
+
+        :param path: path (string).
+        :return:
+        """
+
+        try:
+            st = os.lstat(path)
+        except OSError:
+            self.remove_entry(path)
+            return
+
+        if stat.S_ISDIR(st.st_mode):
+            self.scan_dir(path)
+        else:
+            self.set_entry(path, st)
+
+    def scan_dir(self, path):
+        """
+        Scan the given directory incrementally.
+        The directory is only listed again if its modification time has changed; otherwise the already known entries
+        are stat'ed. Symbolic links are not followed (like du).
+
+        :param path: directory path (string).
+        :return:
+        """
+
+        try:
+            st = os.lstat(path)
+        except OSError:
+            self.remove_entry(path)
+            return
+
+        if not stat.S_ISDIR(st.st_mode):
+            self.remove_entry(path)
+            self.set_entry(path, st)
+            return
+
+        new_dir = path not in self.dirs
+        if new_dir:
+            self.add_watch(path)
+
+        self.set_entry(path, st)
+        known = self.children.get(path, set())
+        if not new_dir and self.dirs.get(path) == st.st_mtime:
+            children = list(known)
+        else:
+            try:
+                children = [os.path.join(path, name) for name in os.listdir(path)]
+            except OSError as e:
+                logger.debug('cannot list %s: %s' % (path, e))
+                children = []
+            for child in known - set(children):
+                self.remove_entry(child)
+            self.dirs[path] = st.st_mtime
+
+        # note: in inotify mode, existing entries are only updated through events, except for new directories
+        if self.mode == 'inotify' and not new_dir:
+            children = [child for child in children if child not in self.entries]
+
+        for child in children:
+            try:
+                _st = os.lstat(child)
+            except OSError:
+                self.remove_entry(child)
+                continue
+            if stat.S_ISDIR(_st.st_mode):
+                self.scan_dir(child)
+            else:
+                self.set_entry(child, _st)
+
+    def run(self):
+        """
+        Read and handle the inotify events until the tracker is stopped.
+
+        :return:
+        """
+
+        while not self.stop_event.is_set() and self.mode == 'inotify':
+            try:
+                readable, _, _ = select.select([self.fd], [], [], 1)
+            except (select.error, ValueError, TypeError) as e:  # e.g. fd closed
+                logger.debug('stopped reading inotify events: %s' % e)
+                break
+            if not readable:
+                continue
+
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    continue
+                logger.warning('failed to read inotify events: %s' % e)
+                break
+
+            with self.lock:
+                self.handle_events(data)
+
+        if self.mode == 'scan':
+            # inotify tracking was abandoned, the entries will be updated by scanning from now on
+            self.close()
+
+    def handle_events(self, data):
+        """
+        Handle a buffer of inotify events.
+
+        :param data: raw event data (bytes).
+        :return:
+        """
+
+        updated = set()
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = decode_name(data[offset:offset + length])
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                logger.warning('inotify event queue overflow - will rescan %s' % self.workdir)
+                self.dirs = {}
+                self.scan_dir(self.workdir)
+                updated = set()
+                continue
+
+            directory = self.watches.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                if directory == self.workdir:
+                    logger.info('work directory %s has been removed or moved - will stop tracking it' % directory)
+                    self.stop_event.set()
+                continue
+
+            path = os.path.join(directory, name) if name else directory
+            if mask & (IN_DELETE | IN_MOVED_FROM):
+                self.remove_entry(path)
+                updated.discard(path)
+            else:
+                updated.add(path)
+            updated.add(directory)  # the directory modification time changes when entries are created or removed
+
+        # several events for the same file are common (e.g. each write), stat each path only once
+        for path in updated:
+            if path in self.dirs:
+                self.update_dir_entry(path)
+            else:
+                self.update_path(path)
+
+    def update_dir_entry(self, path):
+        """
+        Update the entry of an already known directory (without scanning it).
+
+        :param path: directory path (string).
+        :return:
+        """
+
+        try:
+            st = os.lstat(path)
+        except OSError:
+            self.remove_entry(path)
+        else:
+            self.set_entry(path, st)
+            self.dirs[path] = st.st_mtime
+
+
+def get_workdir_tracker(workdir, accept=None):
+    """
+    Return the (started) tracker for the given work directory, creating it if necessary.
+    No tracker is returned for work directories whose tracking has been stopped (see stop_workdir_tracker()).
+
+    :param workdir: work directory (string).
+    :param accept: optional function returning True for paths that count as activity (only used for new trackers).
+    :return: WorkdirTracker object (None if the tracking has been stopped).
+    """
+
+    workdir = os.path.abspath(workdir)
+    with _trackers_lock:
+        if workdir in _stopped_workdirs:
+            return None
+        tracker = _trackers.get(workdir)
+        if not tracker:
+            global _atexit_registered
+            if not _atexit_registered:
+                atexit.register(stop_workdir_trackers)
+                _atexit_registered = True
+            tracker = WorkdirTracker(workdir, accept=accept)
+            tracker.start()
+            _trackers[workdir] = tracker
+
+    return tracker
+
+
+def stop_workdir_tracker(workdir):
+    """
+    Stop tracking the given work directory (e.g. when the job has finished).
+    The work directory will not be tracked again, even if get_workdir_tracker() is called later for it.
+
+    :param workdir: work directory (string).
+    :return:
+    """
+
+    workdir = os.path.abspath(workdir)
+    with _trackers_lock:
+        _stopped_workdirs.add(workdir)
+        tracker = _trackers.pop(workdir, None)
+    if tracker:
+        tracker.stop()
+
+
+def stop_workdir_trackers():
+    """
+    Stop all work directory trackers.
+
+    :return:
+    """
+
+    with _trackers_lock:
+        trackers = list(_trackers.values())
+        _trackers.clear()
+    for tracker in trackers:
+        tracker.stop()
@@ -11,7 +11,7 @@
 import functools
 import signal
 from collections import namedtuple
-from os import environ
+from os import environ, getcwd, path
 
 from pilot.util.constants import SUCCESS, FAILURE
 
@@ -56,13 +56,19 @@ def run(args):
         logger.info('setup for resource %s: %s' % (args.hpc_resource, str(resource.get_setup())))
 
         # are we Yoda or Droid?
-        if environ.get('SOME_ENV_VARIABLE', '') == 'YODA':
-            yodadroid = __import__('pilot.eventservice.yoda')
+        # note: Droids on other nodes than Yoda need a TCP address ('host:port') in PILOT_YODA_ADDRESS
+        address = environ.get('PILOT_YODA_ADDRESS', path.join(getcwd(), 'yoda.socket'))
+        if environ.get('PILOT_ES_ROLE', '') == 'YODA':
+            yodadroid = __import__('pilot.eventservice.yoda', globals(), locals(), ['yoda'], 0)  # Python 2/3
         else:
-            yodadroid = __import__('pilot.eventservice.droid')
-        yodadroid.run()
+            yodadroid = __import__('pilot.eventservice.droid', globals(), locals(), ['droid'], 0)  # Python 2/3
+        exit_code = yodadroid.run(args, address)
+        if exit_code:
+            logger.warning('%s finished with exit code %s' % (yodadroid.__name__, exit_code))
+            traces.pilot['state'] = FAILURE
 
     except Exception as e:
         logger.fatal('exception caught: %s' % e)
+        traces.pilot['state'] = FAILURE
 
     return traces